@@ -4,6 +4,11 @@ import pandas as pd
 from urllib.parse import urlencode
 import os
 from dotenv import load_dotenv
+from chatbot_engine import merge_account_details, top_accounts_request
+from exports import download_buttons
+from fast_json import response_json
+from query_stats import track_query
+from results import QueryResult
 
 load_dotenv()
 
@@ -50,13 +55,35 @@ def fetch_salesforce_data(query, access_token, instance_url):
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(
-        f"{instance_url}/services/data/v60.0/query",
+    # Timed per query fingerprint for the query stats page
+    with track_query(query) as sample:
+        with sample.call():
+            response = requests.get(
+                f"{instance_url}/services/data/v60.0/query",
+                headers=headers,
+                params={"q": query}
+            )
+            data = response_json(response) if response.status_code == 200 else None
+        if data is not None:
+            sample.rows = len(data["records"])
+            return data["records"]
+        else:
+            sample.error = True
+            st.error(f"Error fetching data: {response.text}")
+            return None
+
+def send_composite(composite, access_token, instance_url):
+    """Run a Composite API call (several dependent requests in one round-trip)"""
+    headers = {
+        "Authorization": f"Bearer {access_token}"
+    }
+    response = requests.post(
+        f"{instance_url}/services/data/v{composite.api_version}/composite",
         headers=headers,
-        params={"q": query}
+        json=composite.payload
     )
     if response.status_code == 200:
-        return response.json()["records"]
+        return composite.parse(response_json(response))
     else:
         st.error(f"Error fetching data: {response.text}")
         return None
@@ -94,19 +121,16 @@ else:
                     ORDER BY totalAmount DESC
                     LIMIT 5
                 """
-                top_accounts = fetch_salesforce_data(query, st.session_state.access_token, st.session_state.instance_url)
+                # The aggregate and each account's details go out as one Composite API call
+                composite = top_accounts_request(query, api_version="60.0")
+                results = send_composite(composite, st.session_state.access_token, st.session_state.instance_url)
                 
-                if top_accounts:
-                    account_ids = [acc["AccountId"] for acc in top_accounts]
-                    ids_str = ",".join([f"'{id}'" for id in account_ids])
-                    account_query = f"SELECT Id, Name, Industry, AnnualRevenue FROM Account WHERE Id IN ({ids_str})"
-                    
-                    account_data = fetch_salesforce_data(account_query, st.session_state.access_token, st.session_state.instance_url)
+                if results:
+                    account_data = merge_account_details(results)
                     if account_data:
-                        df = pd.DataFrame(account_data)
+                        df = QueryResult.from_records(account_data).to_pandas()
                         st.dataframe(df)
-                        csv = df.to_csv(index=False)
-                        st.download_button("Download as CSV", csv, "top_accounts.csv", "text/csv")
+                        download_buttons(df, "top_accounts.csv", key="top_accounts")
 
     elif data_option == "Recent Opportunities":
         if st.button("Fetch Recent Opportunities"):
@@ -119,10 +143,9 @@ else:
                 """
                 opportunities = fetch_salesforce_data(query, st.session_state.access_token, st.session_state.instance_url)
                 if opportunities:
-                    df = pd.DataFrame(opportunities)
+                    df = QueryResult.from_records(opportunities).to_pandas()
                     st.dataframe(df)
-                    csv = df.to_csv(index=False)
-                    st.download_button("Download as CSV", csv, "recent_opportunities.csv", "text/csv")
+                    download_buttons(df, "recent_opportunities.csv", key="recent_opportunities")
 
     elif data_option == "Contacts by Account":
         if st.button("Fetch Contacts"):
@@ -135,10 +158,9 @@ else:
                 """
                 contacts = fetch_salesforce_data(query, st.session_state.access_token, st.session_state.instance_url)
                 if contacts:
-                    df = pd.DataFrame(contacts)
+                    df = QueryResult.from_records(contacts).to_pandas()
                     st.dataframe(df)
-                    csv = df.to_csv(index=False)
-                    st.download_button("Download as CSV", csv, "contacts.csv", "text/csv")
+                    download_buttons(df, "contacts.csv", key="contacts")
 
     elif data_option == "Custom Query":
         custom_query = st.text_area("Enter your SOQL query:")
@@ -146,7 +168,6 @@ else:
             with st.spinner("Executing query..."):
                 results = fetch_salesforce_data(custom_query, st.session_state.access_token, st.session_state.instance_url)
                 if results:
-                    df = pd.DataFrame(results)
+                    df = QueryResult.from_records(results).to_pandas()
                     st.dataframe(df)
-                    csv = df.to_csv(index=False)
-                    st.download_button("Download as CSV", csv, "query_results.csv", "text/csv")
+                    download_buttons(df, "query_results.csv", key="query_results")
@@ -0,0 +1,1179 @@
+import json
+import logging
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Offline benchmarks, run with `python benchmarks.py [name ...]`
+SIZES = [1_000, 10_000, 100_000]
+
+
+def best_of(fn, *args, repeat=3):
+    """Return (best wall time in seconds, last result) over a few runs"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def synthetic_geocoded_accounts(n, seed=42):
+    """Accounts shaped like the Location Intelligence tab output, with geocodes"""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-124.0, -67.0, n)
+    y = rng.uniform(25.0, 49.0, n)
+    states = np.array(['CA', 'NY', 'TX', 'WA', 'IL', 'FL'])
+    df = pd.DataFrame({
+        'Id': [f"001{i:015d}" for i in range(n)],
+        'Name': [f"Account {i}" for i in range(n)],
+        'Industry': rng.choice(['Technology', 'Education', 'Energy', 'Retail'], n),
+        'AnnualRevenue': rng.integers(10_000, 50_000_000, n).astype(float),
+        'BillingStreet': [f"{i} Market St" for i in range(n)],
+        'BillingCity': 'Springfield',
+        'BillingState': rng.choice(states, n),
+        'BillingPostalCode': None,
+        'BillingCountry': 'USA',
+    })
+    df['geocoded_location'] = [
+        {'address': '', 'location': {'x': float(px), 'y': float(py)}, 'score': 100}
+        for px, py in zip(x, y)
+    ]
+    return df
+
+
+def legacy_map_features(map_df, location_field='geocoded_location'):
+    """The original iterrows feature builder from simple_app's map tab"""
+    features = []
+    for _, row in map_df.iterrows():
+        if row[location_field] and isinstance(row[location_field], dict):
+            attributes = {k: str(v) for k, v in row.items() if k != location_field}
+            attributes['display_name'] = row.get('Name', 'Unknown')
+            features.append({'geometry': row[location_field]['location'], 'attributes': attributes})
+    return features
+
+
+def legacy_full_address(df):
+    """The original row-wise address join from simple_app.add_arcgis_tab"""
+    return df.apply(
+        lambda row: ", ".join([
+            str(row.get(f, "")) for f in
+            ['BillingStreet', 'BillingCity', 'BillingState', 'BillingPostalCode', 'BillingCountry']
+            if row.get(f)
+        ]),
+        axis=1
+    )
+
+
+def map_payload(features):
+    """The featureCollection JSON render_features hands to WebMap"""
+    from map_features import build_feature_collection
+
+    return json.dumps(build_feature_collection(features), separators=(',', ':'), default=str)
+
+
+def bench_map_features():
+    """Feature construction and payload size for the map tab"""
+    from map_features import build_features, build_full_address
+
+    print(f"{'points':>8} {'legacy_s':>10} {'vector_s':>10} {'addr_old_s':>11} {'addr_new_s':>11} {'features':>9} {'payload_kb':>11}")
+    for n in SIZES:
+        df = synthetic_geocoded_accounts(n)
+        # The legacy paths are far too slow to repeat at 100k
+        repeat = 1 if n >= 100_000 else 3
+        legacy_s, _ = best_of(legacy_map_features, df, repeat=repeat)
+        vector_s, features = best_of(build_features, df, repeat=repeat)
+        addr_old_s, _ = best_of(legacy_full_address, df, repeat=1)
+        addr_new_s, _ = best_of(build_full_address, df, repeat=repeat)
+        payload = map_payload(features)
+        print(f"{n:>8} {legacy_s:>10.3f} {vector_s:>10.3f} {addr_old_s:>11.3f} {addr_new_s:>11.3f} {len(features):>9} {len(payload) / 1024:>11.1f}")
+
+
+def bench_map_tiles():
+    """Viewport queries against the tiled account index"""
+    from map_tiles import MapTileIndex, viewport_bbox
+
+    print(f"{'points':>8} {'index_s':>8} {'zoom':>5} {'cold_ms':>8} {'warm_ms':>8} {'features':>9} {'payload_kb':>11}")
+    for n in SIZES:
+        df = synthetic_geocoded_accounts(n)
+        index_s, index = best_of(MapTileIndex, df, repeat=1)
+        for zoom in (3, 6, 10):
+            bbox = viewport_bbox(-95.0, 37.0, zoom)
+            cold_s, features = best_of(index.query, bbox, zoom, repeat=1)
+            warm_s, _ = best_of(index.query, bbox, zoom)
+            payload = map_payload(features)
+            print(f"{n:>8} {index_s:>8.3f} {zoom:>5} {cold_s * 1000:>8.1f} {warm_s * 1000:>8.1f} {len(features):>9} {len(payload) / 1024:>11.1f}")
+
+
+def legacy_amount_chart_json(df):
+    """The original inline-data Altair chart from create_visualization"""
+    import altair as alt
+
+    alt.data_transformers.disable_max_rows()
+    return alt.Chart(df).mark_bar().encode(
+        y=alt.Y('Name:N', sort='-x'),
+        x=alt.X('Amount:Q', title='Amount ($)'),
+        tooltip=['Name', 'Amount', 'CloseDate']
+    ).properties(title='Top Opportunities by Amount', width=600).to_json()
+
+
+def by_reference_payload(spec):
+    """Spec JSON plus the Arrow IPC bytes Streamlit sends for the named datasets"""
+    import json
+
+    import pyarrow as pa
+
+    size = len(json.dumps({k: v for k, v in spec.items() if k != 'datasets'}))
+    for data in spec['datasets'].values():
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        size += sink.getvalue().size
+    return size
+
+
+def bench_charts():
+    """Chart spec serialization time and payload size against row count"""
+    import charts
+
+    rng = np.random.default_rng(7)
+    print(f"{'rows':>8} {'inline_s':>9} {'inline_kb':>10} {'cold_s':>8} {'cached_s':>9} {'byref_kb':>9}")
+    for n in SIZES:
+        df = pd.DataFrame({
+            'Name': [f"Opportunity {i}" for i in range(n)],
+            'Amount': rng.integers(1_000, 1_000_000, n).astype(float),
+            'CloseDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D'),
+        })
+        inline_s, inline_json = best_of(legacy_amount_chart_json, df, repeat=1)
+
+        charts._spec_cache.clear()
+        cold_s, spec = best_of(charts.create_visualization, df, 'opportunity_amount_chart', repeat=1)
+        cached_s, _ = best_of(charts.create_visualization, df, 'opportunity_amount_chart')
+        print(f"{n:>8} {inline_s:>9.3f} {len(inline_json) / 1024:>10.1f} {cold_s:>8.3f} {cached_s:>9.4f} {by_reference_payload(spec) / 1024:>9.1f}")
+
+
+def opportunity_cursor(n):
+    """Zero-arg callable yielding Opportunity records lazily, like sf.query_all_iter"""
+    def records():
+        for i in range(n):
+            yield {
+                'attributes': {'type': 'Opportunity', 'url': f"/services/data/v59.0/sobjects/Opportunity/006{i:015d}"},
+                'Id': f"006{i:015d}",
+                'Name': f"Opportunity {i}",
+                'Amount': float(i % 100_000),
+                'StageName': ('Prospecting', 'Negotiation', 'Closed Won')[i % 3],
+                'CloseDate': '2024-06-30',
+            }
+    return records
+
+
+def peak_memory(fn, *args):
+    """Return (seconds, peak traced bytes, result) for one call"""
+    import tracemalloc
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def legacy_csv_export(cursor):
+    """The original path: materialize every record, then build the whole CSV string"""
+    return pd.DataFrame(list(cursor())).to_csv(index=False)
+
+
+def bench_exports():
+    """Export time and peak serializer memory against row count"""
+    import tempfile
+
+    from exports import write_export
+
+    def streamed(cursor, fmt):
+        with tempfile.TemporaryFile() as fileobj:
+            write_export(cursor, fmt, fileobj)
+            return fileobj.tell()
+
+    print(f"{'rows':>8} {'format':>11} {'seconds':>8} {'peak_mb':>8} {'size_mb':>8}")
+    for n in SIZES:
+        cursor = opportunity_cursor(n)
+        elapsed, peak, csv_text = peak_memory(legacy_csv_export, cursor)
+        print(f"{n:>8} {'legacy csv':>11} {elapsed:>8.2f} {peak / 2**20:>8.1f} {len(csv_text) / 2**20:>8.1f}")
+        for fmt in ('CSV', 'CSV (gzip)', 'Parquet'):
+            elapsed, peak, size = peak_memory(streamed, cursor, fmt)
+            print(f"{n:>8} {fmt:>11} {elapsed:>8.2f} {peak / 2**20:>8.1f} {size / 2**20:>8.1f}")
+    print("peak_mb is tracemalloc-traced memory; Arrow buffers used by Parquet are not traced")
+
+
+def slow_backend(delay, pages=5):
+    """Job function standing in for a slow Salesforce query or geocoding loop"""
+    def run(job):
+        for page in range(pages):
+            job.report(page / pages, f"page {page + 1} of {pages}")
+            time.sleep(delay / pages)
+        return pages
+    return run
+
+
+def wait_for(jobs, timeout=10):
+    deadline = time.time() + timeout
+    while not all(job.finished for job in jobs) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def bench_jobs():
+    """Background job runner against simulated slow backends"""
+    from jobs import DONE, JobRunner
+
+    delay = 0.5
+    for n in (1, 4, 8, 16):
+        runner = JobRunner(max_workers=8)
+        start = time.perf_counter()
+        jobs = [runner.submit(slow_backend(delay), label=f"query {i}") for i in range(n)]
+        submitted = time.perf_counter() - start
+        wait_for(jobs)
+        elapsed = time.perf_counter() - start
+        assert all(job.status == DONE for job in jobs)
+        print(f"{n:>3} jobs of {delay}s: submit {submitted * 1000:.2f} ms, all done in {elapsed:.2f}s (inline: {n * delay:.1f}s)")
+
+
+def serve_in_thread(app):
+    """Start a uvicorn server for app on a free local port; returns (base_url, server)"""
+    import socket
+    import threading
+
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
+
+
+def bench_query_service():
+    """Query service throughput against a mock Salesforce and a fake LLM"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    from cache import NullBackend, set_backend
+    from chatbot_engine import answer_query
+    from mock_services import FakeLLM, MockSalesforce
+    from query_service import create_app
+
+    # Measure the engine itself; repeated questions would otherwise be cache hits
+    set_backend(NullBackend())
+
+    # Importing the service configures INFO logging, which would drown the numbers
+    logging.getLogger().setLevel(logging.WARNING)
+
+    sf_latency, llm_latency = 0.05, 0.2
+    questions = ["Show me top accounts", "Show recent opportunities", "Show opportunities by stage", "List contacts"]
+    sf, llm = MockSalesforce(latency=sf_latency), FakeLLM(latency=llm_latency)
+    print(f"mock Salesforce {sf_latency * 1000:.0f} ms per page, fake LLM {llm_latency * 1000:.0f} ms per call")
+
+    # The Streamlit script answers one question at a time per session
+    start = time.perf_counter()
+    for question in questions * 2:
+        answer_query(question, llm, sf)
+    inline = len(questions) * 2 / (time.perf_counter() - start)
+    print(f"{'in process, sequential':>28}: {inline:>7.1f} req/s")
+
+    base_url, server = serve_in_thread(create_app(lambda: sf, lambda: llm, warm=False, allow_default=True))
+    http = requests.Session()
+    http.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=64))
+
+    def ask(i):
+        started = time.perf_counter()
+        response = http.post(f"{base_url}/query", json={"query": questions[i % len(questions)]})
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    try:
+        for concurrency in (1, 8, 32, 64):
+            requests_made = concurrency * 4
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                latencies = sorted(pool.map(ask, range(requests_made)))
+            elapsed = time.perf_counter() - start
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{'/query, concurrency ' + str(concurrency):>28}: {requests_made / elapsed:>7.1f} req/s  p50 {p50 * 1000:.0f} ms  p95 {p95 * 1000:.0f} ms")
+
+        # Time to the first streamed event versus the whole answer
+        sf.rows = 10_000
+        start = time.perf_counter()
+        with http.post(f"{base_url}/query/stream", json={"query": "SELECT Id, Name FROM Opportunity"}, stream=True) as response:
+            lines = response.iter_lines()
+            next(lines)
+            first = time.perf_counter() - start
+            events = 1 + sum(1 for _ in lines)
+        total = time.perf_counter() - start
+        print(f"{'/query/stream, 10k rows':>28}: first event {first * 1000:.0f} ms, {events} events in {total * 1000:.0f} ms")
+    finally:
+        server.should_exit = True
+
+
+def cache_values():
+    """Representative cached values: a geocode, a page of query records and a result frame"""
+    from chatbot_engine import format_records
+    from mock_services import mock_record
+
+    records = [mock_record('Opportunity', i) for i in range(100)]
+    return {
+        'geocode': {'address': '1 Market St, San Francisco, CA', 'location': {'x': -122.39, 'y': 37.79}, 'score': 100},
+        'records_100': records,
+        'frame_10k': format_records([mock_record('Opportunity', i) for i in range(10_000)]),
+    }
+
+
+def read_cache_latencies(url, names, repeat, cache=None):
+    """Time hits on keys another process wrote (or on cache, when given)"""
+    from cache import Cache, backend_from_url
+
+    cache = cache or Cache(backend_from_url(url), 'bench')
+    results = {}
+    for name in names:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = cache.get(name)
+            timings.append(time.perf_counter() - start)
+            assert value is not None
+        timings.sort()
+        results[name] = (timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1])
+    return results
+
+
+def bench_cache():
+    """Cache hit latency across processes for each backend, and value sizes"""
+    import multiprocessing
+    import os
+    import pickle
+    import tempfile
+
+    from cache import Cache, backend_from_url, encode_value
+    from mock_services import MockRedisServer
+
+    values = cache_values()
+    print(f"{'value':>12} {'encoded_kb':>11} {'pickle_kb':>10} {'json_kb':>8}")
+    for name, value in values.items():
+        as_json = value.to_json(orient='records') if isinstance(value, pd.DataFrame) else json.dumps(value)
+        print(f"{name:>12} {len(encode_value(value)) / 1024:>11.1f} {len(pickle.dumps(value)) / 1024:>10.1f} {len(as_json) / 1024:>8.1f}")
+
+    redis = MockRedisServer().start()
+    tmpdir = tempfile.mkdtemp()
+    backends = {
+        'memory': 'memory://',
+        'sqlite': f"sqlite:///{os.path.join(tmpdir, 'cache.db')}",
+        'redis': redis.url,
+    }
+    repeat = 200
+    print(f"\n{'backend':>8} {'value':>12} {'p50_ms':>8} {'p99_ms':>8}")
+    context = multiprocessing.get_context('spawn')
+    for backend, url in backends.items():
+        cache = Cache(backend_from_url(url), 'bench')
+        for name, value in values.items():
+            cache.set(name, value)
+        if backend == 'memory':
+            # Process-local by definition, so this is the in-process baseline
+            latencies = read_cache_latencies(url, list(values), repeat, cache=cache)
+        else:
+            with context.Pool(1) as pool:
+                latencies = pool.apply(read_cache_latencies, (url, list(values), repeat))
+        for name, (p50, p99) in latencies.items():
+            print(f"{backend:>8} {name:>12} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+    print("memory is read in the writing process; sqlite and redis are read from a second process")
+    redis.shutdown()
+
+
+def legacy_format_records(records):
+    """The original dict-by-dict formatter from gemini_salesforce_app"""
+    formatted_records = []
+    for record in records:
+        record_copy = {k: v for k, v in record.items() if k != 'attributes'}
+        for key, value in record_copy.copy().items():
+            if isinstance(value, dict) and 'attributes' in value:
+                for nested_key, nested_value in value.items():
+                    if nested_key != 'attributes':
+                        record_copy[f"{key}.{nested_key}"] = nested_value
+                del record_copy[key]
+        formatted_records.append(record_copy)
+    return pd.DataFrame(formatted_records)
+
+
+def opportunity_pages(n, page_size=2000):
+    """JSON text of n Opportunity records split into REST-sized pages"""
+    from mock_services import mock_record
+
+    return [
+        json.dumps({'records': [mock_record('Opportunity', i) for i in range(start, min(start + page_size, n))]})
+        for start in range(0, n, page_size)
+    ]
+
+
+def bench_results():
+    """Memory per 100k Opportunity rows: lists of dicts versus Arrow-backed results"""
+    import tracemalloc
+
+    from results import ResultBuilder
+
+    n = 100_000
+    pages = opportunity_pages(n)
+
+    def decode_all():
+        records = []
+        for page in pages:
+            records.extend(json.loads(page)['records'])
+        return records
+
+    def build_columnar():
+        builder = ResultBuilder()
+        for page in pages:
+            builder.add_page(json.loads(page)['records'])
+        return builder.build()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = decode_all()
+    decoded = time.perf_counter() - start
+    records_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    legacy = legacy_format_records(records)
+    legacy_time = time.perf_counter() - start
+    legacy_bytes = legacy.memory_usage(deep=True).sum()
+    del records
+
+    start = time.perf_counter()
+    result = build_columnar()
+    columnar_time = time.perf_counter() - start
+    start = time.perf_counter()
+    frame = result.to_pandas()
+    to_pandas_time = time.perf_counter() - start
+    start = time.perf_counter()
+    raw = result.raw_records()
+    raw_time = time.perf_counter() - start
+
+    print(f"{n} Opportunity rows, {sum(len(p) for p in pages) / 2**20:.1f} MB of JSON")
+    print(f"{'before: list of dicts':>32}: {records_bytes / 2**20:>7.1f} MB  (decode {decoded:.2f}s under tracemalloc)")
+    print(f"{'before: formatted DataFrame':>32}: {legacy_bytes / 2**20:>7.1f} MB  (format {legacy_time:.2f}s)")
+    print(f"{'after: Arrow table':>32}: {result.nbytes / 2**20:>7.1f} MB  (decode + build {columnar_time:.2f}s)")
+    print(f"{'after: pandas view':>32}: {frame.memory_usage(deep=True).sum() / 2**20:>7.1f} MB  (to_pandas {to_pandas_time * 1000:.0f} ms)")
+    print(f"{'raw JSON rebuilt on demand':>32}: {len(raw)} records in {raw_time:.2f}s")
+    print("column types:", ", ".join(f"{f.name}={f.type}" for f in result.table.schema))
+
+
+def bench_json():
+    """Decode throughput for REST query pages: json versus the fast_json decoders"""
+    import fast_json
+    from results import ResultBuilder
+
+    pages = [page.encode() for page in opportunity_pages(100_000)]
+    size = sum(len(p) for p in pages)
+    decoders = {'json.loads': json.loads}
+    if fast_json.orjson is not None:
+        decoders['orjson.loads'] = fast_json.orjson.loads
+    if fast_json.msgspec is not None:
+        decoders['msgspec'] = fast_json.msgspec.json.decode
+    decoders[f'decode_query_page ({fast_json.DECODER})'] = fast_json.decode_query_page
+
+    print(f"{len(pages)} pages, {size / 2**20:.1f} MB of JSON")
+    for name, decode in decoders.items():
+        start = time.perf_counter()
+        for page in pages:
+            decode(page)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>36}: {size / 2**20 / elapsed:>7.0f} MB/s  {elapsed / len(pages) * 1000:>6.1f} ms/page")
+
+    for name, decode in (('json.loads + add_page', json.loads), ('decode_page_into', None)):
+        builder = ResultBuilder()
+        start = time.perf_counter()
+        for page in pages:
+            if decode is None:
+                fast_json.decode_page_into(page, builder)
+            else:
+                builder.add_page(decode(page)['records'])
+        builder.build()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>36}: {size / 2**20 / elapsed:>7.0f} MB/s  {elapsed / len(pages) * 1000:>6.1f} ms/page  (to Arrow)")
+
+
+def bench_composite():
+    """Top accounts plus account details: one query per step versus one Composite API call"""
+    from chatbot_engine import get_default_queries, merge_account_details, top_accounts_request
+    from mock_services import MockSalesforce
+
+    latency = 0.05
+    query = get_default_queries()['top_accounts']
+    print(f"mock Salesforce {latency * 1000:.0f} ms per round-trip")
+
+    def one_query_per_step(sf):
+        top = sf.query(query)['records']
+        ids = ",".join(f"'{r['AccountId']}'" for r in top)
+        sf.query(f"SELECT Id, Name, Industry, AnnualRevenue FROM Account WHERE Id IN ({ids}) LIMIT {len(top)}")
+
+    def one_query_per_account(sf):
+        top = sf.query(query)['records']
+        for r in top:
+            sf.query(f"SELECT Id, Name, Industry, AnnualRevenue FROM Account WHERE Id = '{r['AccountId']}' LIMIT 1")
+
+    def composite(sf):
+        merge_account_details(top_accounts_request(query).send(sf))
+
+    for name, fn in (('aggregate, then IN query', one_query_per_step), ('aggregate, then one per account', one_query_per_account), ('composite', composite)):
+        sf = MockSalesforce(latency=latency)
+        start = time.perf_counter()
+        fn(sf)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>32}: {sf.api_calls} round-trips  {elapsed * 1000:>5.0f} ms")
+
+
+def bench_dml():
+    """Updating Account records: one call per record versus sObject Collections and Bulk API 2.0"""
+    from cache import get_cache
+    from chatbot_engine import prime_query_cache, query_cache_key
+    from dml import DmlEngine
+    from mock_services import MockSalesforce
+
+    logging.getLogger().setLevel(logging.WARNING)
+    latency = 0.02
+    print(f"mock Salesforce {latency * 1000:.0f} ms per call")
+
+    def records(n):
+        return [{'Id': f'ACC{i:015d}', 'Phone': f'555-{i % 10000:04d}', 'Industry': 'Technology'} for i in range(n)]
+
+    for n in (200, 1000, 5000):
+        runs = [('one call per record', dict(workers=1, bulk_threshold=n + 1), True)] if n <= 200 else []
+        runs += [
+            ('collections, 1 worker', dict(workers=1, bulk_threshold=n + 1), False),
+            ('collections, 4 workers', dict(workers=4, bulk_threshold=n + 1), False),
+            ('bulk api 2.0', dict(workers=4, bulk_threshold=1), False),
+        ]
+        for name, options, per_record in runs:
+            sf = MockSalesforce(latency=latency)
+            engine = DmlEngine(sf, **options)
+            start = time.perf_counter()
+            if per_record:
+                failed = sum(len(engine.update('Account', [r]).failed) for r in records(n))
+            else:
+                failed = len(engine.update('Account', records(n)).failed)
+            elapsed = time.perf_counter() - start
+            print(f"{n:>5} records, {name:>24}: {sf.api_calls:>5} calls  {elapsed * 1000:>6.0f} ms  {failed} failed")
+
+    # A write drops the writer's cached query results so its next read refetches
+    sf = MockSalesforce(latency=0)
+    cache = get_cache('query')
+    prime_query_cache(sf, 'probe', [1])
+    DmlEngine(sf).update('Account', records(1))
+    print("query cache after a write:", "cleared" if cache.get(query_cache_key(sf, 'probe')) is None else "stale")
+
+
+def logged_queries(path='salesforce_data.log'):
+    """SOQL queries the apps have logged as executed, multi-line ones included
+
+    Reads both the original text log lines and log_config's JSON lines.
+    """
+    queries, current = [], None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('{'):
+                current = None
+                message = json.loads(line).get('message', '')
+                if message.startswith('Query executed: '):
+                    queries.append([message.split('Query executed: ', 1)[1]])
+            elif 'Query executed: ' in line:
+                current = [line.split('Query executed: ', 1)[1]]
+                queries.append(current)
+            elif current is not None and not re.match(r'\d{4}-\d{2}-\d{2} ', line):
+                current.append(line)
+            else:
+                current = None
+    return [' '.join(''.join(q).split()) for q in queries if ''.join(q).strip()]
+
+
+def bench_advisor():
+    """Query-plan advisor over the logged queries: decisions, explain calls and overhead"""
+    import chatbot_engine.advisor as advisor
+    from collections import Counter
+
+    from cache import MemoryBackend, set_backend
+    from mock_services import FakeLLM, MockSalesforce
+
+    logging.getLogger().setLevel(logging.WARNING)
+    set_backend(MemoryBackend())
+    advisor.ADVISOR_LOG = None
+
+    queries = logged_queries()
+    shapes = {advisor.query_shape(q) for q in queries}
+    latency = 0.05
+    sf, llm = MockSalesforce(latency=latency, table_rows=120_000), FakeLLM(latency=0.2)
+    print(f"{len(queries)} logged queries, {len(shapes)} distinct shapes; mock Salesforce {latency * 1000:.0f} ms per call, objects of 120k rows")
+
+    start = time.perf_counter()
+    decisions = [advisor.advise(sf, q, llm, mode="rewrite") for q in queries]
+    elapsed = time.perf_counter() - start
+    print(f"{'explain calls':>20}: {sf.api_calls} ({elapsed * 1000 / len(queries):.1f} ms per query on average)")
+    print(f"{'rewrite requests':>20}: {llm.calls}")
+    for action, count in Counter(d['action'] for d in decisions).most_common():
+        print(f"{action:>20}: {count}")
+    print(f"{'rewrites rejected':>20}: {sum('rejected_rewrite' in d for d in decisions)}")
+    for d in decisions:
+        if d['action'] == 'rewritten':
+            print(f"\n  {d['original']}\n  -> {d['query']}")
+            break
+
+
+def bench_query_stats():
+    """Instrumentation overhead per query, and the logged queries grouped by fingerprint"""
+    import pandas as pd
+
+    from chatbot_engine import fetch_salesforce_data
+    from mock_services import MockSalesforce
+    from query_stats import QueryStats, QuerySample, get_query_stats, track_query
+
+    logging.getLogger().setLevel(logging.WARNING)
+    queries = logged_queries()
+
+    n = 100_000
+    scratch = QueryStats()
+    start = time.perf_counter()
+    for i in range(n):
+        sample = QuerySample(queries[i % len(queries)], 'custom_query')
+        with sample.call():
+            pass
+        scratch.record_query(sample)
+    per_query = (time.perf_counter() - start) / n
+    print(f"{'overhead per tracked query':>28}: {per_query * 1e6:.1f} us")
+
+    start = time.perf_counter()
+    for i in range(n):
+        with track_query(queries[i % len(queries)]):
+            pass
+    get_query_stats().reset()
+    print(f"{'track_query context':>28}: {(time.perf_counter() - start) / n * 1e6:.1f} us")
+
+    sf = MockSalesforce(latency=0.002)
+    for query in queries:
+        fetch_salesforce_data(sf, query)
+    rows = pd.DataFrame(get_query_stats().query_rows())
+    print(f"\n{len(queries)} logged queries -> {len(rows)} fingerprints; busiest:")
+    print(rows[['fingerprint', 'calls', 'total_s', 'rows', 'query']].head(5).to_string(index=False, max_colwidth=70))
+    print(f"\n/metrics payload: {len(get_query_stats().to_text()):,} bytes")
+
+
+def print_span_tree(spans):
+    """Indented span names with durations, children under their parents"""
+    children = {}
+    for s in spans:
+        children.setdefault(s['parentSpanId'], []).append(s)
+    ids = {s['spanId'] for s in spans}
+
+    def show(s, depth):
+        ms = (int(s['endTimeUnixNano']) - int(s['startTimeUnixNano'])) / 1e6
+        attrs = {a['key']: next(iter(a['value'].values())) for a in s['attributes'] if a['key'] in ('intent', 'rows', 'cache', 'action')}
+        print(f"  {'  ' * depth}{s['name']:<{32 - 2 * depth}} {ms:>8.1f} ms  {attrs if attrs else ''}")
+        for child in sorted(children.get(s['spanId'], []), key=lambda c: int(c['startTimeUnixNano'])):
+            show(child, depth + 1)
+
+    for root in sorted((s for s in spans if s['parentSpanId'] not in ids), key=lambda s: int(s['startTimeUnixNano'])):
+        show(root, 0)
+
+
+def bench_tracing():
+    """Tracing overhead per chat turn at several sample rates, and one trace through the query service"""
+    import os
+    import tempfile
+
+    from cache import NullBackend, set_backend
+    from chatbot_engine import QueryServiceClient, advisor, answer_query
+    from mock_services import FakeLLM, MockOTLPCollector, MockSalesforce
+    from query_service import create_app
+    from tracing import FileExporter, OTLPExporter, configure_tracing, flush_spans, span
+
+    set_backend(NullBackend())
+    advisor.ADVISOR_LOG = None
+    logging.getLogger().setLevel(logging.WARNING)
+    questions = ["Show me top accounts", "Show recent opportunities", "Show opportunities by stage", "List contacts"]
+
+    n = 100_000
+    for label, exporter, rate in (("off", None, 0.0), ("sampled out", FileExporter(os.devnull), 0.0), ("recorded", FileExporter(os.devnull), 1.0)):
+        configure_tracing(exporter, rate)
+        start = time.perf_counter()
+        for _ in range(n):
+            with span("noop"):
+                pass
+        print(f"{'span, ' + label:>28}: {(time.perf_counter() - start) / n * 1e6:.2f} us")
+
+    # Zero-latency mocks leave only our own CPU time, the worst case for relative overhead
+    def turns(sf, llm, count):
+        start = time.perf_counter()
+        for i in range(count):
+            with span("chat_turn"):
+                answer_query(questions[i % len(questions)], llm, sf)
+        return (time.perf_counter() - start) / count
+
+    path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+    for sf_latency, llm_latency, count in ((0.0, 0.0, 2000), (0.05, 0.2, 8)):
+        sf, llm = MockSalesforce(latency=sf_latency), FakeLLM(latency=llm_latency)
+        print(f"\nchat turns, mock Salesforce {sf_latency * 1000:.0f} ms per page, fake LLM {llm_latency * 1000:.0f} ms per call")
+        configure_tracing(None)
+        turns(sf, llm, count // 4)
+        baseline = min(turns(sf, llm, count) for _ in range(5))
+        print(f"{'tracing off':>28}: {baseline * 1000:8.2f} ms per turn")
+        for rate in (0.01, 0.1, 1.0):
+            configure_tracing(FileExporter(path), rate)
+            per_turn = min(turns(sf, llm, count) for _ in range(5))
+            flush_spans()
+            print(f"{'sample rate ' + str(rate):>28}: {per_turn * 1000:8.2f} ms per turn ({(per_turn / baseline - 1) * 100:+.1f}%)")
+    print(f"{'file export':>28}: {os.path.getsize(path) / 1024:.0f} KiB of OTLP/JSON")
+
+    # One traced turn: Streamlit-side span, the service continuing it through traceparent, exported over OTLP/HTTP
+    collector = MockOTLPCollector().start()
+    configure_tracing(OTLPExporter(collector.endpoint), 1.0)
+    sf, llm = MockSalesforce(latency=0.05), FakeLLM(latency=0.2)
+    base_url, server = serve_in_thread(create_app(lambda: sf, lambda: llm, warm=False, allow_default=True))
+    try:
+        with span("chat_turn"):
+            # The service uses its own (mock) login rather than a forwarded session
+            QueryServiceClient(base_url).answer("Show me top accounts")
+        flush_spans()
+    finally:
+        server.should_exit = True
+        configure_tracing(None)
+    traces = collector.traces()
+    print(f"\none turn through the query service: {len(traces)} trace, {sum(len(t) for t in traces.values())} spans in {collector.requests} OTLP requests")
+    for spans in traces.values():
+        print_span_tree(spans)
+
+
+def bench_logging():
+    """Logging cost on the calling thread: synchronous file handler versus the background JSON writer"""
+    import os
+    import tempfile
+    import threading
+
+    from log_config import JsonFormatter, TextFormatter, background_handler, file_handler
+
+    directory = tempfile.mkdtemp()
+    query = "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity ORDER BY CreatedDate DESC LIMIT 10"
+
+    def isolated_logger(name, handler):
+        log = logging.getLogger(f"bench.{name}")
+        log.handlers, log.propagate = [handler], False
+        log.setLevel(logging.DEBUG)
+        return log
+
+    def per_call(log, n, threads=1, level=logging.INFO, exc=False):
+        def work():
+            for i in range(n):
+                if exc:
+                    try:
+                        raise ConnectionError("Cannot connect to host mock.my.salesforce.com:443")
+                    except ConnectionError:
+                        log.exception("Query failed")
+                else:
+                    log.log(level, f"Query executed: {query}")
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return (time.perf_counter() - start) / (n * threads)
+
+    class SlowDiskHandler(logging.FileHandler):
+        """A file on a disk (or network share) where each write takes a millisecond"""
+
+        def emit(self, record):
+            super().emit(record)
+            time.sleep(0.001)
+
+    text_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for disk, handler_class, n in (('local disk', logging.FileHandler, 20_000), ('1 ms/write disk', SlowDiskHandler, 400)):
+        for label in ('basicConfig FileHandler', 'queue + JSON writer'):
+            for threads in (1, 8):
+                path = os.path.join(directory, f"{label.split()[0]}_{handler_class.__name__}_{threads}.log")
+                if label.startswith('queue'):
+                    target = file_handler(path)
+                    if handler_class is SlowDiskHandler:
+                        target.emit = lambda record, emit=target.emit: (emit(record), time.sleep(0.001))
+                    handler, listener = background_handler([target], rate_limit='off')
+                else:
+                    handler, listener = handler_class(path), None
+                    handler.setFormatter(text_format)
+                log = isolated_logger(f"{label.split()[0]}{disk}{threads}", handler)
+                cost = per_call(log, n // threads, threads)
+                drained = ''
+                if listener is not None:
+                    start = time.perf_counter()
+                    listener.stop()
+                    drained = f" (writer caught up {(time.perf_counter() - start) * 1000:.0f} ms later)"
+                handler.close()
+                print(f"{disk + ', ' + label + ', ' + str(threads) + 't':>50}: {cost * 1e6:7.1f} us per INFO record{drained}")
+
+    # A burst of identical errors with tracebacks, as a Salesforce outage produces
+    for label, spec in (('no rate limit', 'off'), ('rate limited 5/60', '5/60')):
+        path = os.path.join(directory, f"errors_{spec.replace('/', '_')}.log")
+        handler, listener = background_handler([file_handler(path)], rate_limit=spec)
+        cost = per_call(isolated_logger(f"errors{spec}", handler), 2_000, exc=True)
+        listener.stop()
+        print(f"{'2000 repeated errors, ' + label:>50}: {cost * 1e6:6.1f} us each, {os.path.getsize(path) / 1024:7.1f} KiB written")
+
+    # High-volume DEBUG logging on the hot path
+    for rate in (1.0, 0.01):
+        handler, listener = background_handler([file_handler(os.path.join(directory, f'debug_{rate}.log'))], rate_limit='off', debug_sample_rate=rate)
+        cost = per_call(isolated_logger(f"debug{rate}", handler), 20_000, level=logging.DEBUG)
+        listener.stop()
+        print(f"{'DEBUG records, sample rate ' + str(rate):>50}: {cost * 1e6:6.1f} us each")
+
+    # Rotation with compression on a small size limit
+    rotating = file_handler(os.path.join(directory, 'rotating.log'), max_bytes=256 * 1024, backup_count=3)
+    handler, listener = background_handler([rotating], rate_limit='off')
+    per_call(isolated_logger('rotating', handler), 20_000)
+    listener.stop()
+    files = sorted(f for f in os.listdir(directory) if f.startswith('rotating'))
+    print(f"{'rotated at 256 KiB':>50}: " + ", ".join(f"{f} {os.path.getsize(os.path.join(directory, f)) / 1024:.0f} KiB" for f in files))
+
+    record = logging.LogRecord('chatbot_engine.engine', logging.INFO, __file__, 1, f"Query executed: {query}", None, None)
+    print(f"\n{'text':>6}: {TextFormatter().format(record)}")
+    print(f"{'json':>6}: {JsonFormatter().format(record)}")
+
+
+def bench_replay():
+    """Recorded workload replayed through the real Salesforce client against the local mock server"""
+    from replay import default_workload, print_report, run_replay
+
+    logging.getLogger().setLevel(logging.WARNING)
+    prompts = default_workload()
+    for concurrency, sf_latency, llm_latency in ((1, 0.0, 0.0), (8, 0.05, 0.2)):
+        print()
+        print_report(run_replay(prompts, sf_latency=sf_latency, llm_latency=llm_latency, concurrency=concurrency, memory=concurrency == 1))
+
+
+def bench_loadtest():
+    """Saturation curve for concurrent chat users with 8 job workers, 50 ms Salesforce and 200 ms LLM stand-ins"""
+    from loadtest import DEFAULT_MIX, WorkloadMix, print_report, run_load_test, workload_categories
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    mix = WorkloadMix.from_spec(DEFAULT_MIX, workload_categories())
+    report = run_load_test([4, 16, 64], mix, duration=5.0, think=1.0, workers=8, sf_latency=0.05, llm_latency=0.2, progress=None)
+    print_report(report)
+
+
+def bench_synthetic_data():
+    """Synthetic dataset generation rate per format, and peak memory as the row count grows"""
+    import tempfile
+    import tracemalloc
+
+    from synthetic_data import FORMATS, dataset_sizes, write_object
+
+    directory = tempfile.mkdtemp()
+    sizes = dataset_sizes(25_000)
+    for fmt in FORMATS:
+        start = time.perf_counter()
+        files, size = write_object("Opportunity", fmt, sizes, directory)
+        elapsed = time.perf_counter() - start
+        print(f"{fmt:>8}: {sizes['Opportunity'] / elapsed:>10,.0f} rows/s, {size / sizes['Opportunity']:.0f} bytes per row")
+
+    # Streaming writers: peak memory follows the chunk size, not the row count
+    for accounts in (25_000, 250_000):
+        sizes = dataset_sizes(accounts)
+        tracemalloc.start()
+        write_object("Opportunity", "parquet", sizes, directory)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{sizes['Opportunity']:>10,} opportunities to Parquet: peak {peak / 2**20:.0f} MiB traced")
+
+
+def bench_snapshots():
+    """Snapshot save, dedup and memory-mapped reads against the old pretty-printed JSON dumps"""
+    import os
+    import tempfile
+
+    from results import QueryResult
+    from snapshots import SnapshotStore
+    from synthetic_data import as_text, dataset_sizes, generate, page_records
+
+    sizes = dataset_sizes(10_000)
+    frame = generate("Opportunity", 0, 50_000, sizes, seed=0)
+    records = page_records("Opportunity", as_text(frame))
+    result = QueryResult.from_records(records)
+    query = "SELECT Id, Name, Amount, StageName, CloseDate, AccountId FROM Opportunity"
+    directory = tempfile.mkdtemp()
+
+    path = os.path.join(directory, "salesforce_opportunities_data.json")
+    start = time.perf_counter()
+    with open(path, "w") as f:
+        json.dump(records, f, indent=2)
+    dump_time = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(path) as f:
+        QueryResult.from_records(json.load(f)).to_pandas()
+    load_time = time.perf_counter() - start
+    print(f"    json dump: write {dump_time * 1000:7.1f} ms, read {load_time * 1000:7.1f} ms, {os.path.getsize(path) / 2**20:6.1f} MiB")
+
+    for compression in ("zstd", "lz4", "none"):
+        store = SnapshotStore(os.path.join(directory, compression), compression=compression)
+        start = time.perf_counter()
+        snapshot = store.save(result, query)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        store.save(result, query)
+        dedup_time = time.perf_counter() - start
+        start = time.perf_counter()
+        table = store.read_table(snapshot)
+        open_time = time.perf_counter() - start
+        start = time.perf_counter()
+        QueryResult(table).to_pandas()
+        read_time = time.perf_counter() - start + open_time
+        print(f"{compression:>13}: write {save_time * 1000:7.1f} ms, read {read_time * 1000:7.1f} ms "
+              f"(open {open_time * 1000:.1f} ms), {snapshot.bytes / 2**20:6.1f} MiB, unchanged re-fetch {dedup_time * 1000:.1f} ms")
+
+
+def bench_warmup():
+    """Startup warm-up: time to ready from Salesforce and from snapshots, and the first preset turns after it"""
+    import tempfile
+
+    import snapshots
+    import warmup
+    from cache import MemoryBackend, set_backend
+    from chatbot_engine import advisor, answer_query, connect_salesforce
+    from mock_services import MockSalesforce, MockSalesforceServer, load_shapes
+    from warmup import Warmer
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    advisor.ADVISOR_LOG = None
+    # Rule-based intents, so only the Salesforce side differs between runs
+    questions = ["Show me top accounts", "Show recent opportunities", "Show opportunities by stage", "List contacts", "Create a chart of opportunity stages"]
+    server = MockSalesforceServer(MockSalesforce(latency=0.08, rows=2000, shapes=load_shapes())).start()
+    snapshots._store = snapshots.SnapshotStore(tempfile.mkdtemp())
+    # Snapshots are opt-in; the third run measures what turning them on buys
+    snapshots.SNAPSHOTS_ENABLED = warmup.SNAPSHOTS_ENABLED = True
+
+    def login():
+        return connect_salesforce("warmup@example.com", "warmup", "token", session=server.session())
+
+    def first_turns(sf):
+        latencies = []
+        for question in questions:
+            start = time.perf_counter()
+            answer_query(question, None, sf)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    try:
+        for label in ("cold start", "warm from Salesforce", "warm from snapshots"):
+            # A fresh process: empty in-memory caches, only the snapshots on disk survive
+            set_backend(MemoryBackend())
+            server.calls.clear()
+            if label == "cold start":
+                sf, ready = login(), 0.0
+            else:
+                start = time.perf_counter()
+                warmer = Warmer(login, budget=30).run()
+                ready = time.perf_counter() - start
+                sf = warmer.result("login")
+            warm_calls = sum(server.calls.values())
+            server.calls.clear()
+            latencies = first_turns(sf)
+            print(f"{label:>22}: ready in {ready * 1000:6.0f} ms ({warm_calls:>2} API calls), "
+                  f"first turns p50 {sorted(latencies)[len(latencies) // 2] * 1000:5.1f} ms, max {max(latencies) * 1000:5.1f} ms, "
+                  f"{sum(server.calls.values())} API calls")
+    finally:
+        server.shutdown()
+        server.server_close()
+        snapshots._store = None
+        snapshots.SNAPSHOTS_ENABLED = warmup.SNAPSHOTS_ENABLED = False
+
+
+def bench_cold_start():
+    """Import time before each Streamlit app's first page, and what the lazy imports cost when first used"""
+    import subprocess
+
+    from import_profile import COLD_START_BUDGETS, LAZY_PACKAGES, best_profile, check, total_ms
+
+    for script in COLD_START_BUDGETS:
+        timings, missing = best_profile(script)
+        problems = check(script, timings)
+        print(f"{script:>26}: {total_ms(timings):6.0f} ms, {len(timings)} modules"
+              f"{' (' + '; '.join(problems) + ')' if problems else ''}{', missing ' + ', '.join(missing) if missing else ''}")
+
+    # Paid later, on first use, on a warm-up thread or a button press instead of before the first page
+    for package in LAZY_PACKAGES:
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-W", "ignore", "-c", f"import {package}"], capture_output=True)
+        elapsed = time.perf_counter() - started
+        baseline = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"])
+        elapsed -= time.perf_counter() - baseline
+        state = f"{elapsed * 1000:6.0f} ms" if result.returncode == 0 else "not installed"
+        print(f"{'import ' + package:>26}: {state}")
+
+
+def bench_prefetch():
+    """Predictive prefetch over simulated analyst sessions: hit rate, wasted calls and turn latency"""
+    import random
+
+    from cache import MemoryBackend, set_backend
+    from chatbot_engine import advisor, answer_query, connect_salesforce
+    from mock_services import MockSalesforce, MockSalesforceServer, load_shapes
+    from prefetch import CallBudget, Prefetcher
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    advisor.ADVISOR_LOG = None
+    server = MockSalesforceServer(MockSalesforce(latency=0.08, rows=2000, shapes=load_shapes())).start()
+    sf = connect_salesforce("prefetch@example.com", "prefetch", "token", session=server.session())
+
+    def analyst(rng):
+        # Top accounts, then usually the top account's opportunities, then often its contacts
+        reply = yield "Show me top accounts"
+        account = reply["frame"]["AccountId"].iloc[0 if rng.random() < 0.8 else 1]
+        if rng.random() < 0.75:
+            yield f"SELECT Id, Name, Amount, StageName FROM Opportunity WHERE AccountId = '{account}' LIMIT 20"
+        else:
+            yield "Show recent opportunities"
+        if rng.random() < 0.6:
+            yield f"SELECT Id, Name, Email FROM Contact WHERE AccountId = '{account}' LIMIT 20"
+        else:
+            yield "Show opportunities by stage"
+
+    def run(prefetcher, sessions=30):
+        rng = random.Random(7)
+        server.calls.clear()
+        latencies = []
+        for number in range(sessions):
+            # Sessions far enough apart that nothing of the last one is still cached
+            set_backend(MemoryBackend())
+            path = analyst(rng)
+            question = next(path)
+            while True:
+                start = time.perf_counter()
+                reply = answer_query(question, None, sf)
+                latencies.append(time.perf_counter() - start)
+                if prefetcher is not None:
+                    prefetcher.after_turn(sf, reply, f"session-{number}", "analyst")
+                    # The analyst reads the answer while the follow-ups are fetched
+                    prefetcher.drain()
+                try:
+                    question = path.send(reply)
+                except StopIteration:
+                    break
+            if prefetcher is not None:
+                prefetcher.expire(float("inf"))
+        return latencies, sum(server.calls.values())
+
+    configs = [
+        ("no prefetch", None),
+        ("prefetch", Prefetcher(min_probability=0.3, min_observations=3, max_per_turn=2, budget=CallBudget(1000))),
+        ("aggressive (p>=0.1, 3)", Prefetcher(min_probability=0.1, min_observations=3, max_per_turn=3, budget=CallBudget(1000))),
+        ("budget of 20 calls", Prefetcher(min_probability=0.3, min_observations=3, max_per_turn=2, budget=CallBudget(20))),
+    ]
+    try:
+        for label, prefetcher in configs:
+            latencies, calls = run(prefetcher)
+            line = (f"{label:>24}: turn p50 {np.percentile(latencies, 50) * 1000:5.0f} ms, mean {np.mean(latencies) * 1000:5.0f} ms, "
+                    f"{calls:>4} API calls")
+            if prefetcher is not None:
+                stats = prefetcher.stats()
+                line += (f", {stats['hits']:>2} hits of {stats['fetched']:>2} fetched (hit rate {stats['hit_rate']:.0%}), "
+                         f"{stats['wasted_calls']:>2} of {stats['calls']:>2} speculative calls wasted, {stats['over_budget']} over budget")
+            print(line)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_refine():
+    """Follow-ups answered from the previous result against a new Gemini question and SOQL round-trip each"""
+    from cache import MemoryBackend, set_backend
+    from chatbot_engine import advisor, answer_query, refine_reply
+    from mock_services import FakeLLM, MockSalesforce, load_shapes
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    advisor.ADVISOR_LOG = None
+    base = "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity ORDER BY CreatedDate DESC LIMIT 2000"
+    # Each follow-up, and the SOQL the model would write for it as a new question
+    follow_ups = [
+        ("top 10 by amount", "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity ORDER BY Amount DESC LIMIT 10"),
+        ("amount over 400k", "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity WHERE Amount > 400000 LIMIT 2000"),
+        ("excluding prospecting", "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity WHERE StageName != 'Prospecting' LIMIT 2000"),
+        ("sort by close date", "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name FROM Opportunity ORDER BY CloseDate DESC LIMIT 2000"),
+        ("just name and amount", "SELECT Name, Amount FROM Opportunity ORDER BY CreatedDate DESC LIMIT 2000"),
+        ("show created date too", "SELECT Id, Name, Amount, StageName, CloseDate, Account.Name, CreatedDate FROM Opportunity ORDER BY CreatedDate DESC LIMIT 2000"),
+    ]
+    set_backend(MemoryBackend())
+    sf, llm = MockSalesforce(latency=0.08, rows=2000, shapes=load_shapes()), FakeLLM(latency=0.2)
+    previous = answer_query(base, llm, sf)
+    print(f"previous result: {len(previous['frame'])} rows, {len(previous['frame'].columns)} columns")
+
+    for text, soql in follow_ups:
+        # A fresh cache each time, as for a query nobody has run yet
+        set_backend(MemoryBackend())
+        calls, llm_calls = sf.api_calls, llm.calls
+        start = time.perf_counter()
+        answer_query(soql, llm, sf)
+        asked_ms = (time.perf_counter() - start) * 1000
+        asked_calls = sf.api_calls - calls + llm.calls - llm_calls
+
+        set_backend(MemoryBackend())
+        calls, llm_calls = sf.api_calls, llm.calls
+        start = time.perf_counter()
+        refined = refine_reply(text, previous, sf)
+        refined_ms = (time.perf_counter() - start) * 1000
+        refined_calls = sf.api_calls - calls + llm.calls - llm_calls
+        rows = len(refined["frame"]) if refined and "frame" in refined else 0
+        # The mock ignores WHERE and ORDER BY, so only the refined row counts mean anything
+        print(f"{text:>22}: new question {asked_ms:6.0f} ms ({asked_calls} calls), refined {refined_ms:6.1f} ms ({refined_calls} calls, {rows:>4} rows)")
+
+
+BENCHMARKS = {
+    'map_features': bench_map_features,
+    'map_tiles': bench_map_tiles,
+    'charts': bench_charts,
+    'exports': bench_exports,
+    'jobs': bench_jobs,
+    'query_service': bench_query_service,
+    'cache': bench_cache,
+    'results': bench_results,
+    'json': bench_json,
+    'composite': bench_composite,
+    'dml': bench_dml,
+    'advisor': bench_advisor,
+    'query_stats': bench_query_stats,
+    'tracing': bench_tracing,
+    'logging': bench_logging,
+    'replay': bench_replay,
+    'loadtest': bench_loadtest,
+    'synthetic_data': bench_synthetic_data,
+    'snapshots': bench_snapshots,
+    'warmup': bench_warmup,
+    'cold_start': bench_cold_start,
+    'prefetch': bench_prefetch,
+    'refine': bench_refine,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}. Choose from: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        print(f"\n== {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
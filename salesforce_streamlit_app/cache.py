@@ -0,0 +1,452 @@
+"""Pluggable cache tier for query results, LLM responses, geocodes and tokens
+
+The backend is chosen with CACHE_URL, so several Streamlit or query-service
+processes can share one cache:
+
+    memory://                  process-local (the default)
+    none://                    caching disabled
+    sqlite:///path/cache.db    a file shared by the processes on one host
+    redis://host:6379/0        any Redis-protocol server
+
+Values are stored as compact bytes: DataFrames as Arrow IPC streams,
+everything else as msgpack when it is installed and JSON otherwise.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+
+# Entries kept by the in-memory backend before the least recently used is evicted
+MEMORY_MAX_ENTRIES = 10_000
+
+# Default time-to-live per namespace, in seconds
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "300"))
+LLM_CACHE_TTL = 24 * 3600
+GEOCODE_CACHE_TTL = 30 * 24 * 3600
+TOKEN_CACHE_TTL = 3600
+PLAN_CACHE_TTL = 24 * 3600
+
+# One-byte tags saying how a value was serialized
+_ARROW, _MSGPACK, _JSON = b"A", b"M", b"J"
+
+
+def encode_value(value):
+    """Serialize a value to tagged bytes"""
+    if isinstance(value, pd.DataFrame):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(value, preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="lz4")) as writer:
+            writer.write_table(table)
+        return _ARROW + sink.getvalue()
+    if msgpack is not None:
+        return _MSGPACK + msgpack.packb(value, default=str, use_bin_type=True)
+    return _JSON + json.dumps(value, separators=(',', ':'), default=str).encode("utf-8")
+
+
+def decode_value(data):
+    """Inverse of encode_value"""
+    tag, payload = data[:1], data[1:]
+    if tag == _ARROW:
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(payload).read_all().to_pandas()
+    if tag == _MSGPACK:
+        return msgpack.unpackb(payload, raw=False)
+    if tag == _JSON:
+        return json.loads(payload)
+    raise ValueError(f"Unknown cache value format: {tag!r}")
+
+
+def cache_key(*parts):
+    """Fixed-length key for arbitrary parts such as a prompt or a SOQL query"""
+    return hashlib.blake2b("\x1f".join(str(p) for p in parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def credential_scope(*parts):
+    """Short opaque scope id for a set of credentials, e.g. (username, domain)"""
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+
+
+def session_scope(sf):
+    """Opaque scope id of a Salesforce client's session, as the prefix of its cached query results"""
+    return credential_scope(getattr(sf, "sf_instance", ""), getattr(sf, "session_id", ""))
+
+
+class CacheBackend:
+    """Byte store with per-key expiry; implementations must be safe to share between threads"""
+
+    def get(self, key):
+        """Return the bytes stored under key, or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Store bytes under key, expiring after ttl seconds if given"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self, prefix=""):
+        """Drop every key starting with prefix"""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Process-local LRU dict"""
+
+    def __init__(self, max_entries=MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, prefix=""):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+class NullBackend(CacheBackend):
+    """Stores nothing, for running with caching switched off"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self, prefix=""):
+        pass
+
+
+class SQLiteBackend(CacheBackend):
+    """Cache table in a SQLite file, shared by every process that opens the same path
+
+    Runs in WAL mode so readers don't block the writer; each thread gets its
+    own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(value), time.time() + ttl if ttl else None)
+        )
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self, prefix=""):
+        self._connection().execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def purge_expired(self):
+        """Delete expired rows; reads skip them anyway, this just reclaims space"""
+        self._connection().execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP client, so any Redis-compatible server works without the redis package
+
+    Each thread keeps its own connection; expiry is left to the server.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        try:
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", self.db)
+        except Exception:
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        """Close this thread's connection; after an error it may be half-read, so it is never reused"""
+        reader, sock = getattr(self._local, "reader", None), getattr(self._local, "sock", None)
+        self._local.reader = self._local.sock = None
+        for stream in (reader, sock):
+            if stream is not None:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+    def _call(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def command(self, *args):
+        """Send one command and return its reply, reconnecting once if the connection dropped"""
+        for attempt in (0, 1):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return self._call(*args)
+            except (ConnectionError, socket.timeout, OSError):
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            self.command("SET", key, value)
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+    def clear(self, prefix=""):
+        cursor = "0"
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 500)
+            if keys:
+                self.command("DEL", *keys)
+            cursor = cursor.decode("utf-8") if isinstance(cursor, bytes) else cursor
+            if cursor == "0":
+                break
+
+
+def backend_from_url(url):
+    """Build a backend from a CACHE_URL such as sqlite:///cache.db or redis://localhost:6379/0"""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "none":
+        return NullBackend()
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db and sqlite:////absolute/path.db, like SQLAlchemy
+        return SQLiteBackend(parsed.path[1:] if parsed.path.startswith("/") else parsed.path)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+
+class Cache:
+    """Namespaced view of a backend that serializes values and counts hits"""
+
+    def __init__(self, backend, namespace, ttl=None):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key, default=None):
+        try:
+            data = self.backend.get(self._key(key))
+        except Exception as e:
+            # A cache outage must not take the app down; treat it as a miss
+            logger.warning(f"Cache read failed for {self.namespace}: {str(e)}")
+            data = None
+        if data is not None:
+            try:
+                value = decode_value(data)
+            except Exception as e:
+                # A truncated entry or one written by something else; drop it so it is recomputed
+                logger.warning(f"Dropping unreadable cache entry in {self.namespace}: {str(e)}")
+                self.delete(key)
+                data = None
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(self._key(key), encode_value(value), ttl or self.ttl)
+        except Exception as e:
+            logger.warning(f"Cache write failed for {self.namespace}: {str(e)}")
+
+    def delete(self, key):
+        try:
+            self.backend.delete(self._key(key))
+        except Exception as e:
+            logger.warning(f"Cache delete failed for {self.namespace}: {str(e)}")
+
+    def clear(self, prefix=""):
+        """Drop the namespace's keys starting with prefix, or all of them"""
+        try:
+            self.backend.clear(self._key(prefix))
+        except Exception as e:
+            # Entries then live out their TTL; callers such as a committed write mustn't fail over it
+            logger.warning(f"Cache clear failed for {self.namespace}: {str(e)}")
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """Return the cached value for key, computing and storing it on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+
+_backend = None
+_caches = {}
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process's backend from CACHE_URL, created on first use"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backend_from_url(CACHE_URL)
+            logger.info(f"Using {type(_backend).__name__} for the shared cache")
+        return _backend
+
+
+def set_backend(backend):
+    """Swap the process's backend, e.g. for a benchmark; existing caches follow it"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+        for cache in _caches.values():
+            cache.backend = backend
+
+
+def get_cache(namespace, ttl=None):
+    """Cache for one kind of value, e.g. get_cache("geocode", GEOCODE_CACHE_TTL)
+
+    Values are set with the ttl of this call, so callers asking for the same
+    namespace with different ttls each get theirs; ttl=None stores without
+    expiry and is meant for reading or clearing.
+    """
+    backend = get_backend()
+    with _backend_lock:
+        if (namespace, ttl) not in _caches:
+            _caches[namespace, ttl] = Cache(backend, namespace, ttl)
+        return _caches[namespace, ttl]
+
+
+def cache_stats():
+    """Hit and miss counts per namespace in this process"""
+    stats = {}
+    for (name, _), c in list(_caches.items()):
+        counts = stats.setdefault(name, {"hits": 0, "misses": 0})
+        counts["hits"] += c.hits
+        counts["misses"] += c.misses
+    return stats
@@ -0,0 +1,127 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from shared_resources import frame_fingerprint
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Bar charts keep this many bars and fold the rest into an "Other" bar
+CHART_MAX_BARS = 25
+
+# Number of compiled chart specs kept per process
+SPEC_CACHE_SIZE = 128
+
+# Chart definitions per intent: label/value fields drive the top-N reduction,
+# tooltips carry explicit types because named data can't be type-inferred
+CHART_DEFINITIONS = {
+    "opportunity_stage_chart": {
+        "label": "StageName",
+        "value": "totalAmount",
+        "title": "Opportunities by Stage",
+        "tooltip": ["StageName:N", "opportunityCount:Q", "totalAmount:Q"],
+    },
+    "opportunity_amount_chart": {
+        "label": "Name",
+        "value": "Amount",
+        "title": "Top Opportunities by Amount",
+        "tooltip": ["Name:N", "Amount:Q", "CloseDate:T"],
+    },
+    "top_accounts": {
+        "label": "Account.Name",
+        "value": "totalAmount",
+        "title": "Top Accounts by Total Opportunity Amount",
+        "tooltip": ["Account.Name:N", "totalAmount:Q"],
+    },
+}
+
+# Shared by every session's script thread
+_spec_cache = OrderedDict()
+_spec_lock = threading.Lock()
+
+
+def top_n(df, label, value, n=CHART_MAX_BARS):
+    """Keep the n-1 largest rows by value and fold the remainder into one "Other" row"""
+    if len(df) <= n:
+        return df
+
+    values = pd.to_numeric(df[value], errors="coerce")
+    keep = values.nlargest(n - 1).index
+    rest = df.drop(index=keep)
+    other = {label: f"Other ({len(rest)})", value: pd.to_numeric(rest[value], errors="coerce").sum()}
+    return pd.concat([df.loc[keep], pd.DataFrame([other])], ignore_index=True)
+
+
+def _field(name):
+    """Escape dots so flattened names like Account.Name aren't read as nested paths"""
+    return name.replace(".", "\\.")
+
+
+def _compile_spec(intent, dataset_name):
+    """Compile the Vega-Lite spec for an intent against a named dataset"""
+    # Imported here: altair costs a quarter of a second at startup and only chart turns need it
+    import altair as alt
+
+    definition = CHART_DEFINITIONS[intent]
+    label, value = _field(definition["label"]), _field(definition["value"])
+    tooltip = [_field(t) for t in definition["tooltip"]]
+    base = alt.Chart(alt.NamedData(name=dataset_name)).mark_bar()
+
+    if intent == "opportunity_stage_chart":
+        # Vertical bars coloured by stage
+        chart = base.encode(
+            x=alt.X(f"{label}:N", sort="-y"),
+            y=alt.Y(f"{value}:Q", title="Total Amount ($)"),
+            color=f"{label}:N",
+            tooltip=tooltip
+        )
+    else:
+        # Horizontal bars sorted by amount
+        chart = base.encode(
+            y=alt.Y(f"{label}:N", sort="-x"),
+            x=alt.X(f"{value}:Q", title="Amount ($)" if value == "Amount" else "Total Amount ($)"),
+            tooltip=tooltip
+        )
+    return chart.properties(title=definition["title"], width=600).to_dict()
+
+
+def create_visualization(df, intent):
+    """Build a Vega-Lite spec for the intent, or None if the data doesn't fit a chart
+
+    The spec references its data by name and the reduced frame is attached under
+    "datasets", so st.vega_lite_chart ships it as Arrow instead of inline JSON.
+    Compiled specs are cached per (intent, data fingerprint).
+    """
+    definition = CHART_DEFINITIONS.get(intent)
+    if definition is None or df.empty:
+        return None
+
+    # Custom and LLM-written queries may not return the fields the chart needs
+    if definition["label"] not in df.columns or definition["value"] not in df.columns:
+        return None
+
+    with span("create_visualization", intent=intent, rows=len(df)) as chart_span:
+        key = (intent, frame_fingerprint(df))
+        with _spec_lock:
+            cached = _spec_cache.get(key)
+            if cached is not None:
+                _spec_cache.move_to_end(key)
+        chart_span.set("cache", "hit" if cached is not None else "miss")
+        if cached is not None:
+            spec, data = cached
+        else:
+            data = top_n(df, definition["label"], definition["value"])
+            fields = [t.rsplit(":", 1)[0] for t in definition["tooltip"]]
+            data = data[[f for f in fields if f in data.columns]]
+            spec = _compile_spec(intent, f"{intent}-{key[1]}")
+            with _spec_lock:
+                _spec_cache[key] = (spec, data)
+                if len(_spec_cache) > SPEC_CACHE_SIZE:
+                    _spec_cache.popitem(last=False)
+            logger.info(f"Compiled chart spec for {intent} from {len(df)} rows ({len(data)} plotted)")
+
+        # Hand out a fresh top-level dict so callers can't mutate the cached spec
+        return {**spec, "datasets": {spec["data"]["name"]: data}}
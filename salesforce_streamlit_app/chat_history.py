@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from contextlib import nullcontext
+
+import pandas as pd
+import streamlit as st
+
+from charts import create_visualization
+from exports import download_buttons
+from results import raw_json_records
+from shared_resources import ResultStore, get_result_store
+from tracing import extract, span
+
+logger = logging.getLogger(__name__)
+
+# The newest messages are rendered with their tables and charts, older ones as text pages
+RECENT_MESSAGES = 6
+HISTORY_PAGE_SIZE = 20
+
+# Past this many in-memory messages the oldest half is spilled to disk
+MAX_IN_MEMORY_MESSAGES = 200
+
+SPILL_DIR = os.getenv("CHAT_SPILL_DIR", ".chat_history")
+
+# Spill directories untouched for this long belong to sessions that are gone
+# (say the process was restarted) and are removed when the next one starts
+SPILL_MAX_AGE = float(os.getenv("CHAT_SPILL_MAX_AGE", str(24 * 3600)))
+
+
+class ChatHistory:
+    """Chat log for one session, holding compact messages with references to result frames
+
+    Messages are small dicts (role, content and, for answers, a result key plus
+    intent/filename/row count). Result frames live in a shared ResultStore,
+    referenced by this session until the message is spilled or cleared. Once
+    the log grows past ``max_in_memory`` the oldest messages are appended to a
+    JSONL file and their frames written next to it, so memory and per-rerun
+    work stay flat however long the conversation gets.
+    """
+
+    def __init__(self, session_id=None, max_in_memory=MAX_IN_MEMORY_MESSAGES, spill_dir=SPILL_DIR, store=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.max_in_memory = max_in_memory
+        self.spill_path = os.path.join(spill_dir, self.session_id)
+        self.store = store if store is not None else ResultStore()
+        self.messages = []
+        # Byte offsets of the spilled messages in messages.jsonl, oldest first
+        self._spilled_offsets = []
+        # Give the shared frames back and delete the spilled messages when the session's history is garbage collected
+        weakref.finalize(self, _discard, self.store, self.session_id, self.spill_path)
+
+    def __len__(self):
+        return len(self._spilled_offsets) + len(self.messages)
+
+    def add(self, role, content, result=None, scope="default", **details):
+        """Append a message, storing an optional result frame by reference under a credential scope"""
+        message = {"role": role, "content": content}
+        if result is not None:
+            key = self.store.put(result, scope, owner=self.session_id)
+            message.update(result=key, rows=len(result), **details)
+        self.messages.append(message)
+
+        if len(self.messages) > self.max_in_memory:
+            self._spill(len(self.messages) - self.max_in_memory // 2)
+        return message
+
+    def get_result(self, key):
+        """Return a result frame from the shared store or from the spill directory"""
+        frame = self.store.get(key)
+        if frame is not None:
+            return frame
+        path = os.path.join(self.spill_path, f"{key}.pkl")
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+        return None
+
+    def recent(self, count=RECENT_MESSAGES):
+        """The newest messages, oldest first"""
+        return self.messages[-count:]
+
+    def older_page(self, page, page_size=HISTORY_PAGE_SIZE, skip_recent=RECENT_MESSAGES):
+        """One page of the messages before the recent ones; page 0 is the newest"""
+        older = max(len(self) - skip_recent, 0)
+        end = max(older - page * page_size, 0)
+        start = max(end - page_size, 0)
+        return [self._message_at(i) for i in range(start, end)]
+
+    def older_pages(self, page_size=HISTORY_PAGE_SIZE, skip_recent=RECENT_MESSAGES):
+        """Number of pages older_page can return"""
+        older = max(len(self) - skip_recent, 0)
+        return (older + page_size - 1) // page_size
+
+    def clear(self):
+        """Drop every message and any spilled files"""
+        self.messages = []
+        self._spilled_offsets = []
+        _discard(self.store, self.session_id, self.spill_path)
+
+    def _message_at(self, index):
+        """Message by absolute position, reading spilled ones back from disk"""
+        spilled = len(self._spilled_offsets)
+        if index >= spilled:
+            return self.messages[index - spilled]
+        with open(os.path.join(self.spill_path, "messages.jsonl"), "rb") as f:
+            f.seek(self._spilled_offsets[index])
+            return json.loads(f.readline())
+
+    def _spill(self, count):
+        """Move the oldest count messages and their result frames to disk"""
+        os.makedirs(self.spill_path, exist_ok=True)
+        spilled, self.messages = self.messages[:count], self.messages[count:]
+        with open(os.path.join(self.spill_path, "messages.jsonl"), "ab") as f:
+            for message in spilled:
+                self._spilled_offsets.append(f.tell())
+                f.write(json.dumps(message, default=str).encode("utf-8") + b"\n")
+                key = message.get("result")
+                if key is None:
+                    continue
+                path = os.path.join(self.spill_path, f"{key}.pkl")
+                frame = self.store.get(key)
+                if frame is not None and not os.path.exists(path):
+                    frame.to_pickle(path)
+                self.store.release(self.session_id, key)
+        logger.info(f"Spilled {count} chat messages to {self.spill_path}")
+
+
+def _discard(store, session_id, spill_path):
+    # No reference to the history itself, so it can run as its finalizer
+    store.release_owner(session_id)
+    shutil.rmtree(spill_path, ignore_errors=True)
+
+
+def sweep_spill_dirs(spill_dir=SPILL_DIR, max_age=SPILL_MAX_AGE, now=None):
+    """Remove session spill directories nothing has written to for max_age seconds; returns how many"""
+    now = time.time() if now is None else now
+    try:
+        entries = list(os.scandir(spill_dir))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        try:
+            newest = max([entry.stat().st_mtime] + [f.stat().st_mtime for f in os.scandir(entry.path)])
+        except FileNotFoundError:
+            continue
+        if now - newest > max_age:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale chat spill directories from {spill_dir}")
+    return removed
+
+
+_swept = False
+_sweep_lock = threading.Lock()
+
+
+def _sweep_once():
+    global _swept
+    with _sweep_lock:
+        if _swept:
+            return
+        _swept = True
+    try:
+        sweep_spill_dirs()
+    except OSError as e:
+        logger.warning(f"Could not sweep chat spill directories: {e}")
+
+
+def get_chat_history():
+    """Return this session's ChatHistory, creating it on first use
+
+    The first one in a process also sweeps away spill directories left
+    behind by sessions of earlier processes.
+    """
+    if not isinstance(st.session_state.get("chat_history"), ChatHistory):
+        _sweep_once()
+        st.session_state.chat_history = ChatHistory(store=get_result_store())
+    return st.session_state.chat_history
+
+
+def render_result(history, message, export_source=None, export_transform=None, show_raw_json=False):
+    """Render the table or chart and download buttons attached to a message"""
+    df = history.get_result(message["result"])
+    if df is None:
+        st.caption(f"Result with {message['rows']} rows is no longer available")
+        return
+
+    # The first render of an answer ends its chat turn's trace; later reruns aren't traced
+    trace = extract(message.pop("trace", None))
+    with span("render_result", parent=trace, rows=len(df)) if trace else nullcontext():
+        chart = create_visualization(df, message.get("intent"))
+        if chart:
+            st.vega_lite_chart(spec=chart, use_container_width=True)
+        else:
+            st.dataframe(df)
+
+        # An export source may pass on a message, which then exports from its frame
+        source = export_source(message) if export_source else None
+        download_buttons(df if source is None else source, message.get("filename", "query_results.csv"), key=f"download_{message['result']}", transform=export_transform)
+
+    # The JSON view is rebuilt from the typed frame only when asked for
+    if show_raw_json and st.checkbox("Show Raw JSON", key=f"raw_json_{message['result']}"):
+        st.json(raw_json_records(df))
+
+
+def render_message(history, message, expanded=True, **render_options):
+    """Render one chat message, with its result only when expanded"""
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+        if "result" not in message:
+            return
+        if expanded:
+            render_result(history, message, **render_options)
+        else:
+            st.caption(f"📎 {message['rows']} rows")
+
+
+def display_chat_history(**render_options):
+    """Render recent messages in full and older ones as collapsed, paginated text"""
+    history = get_chat_history()
+
+    pages = history.older_pages()
+    if pages:
+        with st.expander(f"Earlier messages ({len(history) - len(history.recent())})"):
+            page = st.number_input("Page (1 is most recent)", 1, pages, 1, key="history_page") - 1
+            for message in history.older_page(page):
+                render_message(history, message, expanded=False)
+
+    for message in history.recent():
+        render_message(history, message, **render_options)
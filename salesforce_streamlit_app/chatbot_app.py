@@ -1,11 +1,13 @@
 import streamlit as st
 import requests
-import pandas as pd
-import altair as alt
 import re
-from urllib.parse import urlencode
 import os
 from dotenv import load_dotenv
+from chat_history import display_chat_history, get_chat_history, render_message
+from fast_json import response_json
+from query_stats import track_query
+from results import QueryResult
+from shared_resources import credential_scope, get_http_session
 
 load_dotenv()
 
@@ -55,17 +57,23 @@ def fetch_salesforce_data(query, access_token, instance_url):
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    response = requests.get(
-        f"{instance_url}/services/data/v60.0/query",
-        headers=headers,
-        params={"q": query}
-    )
-    if response.status_code == 200:
-        return response.json()["records"]
-    else:
-        error_msg = f"Error fetching data: {response.text}"
-        add_message("assistant", error_msg)
-        return None
+    # Timed per query fingerprint for the query stats page
+    with track_query(query) as sample:
+        with sample.call():
+            response = get_http_session().get(
+                f"{instance_url}/services/data/v60.0/query",
+                headers=headers,
+                params={"q": query}
+            )
+            data = response_json(response) if response.status_code == 200 else None
+        if data is not None:
+            sample.rows = len(data["records"])
+            return data["records"]
+        else:
+            sample.error = True
+            error_msg = f"Error fetching data: {response.text}"
+            add_message("assistant", error_msg)
+            return None
 
 def detect_intent(query):
     """Detect the intent of the user's query using keyword matching"""
@@ -164,47 +172,6 @@ def generate_query(intent, user_query):
     
     return None
 
-def create_visualization(df, intent):
-    """Create visualization based on data and intent"""
-    if intent == "opportunity_stage_chart":
-        # Create a bar chart for opportunity stages
-        chart = alt.Chart(df).mark_bar().encode(
-            x=alt.X('StageName:N', sort='-y'),
-            y=alt.Y('totalAmount:Q', title='Total Amount ($)'),
-            color='StageName:N',
-            tooltip=['StageName', 'opportunityCount', 'totalAmount']
-        ).properties(
-            title='Opportunities by Stage',
-            width=600
-        )
-        return chart
-    
-    elif intent == "opportunity_amount_chart":
-        # Create a horizontal bar chart for opportunity amounts
-        chart = alt.Chart(df).mark_bar().encode(
-            y=alt.Y('Name:N', sort='-x'),
-            x=alt.X('Amount:Q', title='Amount ($)'),
-            tooltip=['Name', 'Amount', 'CloseDate']
-        ).properties(
-            title='Top Opportunities by Amount',
-            width=600
-        )
-        return chart
-    
-    elif intent == "top_accounts":
-        # Create a horizontal bar chart for top accounts
-        chart = alt.Chart(df).mark_bar().encode(
-            y=alt.Y('Account.Name:N', sort='-x'),
-            x=alt.X('totalAmount:Q', title='Total Amount ($)'),
-            tooltip=['Account.Name', 'totalAmount']
-        ).properties(
-            title='Top Accounts by Total Opportunity Amount',
-            width=600
-        )
-        return chart
-    
-    return None
-
 def process_chatbot_query(user_query):
     if not user_query:
         return
@@ -237,47 +204,25 @@ def process_chatbot_query(user_query):
     with st.spinner("Fetching data..."):
         results = fetch_salesforce_data(query, st.session_state.access_token, st.session_state.instance_url)
         if results:
-            # Add chatbot response message
-            add_message("assistant", response_text)
+            # Typed columnar result with relationship fields flattened (Account.Name)
+            df = QueryResult.from_records(results).to_pandas()
             
-            # Create a container for results
-            result_container = st.container()
-            with result_container:
-                df = pd.DataFrame(results)
-                
-                # Check if visualization is appropriate for this intent
-                chart = create_visualization(df, intent)
-                if chart and any(x in intent for x in ["chart", "top_accounts", "opportunity_stage"]):
-                    st.altair_chart(chart, use_container_width=True)
-                else:
-                    st.dataframe(df)
-                
-                # Add download button
-                csv = df.to_csv(index=False)
-                st.download_button("Download as CSV", csv, filename, "text/csv")
+            # Keep the result frame in history so it survives reruns
+            history = get_chat_history()
+            message = history.add("assistant", response_text, result=df, scope=credential_scope(st.session_state.instance_url), intent=intent, filename=filename)
+            render_message(history, message)
         else:
             add_message("assistant", "No results found for your query.")
 
 def add_message(role, content):
     """Add a message to the chat history"""
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    
-    st.session_state.chat_history.append({"role": role, "content": content})
-
-def display_chat_history():
-    """Display the chat history"""
-    if "chat_history" in st.session_state:
-        for message in st.session_state.chat_history:
-            with st.chat_message(message["role"]):
-                st.write(message["content"])
+    get_chat_history().add(role, content)
 
 def main():
     st.title("🔮 Salesforce AI Assistant")
     
     # Initialize chat history if not exists
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+    get_chat_history()
     
     # Auto-login on startup
     if "access_token" not in st.session_state:
@@ -304,7 +249,7 @@ def main():
             
             # Add clear chat button
             if st.button("Clear Chat History"):
-                st.session_state.chat_history = []
+                get_chat_history().clear()
                 st.experimental_rerun()
         
         # Display chat history
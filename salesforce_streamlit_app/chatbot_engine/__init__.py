@@ -0,0 +1,99 @@
+"""Chatbot core shared by the Streamlit apps and the headless query service
+
+Nothing in this package imports Streamlit: it resolves a question to SOQL
+(with Gemini or the rule-based fallback), runs it against a simple-salesforce
+client and builds the reply, either in process or through query_service.
+
+FastSalesforce and connect_salesforce are loaded on first use, since
+simple_salesforce is slow to import and a page that hasn't logged in yet
+doesn't need it.
+"""
+
+from .advisor import advise, explain, query_shape
+from .client import QueryServiceClient
+from .composite import (
+    Composite,
+    CompositeError,
+    merge_account_details,
+    reference,
+    top_accounts_cache_key,
+    top_accounts_pages,
+    top_accounts_request,
+)
+from .engine import (
+    INTENT_MAP,
+    MULTI_STEP_INTENTS,
+    NO_RESULTS_MESSAGE,
+    UNKNOWN_MESSAGE,
+    QueryServiceError,
+    answer_query,
+    collect_reply,
+    plan_reply,
+    stream_answer,
+)
+from .intents import (
+    SALESFORCE_CONTEXT,
+    fallback_query_processing,
+    generate_gemini_response,
+    get_default_queries,
+    parse_gemini_response,
+    resolve_query,
+)
+from .records import (
+    cached_query_pages,
+    fetch_salesforce_data,
+    format_records,
+    iter_query_pages,
+    prime_query_cache,
+    query_cache_key,
+)
+from .refine import apply_steps, describe_steps, parse_refinement, refine_reply
+
+__all__ = [
+    "INTENT_MAP",
+    "MULTI_STEP_INTENTS",
+    "NO_RESULTS_MESSAGE",
+    "SALESFORCE_CONTEXT",
+    "UNKNOWN_MESSAGE",
+    "Composite",
+    "CompositeError",
+    "FastSalesforce",
+    "QueryServiceClient",
+    "QueryServiceError",
+    "advise",
+    "answer_query",
+    "apply_steps",
+    "cached_query_pages",
+    "collect_reply",
+    "connect_salesforce",
+    "describe_steps",
+    "explain",
+    "fallback_query_processing",
+    "fetch_salesforce_data",
+    "format_records",
+    "generate_gemini_response",
+    "get_default_queries",
+    "iter_query_pages",
+    "merge_account_details",
+    "parse_gemini_response",
+    "parse_refinement",
+    "plan_reply",
+    "prime_query_cache",
+    "query_cache_key",
+    "query_shape",
+    "reference",
+    "refine_reply",
+    "resolve_query",
+    "stream_answer",
+    "top_accounts_cache_key",
+    "top_accounts_pages",
+    "top_accounts_request",
+]
+
+
+def __getattr__(name):
+    if name in ("FastSalesforce", "connect_salesforce"):
+        from . import auth
+
+        return getattr(auth, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,271 @@
+"""Query-plan check for generated SOQL before it runs
+
+Gemini writes queries without knowing which fields are indexed, so a
+question like "students at College A" can become a full scan of the object
+(WHERE College__r.Name = 'College A'). Before running a query the advisor
+asks Salesforce's explain endpoint for its plan, cached per query shape.
+When the cheapest plan is a costly table scan of a large object, it warns,
+or with QUERY_ADVISOR=block refuses to run. With QUERY_ADVISOR=rewrite it
+first asks the model for a more selective query, and uses it only if it
+returns the same records (see rewrite_problem) and Salesforce agrees it is
+cheaper.
+Every decision is logged to the query_advisor logger, which writes JSON
+lines to QUERY_ADVISOR_LOG from a background thread and rotates it like
+the app log (see log_config).
+"""
+import logging
+import os
+import re
+import threading
+
+from cache import PLAN_CACHE_TTL, cache_key, get_cache
+from log_config import dedicated_logger
+from query_stats import normalize_query, track_llm
+
+from .intents import parse_gemini_response
+
+logger = logging.getLogger(__name__)
+
+# off, warn (run flagged queries with a warning), rewrite (try a selective rewrite first) or block
+ADVISOR_MODE = os.getenv("QUERY_ADVISOR", "warn")
+
+# Relative costs above 1 mean Salesforce considers the query non-selective
+MAX_RELATIVE_COST = float(os.getenv("QUERY_ADVISOR_MAX_COST", "1.0"))
+
+# Scanning smaller objects is cheap whatever the plan says
+MIN_TABLE_ROWS = int(os.getenv("QUERY_ADVISOR_MIN_ROWS", "10000"))
+
+ADVISOR_LOG = os.getenv("QUERY_ADVISOR_LOG", "query_advisor.jsonl")
+
+RUN = "run"
+REWRITTEN = "rewritten"
+WARNED = "warned"
+BLOCKED = "blocked"
+UNCHECKED = "unchecked"
+
+REWRITE_PROMPT = """The SOQL query below is not selective. Salesforce's query plan is {plan}.
+{notes}
+User question: {question}
+Query: {query}
+
+Please rewrite it as a more selective SOQL query that returns exactly the same records, for example by filtering on a lookup Id field (College__c IN (SELECT Id FROM College__c WHERE Name = '...')) instead of a relationship field (College__r.Name = '...'). Keep everything outside the WHERE clause as it is, and don't add filters, date ranges or limits. Respond with a JSON in this exact format:
+{{"intent": "custom_query", "query": "[the rewritten SOQL query, or null if no selective query returns the same records]", "explanation": "[one sentence on what changed]"}}"""
+
+_CLAUSE = re.compile(r"\b(SELECT|FROM|WHERE|WITH|GROUP BY|HAVING|ORDER BY|LIMIT|OFFSET|FOR)\b", re.IGNORECASE)
+_AND = re.compile(r"\bAND\b", re.IGNORECASE)
+_FILTER = re.compile(r"([A-Za-z_][\w.]*)\s*(?:=|!=|<>|<=|>=|<|>|\bLIKE\b|\bNOT\s+IN\b|\bIN\b|\bINCLUDES\b|\bEXCLUDES\b)", re.IGNORECASE)
+
+_decision_logger = None
+_log_lock = threading.Lock()
+
+
+def query_shape(query):
+    """The query with literals replaced, so queries differing only in values share a plan"""
+    return normalize_query(query)
+
+
+def explain(sf, query):
+    """Salesforce's candidate plans for a query, cheapest first, cached per org and query shape"""
+    cache = get_cache("plan", PLAN_CACHE_TTL)
+    key = cache_key(getattr(sf, "sf_instance", ""), query_shape(query))
+    plans = cache.get(key)
+    if plans is None:
+        response = sf.restful("query", params={"explain": " ".join(query.split())})
+        plans = sorted((response or {}).get("plans", []), key=lambda p: p.get("relativeCost", 0))
+        cache.set(key, plans)
+    return plans
+
+
+def is_costly(plan):
+    return (
+        plan is not None
+        and plan.get("leadingOperationType") == "TableScan"
+        and plan.get("relativeCost", 0) > MAX_RELATIVE_COST
+        and plan.get("sobjectCardinality", 0) >= MIN_TABLE_ROWS
+    )
+
+
+def describe_plan(plan):
+    return f"a full scan of {plan.get('sobjectCardinality', 0):,} {plan.get('sobjectType')} records (relative cost {plan.get('relativeCost', 0):.2f})"
+
+
+def _plan_summary(plan):
+    if plan is None:
+        return None
+    return {k: plan.get(k) for k in ("leadingOperationType", "relativeCost", "cardinality", "sobjectCardinality", "sobjectType")}
+
+
+def _blank_literals(text):
+    return re.sub(r"'(?:[^'\\]|\\.)*'", lambda m: "_" * len(m.group()), text)
+
+
+def _mask(text):
+    """text with literals and parenthesised groups blanked out, keeping positions, so only top-level keywords match"""
+    chars, depth = [], 0
+    for c in _blank_literals(text):
+        depth += c == "("
+        chars.append(c if depth == 0 else "_")
+        depth -= c == ")" and depth > 0
+    return "".join(chars)
+
+
+def _enclosed(text):
+    """Whether text is one parenthesised group, as in (a = 1 OR b = 2)"""
+    if not text.startswith("(") or not text.endswith(")"):
+        return False
+    depth = 0
+    for c in _blank_literals(text)[:-1]:
+        depth += (c == "(") - (c == ")")
+        if depth == 0:
+            return False
+    return True
+
+
+def _clauses(query):
+    """A query's top-level clauses by keyword, whitespace-normalized"""
+    text = " ".join(query.split())
+    masked = _mask(text)
+    marks = [(m.start(), m.end(), " ".join(m.group(1).upper().split())) for m in _CLAUSE.finditer(masked)]
+    ends = [start for start, _, _ in marks[1:]] + [len(text)]
+    return {name: text[end:stop].strip() for (_, end, name), stop in zip(marks, ends)}
+
+
+def _conditions(where):
+    """The AND-ed conditions of a WHERE clause, looking inside parenthesised conjunctions"""
+    where = where.strip()
+    while _enclosed(where):
+        where = where[1:-1].strip()
+    masked = _mask(where)
+    cuts = [0] + [p for m in _AND.finditer(masked) for p in (m.start(), m.end())] + [len(where)]
+    parts = [where[start:stop].strip() for start, stop in zip(cuts[::2], cuts[1::2])]
+    if len(parts) == 1:
+        return [where] if where else []
+    return [c for part in parts for c in _conditions(part)]
+
+
+def _lookup_field(path):
+    """The lookup Id field behind a relationship path: College__r.Name -> college__c, Account.Name -> accountid"""
+    relationship = path.split(".", 1)[0].lower()
+    return relationship[:-3] + "__c" if relationship.endswith("__r") else relationship + "id"
+
+
+def rewrite_problem(query, rewritten):
+    """Why a rewritten query might not return the same records as the original, or None
+
+    A rewrite may only change the WHERE clause, and only by replacing a
+    filter on a relationship path with one on the lookup Id field behind it
+    (College__r.Name = 'A' becoming College__c IN (SELECT Id FROM College__c
+    WHERE Name = 'A')). Anything else - an extra condition, a date range, a
+    LIMIT - narrows or changes the answer.
+    """
+    old, new = _clauses(query), _clauses(rewritten)
+    for clause in sorted((set(old) | set(new)) - {"WHERE"}):
+        if old.get(clause, "").lower() != new.get(clause, "").lower():
+            return f"adds a {clause} clause" if clause not in old else f"changes the {clause} clause"
+
+    old_conditions, new_conditions = _conditions(old.get("WHERE", "")), _conditions(new.get("WHERE", ""))
+    if len(new_conditions) != len(old_conditions):
+        return "adds a filter" if len(new_conditions) > len(old_conditions) else "drops a filter"
+    kept = {" ".join(c.lower().split()) for c in old_conditions}
+    lookups = {_lookup_field(f) for c in old_conditions for f in _FILTER.findall(_mask(c)) if "." in f}
+    for condition in new_conditions:
+        if " ".join(condition.lower().split()) in kept:
+            continue
+        fields = {f.lower() for f in _FILTER.findall(_mask(condition))}
+        if not fields or not fields <= lookups:
+            return f"adds the filter {condition}"
+    return None
+
+
+def decision_logger():
+    """The query_advisor logger, set up on first use"""
+    global _decision_logger
+    with _log_lock:
+        if _decision_logger is None:
+            _decision_logger = dedicated_logger("query_advisor", ADVISOR_LOG)
+        return _decision_logger
+
+
+def record_decision(decision):
+    """Log an advisor decision to the tuning log; the file is written in the background"""
+    if not ADVISOR_LOG:
+        return
+    decision_logger().info(f"{decision.get('action')} for {decision.get('shape')}", extra={"decision": decision})
+
+
+def suggest_rewrite(model, query, plan, question=""):
+    """Ask the model for a more selective query; returns (query, explanation) or None"""
+    notes = "\n".join(f"- {n.get('description')}: {', '.join(n.get('fields', []))}" for n in plan.get("notes", []))
+    prompt = REWRITE_PROMPT.format(plan=describe_plan(plan), notes=notes, question=question or "(not given)", query=" ".join(query.split()))
+    try:
+        with track_llm(getattr(model, "model_name", type(model).__name__)) as sample:
+            sample.intent = "query_rewrite"
+            reply = model.generate_content(prompt)
+            sample.count_tokens(reply, prompt)
+        response = parse_gemini_response(reply.text)
+    except Exception as e:
+        logger.error(f"Error asking for a query rewrite: {str(e)}")
+        return None
+    rewritten = response.get("query")
+    if not rewritten or not rewritten.strip().upper().startswith("SELECT") or query_shape(rewritten) == query_shape(query):
+        return None
+    return rewritten, response.get("explanation", "")
+
+
+def advise(sf, query, model=None, question="", mode=None):
+    """Decide whether to run a query as is, rewritten, with a warning, or not at all
+
+    Returns a decision dict with the query to run, the action taken and, for
+    flagged queries that weren't rewritten, a warning for the user.
+    """
+    mode = mode or ADVISOR_MODE
+    if mode == "off" or not hasattr(sf, "restful"):
+        return {"query": query, "action": RUN}
+
+    cache = get_cache("advice", PLAN_CACHE_TTL)
+    key = cache_key(getattr(sf, "sf_instance", ""), mode, " ".join(query.split()))
+    decision = cache.get(key)
+    if decision is not None:
+        return decision
+
+    decision = {"query": query, "original": query, "shape": query_shape(query), "mode": mode}
+    try:
+        plans = explain(sf, query)
+    except Exception as e:
+        # Never hold up a query because the explain call failed
+        logger.warning(f"Could not explain query, running it unchecked: {str(e)}")
+        decision.update(action=UNCHECKED, error=str(e))
+        record_decision(decision)
+        return decision
+
+    plan = plans[0] if plans else None
+    decision["plan"] = _plan_summary(plan)
+    if not is_costly(plan):
+        decision["action"] = RUN
+    else:
+        rewrite = suggest_rewrite(model, query, plan, question) if mode == "rewrite" and model is not None else None
+        if rewrite is not None:
+            rewritten, explanation = rewrite
+            problem = rewrite_problem(query, rewritten)
+            if problem is not None:
+                logger.info(f"Query advisor: rejected a rewrite that {problem}")
+                decision.update(rejected_rewrite=rewritten, rejected_reason=problem)
+                rewritten_plans = []
+            else:
+                try:
+                    rewritten_plans = explain(sf, rewritten)
+                except Exception as e:
+                    logger.warning(f"Could not explain rewritten query: {str(e)}")
+                    rewritten_plans = []
+            new_plan = rewritten_plans[0] if rewritten_plans else None
+            decision["rewrite_plan"] = _plan_summary(new_plan)
+            if new_plan is not None and not is_costly(new_plan) and new_plan.get("relativeCost", 0) < plan.get("relativeCost", 0):
+                decision.update(action=REWRITTEN, query=rewritten, explanation=explanation)
+        if "action" not in decision:
+            decision["action"] = BLOCKED if mode == "block" else WARNED
+            decision["warning"] = f"This query needs {describe_plan(plan)}, so it may be slow and use more API capacity. Filtering on an indexed field such as Id, Name or CreatedDate would make it faster."
+
+    logger.info(f"Query advisor: {decision['action']} for {decision['shape']}")
+    record_decision(decision)
+    cache.set(key, decision)
+    return decision
@@ -0,0 +1,85 @@
+import logging
+import re
+import threading
+import time
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+from simple_salesforce import Salesforce, SalesforceLogin
+
+from cache import TOKEN_CACHE_TTL, cache_key
+from fast_json import decode_query_page, loads
+
+logger = logging.getLogger(__name__)
+
+# query?q=... and queryMore's query/<locator> return pages; query?explain=... returns plans
+_QUERY_PATH = re.compile(r"/query(?:All)?(?:/(?P<locator>[\w-]+))?/?$")
+
+# Sessions this process opened, by a hash of the credentials: (session id, instance, expiry).
+# A session id is a bearer credential, so it stays in memory rather than the shared cache.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def is_query_page(url):
+    """Whether a GET of url returns a page of query results"""
+    parts = urlsplit(url)
+    match = _QUERY_PATH.search(parts.path)
+    return match is not None and (match.group("locator") is not None or "q" in parse_qs(parts.query))
+
+
+class FastSalesforce(Salesforce):
+    """simple_salesforce client that decodes responses with fast_json
+
+    Query and queryMore pages are decoded against the typed query envelope;
+    everything else, explain plans included, goes through the plain fast
+    decoder. A client built with parse_float keeps the stock decoding, since
+    only the stdlib honours that hook.
+    """
+
+    def parse_result_to_json(self, result):
+        if self._parse_float is not None:
+            return super().parse_result_to_json(result)
+        if result.request.method == "GET" and is_query_page(result.url):
+            return decode_query_page(result.content)
+        return loads(result.content)
+
+
+def _login(key, username, password, security_token, domain, session):
+    """Open a new session for the credentials, replacing the one remembered under key"""
+    with _sessions_lock:
+        _sessions.pop(key, None)
+    session_id, instance = SalesforceLogin(
+        username=username,
+        password=password,
+        security_token=security_token,
+        domain=domain,
+        session=session
+    )
+    with _sessions_lock:
+        _sessions[key] = (session_id, instance, time.time() + TOKEN_CACHE_TTL)
+    return session_id, instance
+
+
+def connect_salesforce(username, password, security_token, domain="login", session=None):
+    """Log in to Salesforce, reusing a session this process already opened for these credentials
+
+    Sessions are kept in process memory only, under a hash of the
+    credentials, and expire well inside Salesforce's session timeout. A call
+    answered with INVALID_SESSION_ID (the session was revoked, say) logs in
+    again and is retried.
+    """
+    key = cache_key(username, password, security_token, domain)
+    login = partial(_login, key, username, password, security_token, domain, session)
+    with _sessions_lock:
+        remembered = _sessions.get(key)
+    if remembered is not None and remembered[2] > time.time():
+        logger.info(f"Reusing Salesforce session for {username}")
+        session_id, instance = remembered[:2]
+    else:
+        session_id, instance = login()
+
+    sf = FastSalesforce(instance=instance, session_id=session_id, session=session)
+    # simple_salesforce refreshes an expired session through this partial and retries the call
+    sf._salesforce_login_partial = login
+    return sf
@@ -0,0 +1,57 @@
+import json
+import logging
+
+import requests
+
+from tracing import inject
+
+from .engine import QueryServiceError, collect_reply
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the service to start answering (the stream itself can run longer)
+DEFAULT_TIMEOUT = 60
+
+
+def salesforce_headers(sf):
+    """Forward an existing Salesforce session so the service doesn't log in again"""
+    if sf is None:
+        return {}
+    return {"Authorization": f"Bearer {sf.session_id}", "X-Salesforce-Instance": sf.sf_instance}
+
+
+class QueryServiceClient:
+    """Thin client for query_service, so a frontend doesn't run the engine itself"""
+
+    def __init__(self, base_url, session=None, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def stream(self, user_query, sf=None):
+        """Yield the service's answer events as they arrive"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/query/stream",
+                json={"query": user_query},
+                # The service continues this chat turn's trace
+                headers=inject(salesforce_headers(sf)),
+                stream=True,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.error(f"Query service request failed: {str(e)}")
+            raise QueryServiceError(f"Query service unavailable: {str(e)}")
+
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def answer(self, user_query, sf=None, progress=None):
+        """Ask the service one question and return the reply dict"""
+        return collect_reply(self.stream(user_query, sf), progress)
+
+    def health(self):
+        return self.session.get(f"{self.base_url}/health", timeout=self.timeout).json()
@@ -0,0 +1,152 @@
+"""Composite API batching for multi-step lookups
+
+The Composite API runs up to 25 dependent sub-requests in one round-trip, and
+later sub-requests can refer to earlier results with ``@{referenceId.path}``.
+Top accounts, for example, becomes one call: the aggregate query plus one
+retrieve per account whose id comes from ``@{top.records[i].AccountId}``.
+"""
+import json
+import logging
+import re
+from urllib.parse import quote_plus
+
+from cache import QUERY_CACHE_TTL, cache_key, get_cache, session_scope
+from query_stats import HIT, MISS, track_query
+
+from .records import cached_query_pages
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "59.0"
+
+# Composite API limits per call
+MAX_SUBREQUESTS = 25
+MAX_QUERIES = 5
+
+ACCOUNT_DETAIL_FIELDS = ["Id", "Name", "Industry", "AnnualRevenue"]
+
+_LIMIT = re.compile(r"\bLIMIT\s+(\d+)", re.IGNORECASE)
+
+
+class CompositeError(Exception):
+    """A composite call, or a sub-request of an all-or-none call, failed"""
+
+
+def reference(reference_id, path):
+    """Refer to part of an earlier sub-request's result, e.g. reference("top", "records[0].AccountId")"""
+    return f"@{{{reference_id}.{path}}}"
+
+
+def query_limit(query):
+    match = _LIMIT.search(query)
+    return int(match.group(1)) if match else None
+
+
+class Composite:
+    """Builds one Composite API call out of dependent sub-requests and splits up its results
+
+    Sub-requests run in the order they were added. With all_or_none=False a
+    failed sub-request (say a reference to a record the query didn't return)
+    only loses its own result; with all_or_none=True it fails the whole call.
+    """
+
+    def __init__(self, api_version=API_VERSION, all_or_none=False):
+        self.api_version = api_version
+        self.all_or_none = all_or_none
+        self.subrequests = []
+
+    def _add(self, reference_id, method, url, body=None):
+        if len(self.subrequests) >= MAX_SUBREQUESTS:
+            raise CompositeError(f"A composite call takes at most {MAX_SUBREQUESTS} sub-requests")
+        subrequest = {"method": method, "url": f"/services/data/v{self.api_version}/{url}", "referenceId": reference_id}
+        if body is not None:
+            subrequest["body"] = body
+        self.subrequests.append(subrequest)
+        return self
+
+    def query(self, reference_id, soql):
+        if sum(1 for s in self.subrequests if "/query?" in s["url"]) >= MAX_QUERIES:
+            raise CompositeError(f"A composite call takes at most {MAX_QUERIES} queries")
+        return self._add(reference_id, "GET", f"query?q={quote_plus(' '.join(soql.split()))}")
+
+    def retrieve(self, reference_id, sobject, record_id, fields):
+        return self._add(reference_id, "GET", f"sobjects/{sobject}/{record_id}?fields={','.join(fields)}")
+
+    @property
+    def payload(self):
+        return {"allOrNone": self.all_or_none, "compositeRequest": self.subrequests}
+
+    def parse(self, response):
+        """Map each referenceId to its result body, or None where the sub-request failed"""
+        results = {}
+        for item in response.get("compositeResponse", []):
+            if 200 <= item["httpStatusCode"] < 300:
+                results[item["referenceId"]] = item["body"]
+                continue
+            results[item["referenceId"]] = None
+            errors = item.get("body") or []
+            message = "; ".join(e.get("message", e.get("errorCode", "")) for e in errors) if isinstance(errors, list) else str(errors)
+            if self.all_or_none:
+                raise CompositeError(f"Sub-request {item['referenceId']} failed: {message}")
+            logger.info(f"Composite sub-request {item['referenceId']} failed: {message}")
+        return results
+
+    def send(self, sf):
+        """Run the call through a simple_salesforce client in one round-trip"""
+        return self.parse(sf.restful("composite", method="POST", data=json.dumps(self.payload)))
+
+
+def top_accounts_request(query, api_version=API_VERSION, fields=ACCOUNT_DETAIL_FIELDS):
+    """Composite call for a top-accounts aggregate query plus each account's details
+
+    Returns None when the query has no LIMIT, or one too large to fit a
+    retrieve per row into a single call.
+    """
+    limit = query_limit(query)
+    if limit is None or limit >= MAX_SUBREQUESTS:
+        return None
+    composite = Composite(api_version).query("top", query)
+    for i in range(limit):
+        composite.retrieve(f"account{i}", "Account", reference("top", f"records[{i}].AccountId"), fields)
+    return composite
+
+
+def merge_account_details(results):
+    """Aggregate rows with each account's detail fields added alongside"""
+    records = (results.get("top") or {}).get("records", [])
+    for i, record in enumerate(records):
+        details = results.get(f"account{i}") or {}
+        for name, value in details.items():
+            if name not in ("attributes", "Id") and name not in record:
+                record[name] = value
+    return records
+
+
+def top_accounts_cache_key(sf, query):
+    """Shared cache key of a top-accounts query's merged records, per Salesforce session like query_cache_key"""
+    return f"{session_scope(sf)}:{cache_key('composite:top_accounts', query)}"
+
+
+def top_accounts_pages(sf, query, ttl=QUERY_CACHE_TTL, intent="top_accounts"):
+    """Top accounts with their details in one round-trip, as a single page like cached_query_pages
+
+    Falls back to the plain query when the client can't make composite calls
+    or the query doesn't fit into one.
+    """
+    composite = top_accounts_request(query, getattr(sf, "sf_version", API_VERSION))
+    if composite is None or not hasattr(sf, "restful"):
+        yield from cached_query_pages(sf, query, ttl, intent=intent)
+        return
+
+    cache = get_cache("query", ttl)
+    key = top_accounts_cache_key(sf, query)
+    with track_query(query, intent) as sample:
+        with sample.call("cache.get"):
+            records = cache.get(key)
+        sample.cache = MISS if records is None else HIT
+        if records is None:
+            with sample.call("salesforce.composite"):
+                records = merge_account_details(composite.send(sf))
+            cache.set(key, records)
+        sample.rows = len(records)
+    yield records, len(records), len(records)
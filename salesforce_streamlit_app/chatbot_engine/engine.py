@@ -0,0 +1,141 @@
+import logging
+
+from results import ResultBuilder
+from tracing import span
+
+from .advisor import BLOCKED, REWRITTEN, advise
+from .composite import top_accounts_pages
+from .intents import get_default_queries, resolve_query
+from .records import cached_query_pages
+
+logger = logging.getLogger(__name__)
+
+# Title, download filename and reply text per intent
+INTENT_MAP = {
+    "top_accounts": {"title": "Top Accounts by Opportunity Amount", "filename": "top_accounts.csv", "response": "Here are the top accounts by opportunity amount:"},
+    "recent_opportunities": {"title": "Recent Opportunities", "filename": "recent_opportunities.csv", "response": "Here are the most recent opportunities:"},
+    "opportunity_by_stage": {"title": "Opportunities by Stage", "filename": "opportunities_by_stage.csv", "response": "Here's a breakdown of opportunities by stage:"},
+    "opportunity_stage_chart": {"title": "Opportunities by Stage Chart", "filename": "opportunities_by_stage.csv", "response": "Here's a chart showing opportunities by stage:"},
+    "opportunity_amount_chart": {"title": "Top Opportunities by Amount", "filename": "top_opportunities.csv", "response": "Here's a chart showing top opportunities by amount:"},
+    "contacts": {"title": "Contact Information", "filename": "contacts.csv", "response": "Here are the recent contacts:"},
+    "custom_query": {"title": "Custom Query Results", "filename": "query_results.csv", "response": "Here are the results for your custom query:"}
+}
+
+# Intents whose follow-up lookups run as one Composite API call instead of one query each
+MULTI_STEP_INTENTS = {
+    "top_accounts": top_accounts_pages,
+}
+
+DEFAULT_REPLY = {"title": "Query Results", "filename": "query_results.csv", "response": "Here are the results:"}
+
+UNKNOWN_MESSAGE = "I couldn't understand your request. Please try one of these queries:\n- Show me top accounts\n- Show recent opportunities\n- Show opportunities by stage\n- List contacts\n- Create a chart of opportunity stages\n- Or write a custom SOQL query"
+
+NO_RESULTS_MESSAGE = "No results found for your query."
+
+
+class QueryServiceError(Exception):
+    """A chat turn failed, either in process or on the query service"""
+
+
+def plan_reply(response):
+    """Turn a resolved intent into the query to run and the reply around it, or None if unknown"""
+    intent = response["intent"]
+    query = response["query"]
+    explanation = response.get("explanation", "Processing your request...")
+
+    # If there's no query but we have a recognized intent, use default query
+    if query is None and intent in get_default_queries():
+        query = get_default_queries()[intent]
+    if intent == "unknown" or query is None:
+        return None
+
+    reply = INTENT_MAP.get(intent, DEFAULT_REPLY)
+    text = reply["response"]
+    # Add explanation from Gemini if available
+    if explanation and explanation != "Processing your request...":
+        text = f"{explanation}\n\n{text}"
+    return {"intent": intent, "query": query, "title": reply["title"], "filename": reply["filename"], "text": text}
+
+
+def stream_answer(user_query, model, sf):
+    """Run one chat turn as a stream of events
+
+    Events are plain dicts with an "event" key: "progress", "advice" (the
+    query-plan check), "plan" (intent, query and reply text), one "records"
+    event per Salesforce page, then
+    "done" with the final text and row count. Nothing here touches Streamlit,
+    so the same stream backs the Streamlit jobs and the HTTP query service.
+    """
+    yield {"event": "progress", "progress": 0.0, "message": "Understanding your question..."}
+    # No span stays open across a yield; the consumer's own spans aren't part of this one
+    with span("resolve_intent") as resolve_span:
+        plan = plan_reply(resolve_query(user_query, model))
+        resolve_span.set("intent", plan["intent"] if plan else "unknown")
+    if plan is None:
+        yield {"event": "done", "text": UNKNOWN_MESSAGE, "rows": 0}
+        return
+
+    # Check the plan before spending time and API calls on a full scan
+    yield {"event": "progress", "progress": 0.05, "message": "Checking the query plan..."}
+    with span("query_advisor") as advice_span:
+        advice = advise(sf, plan["query"], model, user_query)
+        advice_span.set("action", advice["action"])
+    yield {"event": "advice", **advice}
+    if advice["action"] == BLOCKED:
+        yield {"event": "done", "text": advice["warning"], "rows": 0}
+        return
+    if advice["action"] == REWRITTEN:
+        plan["query"] = advice["query"]
+        plan["text"] = f"I rewrote the query to use an index: {advice['explanation']}\n\n{plan['text']}"
+    elif advice.get("warning"):
+        plan["text"] = f"{advice['warning']}\n\n{plan['text']}"
+
+    yield {"event": "plan", **plan}
+    rows = 0
+    pages = MULTI_STEP_INTENTS.get(plan["intent"], cached_query_pages)
+    for page, fetched, total in pages(sf, plan["query"], intent=plan["intent"]):
+        rows = fetched
+        yield {"event": "records", "records": page, "fetched": fetched, "total": total}
+    logger.info(f"Query executed: {plan['query']}")
+    logger.info(f"Records returned: {rows}")
+    yield {"event": "done", "text": plan["text"] if rows else NO_RESULTS_MESSAGE, "rows": rows}
+
+
+def collect_reply(events, progress=None):
+    """Fold an event stream into a reply dict, reporting progress(fraction, message) along the way
+
+    The reply has the answer text and, when the query returned rows, the
+    formatted frame with its intent, filename and query.
+    """
+    plan = None
+    # Each page becomes an Arrow batch as it arrives, so the JSON dicts can be freed
+    builder = ResultBuilder()
+    for event in events:
+        kind = event["event"]
+        if kind == "progress":
+            if progress:
+                progress(event["progress"], event["message"])
+        elif kind == "plan":
+            plan = event
+            if progress:
+                progress(0.1, "Fetching data...")
+        elif kind == "records":
+            builder.add_page(event["records"])
+            if progress and event["total"]:
+                progress(0.1 + 0.9 * event["fetched"] / event["total"], f"Fetched {event['fetched']} of {event['total']} records")
+        elif kind == "error":
+            raise QueryServiceError(event["error"])
+        elif kind == "done":
+            reply = {"text": event["text"]}
+            if builder.rows:
+                with span("build_frame", rows=builder.rows) as frame_span:
+                    frame = builder.build().to_pandas()
+                    frame_span.set("columns", len(frame.columns))
+                reply.update(frame=frame, intent=plan["intent"], filename=plan["filename"], query=plan["query"])
+            return reply
+    raise QueryServiceError("Answer stream ended before the reply was complete")
+
+
+def answer_query(user_query, model, sf, progress=None):
+    """Run one chat turn in process and return its reply dict"""
+    return collect_reply(stream_answer(user_query, model, sf), progress)
@@ -0,0 +1,251 @@
+import json
+import logging
+
+from cache import LLM_CACHE_TTL, cache_key, get_cache
+from query_stats import HIT, MISS, track_llm
+
+logger = logging.getLogger(__name__)
+
+# Context about the Salesforce schema sent to the model with every question
+SALESFORCE_CONTEXT = """
+        You are an AI assistant specialized in Salesforce data analysis. Your task is to interpret natural language queries and convert them to SOQL (Salesforce Object Query Language) queries.
+        
+        Common Salesforce objects and their fields:
+        - Account: Id, Name, Industry, AnnualRevenue
+        - Opportunity: Id, Name, Amount, StageName, CloseDate, AccountId, Account.Name, CreatedDate, IsClosed
+        - Contact: Id, Name, Email, Phone, AccountId, Account.Name, CreatedDate
+        
+        Custom Objects (note the __c suffix):
+        - College__c: Id, Name, city__c
+        - Student__c: Id, First_Name__c, Last_Name__c
+        
+        Important rules for custom objects:
+        1. Always use the __c suffix for custom object names
+        2. Custom fields also use the __c suffix
+        3. When querying custom objects, use the exact object name with __c
+        
+        Common query intents and their SOQL queries:
+        - top_accounts: Queries for accounts with highest opportunity amounts
+        - recent_opportunities: Lists the most recently created opportunities
+        - opportunity_by_stage: Groups opportunities by their stage
+        - contacts: Lists contact information
+        - opportunity_stage_chart: Similar to opportunity_by_stage but meant for visualization
+        - opportunity_amount_chart: Shows opportunities with highest amounts
+        - custom_query: Any valid SOQL query provided by the user
+        """
+
+
+def generate_gemini_response(model, prompt, context=""):
+    full_prompt = f"{context}\n\nUser query: {prompt}\n\nPlease analyze this query about Salesforce data and respond with a JSON in this exact format:\n{{\"intent\": \"[one of: top_accounts, recent_opportunities, opportunity_by_stage, contacts, opportunity_stage_chart, opportunity_amount_chart, custom_query, unknown]\", \"query\": \"[the SOQL query to execute or null if unknown]\", \"explanation\": \"[brief explanation of what the query will do]\"}}"
+    
+    try:
+        if model is None:
+            return {"intent": "unknown", "query": None, "explanation": "No Gemini model available"}
+        
+        # The same prompt to the same model gets the same answer, from any process
+        model_name = getattr(model, "model_name", type(model).__name__)
+        cache = get_cache("llm", LLM_CACHE_TTL)
+        key = cache_key(model_name, full_prompt)
+        with track_llm(model_name) as sample:
+            cached = cache.get(key)
+            if cached is not None:
+                sample.cache, sample.intent = HIT, cached["intent"]
+                return cached
+            
+            # Log the prompt for debugging
+            logger.info(f"Sending prompt to Gemini: {prompt[:100]}...")
+            
+            sample.cache = MISS
+            response = model.generate_content(full_prompt)
+            sample.count_tokens(response, full_prompt)
+            result = parse_gemini_response(response.text)
+            sample.intent = result["intent"]
+        if result["intent"] != "unknown":
+            cache.set(key, result)
+        return result
+    except Exception as e:
+        # The engine runs off the UI thread, so errors are logged rather than shown
+        logger.error(f"Error with Gemini API: {str(e)}")
+        
+        # Fallback to rule-based processing
+        return fallback_query_processing(prompt)
+
+
+def fallback_query_processing(prompt):
+    """Process query using rule-based approach when Gemini fails"""
+    prompt = prompt.lower()
+    logger.info(f"Using fallback processing for query: {prompt}")
+    
+    # Default to unknown
+    result = {"intent": "unknown", "query": None, "explanation": "Using rule-based fallback processing"}
+    
+    # Simple rule-based detection - expanded for better matching
+    account_terms = ["account", "accounts", "customer", "customers", "client", "clients", "top account", "best account", "highest value account"]
+    opportunity_terms = ["opportunity", "opportunities", "deal", "deals", "sale", "sales"]
+    recent_terms = ["recent", "latest", "new", "newest", "last"]
+    stage_terms = ["stage", "status", "phase", "pipeline", "progress"]
+    contact_terms = ["contact", "contacts", "people", "person", "employee", "employees"]
+    chart_terms = ["chart", "graph", "visual", "visualization", "diagram", "plot"]
+    
+    # Check for top accounts intent
+    if any(term in prompt for term in account_terms) and ("top" in prompt or "best" in prompt or "highest" in prompt or "largest" in prompt):
+        result["intent"] = "top_accounts"
+        result["query"] = get_default_queries()["top_accounts"]
+        result["explanation"] = "Finding the top accounts by opportunity amount"
+    
+    # Check for recent opportunities intent
+    elif any(term in prompt for term in opportunity_terms) and any(term in prompt for term in recent_terms):
+        result["intent"] = "recent_opportunities"
+        result["query"] = get_default_queries()["recent_opportunities"]
+        result["explanation"] = "Listing the most recently created opportunities"
+    
+    # Check for opportunities by stage intent
+    elif any(term in prompt for term in opportunity_terms) and any(term in prompt for term in stage_terms):
+        result["intent"] = "opportunity_by_stage"
+        result["query"] = get_default_queries()["opportunity_by_stage"]
+        result["explanation"] = "Showing opportunities grouped by stage"
+    
+    # Check for contacts intent
+    elif any(term in prompt for term in contact_terms):
+        result["intent"] = "contacts"
+        result["query"] = get_default_queries()["contacts"]
+        result["explanation"] = "Listing contact information"
+    
+    # Check for chart intents
+    elif any(term in prompt for term in chart_terms) or "show me" in prompt:
+        if any(term in prompt for term in stage_terms):
+            result["intent"] = "opportunity_stage_chart"
+            result["query"] = get_default_queries()["opportunity_stage_chart"]
+            result["explanation"] = "Creating a chart of opportunities by stage"
+        elif any(term in prompt for term in opportunity_terms):
+            result["intent"] = "opportunity_amount_chart"
+            result["query"] = get_default_queries()["opportunity_amount_chart"]
+            result["explanation"] = "Creating a chart of opportunities by amount"
+    
+    # Check for simple intent patterns
+    elif "top" in prompt and any(term in prompt for term in opportunity_terms):
+        result["intent"] = "opportunity_amount_chart"
+        result["query"] = get_default_queries()["opportunity_amount_chart"]
+        result["explanation"] = "Showing top opportunities by amount"
+    elif "all" in prompt and any(term in prompt for term in opportunity_terms):
+        result["intent"] = "recent_opportunities"
+        result["query"] = get_default_queries()["recent_opportunities"]
+        result["explanation"] = "Listing opportunities"
+    
+    # Catch-all for basic terms
+    elif any(term in prompt for term in opportunity_terms):
+        result["intent"] = "recent_opportunities"
+        result["query"] = get_default_queries()["recent_opportunities"]
+        result["explanation"] = "Showing recent opportunities"
+    elif any(term in prompt for term in account_terms):
+        result["intent"] = "top_accounts"
+        result["query"] = get_default_queries()["top_accounts"]
+        result["explanation"] = "Showing top accounts"
+    
+    logger.info(f"Fallback processing result: {result['intent']}")
+    return result
+
+
+def parse_gemini_response(response_text):
+    try:
+        # Find the JSON within the response text
+        start_idx = response_text.find('{')
+        end_idx = response_text.rfind('}') + 1
+        
+        if start_idx != -1 and end_idx != -1:
+            json_str = response_text[start_idx:end_idx]
+            response_data = json.loads(json_str)
+            
+            # Ensure the response has the expected structure
+            if "intent" not in response_data or "query" not in response_data:
+                default_response = {
+                    "intent": "unknown", 
+                    "query": None, 
+                    "explanation": "I couldn't understand your request."
+                }
+                return default_response
+            
+            return response_data
+        else:
+            return {
+                "intent": "unknown", 
+                "query": None, 
+                "explanation": "I couldn't parse the response properly."
+            }
+    except Exception as e:
+        logger.error(f"Error parsing response: {str(e)}")
+        return {
+            "intent": "unknown", 
+            "query": None, 
+            "explanation": "I encountered an error processing your request."
+        }
+
+
+def get_default_queries():
+    return {
+        "top_accounts": """
+            SELECT AccountId, Account.Name, SUM(Amount) totalAmount
+            FROM Opportunity
+            WHERE IsClosed = true
+            GROUP BY AccountId, Account.Name
+            ORDER BY totalAmount DESC
+            LIMIT 5
+        """,
+        "recent_opportunities": """
+            SELECT Id, Name, Amount, StageName, CloseDate, Account.Name
+            FROM Opportunity
+            ORDER BY CreatedDate DESC
+            LIMIT 10
+        """,
+        "opportunity_by_stage": """
+            SELECT StageName, COUNT(Id) opportunityCount, SUM(Amount) totalAmount
+            FROM Opportunity
+            GROUP BY StageName
+            ORDER BY SUM(Amount) DESC
+        """,
+        "opportunity_stage_chart": """
+            SELECT StageName, COUNT(Id) opportunityCount, SUM(Amount) totalAmount
+            FROM Opportunity
+            GROUP BY StageName
+            ORDER BY SUM(Amount) DESC
+        """,
+        "opportunity_amount_chart": """
+            SELECT Name, Amount, CloseDate
+            FROM Opportunity
+            WHERE Amount != null
+            ORDER BY Amount DESC
+            LIMIT 10
+        """,
+        "contacts": """
+            SELECT Id, Name, Email, Phone, Account.Name
+            FROM Contact
+            ORDER BY CreatedDate DESC
+            LIMIT 10
+        """
+    }
+
+
+def resolve_query(user_query, model):
+    """Turn a chat message into an intent, SOQL query and explanation"""
+    # Determine if we have a Gemini model or need to use fallback
+    if model is not None:
+        # Generate response using Gemini
+        response = generate_gemini_response(model, user_query, SALESFORCE_CONTEXT)
+    else:
+        # Fallback processing when Gemini is not available
+        logger.info("Using fallback query processing (no Gemini model available)")
+        
+        # Check if the query looks like a SOQL query
+        if user_query.strip().upper().startswith("SELECT") and " FROM " in user_query.upper():
+            # This is likely a SOQL query
+            response = {
+                "intent": "custom_query",
+                "query": user_query,
+                "explanation": "Running your custom SOQL query"
+            }
+        else:
+            # Use rule-based processing
+            response = fallback_query_processing(user_query)
+            logger.info(f"Fallback processing determined intent: {response['intent']}")
+    
+    return response
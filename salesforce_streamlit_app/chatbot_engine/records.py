@@ -0,0 +1,101 @@
+import logging
+from contextlib import nullcontext
+
+import pandas as pd
+
+from cache import QUERY_CACHE_TTL, cache_key, get_cache, session_scope
+from query_stats import HIT, MISS, track_query
+from results import QueryResult
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def iter_query_pages(sf, query, sample=None):
+    """Yield (records, fetched so far, total size) for each page of a SOQL query
+
+    sample, if given, is a query_stats.QuerySample charged with each call's
+    time, bytes and rows.
+    """
+    timed = sample.call if sample is not None else nullcontext
+    with timed():
+        result = sf.query(query)
+    fetched = len(result['records'])
+    total = result.get('totalSize') or fetched
+    if sample is not None:
+        sample.rows = fetched
+    yield result['records'], fetched, total
+    while not result.get('done', True):
+        with timed():
+            result = sf.query_more(result['nextRecordsUrl'], identifier_is_url=True)
+        fetched += len(result['records'])
+        if sample is not None:
+            sample.rows = fetched
+        yield result['records'], fetched, total
+
+
+# Larger results are streamed through without being cached
+QUERY_CACHE_MAX_ROWS = 50_000
+
+
+def query_cache_key(sf, query):
+    """Shared cache key of a query's records
+
+    Entries are keyed by the Salesforce session as well as the query, so a
+    user only ever sees results fetched with their own permissions. The
+    session comes first, so a write can drop that session's entries alone.
+    """
+    return f"{session_scope(sf)}:{cache_key(query)}"
+
+
+def prime_query_cache(sf, query, records, ttl=QUERY_CACHE_TTL):
+    """Put records in the shared cache as if cached_query_pages had just fetched them"""
+    get_cache("query", ttl).set(query_cache_key(sf, query), records)
+
+
+def cached_query_pages(sf, query, ttl=QUERY_CACHE_TTL, intent=None):
+    """iter_query_pages through the shared cache; a hit comes back as a single page"""
+    cache = get_cache("query", ttl)
+    key = query_cache_key(sf, query)
+    with track_query(query, intent) as sample:
+        with sample.call("cache.get"):
+            records = cache.get(key)
+        if records is not None:
+            sample.cache, sample.rows = HIT, len(records)
+            yield records, len(records), len(records)
+            return
+
+        sample.cache = MISS
+        records = []
+        for page, fetched, total in iter_query_pages(sf, query, sample):
+            if records is not None:
+                records.extend(page)
+                if len(records) > QUERY_CACHE_MAX_ROWS:
+                    records = None
+            yield page, fetched, total
+        if records is not None:
+            cache.set(key, records)
+
+
+def fetch_salesforce_data(sf, query, progress=None):
+    """Run a SOQL query page by page with simple-salesforce
+
+    progress, if given, is called as progress(fraction, message) after each page.
+    """
+    records = []
+    with track_query(query) as sample:
+        for page, fetched, total in iter_query_pages(sf, query, sample):
+            records.extend(page)
+            if progress:
+                progress(fetched / total if total else 1.0, f"Fetched {fetched} of {total} records")
+    logger.info(f"Query executed: {query}")
+    logger.info(f"Records returned: {len(records)}")
+    return records
+
+
+def format_records(records):
+    """Format Salesforce records for display in a dataframe, via a typed Arrow table"""
+    if not records:
+        return pd.DataFrame()
+    with span("format_records", rows=len(records)):
+        return QueryResult.from_records(records).to_pandas()
@@ -0,0 +1,614 @@
+"""Follow-up refinements answered from the previous result instead of a new query
+
+A follow-up such as "only the ones in Closed Won", "sort by amount",
+"top 3 by amount" or "just name and amount" narrows the answer on screen.
+parse_refinement recognises those without the model, as steps over the
+previous turn's result frame:
+
+    filter   a column in, not in, over, under, before or after some values
+    sort     by a column, ascending or descending
+    head     the first (or, as tail, the last) n rows
+    select   only some columns; drop hides some
+
+refine_reply runs the steps as vectorized pandas operations on the frame
+already held in the result store, with no Gemini call and no SOQL round-trip.
+It only goes back to Salesforce when the frame can't answer: a step names a
+field of the queried object that isn't among its columns, or asks for more
+rows than a result cut off at its LIMIT holds. The previous query is then run
+again with the fields added or the LIMIT raised, through the query cache, and
+the steps, earlier refinements included, are applied to that result.
+
+A follow-up only counts as a refinement when every word in it is accounted
+for; the only object it may name is the one the previous query read ("top 5
+deals" of opportunities). Anything else ("show me the top 5 accounts",
+"break that down by account") goes to the model as a new question.
+"""
+import logging
+import re
+
+import pandas as pd
+
+from results import ResultBuilder
+from tracing import span
+
+from .composite import query_limit
+from .intents import SALESFORCE_CONTEXT
+from .records import cached_query_pages
+
+logger = logging.getLogger(__name__)
+
+FILTER = "filter"
+SORT = "sort"
+HEAD = "head"
+TAIL = "tail"
+SELECT = "select"
+DROP = "drop"
+
+# Steps run in this order whatever order the follow-up names them in
+STEP_ORDER = (FILTER, SORT, HEAD, TAIL, SELECT, DROP)
+
+# Words a refinement may contain besides the ones its steps are made of
+STOPWORDS = {
+    "a", "all", "also", "an", "and", "are", "as", "can", "could", "from", "give", "have", "has", "in", "is",
+    "it", "just", "list", "me", "now", "of", "on", "one", "ones", "only", "please", "record", "records",
+    "result", "results", "row", "rows", "show", "so", "that", "the", "them", "then", "these", "they", "this",
+    "those", "to", "what", "where", "which", "whose", "with", "you", "filter", "filtered", "keep", "display",
+    "same", "but", "again", "instead", "ok", "okay", "want", "see", "let's", "lets", "how", "about", "for",
+}
+
+# Other names people use for an object's records, besides its own (plurals are stemmed away)
+OBJECT_SYNONYMS = {
+    "opportunity": {"deal", "opp", "oppty"},
+    "account": {"company", "customer", "client"},
+    "contact": {"person", "people"},
+}
+
+NEGATIONS = {"not", "excluding", "except", "without", "exclude", "no", "non"}
+
+_NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+                 "ten": 10, "twenty": 20, "fifty": 50, "hundred": 100}
+_UNITS = {"k": 1e3, "thousand": 1e3, "m": 1e6, "million": 1e6, "b": 1e9, "bn": 1e9, "billion": 1e9}
+_COMPARISONS = {
+    "over": ">", "above": ">", "more than": ">", "greater than": ">", ">": ">",
+    "at least": ">=", ">=": ">=",
+    "under": "<", "below": "<", "less than": "<", "fewer than": "<", "<": "<",
+    "at most": "<=", "<=": "<=",
+    "=": "==", "equal to": "==", "exactly": "==",
+    "after": ">", "since": ">=", "on or after": ">=", "before": "<", "on or before": "<=",
+}
+_DESCENDING = {"desc", "descending", "highest", "largest", "biggest", "most", "newest", "latest", "top", "z-a"}
+
+_END = r"\s*(?=$|[,;]|\band\b|\bthen\b)"
+_COLUMN = r"[a-z][a-z0-9_.]*(?:\s+[a-z][a-z0-9_.]*){0,2}?"
+_SORT = re.compile(
+    rf"\b(?:sort|sorted|order|ordered|rank|ranked|arrange)\s+(?:them\s+|these\s+|it\s+|that\s+|this\s+|results?\s+)?by\s+(?P<column>{_COLUMN})"
+    rf"(?:\s*,?\s+(?P<direction>asc|ascending|desc|descending|a-z|z-a|(?:highest|largest|biggest|most|newest|latest|lowest|smallest|least|oldest|earliest)\s+first))?{_END}"
+    rf"|\b(?P<direction2>highest|largest|biggest|newest|latest|lowest|smallest|oldest|earliest)\s+(?P<column2>{_COLUMN})\s+first{_END}"
+)
+_TOP = re.compile(
+    rf"\b(?:(?P<which>top|first|bottom|last)\s+(?P<n>\d+)|(?P<n2>\d+)\s+(?P<which2>highest|largest|biggest|lowest|smallest|newest|oldest))"
+    rf"(?:\s+(?P<noun>[a-z]+))?(?:\s+(?:by|in|on)\s+(?P<column>{_COLUMN}))?{_END}"
+)
+_COMPARE = re.compile(
+    rf"(?:\b(?P<column>{_COLUMN})\s+(?:is\s+|are\s+|of\s+|was\s+|were\s+)?)?"
+    r"(?P<op>on or after|on or before|more than|greater than|at least|less than|fewer than|at most|equal to|exactly|over|above|under|below|after|since|before|>=|<=|>|<|=)\s*"
+    r"(?:(?P<date>\d{4}-\d{2}-\d{2})|\$?(?P<number>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>k|m|bn|b|thousand|million|billion)?)(?![\w-])"
+)
+_PROJECT = re.compile(
+    r"\b(?P<verb>hide|drop|remove|without|exclude|excluding|except)\s+(?:the\s+)?(?P<drop>[a-z0-9_., &]+?)(?:\s+(?:columns?|fields?))?\s*(?=$|;|\bthen\b)"
+    r"|\b(?:add|include|also show|show|display)\s+(?:the\s+)?(?P<add>[a-z0-9_., &]+?)(?:\s+(?:columns?|fields?))?\s+(?:too|as well)\s*(?=$|;|\bthen\b)"
+    r"|\badd\s+(?:the\s+)?(?P<add2>[a-z0-9_., &]+?)(?:\s+(?:columns?|fields?))?\s*(?=$|;|\bthen\b)"
+    r"|(?:\b(?:show|display|keep|give me|list|include)\s+)?\b(?:only|just)\s+(?:show\s+)?(?:the\s+)?(?P<select>[a-z0-9_., &]+?)(?:\s+(?:columns?|fields?))?\s*(?=$|;|\bthen\b)"
+    r"|\b(?:show|display|keep|include)\s+(?:the\s+)?(?P<select2>[a-z0-9_., &]+?)\s+(?:columns?|fields?)\s*(?=$|;|\bthen\b)"
+)
+_TOKEN = re.compile(r"[^\s,;?!]+")
+_CAMEL = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_CONTEXT_OBJECT = re.compile(r"^\s*-\s*([A-Z]\w*):\s*(.+)$", re.MULTILINE)
+_SELECT_LIST = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\s+(\w+)", re.IGNORECASE | re.DOTALL)
+_LIMIT = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+
+
+def _stem(word):
+    # Close enough to match "closed" to CloseDate and "stages" to StageName
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    if word.endswith("ed") and len(word) > 4:
+        return word[:-1]
+    return word
+
+
+def column_words(name):
+    """The words of a column or field name: StageName, Account.Name and First_Name__c become stage name, account name, first name"""
+    words = []
+    for part in re.split(r"[._\s]+", name.replace("__c", "").replace("__r", "")):
+        words += [w.lower() for w in _CAMEL.findall(part)]
+    return tuple(_stem(w) for w in words)
+
+
+def resolve_column(phrase, columns):
+    """The column a phrase like "amount", "close date" or "account" names, or None
+
+    An exact match beats one the phrase starts (stage for StageName), which
+    beats one it ends (amount for totalAmount); ID columns only match when
+    the phrase asks for an id.
+    """
+    wanted = tuple(_stem(w) for w in re.findall(r"[a-z0-9]+", phrase.lower()) if w not in ("the", "a", "an", "its", "their"))
+    if not wanted:
+        return None
+    best, best_rank = None, None
+    for column in columns:
+        words = column_words(column)
+        if words == wanted or "".join(words) == "".join(wanted):
+            score = 4
+        elif words[:len(wanted)] == wanted:
+            score = 3
+        elif words[-len(wanted):] == wanted:
+            score = 2
+        elif set(wanted) <= set(words):
+            score = 1
+        else:
+            continue
+        if words[-1] == "id" and "id" not in wanted:
+            score -= 0.5
+        rank = (score, -len(words))
+        if best_rank is None or rank > best_rank:
+            best, best_rank = column, rank
+    return best
+
+
+def object_words(sobject):
+    """Stemmed words a follow-up may use for the records of an object: Opportunity gives opportunity, deal, opp..."""
+    words = set(column_words(sobject or ""))
+    for word in list(words):
+        words |= OBJECT_SYNONYMS.get(word, set())
+    return words
+
+
+def object_fields(sobject, context=SALESFORCE_CONTEXT):
+    """Fields the schema context lists for an object, which a follow-up may ask for"""
+    for name, fields in _CONTEXT_OBJECT.findall(context):
+        if name.lower() == (sobject or "").lower():
+            return [f.strip() for f in fields.split(",") if re.fullmatch(r"[\w.]+", f.strip())]
+    return []
+
+
+def query_fields(query):
+    """(selected fields, sObject) of a query; fields is None for aggregates and subqueries"""
+    match = _SELECT_LIST.search(query)
+    if not match:
+        return None, None
+    select = match.group(1)
+    if "(" in select or re.search(r"\bGROUP\s+BY\b", query, re.IGNORECASE):
+        return None, match.group(2)
+    return [f.strip() for f in select.split(",") if f.strip()], match.group(2)
+
+
+def add_fields(query, fields):
+    """The query selecting some more fields, or None when its SELECT list can't take them"""
+    selected, _ = query_fields(query)
+    if selected is None:
+        return None
+    have = {f.lower() for f in selected}
+    extra = [f for f in fields if f.lower() not in have]
+    if not extra:
+        return query
+    match = _SELECT_LIST.search(query)
+    return f"{query[:match.end(1)]}, {', '.join(extra)}{query[match.end(1):]}"
+
+
+def with_limit(query, limit):
+    """The query with its LIMIT set, or None if an OFFSET is in the way"""
+    if _LIMIT.search(query):
+        return _LIMIT.sub(f"LIMIT {limit}", query, count=1)
+    if re.search(r"\bOFFSET\b", query, re.IGNORECASE):
+        return None
+    return f"{query.rstrip()} LIMIT {limit}"
+
+
+def _is_numeric(frame, column):
+    return column in frame.columns and pd.api.types.is_numeric_dtype(frame[column]) and not pd.api.types.is_bool_dtype(frame[column])
+
+
+def _is_datetime(frame, column):
+    return column in frame.columns and pd.api.types.is_datetime64_any_dtype(frame[column])
+
+
+def _only(frame, test):
+    # The one column a step without a column can mean, skipping IDs
+    found = [c for c in frame.columns if test(frame, c) and column_words(c)[-1] != "id"]
+    return found[0] if len(found) == 1 else None
+
+
+class _Parse:
+    """State of one parse: the text still to account for, the steps found and the fields missing from the frame"""
+
+    def __init__(self, text, frame, fields, sobject=None):
+        self.text = text
+        self.frame = frame
+        self.fields = fields
+        self.object_words = object_words(sobject)
+        self.steps = []
+        self.missing = []
+        self.failed = False
+
+    def column(self, phrase, test=None):
+        """Resolve a phrase to a frame column, or to a field to fetch; None (and failed) when neither"""
+        column = resolve_column(phrase, self.frame.columns)
+        if column is not None and (test is None or test(self.frame, column)):
+            return column
+        field = resolve_column(phrase, self.fields)
+        if field is not None:
+            if field not in self.missing and field not in self.frame.columns:
+                self.missing.append(field)
+            return field
+        self.failed = True
+        return None
+
+    def names_object(self, word):
+        return word in STOPWORDS or _stem(word) in self.object_words
+
+    def consume(self, pattern, handle):
+        self.text = pattern.sub(lambda match: " " if handle(match) is not False else match.group(0), self.text)
+
+
+def _default_descending(frame, column):
+    return _is_numeric(frame, column) or _is_datetime(frame, column)
+
+
+def _parse_sort(parse, match):
+    phrase = match.group("column") or match.group("column2")
+    column = parse.column(phrase)
+    if column is None:
+        return False
+    direction = match.group("direction") or match.group("direction2")
+    if direction:
+        descending = direction.split()[0] in _DESCENDING
+    else:
+        # A field still to be fetched gets its default direction once its type is known
+        descending = _default_descending(parse.frame, column) if column in parse.frame.columns else None
+    parse.steps.append({"step": SORT, "column": column, "descending": descending})
+
+
+def _parse_top(parse, match):
+    which = match.group("which") or match.group("which2")
+    n = int(match.group("n") or match.group("n2"))
+    phrase, noun = match.group("column"), match.group("noun")
+    if noun and not parse.names_object(noun):
+        # "top 5 amounts" names the column; "top 5 accounts" of opportunities is a new question
+        column = resolve_column(noun, parse.frame.columns)
+        if phrase or column is None or not _is_numeric(parse.frame, column):
+            parse.failed = True
+            return False
+        phrase = noun
+    if phrase:
+        column = parse.column(phrase)
+        if column is None:
+            return False
+    elif which in ("first", "last"):
+        # Positional: the first rows as they are on screen
+        column = None
+    elif which in ("top", "bottom"):
+        # Ranked by the one numeric column there is, or as listed when there isn't one
+        column = _only(parse.frame, _is_numeric)
+    else:
+        # "3 largest" means the one numeric column there is
+        column = _only(parse.frame, _is_numeric)
+        if column is None:
+            parse.failed = True
+            return False
+    if column is not None:
+        descending = which in _DESCENDING or which == "first"
+        parse.steps.append({"step": SORT, "column": column, "descending": descending})
+        parse.steps.append({"step": HEAD, "n": n})
+    else:
+        parse.steps.append({"step": TAIL if which in ("bottom", "last") else HEAD, "n": n})
+
+
+def _parse_compare(parse, match):
+    op = _COMPARISONS[match.group("op")]
+    is_date = match.group("date") is not None
+    test = _is_datetime if is_date else _is_numeric
+    phrase = match.group("column")
+    column = None
+    if phrase:
+        words = [w for w in phrase.split() if w not in STOPWORDS]
+        # "ones with amount over 100k": the column is the last words before the comparison
+        for start in range(len(words)):
+            column = resolve_column(" ".join(words[start:]), parse.frame.columns)
+            if column is not None and test(parse.frame, column):
+                break
+            column = None
+        if column is None and words:
+            column = parse.column(" ".join(words[-2:]) if len(words) > 1 else words[0])
+            if column is None:
+                parse.failed = False
+                column = parse.column(words[-1])
+            if column is None:
+                return False
+    if column is None:
+        column = _only(parse.frame, test)
+        if column is None:
+            parse.failed = True
+            return False
+    if is_date:
+        value = match.group("date")
+    else:
+        value = float(match.group("number").replace(",", "")) * _UNITS.get(match.group("unit") or "", 1)
+    parse.steps.append({"step": FILTER, "column": column, "op": op, "value": value})
+
+
+def _value_index(frame):
+    """Lower-cased text values of the frame's string columns, to the columns and values they come from"""
+    index = {}
+    for column in frame.columns:
+        series = frame[column]
+        text = pd.api.types.is_string_dtype(series) or series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype)
+        if not text or column_words(column)[-1] == "id":
+            continue
+        values = pd.unique(series.dropna().astype(str))
+        for value in values:
+            key = " ".join(value.lower().split())
+            if len(key) > 1:
+                index.setdefault(key, []).append((column, value))
+    return index
+
+
+def _parse_values(parse):
+    """Filters for text values of the result named in the follow-up, "not" and "excluding" included"""
+    tokens = [(m.start(), m.end(), m.group(0).rstrip(".")) for m in _TOKEN.finditer(parse.text)]
+    if not tokens:
+        return
+    index = _value_index(parse.frame)
+    if not index:
+        return
+    longest = max(len(key.split()) for key in index)
+    chosen, used, i = {}, set(), 0
+    spans = []
+    while i < len(tokens):
+        for n in range(min(longest, len(tokens) - i), 0, -1):
+            key = " ".join(t[2] for t in tokens[i:i + n])
+            if key not in index:
+                continue
+            first = i
+            negated = i > 0 and tokens[i - 1][2] in NEGATIONS and i - 1 not in used
+            if negated:
+                first = i - 1
+            elif i > 1 and tokens[i - 1][2] == "than" and tokens[i - 2][2] == "other":
+                negated, first = True, i - 2
+            column, value = index[key][0]
+            chosen.setdefault((column, negated), []).append(value)
+            used.update(range(first, i + n))
+            spans.append((tokens[first][0], tokens[i + n - 1][1]))
+            i += n - 1
+            break
+        i += 1
+    for (column, negated), values in chosen.items():
+        parse.steps.append({"step": FILTER, "column": column, "op": "not in" if negated else "in", "value": values})
+    for start, end in reversed(spans):
+        parse.text = parse.text[:start] + " " * (end - start) + parse.text[end:]
+
+
+def _parse_projection(parse, match):
+    drop = match.group("drop")
+    add = match.group("add") or match.group("add2")
+    items = drop or add or match.group("select") or match.group("select2")
+    names = [item for item in re.split(r"\s*(?:,|&|\band\b)\s*", items.strip()) if item]
+    if not names:
+        return False
+    columns = []
+    for name in names:
+        column = resolve_column(name, parse.frame.columns)
+        if column is None:
+            column = resolve_column(name, parse.fields)
+            if column is None:
+                # "only the ones in ..." is a filter, not a column list
+                return False
+            if not drop and column not in parse.missing:
+                parse.missing.append(column)
+        columns.append(column)
+    if add:
+        # "show close date too": what's on screen plus the new columns
+        columns = list(dict.fromkeys(list(parse.frame.columns) + columns))
+    parse.steps.append({"step": DROP if drop else SELECT, "columns": columns})
+
+
+def parse_refinement(text, frame, fields=(), sobject=None):
+    """Steps refining a result frame that a follow-up asks for, or None if it isn't a refinement
+
+    fields are the queried object's other fields, which a step may name
+    although the frame lacks them (see missing_fields). sobject is the object
+    the frame was queried from; naming any other object makes the follow-up
+    a new question.
+    """
+    if frame is None or frame.empty and not len(frame.columns):
+        return None
+    lowered = " " + text.lower().replace("“", " ").replace("”", " ").replace('"', " ").replace("`", " ") + " "
+    lowered = re.sub(r"(?<!\w)'|'(?!\w)", " ", lowered)
+    lowered = re.sub(r"\b(" + "|".join(_NUMBER_WORDS) + r")\b", lambda m: str(_NUMBER_WORDS[m.group(1)]), lowered)
+    parse = _Parse(lowered, frame, list(fields), sobject)
+    parse.consume(_SORT, lambda m: _parse_sort(parse, m))
+    parse.consume(_TOP, lambda m: _parse_top(parse, m))
+    parse.consume(_COMPARE, lambda m: _parse_compare(parse, m))
+    _parse_values(parse)
+    parse.consume(_PROJECT, lambda m: _parse_projection(parse, m))
+    if parse.failed or not parse.steps:
+        return None
+
+    # The words of the columns the steps are about ("where stage is ...") are accounted for too
+    named = set()
+    for step in parse.steps:
+        for column in step.get("columns", [step.get("column")]):
+            if column:
+                named.update(column_words(column))
+    leftover = [w for w in re.findall(r"[a-z0-9'$-]+", parse.text) if w not in STOPWORDS and _stem(w) not in named and w not in ("by", "first", "sort", "order")]
+    if not all(parse.names_object(w) for w in leftover):
+        return None
+    return sorted(parse.steps, key=lambda step: STEP_ORDER.index(step["step"]))
+
+
+def missing_fields(steps, frame):
+    """Fields the steps use that the frame doesn't have"""
+    missing = []
+    for step in steps:
+        for column in step.get("columns", [step.get("column")]):
+            if column and column not in frame.columns and column not in missing:
+                missing.append(column)
+    return missing
+
+
+def _mask(series, op, value):
+    if op in ("in", "not in"):
+        wanted = {str(v).lower() for v in value}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Picklists come through as categoricals: compare the few categories, not every row
+            matches = series.isin([c for c in series.cat.categories if str(c).lower() in wanted])
+        else:
+            matches = series.astype(str).str.lower().isin(wanted)
+        return matches if op == "in" else ~matches & series.notna()
+    if pd.api.types.is_datetime64_any_dtype(series):
+        value = pd.Timestamp(value)
+        if series.dt.tz is not None and value.tzinfo is None:
+            value = value.tz_localize(series.dt.tz)
+    return {">": series.gt, ">=": series.ge, "<": series.lt, "<=": series.le, "==": series.eq}[op](value)
+
+
+def apply_steps(frame, steps):
+    """Run refinement steps over a frame with vectorized pandas operations"""
+    for step in steps:
+        kind = step["step"]
+        if kind == FILTER:
+            frame = frame[_mask(frame[step["column"]], step["op"], step["value"]).fillna(False).to_numpy(dtype=bool)]
+        elif kind == SORT:
+            descending = step["descending"]
+            if descending is None:
+                descending = _default_descending(frame, step["column"])
+            frame = frame.sort_values(step["column"], ascending=not descending, kind="stable", na_position="last")
+        elif kind == HEAD:
+            frame = frame.head(step["n"])
+        elif kind == TAIL:
+            frame = frame.tail(step["n"])
+        elif kind == SELECT:
+            frame = frame[[c for c in step["columns"] if c in frame.columns]]
+        elif kind == DROP:
+            frame = frame.drop(columns=[c for c in step["columns"] if c in frame.columns])
+    return frame.reset_index(drop=True)
+
+
+def describe_steps(steps):
+    """The steps in words, e.g. "StageName is Closed Won, sorted by Amount (highest first), first 5\""""
+    names = {">": "over", ">=": "at least", "<": "under", "<=": "at most", "==": "equal to"}
+    dates = {">": "after", ">=": "on or after", "<": "before", "<=": "on or before", "==": "on"}
+    parts = []
+    for step in steps:
+        kind = step["step"]
+        if kind == FILTER:
+            if step["op"] in ("in", "not in"):
+                values = " or ".join(str(v) for v in step["value"])
+                parts.append(f"{step['column']} {'is' if step['op'] == 'in' else 'is not'} {values}")
+            else:
+                value = step["value"]
+                if isinstance(value, str):
+                    parts.append(f"{step['column']} {dates[step['op']]} {value}")
+                else:
+                    value = f"{value:,.0f}" if value.is_integer() else f"{value:,}"
+                    parts.append(f"{step['column']} {names[step['op']]} {value}")
+        elif kind == SORT:
+            order = {True: " (highest first)", False: " (lowest first)", None: ""}[step["descending"]]
+            parts.append(f"sorted by {step['column']}{order}")
+        elif kind in (HEAD, TAIL):
+            parts.append(f"{'first' if kind == HEAD else 'last'} {step['n']}")
+        elif kind == SELECT:
+            parts.append(f"showing {', '.join(step['columns'])}")
+        elif kind == DROP:
+            parts.append(f"without {', '.join(step['columns'])}")
+    return ", ".join(parts)
+
+
+def _projection_free(steps):
+    return [step for step in steps if step["step"] not in (SELECT, DROP)]
+
+
+def refine_reply(user_query, previous, sf, progress=None):
+    """Answer a follow-up from the previous turn's result, or return None to answer it as a new question
+
+    previous holds the last answer's frame, query, intent and filename,
+    plus its own refinement if it was one. The reply is shaped like
+    collect_reply's, with a "refinement" entry holding the steps applied to
+    the query's result and how many rows that result had.
+    """
+    frame, query = previous.get("frame"), previous.get("query")
+    if frame is None or not query:
+        return None
+    earlier = previous.get("refinement") or {}
+    selected, sobject = query_fields(query)
+    fields = list(dict.fromkeys((selected or []) + object_fields(sobject)))
+    steps = parse_refinement(user_query, frame, fields, sobject)
+    if steps is None:
+        return None
+
+    with span("refine", steps=len(steps)) as refine_span:
+        base_rows = earlier.get("base_rows", len(frame))
+        missing = missing_fields(steps, frame)
+        limit = query_limit(query)
+        wanted_rows = max((step["n"] for step in steps if step["step"] in (HEAD, TAIL)), default=0)
+        chain = earlier.get("steps", []) + steps
+        # The chain runs over the query's own result; these steps alone run over what's on screen
+        source, applied = frame, steps
+        # More rows only help when the result stopped at its LIMIT and nothing filters them
+        more_rows = limit is not None and base_rows >= limit and wanted_rows > limit and not any(s["step"] == FILTER for s in chain)
+        fetched_query = None
+        if missing or more_rows:
+            fetched_query = add_fields(query, missing) if missing else query
+            if fetched_query is not None and more_rows:
+                fetched_query = with_limit(fetched_query, wanted_rows)
+            if fetched_query is None:
+                # The query can't be widened (an aggregate, say), so the model writes a new one
+                refine_span.set("outcome", "unrefinable")
+                return None
+            if progress:
+                progress(0.1, "Fetching the extra data from Salesforce...")
+            builder = ResultBuilder()
+            for page, fetched, total in cached_query_pages(sf, fetched_query, intent=previous.get("intent")):
+                builder.add_page(page)
+                if progress and total:
+                    progress(0.1 + 0.8 * fetched / total, f"Fetched {fetched} of {total} records")
+            source = builder.build().to_pandas() if builder.rows else pd.DataFrame()
+            base_rows = len(source)
+            # An earlier "just these columns" would hide what this step needs
+            chain = applied = _projection_free(earlier.get("steps", [])) + steps
+            if missing_fields(chain, source):
+                refine_span.set("outcome", "fields not returned")
+                return None
+            for step in steps:
+                if step["step"] == SORT and step["descending"] is None:
+                    step["descending"] = _default_descending(source, step["column"])
+        try:
+            refined = apply_steps(source, applied)
+        except (TypeError, ValueError) as e:
+            # Say "over 100" of a text column; the model can make sense of it instead
+            logger.info(f"Could not refine the previous result: {e}")
+            refine_span.set("outcome", "not applicable")
+            return None
+        refine_span.update(outcome="fetched" if fetched_query else "local", rows=len(refined))
+
+    description = describe_steps(steps)
+    if fetched_query is not None:
+        # Fields the query already selects were only hidden by an earlier "just these columns"
+        added = [field for field in missing if field.lower() not in {f.lower() for f in selected or []}]
+        again = f" with {', '.join(added)} added" if added else f" for {wanted_rows} rows" if more_rows else ""
+        text = f"Refined the previous result ({description}), running its query again{again}: {len(refined)} rows."
+    else:
+        text = f"Refined the previous result ({description}) without a new query: {len(refined)} of {len(frame)} rows."
+    if refined.empty:
+        return {"text": f"{text}\n\nNothing in the previous result matches."}
+    logger.info(f"Refined a result locally: {description}" if fetched_query is None else f"Refined a result with a new query: {fetched_query}")
+    return {
+        "text": text,
+        "frame": refined,
+        "intent": previous.get("intent"),
+        "filename": previous.get("filename", "query_results.csv"),
+        "query": fetched_query or query,
+        "refinement": {"steps": chain, "base_rows": base_rows},
+    }
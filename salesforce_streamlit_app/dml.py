@@ -0,0 +1,285 @@
+"""Batched record writes: sObject Collections for small sets, Bulk API 2.0 for large ones
+
+Writing one record per call (sf.Account.update(id, data)) costs a round-trip
+per row. DmlEngine groups a set of edits into sObject Collections requests of
+up to 200 records, or into Bulk API 2.0 ingest jobs once the set is large
+enough that a few asynchronous jobs beat hundreds of synchronous calls.
+Chunks run on a small thread pool, every input record gets its own result,
+and the writing session's cached query results are dropped once anything
+has been written.
+"""
+import csv
+import io
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from cache import get_cache, session_scope
+from results import json_value
+
+logger = logging.getLogger(__name__)
+
+INSERT = "insert"
+UPDATE = "update"
+UPSERT = "upsert"
+DELETE = "delete"
+OPERATIONS = (INSERT, UPDATE, UPSERT, DELETE)
+
+# Records per sObject Collections request (the API maximum)
+COLLECTION_SIZE = 200
+
+# Sets this large go through Bulk API 2.0 instead of sObject Collections
+BULK_THRESHOLD = int(os.getenv("DML_BULK_THRESHOLD", "2000"))
+
+# Records per Bulk API 2.0 ingest job
+BULK_JOB_SIZE = 10_000
+
+# Chunks in flight at once. Salesforce allows 25 concurrent long-running
+# requests per org, shared with every other integration, so stay well below.
+DML_WORKERS = int(os.getenv("DML_WORKERS", "4"))
+
+# Bulk API 2.0 CSV value that clears a field; an empty cell leaves it unchanged
+BULK_NULL = "#N/A"
+
+
+class DmlError(Exception):
+    """A write couldn't be attempted at all (as opposed to individual records failing)"""
+
+
+class RecordResult:
+    """Outcome for one input record, by its position in the input"""
+
+    __slots__ = ("index", "id", "success", "created", "errors")
+
+    def __init__(self, index, id=None, success=False, created=False, errors=()):
+        self.index = index
+        self.id = id
+        self.success = success
+        self.created = created
+        self.errors = list(errors)
+
+    def __repr__(self):
+        state = "ok" if self.success else f"failed: {'; '.join(self.errors)}"
+        return f"RecordResult({self.index}, {self.id!r}, {state})"
+
+
+class DmlResult:
+    """Per-record results of one write, in input order"""
+
+    def __init__(self, operation, sobject, results, api_calls=0, mode="collections"):
+        self.operation = operation
+        self.sobject = sobject
+        self.results = sorted(results, key=lambda r: r.index)
+        self.api_calls = api_calls
+        self.mode = mode
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.success]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.success]
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def summary(self):
+        text = f"{len(self.succeeded)} of {len(self.results)} {self.sobject} records {self.operation.rstrip('e')}ed"
+        if self.failed:
+            text += f", {len(self.failed)} failed"
+        return text
+
+    def to_frame(self):
+        """One row per input record, for showing failures next to the edited rows"""
+        return pd.DataFrame({
+            "row": [r.index for r in self.results],
+            "Id": [r.id for r in self.results],
+            "success": [r.success for r in self.results],
+            "errors": ["; ".join(r.errors) for r in self.results],
+        })
+
+
+def invalidate_query_cache(sf):
+    """Drop the session's cached query results so its next read sees the write
+
+    Other sessions' entries stay: they expire within QUERY_CACHE_TTL, as
+    they would after a change made anywhere else in Salesforce.
+    """
+    get_cache("query").clear(f"{session_scope(sf)}:")
+
+
+def _error_messages(errors):
+    return [f"{e.get('statusCode') or e.get('errorCode')}: {e.get('message', '')}" for e in errors or []]
+
+
+def _bulk_value(value):
+    if value is None:
+        return BULK_NULL
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _read_csv(text):
+    return list(csv.DictReader(io.StringIO(text))) if text else []
+
+
+class DmlEngine:
+    """Writes sets of records through a simple_salesforce client in as few calls as possible
+
+    all_or_none applies per request: a failed record rolls back its own
+    chunk of up to 200 records, not chunks that already committed.
+    """
+
+    def __init__(self, sf, workers=DML_WORKERS, bulk_threshold=BULK_THRESHOLD, all_or_none=False):
+        self.sf = sf
+        self.workers = workers
+        self.bulk_threshold = bulk_threshold
+        self.all_or_none = all_or_none
+
+    def insert(self, sobject, records, progress=None):
+        return self.run(INSERT, sobject, records, progress=progress)
+
+    def update(self, sobject, records, progress=None):
+        """Update records; each needs its Id plus the fields to change"""
+        return self.run(UPDATE, sobject, records, progress=progress)
+
+    def upsert(self, sobject, records, external_id_field, progress=None):
+        return self.run(UPSERT, sobject, records, external_id_field=external_id_field, progress=progress)
+
+    def delete(self, sobject, ids, progress=None):
+        return self.run(DELETE, sobject, [{"Id": i} for i in ids], progress=progress)
+
+    def run(self, operation, sobject, records, external_id_field=None, progress=None):
+        """Write records and return a DmlResult
+
+        progress, if given, is called as progress(fraction, message) as
+        chunks finish, so the call can run as a jobs.JobRunner job.
+        """
+        if operation not in OPERATIONS:
+            raise DmlError(f"Unknown operation {operation}; expected one of {', '.join(OPERATIONS)}")
+        if operation == UPSERT and not external_id_field:
+            raise DmlError("Upsert needs an external_id_field")
+
+        results, to_send = [], []
+        for index, record in enumerate(records):
+            # Edited frames hand back numpy scalars, NaN and Timestamps
+            record = {name: json_value(value) for name, value in record.items()}
+            if operation in (UPDATE, DELETE) and not record.get("Id"):
+                results.append(RecordResult(index, errors=["MISSING_ARGUMENT: Id not specified"]))
+            else:
+                to_send.append((index, record))
+        if not to_send:
+            return DmlResult(operation, sobject, results)
+
+        bulk = len(to_send) >= self.bulk_threshold and hasattr(self.sf, "bulk2")
+        size = BULK_JOB_SIZE if bulk else COLLECTION_SIZE
+        send = self._bulk_chunk if bulk else self._collection_chunk
+        chunks = [to_send[start:start + size] for start in range(0, len(to_send), size)]
+        logger.info(f"Writing {len(to_send)} {sobject} records ({operation}) as {len(chunks)} {'bulk jobs' if bulk else 'collection requests'}")
+
+        api_calls = 0
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks)), thread_name_prefix="dml") as pool:
+            futures = {pool.submit(send, operation, sobject, chunk, external_id_field): chunk for chunk in chunks}
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    chunk_results, calls = future.result()
+                except Exception as e:
+                    # Other chunks may already have committed, so report this one's records rather than raising
+                    logger.error(f"{operation} batch of {len(futures[future])} {sobject} records failed: {str(e)}")
+                    chunk_results, calls = [RecordResult(index, errors=[f"REQUEST_FAILED: {str(e)}"]) for index, _ in futures[future]], 1
+                results.extend(chunk_results)
+                api_calls += calls
+                if progress:
+                    progress(done / len(chunks), f"Wrote {done} of {len(chunks)} batches")
+
+        result = DmlResult(operation, sobject, results, api_calls=api_calls, mode="bulk" if bulk else "collections")
+        if result.succeeded:
+            invalidate_query_cache(self.sf)
+        logger.info(result.summary())
+        return result
+
+    def _collection_chunk(self, operation, sobject, chunk, external_id_field=None):
+        """One sObject Collections request; results come back in request order"""
+        if operation == DELETE:
+            response = self.sf.restful(
+                "composite/sobjects",
+                params={"ids": ",".join(r["Id"] for _, r in chunk), "allOrNone": str(self.all_or_none).lower()},
+                method="DELETE"
+            )
+        else:
+            path = f"composite/sobjects/{sobject}/{external_id_field}" if operation == UPSERT else "composite/sobjects"
+            body = {
+                "allOrNone": self.all_or_none,
+                "records": [{"attributes": {"type": sobject}, **record} for _, record in chunk],
+            }
+            response = self.sf.restful(path, method="POST" if operation == INSERT else "PATCH", data=json.dumps(body))
+
+        results = []
+        for (index, record), item in zip(chunk, response or []):
+            results.append(RecordResult(
+                index,
+                id=item.get("id") or record.get("Id"),
+                success=item.get("success", False),
+                created=item.get("created", operation == INSERT and item.get("success", False)),
+                errors=_error_messages(item.get("errors"))
+            ))
+        return results, 1
+
+    def _bulk_chunk(self, operation, sobject, chunk, external_id_field=None):
+        """One Bulk API 2.0 ingest job, with results matched back to input rows by content
+
+        Bulk results come back as CSV in no particular order, echoing each
+        row's submitted values, so rows are matched on exactly those values.
+        """
+        columns = list(dict.fromkeys(name for _, record in chunk for name in record))
+        rows, by_row = [], defaultdict(deque)
+        for index, record in chunk:
+            # A missing column is left empty, which Bulk API 2.0 reads as "leave unchanged"
+            row = {name: _bulk_value(record[name]) if name in record else "" for name in columns}
+            rows.append(row)
+            by_row[tuple(row[name] for name in columns)].append(index)
+
+        api = getattr(self.sf.bulk2, sobject)
+        kwargs = {"external_id_field": external_id_field} if operation == UPSERT else {}
+        jobs = getattr(api, operation)(records=rows, batch_size=len(rows), **kwargs)
+
+        results, api_calls = [], 0
+        for job in jobs:
+            job_id = job["job_id"]
+            # create, upload, close and poll, then one call per results file
+            api_calls += 4 + 3
+            outcomes = (
+                (api.get_successful_records(job_id), True),
+                (api.get_failed_records(job_id), False),
+                (api.get_unprocessed_records(job_id), False),
+            )
+            for text, success in outcomes:
+                for row in _read_csv(text):
+                    key = tuple(row.get(name, "") for name in columns)
+                    indexes = by_row.get(key)
+                    if not indexes:
+                        logger.warning(f"Bulk job {job_id} returned a row that matches no input record")
+                        continue
+                    if success:
+                        error = []
+                    else:
+                        error = [row.get("sf__Error") or "UNPROCESSED: Record was not processed before the job ended"]
+                    results.append(RecordResult(
+                        indexes.popleft(),
+                        id=row.get("sf__Id") or row.get("Id") or None,
+                        success=success,
+                        created=row.get("sf__Created") == "true",
+                        errors=error
+                    ))
+
+        # Anything the job never reported on counts as failed
+        for indexes in by_row.values():
+            results.extend(RecordResult(i, errors=["UNKNOWN: No result returned by the bulk job"]) for i in indexes)
+        return results, api_calls
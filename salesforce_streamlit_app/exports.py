@@ -0,0 +1,255 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+import streamlit as st
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Rows serialized per chunk, which bounds serializer memory regardless of result size
+EXPORT_CHUNK_ROWS = 10_000
+
+# Excel sheets stop at 1,048,576 rows including the header
+EXCEL_MAX_ROWS = 1_048_575
+
+EXPORT_FORMATS = {
+    "CSV": {"extension": "csv", "mime": "text/csv"},
+    "CSV (gzip)": {"extension": "csv.gz", "mime": "application/gzip"},
+    "Parquet": {"extension": "parquet", "mime": "application/vnd.apache.parquet"},
+    "Excel": {"extension": "xlsx", "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+}
+
+
+def excel_available():
+    """Excel export needs openpyxl, which is an optional dependency"""
+    try:
+        import openpyxl  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def iter_chunks(source, chunk_rows=EXPORT_CHUNK_ROWS, transform=None):
+    """Yield DataFrame chunks from a DataFrame or a zero-arg callable returning records
+
+    Callables are how query cursors are passed in, e.g.
+    ``lambda: sf.query_all_iter(query)``; their records are batched and turned
+    into frames with ``transform`` (defaults to pd.DataFrame).
+    """
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunk_rows):
+            yield source.iloc[start:start + chunk_rows]
+        return
+
+    transform = transform or pd.DataFrame
+    batch = []
+    for record in source():
+        batch.append(record)
+        if len(batch) >= chunk_rows:
+            yield transform(batch)
+            batch = []
+    if batch:
+        yield transform(batch)
+
+
+def _common_dtype(dtypes, gaps):
+    """The dtype a column takes across chunks, from the dtypes of the chunks that had values for it
+
+    gaps says whether some chunk lacked the column or held only nulls in it.
+    Integers that meet floats become floats, as in results.ResultBuilder;
+    integers and booleans with gaps become pandas' nullable types, so they
+    don't turn into 1.0 and 0.0; anything mixed becomes text.
+    """
+    kinds = {d.kind for d in dtypes}
+    if not dtypes:
+        return object
+    if len(set(dtypes)) == 1 and not (gaps and kinds & {"i", "u", "b"}):
+        return dtypes[0]
+    if kinds <= {"i", "u"}:
+        return "Int64" if gaps else "int64"
+    if kinds <= {"i", "u", "f"}:
+        return "float64"
+    if kinds == {"b"}:
+        return "boolean"
+    if kinds == {"M"}:
+        return "datetime64[ns, UTC]" if any(getattr(d, "tz", None) is not None for d in dtypes) else "datetime64[ns]"
+    return str
+
+
+def _as_text(value):
+    if value is None or value is pd.NA or isinstance(value, float) and value != value:
+        return None
+    return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+
+
+def reconcile_chunks(chunks):
+    """Chunks put on one set of columns and dtypes, whichever chunk each column first shows up in
+
+    A query cursor's first rows don't settle the columns: a relationship
+    that is null in them hides Account.Name, and a number can be whole
+    until a later row has cents. The chunks are spooled to a temporary file
+    while the columns and their dtypes are collected, then read back one at
+    a time, so memory stays at one chunk.
+    """
+    columns = {}
+    chunk_count = 0
+    with tempfile.TemporaryFile() as spool:
+        for chunk in chunks:
+            chunk_count += 1
+            for name in chunk.columns:
+                seen = columns.setdefault(name, {"dtypes": [], "chunks": 0})
+                if chunk[name].notna().any():
+                    seen["chunks"] += 1
+                    if chunk[name].dtype not in seen["dtypes"]:
+                        seen["dtypes"].append(chunk[name].dtype)
+            pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # A null relationship comes through as a bare "Account" column next to a later chunk's "Account.Name"
+        columns = {name: seen for name, seen in columns.items() if seen["chunks"] or not any(m.startswith(f"{name}.") for m in columns)}
+        dtypes = {name: _common_dtype(seen["dtypes"], seen["chunks"] < chunk_count) for name, seen in columns.items()}
+        spool.seek(0)
+        for _ in range(chunk_count):
+            chunk = pickle.load(spool).reindex(columns=list(columns))
+            for name, dtype in dtypes.items():
+                if dtype is str:
+                    chunk[name] = pd.Series([_as_text(v) for v in chunk[name].astype(object)], index=chunk.index, dtype=object)
+                elif chunk[name].dtype != dtype:
+                    chunk[name] = chunk[name].astype(dtype)
+            yield chunk
+
+
+def _aligned(chunks):
+    """Keep every chunk on the first chunk's columns, since the header is written once"""
+    columns = None
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+        yield chunk.reindex(columns=columns)
+
+
+def write_csv(chunks, fileobj, compress=False):
+    """Write chunks as CSV (optionally gzip-compressed) to a binary file object"""
+    raw = gzip.GzipFile(fileobj=fileobj, mode="wb") if compress else fileobj
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    rows = 0
+    try:
+        for i, chunk in enumerate(_aligned(chunks)):
+            chunk.to_csv(text, index=False, header=(i == 0), quoting=csv.QUOTE_MINIMAL)
+            rows += len(chunk)
+        text.flush()
+    finally:
+        # Detach so closing the wrapper doesn't close the caller's file
+        text.detach()
+        if compress:
+            raw.close()
+    return rows
+
+
+def write_parquet(chunks, fileobj):
+    """Write chunks as row groups of a single Parquet file"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in _aligned(chunks):
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                # An all-null column in the first chunk would pin the column to the null type
+                schema = pa.schema([
+                    f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+                    for f in table.schema
+                ]).remove_metadata()
+                writer = pq.ParquetWriter(fileobj, schema, compression="snappy")
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_excel(chunks, fileobj):
+    """Write chunks to a streaming (write-only) Excel workbook"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Results")
+    rows = 0
+    for i, chunk in enumerate(_aligned(chunks)):
+        if i == 0:
+            sheet.append([str(c) for c in chunk.columns])
+        remaining = EXCEL_MAX_ROWS - rows
+        if remaining <= 0:
+            logger.warning(f"Excel export truncated at {EXCEL_MAX_ROWS} rows")
+            break
+        chunk = chunk.iloc[:remaining].astype(object)
+        for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+            # Raw records can carry nested dicts (attributes, relationships), which Excel can't hold
+            sheet.append([json.dumps(v) if isinstance(v, (dict, list)) else v for v in row])
+        rows += len(chunk)
+    workbook.save(fileobj)
+    return rows
+
+
+def write_export(source, fmt, fileobj, chunk_rows=EXPORT_CHUNK_ROWS, transform=None):
+    """Stream source into fileobj in the given export format, returning the row count"""
+    chunks = iter_chunks(source, chunk_rows, transform)
+    if not isinstance(source, pd.DataFrame):
+        # A frame's slices already agree; a cursor's batches are formatted one by one
+        chunks = reconcile_chunks(chunks)
+    if fmt == "CSV":
+        return write_csv(chunks, fileobj)
+    if fmt == "CSV (gzip)":
+        return write_csv(chunks, fileobj, compress=True)
+    if fmt == "Parquet":
+        return write_parquet(chunks, fileobj)
+    if fmt == "Excel":
+        return write_excel(chunks, fileobj)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def export_file(source, fmt, chunk_rows=EXPORT_CHUNK_ROWS, transform=None):
+    """Serialize source into a temporary file on disk and return it rewound"""
+    fileobj = tempfile.TemporaryFile()
+    with span("export", format=fmt) as export_span:
+        rows = write_export(source, fmt, fileobj, chunk_rows, transform)
+        size = os.fstat(fileobj.fileno()).st_size
+        export_span.update(rows=rows, bytes=size)
+    fileobj.seek(0)
+    logger.info(f"Exported {rows} rows as {fmt} ({size} bytes)")
+    return fileobj
+
+
+def _deferred_export(source, fmt, transform):
+    """Zero-arg callable for st.download_button that serializes only when clicked"""
+    def build():
+        with export_file(source, fmt, transform=transform) as fileobj:
+            return fileobj.read()
+    return build
+
+
+def download_buttons(source, filename, key, transform=None):
+    """Render one download button per export format, serializing lazily on click"""
+    stem = filename.rsplit(".", 1)[0]
+    formats = [f for f in EXPORT_FORMATS if f != "Excel" or excel_available()]
+    columns = st.columns(len(formats))
+    for column, fmt in zip(columns, formats):
+        spec = EXPORT_FORMATS[fmt]
+        with column:
+            st.download_button(
+                f"Download as {fmt}",
+                _deferred_export(source, fmt, transform),
+                f"{stem}.{spec['extension']}",
+                spec["mime"],
+                key=f"{key}_{spec['extension']}",
+            )
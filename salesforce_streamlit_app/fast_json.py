@@ -0,0 +1,91 @@
+"""Fast decoding for Salesforce REST responses
+
+Uses msgspec when installed, then orjson, then the standard library. Query
+responses are decoded against a typed envelope (totalSize, done,
+nextRecordsUrl, records) when msgspec is available, so a malformed page
+fails at decode time instead of deep inside the formatting code.
+"""
+import json
+import logging
+import threading
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger(__name__)
+
+DECODER = "msgspec" if msgspec is not None else "orjson" if orjson is not None else "json"
+
+if msgspec is not None:
+    class QueryEnvelope(msgspec.Struct):
+        """One page of a REST query response"""
+        totalSize: int
+        done: bool
+        records: list
+        nextRecordsUrl: Optional[str] = None
+
+    _json_decoder = msgspec.json.Decoder()
+    _envelope_decoder = msgspec.json.Decoder(QueryEnvelope)
+
+
+_decoded = threading.local()
+
+
+def bytes_decoded():
+    """Bytes of JSON decoded on this thread so far, for per-query transfer stats"""
+    return getattr(_decoded, "total", 0)
+
+
+def _count(data):
+    _decoded.total = bytes_decoded() + len(data)
+
+
+def loads(data):
+    """Decode JSON bytes or text with the fastest available decoder"""
+    _count(data)
+    if msgspec is not None:
+        return _json_decoder.decode(data)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_query_page(data):
+    """Decode a query/queryMore response body into the usual page dict"""
+    if msgspec is None:
+        return loads(data)
+    _count(data)
+    try:
+        envelope = _envelope_decoder.decode(data)
+    except msgspec.ValidationError as e:
+        # Valid JSON that isn't a query page (an error body, say): hand it back as it is
+        logger.debug(f"Response is not a query page: {str(e)}")
+        return _json_decoder.decode(data)
+    page = {"totalSize": envelope.totalSize, "done": envelope.done, "records": envelope.records}
+    if envelope.nextRecordsUrl is not None:
+        page["nextRecordsUrl"] = envelope.nextRecordsUrl
+    return page
+
+
+def decode_page_into(data, builder):
+    """Decode a query page straight into a results.ResultBuilder and return the page without its records
+
+    The decoded dicts only live until the page has been turned into an
+    Arrow batch, so a long result never holds more than one page of them.
+    """
+    page = decode_query_page(data)
+    builder.add_page(page.pop("records"))
+    return page
+
+
+def response_json(response):
+    """Drop-in for requests' response.json()"""
+    return loads(response.content)
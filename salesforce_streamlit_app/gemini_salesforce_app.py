@@ -1,15 +1,19 @@
 import streamlit as st
 import requests
-import pandas as pd
-import altair as alt
-import json
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-import time
-from simple_salesforce import Salesforce
 import logging
 import urllib.parse
+from cache import MemoryBackend, get_backend
+from chat_history import display_chat_history as render_chat_history, get_chat_history
+from chatbot_engine import MULTI_STEP_INTENTS, QueryServiceClient, answer_query, format_records, get_default_queries, refine_reply
+from jobs import DONE, FAILED, get_job_runner, poll_pending_jobs, track_job
+from log_config import setup_logging
+from prefetch import PREFETCH_ENABLED, get_prefetcher, prefetch_after_turn
+from shared_resources import credential_scope, format_bytes, get_http_session, get_result_store, get_salesforce_client
+from snapshots import record_snapshot
+from tracing import span
+from warmup import WARMUP_ENABLED, Warmer
 
 # Load environment variables from .env file
 load_dotenv('salesforce_arcgis.env')
@@ -25,15 +29,8 @@ os.environ["CLIENT_SECRET"] = os.getenv("CLIENT_SECRET")
 os.environ["REDIRECT_URI"] = os.getenv("REDIRECT_URI")
 os.environ["GEMINI_API_KEY"] = os.getenv("GEMINI_API_KEY")
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("salesforce_data.log"),
-        logging.StreamHandler()
-    ]
-)
+# Set up logging: JSON lines to a rotating log file, written from a background thread
+setup_logging("salesforce_data.log")
 logger = logging.getLogger(__name__)
 
 # ENV variables with validation
@@ -47,10 +44,10 @@ required_env_vars = {
     "REDIRECT_URI": os.getenv("REDIRECT_URI")
 }
 
-# Log all environment variables (safely)
+# Log all environment variables (safely); this runs on every rerun, so only at debug level
 for var_name, var_value in required_env_vars.items():
     if var_value:
-        logger.info(f"{var_name} is set")
+        logger.debug(f"{var_name} is set")
     else:
         logger.error(f"{var_name} is not set")
 
@@ -74,55 +71,35 @@ CLIENT_SECRET = required_env_vars["CLIENT_SECRET"]
 REDIRECT_URI = required_env_vars["REDIRECT_URI"]
 
 # Print environment variables for debugging (safely)
-logger.info("Environment variables loaded successfully")
-logger.info(f"SF_USERNAME: {SF_USERNAME}")
-logger.info(f"SF_DOMAIN: {SF_DOMAIN}")
-logger.info(f"GEMINI_API_KEY: {GEMINI_API_KEY[:10]}...")  # Only print first 10 chars for security
+logger.debug("Environment variables loaded successfully")
+logger.debug(f"SF_USERNAME: {SF_USERNAME}")
+logger.debug(f"SF_DOMAIN: {SF_DOMAIN}")
+logger.debug(f"GEMINI_API_KEY: {GEMINI_API_KEY[:10]}...")  # Only print first 10 chars for security
+
+# Optional headless query service; when set, chat turns are answered there instead of in process
+QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL")
 
 # Auth URLs
 TOKEN_URL = f"{LOGIN_URL}/services/oauth2/token"
 AUTH_URL = f"{LOGIN_URL}/services/oauth2/authorize"
 
-# Configure Gemini API
-try:
-    # Try to get package version (without pkg_resources)
-    try:
-        genai_version = getattr(genai, "__version__", "unknown")
-        logger.info(f"Using google-generativeai version: {genai_version}")
-    except Exception:
-        logger.info("Could not determine google-generativeai version")
-    
-    # Configure with the API key
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info("Gemini API configured successfully")
-    
-    # Check if API is accessible and print available models
-    try:
-        available_models = genai.list_models()
-        logger.info(f"Successfully listed {len(available_models)} models")
-        model_names = [model.name for model in available_models]
-        logger.info(f"Available models: {model_names}")
-        
-        if not any("gemini" in model.name.lower() for model in available_models):
-            logger.warning("No Gemini models found in the available models list")
-    except Exception as model_list_error:
-        logger.warning(f"Could not list models: {str(model_list_error)}")
-        
-except Exception as e:
-    error_msg = f"Failed to configure Gemini API: {str(e)}"
-    logger.error(error_msg)
-    st.error(error_msg)
-    st.error("Please check your GEMINI_API_KEY in the .env file or create one at https://aistudio.google.com/app/apikey")
-    st.stop()
+@st.cache_resource(show_spinner=False)
+def get_genai():
+    """google.generativeai, imported and configured once per process on first use
 
-# Print available models at startup
-try:
-    available_models = genai.list_models()
-    print("Available models:")
-    for model in available_models:
-        print(f"- {model.name}")
-except Exception as e:
-    print(f"Error listing models: {str(e)}")
+    The package takes most of a second to import, so it is loaded by the
+    warm-up thread rather than before the first page can render. Failures
+    are raised for the caller to show.
+    """
+    import google.generativeai as genai
+
+    logger.debug(f"Using google-generativeai version: {getattr(genai, '__version__', 'unknown')}")
+    try:
+        genai.configure(api_key=GEMINI_API_KEY)
+    except Exception as e:
+        raise RuntimeError(f"Failed to configure Gemini API: {str(e)}. Please check your GEMINI_API_KEY in the .env file or create one at https://aistudio.google.com/app/apikey") from e
+    logger.debug("Gemini API configured successfully")
+    return genai
 
 # Set page config
 st.set_page_config(page_title="Salesforce Gemini Assistant", layout="wide")
@@ -133,9 +110,11 @@ MODEL = "gemini-1.5-pro"  # Changed from gemini-pro to a newer version
 def list_available_models():
     """List available Gemini models"""
     try:
-        models = genai.list_models()
+        models = get_genai().list_models()
         model_names = [model.name for model in models]
-        logger.info(f"Available models: {model_names}")
+        logger.debug(f"Available models: {model_names}")
+        if not any("gemini" in name.lower() for name in model_names):
+            logger.warning("No Gemini models found in the available models list")
         return model_names
     except Exception as e:
         st.error(f"Error listing models: {str(e)}")
@@ -150,7 +129,7 @@ def setup_gemini_model():
         logger.info(f"Found {len(available_models)} available models")
         
         for model_name in available_models:
-            logger.info(f"Available model: {model_name}")
+            logger.debug(f"Available model: {model_name}")
         
         # Try models in order of preference - using names that are likely to exist in the API
         models_to_try = [
@@ -174,7 +153,7 @@ def setup_gemini_model():
         for model_name in models_to_try:
             try:
                 logger.info(f"Attempting to create model with {model_name}")
-                model = genai.GenerativeModel(model_name)
+                model = get_genai().GenerativeModel(model_name)
                 
                 # Test the model with a simple generation
                 test_response = model.generate_content("Hello")
@@ -197,135 +176,32 @@ def setup_gemini_model():
         logger.error(f"Error setting up Gemini model: {str(primary_error)}")
         raise primary_error
 
-def generate_gemini_response(model, prompt, context=""):
-    full_prompt = f"{context}\n\nUser query: {prompt}\n\nPlease analyze this query about Salesforce data and respond with a JSON in this exact format:\n{{\"intent\": \"[one of: top_accounts, recent_opportunities, opportunity_by_stage, contacts, opportunity_stage_chart, opportunity_amount_chart, custom_query, unknown]\", \"query\": \"[the SOQL query to execute or null if unknown]\", \"explanation\": \"[brief explanation of what the query will do]\"}}"
-    
-    try:
-        if model is None:
-            return {"intent": "unknown", "query": None, "explanation": "No Gemini model available"}
-        
-        # Log the prompt for debugging
-        logger.info(f"Sending prompt to Gemini: {prompt[:100]}...")
-        
-        response = model.generate_content(full_prompt)
-        return parse_gemini_response(response.text)
-    except Exception as e:
-        st.error(f"Error with Gemini API: {str(e)}")
-        logger.error(f"Error with Gemini API: {str(e)}")
-        
-        # Fallback to rule-based processing
-        return fallback_query_processing(prompt)
+@st.cache_resource(show_spinner=False)
+def get_warmer():
+    """Warm-up started once per process, on the first script run (see warmup.py)
 
-def fallback_query_processing(prompt):
-    """Process query using rule-based approach when Gemini fails"""
-    prompt = prompt.lower()
-    logger.info(f"Using fallback processing for query: {prompt}")
-    
-    # Default to unknown
-    result = {"intent": "unknown", "query": None, "explanation": "Using rule-based fallback processing"}
-    
-    # Simple rule-based detection - expanded for better matching
-    account_terms = ["account", "accounts", "customer", "customers", "client", "clients", "top account", "best account", "highest value account"]
-    opportunity_terms = ["opportunity", "opportunities", "deal", "deals", "sale", "sales"]
-    recent_terms = ["recent", "latest", "new", "newest", "last"]
-    stage_terms = ["stage", "status", "phase", "pipeline", "progress"]
-    contact_terms = ["contact", "contacts", "people", "person", "employee", "employees"]
-    chart_terms = ["chart", "graph", "visual", "visualization", "diagram", "plot"]
-    
-    # Check for top accounts intent
-    if any(term in prompt for term in account_terms) and ("top" in prompt or "best" in prompt or "highest" in prompt or "largest" in prompt):
-        result["intent"] = "top_accounts"
-        result["query"] = get_default_queries()["top_accounts"]
-        result["explanation"] = "Finding the top accounts by opportunity amount"
-    
-    # Check for recent opportunities intent
-    elif any(term in prompt for term in opportunity_terms) and any(term in prompt for term in recent_terms):
-        result["intent"] = "recent_opportunities"
-        result["query"] = get_default_queries()["recent_opportunities"]
-        result["explanation"] = "Listing the most recently created opportunities"
-    
-    # Check for opportunities by stage intent
-    elif any(term in prompt for term in opportunity_terms) and any(term in prompt for term in stage_terms):
-        result["intent"] = "opportunity_by_stage"
-        result["query"] = get_default_queries()["opportunity_by_stage"]
-        result["explanation"] = "Showing opportunities grouped by stage"
-    
-    # Check for contacts intent
-    elif any(term in prompt for term in contact_terms):
-        result["intent"] = "contacts"
-        result["query"] = get_default_queries()["contacts"]
-        result["explanation"] = "Listing contact information"
-    
-    # Check for chart intents
-    elif any(term in prompt for term in chart_terms) or "show me" in prompt:
-        if any(term in prompt for term in stage_terms):
-            result["intent"] = "opportunity_stage_chart"
-            result["query"] = get_default_queries()["opportunity_stage_chart"]
-            result["explanation"] = "Creating a chart of opportunities by stage"
-        elif any(term in prompt for term in opportunity_terms):
-            result["intent"] = "opportunity_amount_chart"
-            result["query"] = get_default_queries()["opportunity_amount_chart"]
-            result["explanation"] = "Creating a chart of opportunities by amount"
-    
-    # Check for simple intent patterns
-    elif "top" in prompt and any(term in prompt for term in opportunity_terms):
-        result["intent"] = "opportunity_amount_chart"
-        result["query"] = get_default_queries()["opportunity_amount_chart"]
-        result["explanation"] = "Showing top opportunities by amount"
-    elif "all" in prompt and any(term in prompt for term in opportunity_terms):
-        result["intent"] = "recent_opportunities"
-        result["query"] = get_default_queries()["recent_opportunities"]
-        result["explanation"] = "Listing opportunities"
-    
-    # Catch-all for basic terms
-    elif any(term in prompt for term in opportunity_terms):
-        result["intent"] = "recent_opportunities"
-        result["query"] = get_default_queries()["recent_opportunities"]
-        result["explanation"] = "Showing recent opportunities"
-    elif any(term in prompt for term in account_terms):
-        result["intent"] = "top_accounts"
-        result["query"] = get_default_queries()["top_accounts"]
-        result["explanation"] = "Showing top accounts"
-    
-    logger.info(f"Fallback processing result: {result['intent']}")
-    return result
+    It logs in with the default credentials, resolves the Gemini model and
+    prefetches the preset queries off the script thread, so later sessions
+    logging in as the default user find them cached.
+    """
+    def login():
+        return get_salesforce_client(SF_USERNAME, SF_PASSWORD, SF_SECURITY_TOKEN, SF_DOMAIN)
 
-def parse_gemini_response(response_text):
-    try:
-        # Find the JSON within the response text
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}') + 1
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = response_text[start_idx:end_idx]
-            response_data = json.loads(json_str)
-            
-            # Ensure the response has the expected structure
-            if "intent" not in response_data or "query" not in response_data:
-                default_response = {
-                    "intent": "unknown", 
-                    "query": None, 
-                    "explanation": "I couldn't understand your request."
-                }
-                return default_response
-            
-            return response_data
-        else:
-            return {
-                "intent": "unknown", 
-                "query": None, 
-                "explanation": "I couldn't parse the response properly."
-            }
-    except Exception as e:
-        st.error(f"Error parsing response: {str(e)}")
-        return {
-            "intent": "unknown", 
-            "query": None, 
-            "explanation": "I encountered an error processing your request."
-        }
+    if not WARMUP_ENABLED:
+        return Warmer(None, setup_gemini_model, intents=()).start()
+    return Warmer(login, setup_gemini_model, scope=credential_scope(SF_USERNAME, SF_DOMAIN)).start()
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_model():
+    """Gemini model shared by every session in the process, the one the warm-up resolved"""
+    model = get_warmer().result("model")
+    # A failed warm-up attempt is retried here, so the error reaches the page
+    return model if model is not None else setup_gemini_model()
 
 def login_salesforce():
     """Connect to Salesforce using SOAP API or OAuth2 as fallback"""
+    from chatbot_engine import FastSalesforce
+
     try:
         # For debugging - print all environment variables
         logger.info("Environment variables for Salesforce login:")
@@ -348,12 +224,7 @@ def login_salesforce():
         try:
             logger.info(f"Attempting direct login with username: {username} and domain: {domain}")
             
-            sf = Salesforce(
-                username=username,
-                password=password,
-                security_token=security_token,
-                domain=domain
-            )
+            sf = get_salesforce_client(username, password, security_token, domain)
             st.session_state.sf = sf
             logger.info("Successfully connected to Salesforce using username/password")
             return True
@@ -372,7 +243,7 @@ def login_salesforce():
                 domain=domain
             )
             
-            sf = Salesforce(instance=instance, session_id=session_id)
+            sf = FastSalesforce(instance=instance, session_id=session_id)
             st.session_state.sf = sf
             logger.info("Successfully connected to Salesforce using SOAP API")
             return True
@@ -397,7 +268,7 @@ def login_salesforce():
                 response = requests.post(TOKEN_URL, data=token_data)
                 if response.status_code == 200:
                     token_info = response.json()
-                    sf = Salesforce(
+                    sf = FastSalesforce(
                         instance_url=token_info["instance_url"],
                         session_id=token_info["access_token"]
                     )
@@ -432,287 +303,166 @@ def login_salesforce():
         
         return False
 
-def fetch_salesforce_data(query):
-    """Run a SOQL query and return the results using simple-salesforce"""
-    try:
-        if "sf" not in st.session_state:
-            st.error("Not connected to Salesforce")
-            return None
-            
-        results = st.session_state.sf.query_all(query)
-        logger.info(f"Query executed: {query}")
-        logger.info(f"Records returned: {len(results['records'])}")
-        return results['records']
-    except Exception as e:
-        error_msg = f"Query failed: {str(e)}"
-        add_message("assistant", error_msg)
-        logger.error(error_msg)
+@st.cache_resource(show_spinner=False)
+def get_query_service_client():
+    """Client for the query service shared by every session, or None to answer in process"""
+    if not QUERY_SERVICE_URL:
         return None
+    return QueryServiceClient(QUERY_SERVICE_URL, session=get_http_session())
 
-def format_records(records):
-    """Format Salesforce records for display in a dataframe"""
-    if not records:
-        return pd.DataFrame()
-    
-    # Remove attributes
-    formatted_records = []
-    for record in records:
-        record_copy = {k: v for k, v in record.items() if k != 'attributes'}
-        
-        # Process nested objects
-        for key, value in record_copy.copy().items():
-            if isinstance(value, dict) and 'attributes' in value:
-                for nested_key, nested_value in value.items():
-                    if nested_key != 'attributes':
-                        record_copy[f"{key}.{nested_key}"] = nested_value
-                del record_copy[key]
-        
-        formatted_records.append(record_copy)
-    
-    return pd.DataFrame(formatted_records)
-
-def create_visualization(df, intent):
-    """Create visualization based on data and intent"""
-    if intent == "opportunity_stage_chart":
-        # Create a bar chart for opportunity stages
-        chart = alt.Chart(df).mark_bar().encode(
-            x=alt.X('StageName:N', sort='-y'),
-            y=alt.Y('totalAmount:Q', title='Total Amount ($)'),
-            color='StageName:N',
-            tooltip=['StageName', 'opportunityCount', 'totalAmount']
-        ).properties(
-            title='Opportunities by Stage',
-            width=600
-        )
-        return chart
-    
-    elif intent == "opportunity_amount_chart":
-        # Create a horizontal bar chart for opportunity amounts
-        chart = alt.Chart(df).mark_bar().encode(
-            y=alt.Y('Name:N', sort='-x'),
-            x=alt.X('Amount:Q', title='Amount ($)'),
-            tooltip=['Name', 'Amount', 'CloseDate']
-        ).properties(
-            title='Top Opportunities by Amount',
-            width=600
-        )
-        return chart
-    
-    elif intent == "top_accounts":
-        # Create a horizontal bar chart for top accounts
-        if 'Account.Name' in df.columns and 'totalAmount' in df.columns:
-            chart = alt.Chart(df).mark_bar().encode(
-                y=alt.Y('Account.Name:N', sort='-x'),
-                x=alt.X('totalAmount:Q', title='Total Amount ($)'),
-                tooltip=['Account.Name', 'totalAmount']
-            ).properties(
-                title='Top Accounts by Total Opportunity Amount',
-                width=600
-            )
-            return chart
-    
-    return None
+def run_chat_turn(job, user_query, model, sf, client=None, scope="", session=None, previous=None):
+    """Background job for one chat turn, answered by the query service when a client is given
 
-def get_default_queries():
-    return {
-        "top_accounts": """
-            SELECT AccountId, Account.Name, SUM(Amount) totalAmount
-            FROM Opportunity
-            WHERE IsClosed = true
-            GROUP BY AccountId, Account.Name
-            ORDER BY totalAmount DESC
-            LIMIT 5
-        """,
-        "recent_opportunities": """
-            SELECT Id, Name, Amount, StageName, CloseDate, Account.Name
-            FROM Opportunity
-            ORDER BY CreatedDate DESC
-            LIMIT 10
-        """,
-        "opportunity_by_stage": """
-            SELECT StageName, COUNT(Id) opportunityCount, SUM(Amount) totalAmount
-            FROM Opportunity
-            GROUP BY StageName
-            ORDER BY SUM(Amount) DESC
-        """,
-        "opportunity_stage_chart": """
-            SELECT StageName, COUNT(Id) opportunityCount, SUM(Amount) totalAmount
-            FROM Opportunity
-            GROUP BY StageName
-            ORDER BY SUM(Amount) DESC
-        """,
-        "opportunity_amount_chart": """
-            SELECT Name, Amount, CloseDate
-            FROM Opportunity
-            WHERE Amount != null
-            ORDER BY Amount DESC
-            LIMIT 10
-        """,
-        "contacts": """
-            SELECT Id, Name, Email, Phone, Account.Name
-            FROM Contact
-            ORDER BY CreatedDate DESC
-            LIMIT 10
-        """
-    }
+    Runs off the script thread, so it only touches the objects passed in and
+    returns a plain dict for deliver_chat_job to add to the history. A
+    follow-up that filters, sorts or trims the previous answer is answered
+    from its frame (see chatbot_engine/refine.py). Otherwise a result with
+    rows is kept as a snapshot under the session's credential scope, and the
+    chat session's likely next queries are prefetched (see prefetch.py).
+    """
+    with span("chat_turn", job=job.id, remote=client is not None) as turn:
+        reply = refine_reply(user_query, previous, sf, progress=job.report) if previous else None
+        if reply is not None:
+            turn.update(refined=True, intent=reply.get("intent") or "unknown", rows=len(reply["frame"]) if "frame" in reply else 0)
+            reply["trace"] = turn.traceparent
+            return reply
+        if client is not None:
+            reply = client.answer(user_query, sf, progress=job.report)
+        else:
+            reply = answer_query(user_query, model, sf, progress=job.report)
+        turn.update(intent=reply.get("intent", "unknown"), rows=len(reply["frame"]) if "frame" in reply else 0)
+        if "frame" in reply:
+            with span("snapshot", rows=len(reply["frame"])):
+                record_snapshot(reply["frame"], reply["query"], scope=scope, intent=reply["intent"])
+        # The query service only finds prefetched results through a shared cache
+        prefetch_after_turn(sf, reply, session, scope, speculate=client is None or not isinstance(get_backend(), MemoryBackend))
+        # Rendering the answer later joins the same trace
+        reply["trace"] = turn.traceparent
+        return reply
+
+def previous_result():
+    """The latest answer with a result, as refine_reply takes it, or None"""
+    history = get_chat_history()
+    for message in reversed(history.messages):
+        if message["role"] != "assistant" or "result" not in message or not message.get("query"):
+            continue
+        frame = history.get_result(message["result"])
+        if frame is None:
+            return None
+        return {
+            "key": message["result"],
+            "frame": frame,
+            "query": message["query"],
+            "intent": message.get("intent"),
+            "filename": message.get("filename", "query_results.csv"),
+            "refinement": message.get("refinement"),
+        }
+    return None
 
 def process_chatbot_query(user_query, model):
+    """Submit a chat turn as a background job; its answer is added when the job finishes"""
     if not user_query:
         return
     
-    # Determine if we have a Gemini model or need to use fallback
-    if model is not None:
-        # Get context about Salesforce schema for the model
-        salesforce_context = """
-        You are an AI assistant specialized in Salesforce data analysis. Your task is to interpret natural language queries and convert them to SOQL (Salesforce Object Query Language) queries.
-        
-        Common Salesforce objects and their fields:
-        - Account: Id, Name, Industry, AnnualRevenue
-        - Opportunity: Id, Name, Amount, StageName, CloseDate, AccountId, Account.Name, CreatedDate, IsClosed
-        - Contact: Id, Name, Email, Phone, AccountId, Account.Name, CreatedDate
-        
-        Custom Objects (note the __c suffix):
-        - College__c: Id, Name, city__c
-        - Student__c: Id, First_Name__c, Last_Name__c
-        
-        Important rules for custom objects:
-        1. Always use the __c suffix for custom object names
-        2. Custom fields also use the __c suffix
-        3. When querying custom objects, use the exact object name with __c
-        
-        Common query intents and their SOQL queries:
-        - top_accounts: Queries for accounts with highest opportunity amounts
-        - recent_opportunities: Lists the most recently created opportunities
-        - opportunity_by_stage: Groups opportunities by their stage
-        - contacts: Lists contact information
-        - opportunity_stage_chart: Similar to opportunity_by_stage but meant for visualization
-        - opportunity_amount_chart: Shows opportunities with highest amounts
-        - custom_query: Any valid SOQL query provided by the user
-        """
-        
-        # Generate response using Gemini
-        response = generate_gemini_response(model, user_query, salesforce_context)
-    else:
-        # Fallback processing when Gemini is not available
-        logger.info("Using fallback query processing (no Gemini model available)")
-        
-        # Check if the query looks like a SOQL query
-        if user_query.strip().upper().startswith("SELECT") and " FROM " in user_query.upper():
-            # This is likely a SOQL query
-            response = {
-                "intent": "custom_query",
-                "query": user_query,
-                "explanation": "Running your custom SOQL query"
-            }
+    # The root of the chat turn's trace; the job continues it on its worker thread
+    with span("process_chatbot_query", question_length=len(user_query)):
+        previous = previous_result()
+        # The same question from the same session about the same result reuses a running job
+        job = get_job_runner().submit(
+            run_chat_turn, user_query, model, st.session_state.sf, get_query_service_client(),
+            label="Answering your question",
+            key=f"{get_chat_history().session_id}:{session_scope()}:{previous['key'] if previous else ''}:{user_query.strip().lower()}",
+            owner=get_chat_history().session_id,
+            scope=session_scope(),
+            session=get_chat_history().session_id,
+            previous=previous
+        )
+    track_job(job)
+
+def deliver_chat_job(job):
+    """Add a finished chat job's answer, or what went wrong, to the history"""
+    if job.status == DONE:
+        reply = job.result
+        if "frame" in reply:
+            # Keep the result frame in history so it survives reruns
+            details = {"refinement": reply["refinement"]} if reply.get("refinement") else {}
+            get_chat_history().add("assistant", reply["text"], result=reply["frame"], scope=session_scope(), intent=reply["intent"], filename=reply["filename"], query=reply["query"], trace=reply.get("trace"), **details)
         else:
-            # Use rule-based processing
-            response = fallback_query_processing(user_query)
-            logger.info(f"Fallback processing determined intent: {response['intent']}")
-    
-    intent = response["intent"]
-    query = response["query"]
-    explanation = response.get("explanation", "Processing your request...")
-    
-    if intent == "unknown" or query is None:
-        # Use default message for unknown intent
-        add_message("assistant", "I couldn't understand your request. Please try one of these queries:\n- Show me top accounts\n- Show recent opportunities\n- Show opportunities by stage\n- List contacts\n- Create a chart of opportunity stages\n- Or write a custom SOQL query")
-        return
-    
-    # If there's no query but we have a recognized intent, use default query
-    if query is None and intent in get_default_queries():
-        query = get_default_queries()[intent]
-    
-    # Set title and filename based on intent
-    intent_map = {
-        "top_accounts": {"title": "Top Accounts by Opportunity Amount", "filename": "top_accounts.csv", "response": "Here are the top accounts by opportunity amount:"},
-        "recent_opportunities": {"title": "Recent Opportunities", "filename": "recent_opportunities.csv", "response": "Here are the most recent opportunities:"},
-        "opportunity_by_stage": {"title": "Opportunities by Stage", "filename": "opportunities_by_stage.csv", "response": "Here's a breakdown of opportunities by stage:"},
-        "opportunity_stage_chart": {"title": "Opportunities by Stage Chart", "filename": "opportunities_by_stage.csv", "response": "Here's a chart showing opportunities by stage:"},
-        "opportunity_amount_chart": {"title": "Top Opportunities by Amount", "filename": "top_opportunities.csv", "response": "Here's a chart showing top opportunities by amount:"},
-        "contacts": {"title": "Contact Information", "filename": "contacts.csv", "response": "Here are the recent contacts:"},
-        "custom_query": {"title": "Custom Query Results", "filename": "query_results.csv", "response": "Here are the results for your custom query:"}
-    }
-    
-    if intent in intent_map:
-        title = intent_map[intent]["title"]
-        filename = intent_map[intent]["filename"]
-        response_text = intent_map[intent]["response"]
+            add_message("assistant", reply["text"])
+    elif job.status == FAILED:
+        add_message("assistant", f"Query failed: {job.error}")
     else:
-        title = "Query Results"
-        filename = "query_results.csv"
-        response_text = "Here are the results:"
-    
-    # Add explanation from Gemini if available
-    if explanation and explanation != "Processing your request...":
-        response_text = f"{explanation}\n\n{response_text}"
-    
-    with st.spinner("Fetching data..."):
-        results = fetch_salesforce_data(query)
-        if results:
-            # Add chatbot response message
-            add_message("assistant", response_text)
-            
-            # Create a container for results
-            result_container = st.container()
-            with result_container:
-                df = format_records(results)
-                
-                # Check if visualization is appropriate for this intent
-                chart = create_visualization(df, intent)
-                if chart and any(x in intent for x in ["chart", "top_accounts", "opportunity_stage"]):
-                    st.altair_chart(chart, use_container_width=True)
-                else:
-                    st.dataframe(df)
-                
-                # Add download button
-                csv = df.to_csv(index=False)
-                st.download_button("Download as CSV", csv, filename, "text/csv")
-                
-                # Option to view raw JSON
-                if st.checkbox("Show Raw JSON"):
-                    st.json(results)
-        else:
-            add_message("assistant", "No results found for your query.")
+        add_message("assistant", f"{job.error}.")
+
+@st.fragment(run_every=1.0)
+def show_pending_jobs():
+    """Poll this session's background jobs, rerunning the app once one finishes"""
+    if poll_pending_jobs(deliver_chat_job):
+        st.rerun()
+
+def session_scope():
+    """Credential scope that result frames are shared under"""
+    return credential_scope(st.session_state.get('username', SF_USERNAME), st.session_state.get('domain', SF_DOMAIN))
 
 def add_message(role, content):
     """Add a message to the chat history"""
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    
-    st.session_state.chat_history.append({"role": role, "content": content})
+    get_chat_history().add(role, content)
+
+def query_export_source(message):
+    """Stream exports from the Salesforce query cursor instead of the cached frame
+
+    A refined answer is only part of what its query returns, and a multi-step
+    answer (top accounts with their details from Composite) has more, so
+    those export the frame that was displayed.
+    """
+    if message.get("refinement") or message.get("intent") in MULTI_STEP_INTENTS:
+        return None
+    sf = st.session_state.sf
+    query = message["query"]
+    return lambda: sf.query_all_iter(query)
+
+# How result messages render, both for the new turn and in the history
+RESULT_RENDER_OPTIONS = {
+    "export_source": query_export_source,
+    "export_transform": format_records,
+    "show_raw_json": True,
+}
 
 def display_chat_history():
     """Display the chat history"""
-    if "chat_history" in st.session_state:
-        for message in st.session_state.chat_history:
-            with st.chat_message(message["role"]):
-                st.write(message["content"])
+    render_chat_history(**RESULT_RENDER_OPTIONS)
 
-def main():
-    st.title("🔮 Salesforce Gemini Assistant")
-    
-    # Initialize chat history if not exists
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    
-    # Initialize Gemini model
-    gemini_available = False
+def init_gemini_model():
+    """Put the process's Gemini model in the session, once, and return whether there is one"""
     if "gemini_model" not in st.session_state:
         try:
-            st.session_state.gemini_model = setup_gemini_model()
-            gemini_available = True
+            st.session_state.gemini_model = get_gemini_model()
             st.success("Connected to Gemini AI ✅")
         except Exception as e:
             st.error(f"Failed to initialize Gemini AI: {str(e)}")
             st.info("Switching to simple query mode without AI features.")
             st.session_state.gemini_model = None
             logger.error(f"Gemini initialization failed: {str(e)}")
-    else:
-        gemini_available = st.session_state.gemini_model is not None
+    return st.session_state.gemini_model is not None
+
+def main():
+    st.title("🔮 Salesforce Gemini Assistant")
+    
+    # Starts the process's warm-up on the first run; later runs just get it back
+    get_warmer()
+    
+    # Initialize chat history if not exists
+    get_chat_history()
     
     # Check authentication status
     authenticated = "sf" in st.session_state or st.session_state.get("authenticated", False)
     
+    # The login form doesn't wait for Gemini: the warm-up resolves the model while the user types.
+    # None means not known yet.
+    gemini_available = None
+    if authenticated or "gemini_model" in st.session_state or get_warmer().done("model"):
+        gemini_available = init_gemini_model()
+    
     if not authenticated:
         # Show a welcome message
         st.markdown("""
@@ -739,6 +489,7 @@ def main():
                     logger.info("Login successful, setting authenticated state")
                     st.session_state.authenticated = True  # Store in session state
                     st.success("Login successful!")
+                    gemini_available = init_gemini_model()
                     # Add welcome message to chat history
                     welcome_message = "Hello! I'm your Salesforce assistant. "
                     if gemini_available:
@@ -768,7 +519,7 @@ def main():
             """)
             
         # Add a helper section for Gemini API issues
-        if not gemini_available:
+        if gemini_available is False:
             with st.expander("How to fix Gemini API issues"):
                 st.markdown("""
                 ### Fixing Gemini API Key Issues:
@@ -833,8 +584,16 @@ def main():
             
             # Add clear chat button
             if st.button("Clear Chat History"):
-                st.session_state.chat_history = []
+                get_chat_history().clear()
                 st.rerun()
+            
+            # Memory held by this session's results, with shared frames split between sessions
+            usage = get_result_store().usage(get_chat_history().session_id)
+            st.caption(f"Session results: {format_bytes(usage['attributed_bytes'])} in {usage['frames']} frames ({usage['shared_frames']} shared)")
+            if PREFETCH_ENABLED:
+                prefetched = get_prefetcher().stats(session_scope())
+                st.caption(f"Prefetch: {prefetched['hits']} hits of {prefetched['fetched']} fetched, "
+                           f"{prefetched['wasted_calls']} of {prefetched['calls']} API calls wasted, {prefetched['budget_left']} left in budget")
         
         # Display chat history
         display_chat_history()
@@ -852,6 +611,10 @@ def main():
             
             # Process the query
             process_chatbot_query(user_input, st.session_state.gemini_model)
+        
+        # Progress of queries still running, which keeps going across reruns
+        if st.session_state.get("pending_jobs"):
+            show_pending_jobs()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""Import-time profile and cold-start budget for the Streamlit apps
+
+A fresh Streamlit process imports everything at the top of the app script
+before it can draw the first page. This runs just those module-level
+imports in a clean interpreter under ``python -X importtime`` and reports
+where the time goes: the app's own imports by cumulative time, and the
+packages that cost the most themselves. The app's code never runs, so no
+login, network call or log file is involved.
+
+Heavy optional subsystems are meant to load on first use: arcgis when the
+Location Intelligence tab geocodes or maps, altair when a chart is drawn,
+google.generativeai in the warm-up thread and simple_salesforce at login.
+--check fails (exit 1) if one of them is imported at startup anyway, or if
+the imports take longer than the app's budget, so a CI job can keep them
+lazy:
+
+    python import_profile.py                          # gemini_salesforce_app.py
+    python import_profile.py simple_app.py --top 30
+    python import_profile.py --check                  # every app against its budget
+
+Budgets are in milliseconds of import time, the best of --repeat runs.
+IMPORT_BUDGET_MS overrides them all.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Import time allowed before the first page, per app, in milliseconds. Each
+# takes 600-900 ms depending on the machine and its load, with streamlit and
+# pandas as the bulk of it, so the budgets leave room for a slow CI runner.
+# They catch a new heavy dependency; a lazy package imported up front again
+# (250-750 ms) is caught by the LAZY_PACKAGES check whatever the timing.
+COLD_START_BUDGETS = {
+    "gemini_salesforce_app.py": 1500,
+    "simple_app.py": 1500,
+    "chatbot_app.py": 1500,
+}
+
+# Packages no app should import before it needs them
+LAZY_PACKAGES = ("altair", "arcgis", "google.generativeai", "simple_salesforce")
+
+IMPORT_BUDGET_MS = os.getenv("IMPORT_BUDGET_MS")
+
+
+class ImportTiming:
+    """One line of -X importtime output: a module, its own time and its time including what it imported"""
+
+    __slots__ = ("module", "self_us", "cumulative_us", "depth")
+
+    def __init__(self, module, self_us, cumulative_us, depth):
+        self.module = module
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+    @property
+    def package(self):
+        return self.module.split(".")[0]
+
+
+def module_imports(path):
+    """Source of the import statements a script runs at module level, in order
+
+    Imports inside functions are the lazy ones and are left out; imports in
+    top-level try blocks (optional dependencies) are kept.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    statements = []
+
+    def collect(nodes):
+        for node in nodes:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                statements.append(ast.unparse(node))
+            elif isinstance(node, ast.Try):
+                collect(node.body)
+    collect(tree.body)
+    return statements
+
+
+def _driver(statements):
+    # Each import may fail on its own (an optional package that isn't installed) without hiding the rest
+    lines = []
+    for statement in statements:
+        lines += ["try:", f"    {statement}", "except ImportError as e:", "    print('missing', repr(str(e)))"]
+    return "\n".join(lines)
+
+
+def parse_importtime(output):
+    """ImportTiming per module from -X importtime's stderr"""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # One space after the bar, then two more per level of nesting
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        timings.append(ImportTiming(name.strip(), int(self_us), int(cumulative_us), depth))
+    return timings
+
+
+def _importtime(code, cwd, python):
+    env = {**os.environ, "PYTHONWARNINGS": "ignore", "PYTHONDONTWRITEBYTECODE": "1"}
+    return subprocess.run([python, "-X", "importtime", "-c", code], cwd=cwd, env=env, capture_output=True, text=True)
+
+
+def profile_imports(script, python=sys.executable):
+    """Import a script's module-level imports in a fresh interpreter; returns (timings, missing packages)
+
+    Modules the interpreter imports on its own before running anything
+    (site, encodings) are left out.
+    """
+    cwd = os.path.dirname(os.path.abspath(script))
+    startup = {t.module for t in parse_importtime(_importtime("pass", cwd, python).stderr)}
+    result = _importtime(_driver(module_imports(script)), cwd, python)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {script}'s dependencies failed:\n{result.stderr[-2000:]}")
+    missing = list(dict.fromkeys(line.split(" ", 1)[1] for line in result.stdout.splitlines() if line.startswith("missing ")))
+    return [t for t in parse_importtime(result.stderr) if t.module not in startup], missing
+
+
+def total_ms(timings):
+    """Time spent importing, the sum of the top-level imports' cumulative times"""
+    return sum(t.cumulative_us for t in timings if t.depth == 0) / 1000
+
+
+def lazy_violations(timings, lazy=LAZY_PACKAGES):
+    """Lazy packages that were imported anyway"""
+    modules = {t.module for t in timings}
+    return [name for name in lazy if name in modules]
+
+
+def best_profile(script, repeat=3):
+    """The fastest of several runs; the first one also pays for a cold disk cache"""
+    runs = [profile_imports(script) for _ in range(repeat)]
+    return min(runs, key=lambda run: total_ms(run[0]))
+
+
+def budget_for(script):
+    if IMPORT_BUDGET_MS:
+        return float(IMPORT_BUDGET_MS)
+    return COLD_START_BUDGETS.get(os.path.basename(script))
+
+
+def print_report(script, timings, missing, top=20):
+    print(f"{os.path.basename(script)}: {total_ms(timings):.0f} ms importing {len(timings)} modules")
+    for name in missing:
+        print(f"  not installed: {name}")
+
+    print(f"\n  {'cumulative':>10}  {'self':>8}  module-level import")
+    for timing in sorted((t for t in timings if t.depth == 0), key=lambda t: -t.cumulative_us)[:top]:
+        print(f"  {timing.cumulative_us / 1000:>8.1f}ms  {timing.self_us / 1000:>6.1f}ms  {timing.module}")
+
+    by_package = defaultdict(int)
+    for timing in timings:
+        by_package[timing.package] += timing.self_us
+    print(f"\n  {'self':>10}  package")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1000:>8.1f}ms  {package}")
+
+
+def check(script, timings):
+    """Problems with a profile: lazy packages imported at startup, or the budget exceeded"""
+    problems = [f"{name} is imported at startup; import it where it is used" for name in lazy_violations(timings)]
+    budget = budget_for(script)
+    if budget is not None and total_ms(timings) > budget:
+        problems.append(f"imports take {total_ms(timings):.0f} ms, over the {budget:.0f} ms budget")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Where a Streamlit app's cold start goes, by import")
+    parser.add_argument("scripts", nargs="*", help="app scripts (default gemini_salesforce_app.py, or every budgeted app with --check)")
+    parser.add_argument("--top", type=int, default=20, help="rows per table (default 20)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per app, best taken (default 3)")
+    parser.add_argument("--check", action="store_true", help="exit 1 if an app is over budget or imports a lazy package")
+    args = parser.parse_args(argv)
+
+    scripts = args.scripts or (list(COLD_START_BUDGETS) if args.check else ["gemini_salesforce_app.py"])
+    failed = False
+    for script in scripts:
+        path = script if os.path.exists(script) else os.path.join(APP_DIR, script)
+        timings, missing = best_profile(path, args.repeat)
+        if args.check:
+            problems = check(path, timings)
+            budget = budget_for(path)
+            limit = f" (budget {budget:.0f} ms)" if budget is not None else ""
+            print(f"{'FAIL' if problems else 'ok':>4}  {os.path.basename(path)}: {total_ms(timings):.0f} ms{limit}")
+            for problem in problems:
+                print(f"        {problem}")
+            failed |= bool(problems)
+        else:
+            print_report(path, timings, missing, args.top)
+            print()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+
+# Seconds a job may run before it is abandoned
+DEFAULT_JOB_TIMEOUT = 300
+
+# Finished jobs are kept this long so the session that submitted one can pick up the result
+JOB_RETENTION_SECONDS = 900
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled"""
+
+
+class JobTimedOut(JobCancelled):
+    """Raised inside a job when it has run past its timeout"""
+
+
+class Job:
+    """One unit of background work, updated by its worker thread and polled by the UI
+
+    The worker, a cancelling session and a poll that notices a timeout can all
+    try to finish the same job; _lock makes the first of them win, and makes
+    status, result and error change together.
+    """
+
+    def __init__(self, label, key=None, owner=None, timeout=DEFAULT_JOB_TIMEOUT):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.key = key
+        self.owner = owner
+        self.timeout = timeout
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a worker..."
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def deadline(self):
+        return self.submitted_at + self.timeout if self.timeout else None
+
+    def report(self, progress=None, message=None):
+        """Publish progress from inside the job; raises JobCancelled if the job should stop"""
+        if progress is not None:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        self.check()
+
+    def check(self):
+        """Cooperative cancellation point for long loops"""
+        if self._cancel.is_set():
+            raise JobCancelled(f"{self.label} was cancelled")
+        if self.deadline and time.time() > self.deadline:
+            raise JobTimedOut(f"{self.label} timed out after {self.timeout}s")
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False if timeout passed first"""
+        return self._done.wait(timeout)
+
+    def _start(self):
+        """Move a queued job to running; False if it was finished before a worker got to it"""
+        with self._lock:
+            if self.status != QUEUED:
+                return False
+            self.status = RUNNING
+            self.started_at = time.time()
+            return True
+
+    def _finish(self, status, result=None, error=None):
+        """Record the outcome; False if the job had already finished some other way"""
+        with self._lock:
+            if self.finished:
+                return False
+            if status == DONE:
+                self.progress = 1.0
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            # Set last, so anyone who sees a finished status also sees its result
+            self.status = status
+        self._done.set()
+        return True
+
+
+class JobRunner:
+    """Thread pool plus a registry of jobs, shared by every session in the process
+
+    Jobs are deduplicated by key while they are queued or running: submitting
+    the same key again (a double click, say) returns the existing job instead
+    of doing the work twice. A finished job is never handed out again, since
+    its result may be stale by then; keys should carry the session or
+    credential scope the result belongs to. Threads can't be killed, so cancellation
+    and timeouts are cooperative through Job.report/Job.check, and a job that
+    overruns its timeout is marked timed out as soon as anyone polls it.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+
+    def submit(self, fn, *args, label="job", key=None, owner=None, timeout=DEFAULT_JOB_TIMEOUT, **kwargs):
+        """Run fn(job, *args, **kwargs) in the background and return its Job"""
+        with self._lock:
+            self._prune()
+            if key is not None and key in self._by_key:
+                existing = self._jobs.get(self._by_key[key])
+                if existing and existing.status in (QUEUED, RUNNING):
+                    logger.info(f"Reusing job {existing.id} for {label}")
+                    return existing
+
+            job = Job(label, key=key, owner=owner, timeout=timeout)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._by_key[key] = job.id
+
+        # The job runs in the submitter's context, so it continues the submitter's trace
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        logger.info(f"Submitted job {job.id}: {label}")
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check()
+            if not job._start():
+                return
+            result = fn(job, *args, **kwargs)
+            job._finish(DONE, result=result)
+        except JobTimedOut as e:
+            job._finish(TIMED_OUT, error=str(e))
+        except JobCancelled as e:
+            job._finish(CANCELLED, error=str(e))
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.label}) failed: {str(e)}")
+            job._finish(FAILED, error=str(e))
+        finally:
+            self._release(job)
+            if job.started_at:
+                logger.info(f"Job {job.id} {job.status} after {time.time() - job.started_at:.2f}s")
+
+    def get(self, job_id):
+        """Look up a job, marking it timed out if it has overrun"""
+        job = self._jobs.get(job_id)
+        if job and not job.finished and job.deadline and time.time() > job.deadline:
+            job._cancel.set()
+            if job._finish(TIMED_OUT, error=f"{job.label} timed out after {job.timeout}s"):
+                self._release(job)
+        return job
+
+    def cancel(self, job_id):
+        """Ask a job to stop; it is marked cancelled straight away"""
+        job = self._jobs.get(job_id)
+        if job and not job.finished:
+            job._cancel.set()
+            if job._finish(CANCELLED, error=f"{job.label} was cancelled"):
+                self._release(job)
+
+    def _release(self, job):
+        """Free a finished job's key, so the next submit with it does the work again"""
+        with self._lock:
+            if job.key is not None and self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+
+    def jobs_for(self, owner):
+        """Every retained job submitted by owner"""
+        return [job for job in list(self._jobs.values()) if job.owner == owner]
+
+    def _prune(self):
+        """Forget finished jobs past their retention window (caller holds the lock)"""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) == job_id:
+                    del self._by_key[job.key]
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_runner():
+    """The process-wide JobRunner"""
+    return JobRunner()
+
+
+def track_job(job):
+    """Remember a job in this session so its progress is polled until it finishes"""
+    pending = st.session_state.setdefault("pending_jobs", [])
+    if job.id not in pending:
+        pending.append(job.id)
+
+
+def poll_pending_jobs(deliver, render_progress=None):
+    """Show progress of this session's jobs and hand finished ones to deliver(job)
+
+    Returns True if any job finished during this poll.
+    """
+    runner = get_job_runner()
+    finished = False
+    for job_id in list(st.session_state.get("pending_jobs", [])):
+        job = runner.get(job_id)
+        if job is None or job.finished:
+            st.session_state.pending_jobs.remove(job_id)
+            if job is not None:
+                deliver(job)
+                finished = True
+            continue
+
+        if render_progress:
+            render_progress(job)
+        else:
+            st.progress(job.progress, text=f"{job.label}: {job.message}")
+        if st.button("Cancel", key=f"cancel_{job_id}"):
+            runner.cancel(job_id)
+    return finished
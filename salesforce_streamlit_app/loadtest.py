@@ -0,0 +1,330 @@
+"""Load test: many concurrent chat users against local Salesforce and Gemini stand-ins
+
+    python loadtest.py                                        # 10 to 200 users, 30 s per step
+    python loadtest.py --users 50,100,200,400 --think 10 --workers 16
+    python loadtest.py --mix preset=0.2,natural=0.5,soql=0.3 --sf-error-rate 0.01
+    python loadtest.py --output curve.json
+    python loadtest.py --baseline curve.json                  # exits 1 on a scaling regression
+
+Each virtual user asks a question, waits for the answer, thinks for a
+while (exponentially distributed, --think seconds on average) and asks
+again. Questions are drawn from a mix of preset questions, natural-language
+prompts and custom SOQL, taken from salesforce_data.log the way replay.py
+takes them. Every turn is a job on one shared JobRunner, as in the app, so
+--workers is the deployment setting being sized and the time a turn waits
+for a free worker is reported as queueing delay.
+
+The user count steps up through --users, holding each level for
+--duration seconds. For each step the report gives throughput, latency
+percentiles, queueing delay, error rate and the latency of each stage
+of a turn, taken from its trace spans. Together the steps form the
+saturation curve. The capacity estimate is the largest user count before
+p95 latency doubles from the first step or errors pass 1%.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from benchmarks import logged_queries
+from chatbot_engine import answer_query
+from jobs import DONE, JOB_WORKERS, JobRunner
+from replay import PRESET_QUESTIONS, load_workload, logged_prompts, stand_ins
+from tracing import configure_tracing, flush_spans, get_tracer, span
+
+DEFAULT_USERS = "10,25,50,100,200"
+DEFAULT_MIX = "preset=0.4,natural=0.4,soql=0.2"
+
+# Stages of a turn, in the order they happen; spans not listed here are reported after them
+STAGES = ["queue", "resolve_intent", "gemini.generate_content", "query_advisor", "salesforce.query", "salesforce.page", "salesforce.composite", "build_frame", "chat_turn"]
+
+# Relative slowdown at a step, or drop in its throughput, reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Scaling stops when p95 latency reaches this multiple of the first step's, or errors this rate
+SATURATION_LATENCY = 2.0
+SATURATION_ERRORS = 0.01
+
+
+class StageRecorder:
+    """Trace exporter that keeps span durations by name, for per-stage latency"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    def export(self, spans):
+        with self._lock:
+            for finished in spans:
+                self.durations[finished.name].append((finished.end_ns - finished.start_ns) / 1e6)
+
+    def take(self):
+        """Durations recorded since the last call"""
+        with self._lock:
+            durations, self.durations = self.durations, defaultdict(list)
+        return durations
+
+
+class WorkloadMix:
+    """Weighted categories of prompts to draw questions from"""
+
+    def __init__(self, prompts, weights):
+        self.prompts = {name: items for name, items in prompts.items() if items and weights.get(name, 0) > 0}
+        if not self.prompts:
+            raise ValueError("The workload mix has no prompts to draw from")
+        self.names = list(self.prompts)
+        self.weights = [weights[name] for name in self.names]
+
+    @classmethod
+    def from_spec(cls, spec, prompts):
+        """Build from "preset=0.4,natural=0.4,soql=0.2" """
+        weights = {}
+        for part in spec.split(","):
+            name, _, weight = part.partition("=")
+            weights[name.strip()] = float(weight or 1)
+        unknown = set(weights) - set(prompts)
+        if unknown:
+            raise ValueError(f"Unknown workload categories: {', '.join(sorted(unknown))}. Choose from: {', '.join(prompts)}")
+        return cls(prompts, weights)
+
+    def pick(self, rng):
+        name = rng.choices(self.names, self.weights)[0]
+        return name, rng.choice(self.prompts[name])
+
+
+def workload_categories(log_path="salesforce_data.log"):
+    """Preset questions, natural-language prompts and custom SOQL from the log"""
+    try:
+        prompts, queries = logged_prompts(log_path), logged_queries(log_path)
+    except OSError:
+        prompts, queries = [], []
+    natural = [p for p in prompts if not p.upper().startswith("SELECT")]
+    soql = queries + [p for p in prompts if p.upper().startswith("SELECT")]
+    return {"preset": list(PRESET_QUESTIONS), "natural": natural, "soql": soql}
+
+
+def load_turn(job, prompt, model, sf):
+    """One chat turn, traced as run_chat_turn traces it"""
+    with span("chat_turn"):
+        return answer_query(prompt, model, sf, progress=job.report)
+
+
+def summarize(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {f"p{p}": round(float(np.percentile(values, p)), 1) for p in (50, 95, 99)}
+
+
+def run_step(users, runner, mix, model, sf, duration, think, timeout, recorder, seed=0):
+    """Hold `users` virtual users for `duration` seconds and return the step's results"""
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def virtual_user(index):
+        rng = random.Random(seed * 100_003 + index)
+        # Users arrive spread over one think time rather than all at once
+        time.sleep(min(rng.uniform(0, think), max(deadline - time.monotonic(), 0)))
+        while time.monotonic() < deadline:
+            category, prompt = mix.pick(rng)
+            job = runner.submit(load_turn, prompt, model, sf, label="Load test turn", timeout=timeout)
+            if not job.wait(timeout):
+                # Marks the job timed out; its worker stops at its next progress report
+                runner.get(job.id)
+            with results_lock:
+                results.append((category, job))
+            if think:
+                time.sleep(min(rng.expovariate(1 / think), max(deadline - time.monotonic(), 0)))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    flush_spans()
+
+    jobs = [job for _, job in results]
+    failed = [job for job in jobs if job.status != DONE]
+    stages = recorder.take()
+    stages["queue"] = [((job.started_at or job.finished_at) - job.submitted_at) * 1000 for job in jobs]
+    by_category = Counter(category for category, _ in results)
+    return {
+        "users": users,
+        "turns": len(jobs),
+        "throughput_per_s": round(len(jobs) / elapsed, 2),
+        "latency_ms": summarize([(job.finished_at - job.submitted_at) * 1000 for job in jobs]),
+        "queue_ms": summarize(stages["queue"]),
+        "error_rate": round(len(failed) / len(jobs), 4) if jobs else 0.0,
+        "errors": dict(Counter(f"{job.status}: {(job.error or '')[:80]}" for job in failed).most_common(5)),
+        "mix": dict(by_category),
+        "stages_ms": {name: summarize(values) for name, values in sorted(stages.items(), key=lambda item: _stage_order(item[0]))},
+    }
+
+
+def _stage_order(name):
+    return (STAGES.index(name), name) if name in STAGES else (len(STAGES), name)
+
+
+def capacity(steps):
+    """The largest user count before p95 latency doubles from the first step or errors pass the limit"""
+    if not steps or not steps[0]["latency_ms"]:
+        return None
+    reference = steps[0]["latency_ms"]["p95"]
+    supported = None
+    for step in steps:
+        if not step["latency_ms"] or step["latency_ms"]["p95"] > reference * SATURATION_LATENCY or step["error_rate"] > SATURATION_ERRORS:
+            break
+        supported = step["users"]
+    return supported
+
+
+def run_load_test(user_steps, mix, duration=30.0, think=5.0, workers=JOB_WORKERS, timeout=60.0, rows=2000, page_size=2000,
+                  sf_latency=0.08, llm_latency=0.4, sf_error_rate=0.0, cache=False, seed=0, progress=print):
+    """Step through user counts and return the report: settings, one entry per step and the capacity estimate"""
+    recorder = StageRecorder()
+    previous = get_tracer()
+    # Every turn is traced, for its stage timings
+    configure_tracing(recorder, 1.0)
+    try:
+        with stand_ins(rows, page_size, sf_latency, llm_latency, cache, pool_size=workers, sf_error_rate=sf_error_rate) as (server, sf, model):
+            runner = JobRunner(max_workers=workers)
+            steps = []
+            for i, users in enumerate(user_steps):
+                server.calls.clear()
+                step = run_step(users, runner, mix, model, sf, duration, think, timeout, recorder, seed + i)
+                step["api_calls"] = dict(server.calls)
+                steps.append(step)
+                if progress:
+                    progress(format_step(step))
+    finally:
+        configure_tracing(previous.batch.exporter if previous.batch else None, previous.sample_rate)
+    return {
+        "settings": {"duration": duration, "think": think, "workers": workers, "timeout": timeout, "rows": rows, "page_size": page_size,
+                     "sf_latency": sf_latency, "llm_latency": llm_latency, "sf_error_rate": sf_error_rate, "cache": cache,
+                     "mix": dict(zip(mix.names, mix.weights))},
+        "steps": steps,
+        "capacity_users": capacity(steps),
+    }
+
+
+def format_step(step):
+    latency, queue = step["latency_ms"] or {"p50": 0, "p95": 0, "p99": 0}, step["queue_ms"] or {"p50": 0, "p95": 0}
+    return (f"{step['users']:>6} {step['turns']:>7} {step['throughput_per_s']:>8.2f} {latency['p50']:>9.0f} {latency['p95']:>9.0f} {latency['p99']:>9.0f}"
+            f" {queue['p50']:>9.0f} {queue['p95']:>9.0f} {step['error_rate'] * 100:>7.1f}%")
+
+
+HEADER = f"{'users':>6} {'turns':>7} {'turns/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queue p50':>9} {'queue p95':>9} {'errors':>8}"
+
+
+def print_report(report):
+    settings = report["settings"]
+    print(f"\n{settings['workers']} workers, {settings['think']:g} s think time, Salesforce {settings['sf_latency'] * 1000:.0f} ms, "
+          f"LLM {settings['llm_latency'] * 1000:.0f} ms, {settings['rows']:,} rows per object")
+    print(HEADER)
+    for step in report["steps"]:
+        print(format_step(step))
+
+    print("\nLatency by stage, p50 / p95 ms")
+    names = list(dict.fromkeys(name for step in report["steps"] for name in step["stages_ms"]))
+    print(f"{'stage':>24} " + " ".join(f"{step['users']:>13}" for step in report["steps"]))
+    for name in names:
+        cells = []
+        for step in report["steps"]:
+            stage = step["stages_ms"].get(name)
+            cells.append(f"{stage['p50']:>6.0f} / {stage['p95']:<4.0f}" if stage else f"{'-':>13}")
+        print(f"{name:>24} " + " ".join(cells))
+
+    for step in report["steps"]:
+        for error, count in step["errors"].items():
+            print(f"{step['users']:>6} users: {count} x {error}")
+    supported = report["capacity_users"]
+    if supported is None:
+        print("\nEven the first step was saturated; try fewer users or more workers")
+    elif supported == report["steps"][-1]["users"]:
+        print(f"\nNo saturation up to {supported} users; raise --users to find the limit")
+    else:
+        print(f"\nCapacity: about {supported} users before p95 latency doubles or errors pass {SATURATION_ERRORS:.0%}")
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Scaling regressions against a saved report, step by step for the user counts both have"""
+    regressions = []
+    before_steps = {step["users"]: step for step in baseline["steps"]}
+    for step in report["steps"]:
+        before = before_steps.get(step["users"])
+        if before is None:
+            continue
+        p95, p95_before = step["latency_ms"].get("p95"), before["latency_ms"].get("p95")
+        if p95 and p95_before and p95 > p95_before * (1 + tolerance):
+            regressions.append(f"{step['users']} users: p95 {p95_before:.0f} -> {p95:.0f} ms")
+        if step["throughput_per_s"] < before["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{step['users']} users: throughput {before['throughput_per_s']:.2f} -> {step['throughput_per_s']:.2f} turns/s")
+        if step["error_rate"] > before["error_rate"] + SATURATION_ERRORS:
+            regressions.append(f"{step['users']} users: error rate {before['error_rate']:.1%} -> {step['error_rate']:.1%}")
+    if baseline.get("capacity_users") and (report["capacity_users"] or 0) < baseline["capacity_users"]:
+        regressions.append(f"capacity {baseline['capacity_users']} -> {report['capacity_users']} users")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the chat engine with concurrent virtual users against local stand-ins")
+    parser.add_argument("--users", default=DEFAULT_USERS, help=f"comma-separated user counts to step through (default {DEFAULT_USERS})")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step (default 30)")
+    parser.add_argument("--think", type=float, default=5.0, help="mean think time between a user's questions, in seconds (default 5)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"workload mix (default {DEFAULT_MIX})")
+    parser.add_argument("--workload", help="file of prompts to use as the natural category instead of the logged ones")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help=f"job workers, as JOB_WORKERS sets for the app (default {JOB_WORKERS})")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds before a turn counts as timed out (default 60)")
+    parser.add_argument("--rows", type=int, default=2000, help="records per object (default 2000)")
+    parser.add_argument("--page-size", type=int, default=2000, help="records per query page (default 2000)")
+    parser.add_argument("--sf-latency", type=float, default=0.08, help="seconds per Salesforce request (default 0.08)")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds per LLM call (default 0.4)")
+    parser.add_argument("--sf-error-rate", type=float, default=0.0, help="fraction of Salesforce requests answered 503 (default 0)")
+    parser.add_argument("--cache", action="store_true", help="keep the in-process caches on")
+    parser.add_argument("--seed", type=int, default=0, help="seed for think times and question choice")
+    parser.add_argument("--output", metavar="FILE", help="write the report as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a saved report and exit 1 on a scaling regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative slowdown allowed against the baseline (default 0.2)")
+    args = parser.parse_args(argv)
+
+    # Failed turns are counted in the report; logging each one would bury the table
+    logging.getLogger().setLevel(logging.CRITICAL)
+    categories = workload_categories()
+    if args.workload:
+        categories["natural"] = load_workload(args.workload)
+    mix = WorkloadMix.from_spec(args.mix, categories)
+    user_steps = [int(n) for n in args.users.split(",")]
+
+    print(HEADER)
+    report = run_load_test(user_steps, mix, duration=args.duration, think=args.think, workers=args.workers, timeout=args.timeout,
+                           rows=args.rows, page_size=args.page_size, sf_latency=args.sf_latency, llm_latency=args.llm_latency,
+                           sf_error_rate=args.sf_error_rate, cache=args.cache, seed=args.seed)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Scaling regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No scaling regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""Non-blocking, structured logging shared by the apps and the query service
+
+setup_logging replaces the per-script logging.basicConfig calls. Records go
+through a QueueHandler to a QueueListener thread, so a request thread only
+pays for building the record; formatting, JSON encoding and file I/O
+happen in the background. The log file gets one JSON object per line,
+with the active trace and span ids when the record was logged inside a
+traced chat turn. It is rotated by size (or by time with LOG_ROTATE_WHEN)
+and old files are gzip-compressed. The console keeps the familiar
+one-line text format.
+
+Before a record is queued, two filters keep log volume bounded under load:
+- repeats of the same warning or error beyond a small burst per period are
+  dropped, and the next one to get through says how many were suppressed;
+- with LOG_DEBUG_SAMPLE_RATE below 1, only that fraction of DEBUG records
+  is kept.
+
+Settings, all from the environment:
+
+    LOG_LEVEL               INFO
+    LOG_FILE_FORMAT         json (default) or text
+    LOG_MAX_BYTES           rotate past this size (default 10 MB)
+    LOG_ROTATE_WHEN         rotate on a schedule instead, e.g. midnight or H
+    LOG_BACKUP_COUNT        rotated files kept (default 5)
+    LOG_COMPRESS            gzip rotated files (default 1)
+    LOG_RATE_LIMIT          burst/seconds for repeated warnings and errors (default 5/60)
+    LOG_DEBUG_SAMPLE_RATE   fraction of DEBUG records kept (default 1.0)
+    LOG_MAX_TRACEBACK_LINES longer tracebacks keep their head and tail (default 60)
+"""
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from tracing import current_span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE_FORMAT = os.getenv("LOG_FILE_FORMAT", "json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") not in ("0", "false", "no")
+LOG_RATE_LIMIT = os.getenv("LOG_RATE_LIMIT", "5/60")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+LOG_MAX_TRACEBACK_LINES = int(os.getenv("LOG_MAX_TRACEBACK_LINES", "60"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Distinct repeated messages tracked by the rate limiter before the oldest is forgotten
+MAX_RATE_LIMIT_KEYS = 1000
+
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def truncate_traceback(text, max_lines=LOG_MAX_TRACEBACK_LINES):
+    """Keep the start and end of a long traceback, where the call site and the error are"""
+    lines = text.splitlines()
+    if max_lines <= 0 or len(lines) <= max_lines:
+        return text
+    head, tail = max_lines // 2, max_lines - max_lines // 2
+    return "\n".join(lines[:head] + [f"  ... {len(lines) - max_lines} lines omitted ..."] + lines[-tail:])
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `burst` copies of the same warning or error through per `period` seconds
+
+    Messages are the same when they come from the same logger at the same
+    level with the same text. The first copy let through after a quiet
+    period carries the number suppressed before it as ``suppressed``.
+    """
+
+    def __init__(self, burst=5, period=60.0, level=logging.WARNING, max_keys=MAX_RATE_LIMIT_KEYS):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.level = level
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build from "burst/seconds", e.g. "5/60"; None for an empty spec or "off" """
+        if not spec or spec == "off":
+            return None
+        burst, _, period = spec.partition("/")
+        return cls(int(burst), float(period or 60))
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                self._windows[key] = [now, 1, 0]
+                self._windows.move_to_end(key)
+                while len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            self.suppressed += 1
+            return False
+
+
+class DebugSampleFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records; higher levels always pass"""
+
+    def __init__(self, rate=LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, trace ids, extras and any exception"""
+
+    def format(self, record):
+        # RotatingFileHandler formats each record once to check the size and again to write it
+        cached = record.__dict__.get("_json")
+        if cached is not None:
+            return cached
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = truncate_traceback(self.formatException(record.exc_info))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if orjson is not None:
+            text = orjson.dumps(entry, default=str).decode("utf-8")
+        else:
+            text = json.dumps(entry, default=str, ensure_ascii=False)
+        record._json = text
+        return text
+
+
+class TextFormatter(logging.Formatter):
+    """The apps' original text format, noting suppressed repeats"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that does the minimum on the calling thread
+
+    The message is rendered now (its arguments may change once the call
+    returns) and so is any traceback (it holds live frames); the trace ids
+    are read here because they live in this thread's context. Everything
+    else is left to the listener thread.
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = truncate_traceback(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        active = current_span()
+        if active is not None and active.context is not None:
+            record.trace_id = f"{active.context.trace_id:032x}"
+            record.span_id = f"{active.context.span_id:016x}"
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def file_handler(path, max_bytes=LOG_MAX_BYTES, when=LOG_ROTATE_WHEN, backup_count=LOG_BACKUP_COUNT, compress=LOG_COMPRESS):
+    """Rotating file handler, by size or on a schedule, gzipping what it rotates out"""
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding="utf-8", delay=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+    if compress:
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter() if LOG_FILE_FORMAT == "json" else TextFormatter())
+    return handler
+
+
+def background_handler(handlers, rate_limit=LOG_RATE_LIMIT, debug_sample_rate=LOG_DEBUG_SAMPLE_RATE):
+    """A queue handler with the volume filters, plus its started listener writing to handlers"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = BackgroundQueueHandler(log_queue)
+    limiter = RateLimitFilter.from_spec(rate_limit)
+    if limiter is not None:
+        queue_handler.addFilter(limiter)
+    if debug_sample_rate < 1.0:
+        queue_handler.addFilter(DebugSampleFilter(debug_sample_rate))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return queue_handler, listener
+
+
+_listener = None
+_dedicated = {}
+_setup_lock = threading.Lock()
+
+
+def setup_logging(log_file=None, level=LOG_LEVEL, console=True):
+    """Send every logger through the background writer to log_file and the console
+
+    Safe to call on every Streamlit rerun: only the first call in a process
+    configures anything, and later ones return the same listener.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        handlers = []
+        if log_file:
+            handlers.append(file_handler(log_file))
+        if console:
+            stream = logging.StreamHandler()
+            stream.setFormatter(TextFormatter())
+            handlers.append(stream)
+
+        queue_handler, _listener = background_handler(handlers)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        # Whatever is still queued at exit gets written
+        atexit.register(_listener.stop)
+        return _listener
+
+
+def dedicated_logger(name, log_file, level=logging.INFO):
+    """A logger that writes only to its own rotating JSON-lines file, from a background thread
+
+    For records kept for later analysis rather than for reading alongside
+    the app log: they don't propagate to the root logger or the console,
+    and the file is JSON whatever LOG_FILE_FORMAT says. Structured fields go
+    in through extra=. Later calls for the same name return the same logger.
+    """
+    with _setup_lock:
+        logger = logging.getLogger(name)
+        if name in _dedicated:
+            return logger
+
+        handler = file_handler(log_file)
+        handler.setFormatter(JsonFormatter())
+        # Every record is kept: no repeat limiting or sampling
+        queue_handler, listener = background_handler([handler], rate_limit="off", debug_sample_rate=1.0)
+        logger.addHandler(queue_handler)
+        logger.setLevel(level)
+        logger.propagate = False
+        _dedicated[name] = listener
+        atexit.register(listener.stop)
+        return logger
@@ -0,0 +1,128 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Billing address fields joined into a single geocodable string
+ADDRESS_FIELDS = ['BillingStreet', 'BillingCity', 'BillingState', 'BillingPostalCode', 'BillingCountry']
+
+# Above this many points the map gets clustered features instead of raw points
+MAX_MAP_FEATURES = 2000
+
+WGS84 = {'wkid': 4326}
+
+
+def build_full_address(df, fields=ADDRESS_FIELDS):
+    """Join the billing address columns into one string per row, skipping empty parts"""
+    parts = [df[f].fillna('').astype(str).str.strip() for f in fields if f in df.columns]
+    if not parts:
+        return pd.Series('', index=df.index)
+
+    combined = parts[0].str.cat(parts[1:], sep=', ') if len(parts) > 1 else parts[0]
+
+    # Collapse the separators left behind by empty parts
+    return combined.str.replace(r'(?:, ){2,}', ', ', regex=True).str.strip(', ')
+
+
+def extract_coordinates(df, location_field='geocoded_location'):
+    """Return x/y float arrays for each row, NaN where the row has no geocode"""
+    if 'longitude' in df.columns and 'latitude' in df.columns:
+        x = pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype=float)
+        return x, y
+
+    # Geocode results are dicts, so unpack them once into flat arrays
+    points = [
+        loc['location'] if isinstance(loc, dict) and 'location' in loc else None
+        for loc in df[location_field].tolist()
+    ]
+    x = np.fromiter((p['x'] if p else np.nan for p in points), dtype=float, count=len(points))
+    y = np.fromiter((p['y'] if p else np.nan for p in points), dtype=float, count=len(points))
+    return x, y
+
+
+def cluster_points(x, y, max_points=MAX_MAP_FEATURES):
+    """Bin points into a regular grid with at most max_points cells
+
+    Returns (cell_x, cell_y, counts, first_index) where the cell coordinates are
+    the mean position of the points in each cell and first_index points back at
+    one member row, which is used as-is for cells holding a single point.
+    """
+    cells = max(1, int(np.sqrt(max_points)))
+    x_min, x_max = x.min(), x.max()
+    y_min, y_max = y.min(), y.max()
+    x_span = (x_max - x_min) or 1.0
+    y_span = (y_max - y_min) or 1.0
+
+    gx = np.minimum(((x - x_min) / x_span * cells).astype(np.int64), cells - 1)
+    gy = np.minimum(((y - y_min) / y_span * cells).astype(np.int64), cells - 1)
+    keys = gy * cells + gx
+
+    _, first_index, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    cell_x = np.bincount(inverse, weights=x) / counts
+    cell_y = np.bincount(inverse, weights=y) / counts
+    return cell_x, cell_y, counts, first_index
+
+
+def _point_features(attributes, x, y):
+    """Zip attribute records with x/y arrays into esri point features"""
+    return [
+        {'geometry': {'x': px, 'y': py, 'spatialReference': WGS84}, 'attributes': attrs}
+        for px, py, attrs in zip(x.tolist(), y.tolist(), attributes)
+    ]
+
+
+def build_features(df, location_field='geocoded_location', max_points=MAX_MAP_FEATURES):
+    """Build esri point features column-wise, clustering when there are too many points"""
+    x, y = extract_coordinates(df, location_field)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if not valid.any():
+        return []
+
+    df = df.loc[valid]
+    x, y = x[valid], y[valid]
+
+    # Stringify every attribute column in one pass instead of per row
+    drop = [c for c in (location_field, 'longitude', 'latitude') if c in df.columns]
+    attrs = df.drop(columns=drop)
+    # Blank out missing values before stringifying, or they come through as "nan" and "None"
+    attrs = attrs.astype(object).where(attrs.notna(), '').astype(str)
+    attrs['display_name'] = df['Name'].fillna('Unknown').astype(str) if 'Name' in df.columns else 'Unknown'
+
+    if len(df) <= max_points:
+        return _point_features(attrs.to_dict('records'), x, y)
+
+    cell_x, cell_y, counts, first_index = cluster_points(x, y, max_points)
+    logger.info(f"Clustered {len(df)} map points into {len(counts)} features")
+
+    singles = counts == 1
+    features = _point_features(attrs.iloc[first_index[singles]].to_dict('records'), cell_x[singles], cell_y[singles])
+
+    cluster_counts = counts[~singles].tolist()
+    cluster_attrs = [
+        {'display_name': f"{count} accounts", 'point_count': str(count), 'cluster': 'true'}
+        for count in cluster_counts
+    ]
+    features.extend(_point_features(cluster_attrs, cell_x[~singles], cell_y[~singles]))
+    return features
+
+
+def build_feature_collection(features, name='Accounts'):
+    """Wrap point features in the featureCollection layout WebMap.add_layer expects"""
+    return {
+        'featureCollection': {
+            'layers': [{
+                'layerDefinition': {
+                    'name': name,
+                    'geometryType': 'esriGeometryPoint'
+                },
+                'featureSet': {
+                    'features': features,
+                    'geometryType': 'esriGeometryPoint'
+                }
+            }]
+        }
+    }
+
@@ -0,0 +1,137 @@
+import logging
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from map_features import build_features, extract_coordinates
+
+logger = logging.getLogger(__name__)
+
+# Deepest zoom level the index is built at; tile x/y must fit in 16 bits for the Morton keys
+MAX_ZOOM = 16
+
+# Tiles holding more points than this are returned as clusters
+POINTS_PER_TILE = 100
+
+# Never return more tiles than this for one viewport
+MAX_VIEWPORT_TILES = 64
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+
+
+def lonlat_to_pixel(lon, lat, zoom):
+    """Project lon/lat (scalars or arrays) to Web Mercator world pixels at a zoom level"""
+    world = TILE_SIZE * 2 ** zoom
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    px = (np.asarray(lon, dtype=float) + 180.0) / 360.0 * world
+    py = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2.0 * world
+    return px, py
+
+
+def pixel_to_lonlat(px, py, zoom):
+    """Inverse of lonlat_to_pixel"""
+    world = TILE_SIZE * 2 ** zoom
+    lon = px / world * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * py / world))))
+    return lon, lat
+
+
+def viewport_bbox(center_lon, center_lat, zoom, width=1000, height=600):
+    """Return (min_lon, min_lat, max_lon, max_lat) for a map of width x height pixels"""
+    cx, cy = lonlat_to_pixel(center_lon, center_lat, zoom)
+    min_lon, max_lat = pixel_to_lonlat(cx - width / 2, cy - height / 2, zoom)
+    max_lon, min_lat = pixel_to_lonlat(cx + width / 2, cy + height / 2, zoom)
+    return max(min_lon, -180.0), max(min_lat, -MAX_LATITUDE), min(max_lon, 180.0), min(max_lat, MAX_LATITUDE)
+
+
+def _spread_bits(v):
+    """Spread the low 16 bits of v so there is a zero bit between each of them"""
+    v = v.astype(np.uint64) & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def morton_keys(tx, ty):
+    """Interleave tile x/y into Z-order keys so every quadtree tile is a contiguous range"""
+    return _spread_bits(np.asarray(tx)) | (_spread_bits(np.asarray(ty)) << 1)
+
+
+class MapTileIndex:
+    """Quadtree tile index over geocoded accounts
+
+    Points are sorted once by their Morton key at MAX_ZOOM, so the points in any
+    XYZ tile at any zoom are a contiguous slice found with a binary search.
+    Tiles are built lazily and kept in an LRU cache, and dense tiles come back
+    as clusters so a viewport never carries more than a few thousand features.
+    """
+
+    def __init__(self, df, location_field='geocoded_location', points_per_tile=POINTS_PER_TILE, cache_size=1024):
+        x, y = extract_coordinates(df, location_field)
+        valid = ~(np.isnan(x) | np.isnan(y))
+
+        frame = df.loc[valid].drop(columns=[location_field], errors='ignore')
+        frame = frame.assign(longitude=x[valid], latitude=y[valid])
+
+        px, py = lonlat_to_pixel(frame['longitude'].to_numpy(), frame['latitude'].to_numpy(), MAX_ZOOM)
+        last_tile = 2 ** MAX_ZOOM - 1
+        tx = np.clip((px // TILE_SIZE).astype(np.int64), 0, last_tile)
+        ty = np.clip((py // TILE_SIZE).astype(np.int64), 0, last_tile)
+        keys = morton_keys(tx, ty)
+
+        order = np.argsort(keys, kind='stable')
+        self.frame = frame.iloc[order].reset_index(drop=True)
+        self.keys = keys[order]
+        self.points_per_tile = points_per_tile
+        self.get_tile = lru_cache(maxsize=cache_size)(self._build_tile)
+        logger.info(f"Built map tile index over {len(self.frame)} points")
+
+    def __len__(self):
+        return len(self.frame)
+
+    def tile_slice(self, zoom, tx, ty):
+        """Row range of the sorted frame that falls inside tile (zoom, tx, ty)"""
+        shift = np.uint64(2 * (MAX_ZOOM - zoom))
+        prefix = morton_keys(np.array([tx]), np.array([ty]))[0]
+        lo = np.searchsorted(self.keys, prefix << shift, side='left')
+        hi = np.searchsorted(self.keys, (prefix + np.uint64(1)) << shift, side='left')
+        return int(lo), int(hi)
+
+    def _build_tile(self, zoom, tx, ty):
+        """Features for one tile, raw points when sparse and clusters when dense"""
+        lo, hi = self.tile_slice(zoom, tx, ty)
+        if lo == hi:
+            return []
+        return build_features(self.frame.iloc[lo:hi], max_points=self.points_per_tile)
+
+    def tiles_for_bbox(self, bbox, zoom):
+        """XYZ tile coordinates covering a lon/lat bounding box"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        last_tile = 2 ** zoom - 1
+        left, top = lonlat_to_pixel(min_lon, max_lat, zoom)
+        right, bottom = lonlat_to_pixel(max_lon, min_lat, zoom)
+        x0, x1 = max(int(left // TILE_SIZE), 0), min(int(right // TILE_SIZE), last_tile)
+        y0, y1 = max(int(top // TILE_SIZE), 0), min(int(bottom // TILE_SIZE), last_tile)
+        return [(zoom, tx, ty) for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1)]
+
+    def query(self, bbox, zoom):
+        """Features inside a viewport, zooming out until it fits in MAX_VIEWPORT_TILES tiles"""
+        zoom = int(min(max(zoom, 0), MAX_ZOOM))
+        tiles = self.tiles_for_bbox(bbox, zoom)
+        while len(tiles) > MAX_VIEWPORT_TILES and zoom > 0:
+            zoom -= 1
+            tiles = self.tiles_for_bbox(bbox, zoom)
+
+        features = []
+        for tile in tiles:
+            features.extend(self.get_tile(*tile))
+        return features
+
+    def bounds(self):
+        """Lon/lat bounding box of every indexed point"""
+        lon, lat = self.frame['longitude'], self.frame['latitude']
+        return float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())
@@ -0,0 +1,783 @@
+"""Local stand-ins for Salesforce and Gemini, for benchmarks and offline runs
+
+MockSalesforce answers SOQL with generated records shaped like the JSON
+dumps in this directory, paged the way the REST API pages them, after a
+configurable latency. FakeLLM answers the chatbot prompt with the rule-based
+fallback's JSON after its own latency. MockSalesforce also emulates the
+Composite API endpoint, references between sub-requests included, so a
+multi-step lookup costs one simulated round-trip, and the write side:
+sObject Collections requests and Bulk API 2.0 ingest jobs, with the same
+per-record errors Salesforce reports for missing names and malformed ids.
+Its explain endpoint plans a table scan for filters on unindexed or
+relationship fields, the way Salesforce's optimizer does. MockRedisServer speaks enough of the
+Redis protocol for cache.RedisBackend, and MockOTLPCollector accepts the
+OTLP/HTTP JSON trace exports tracing.OTLPExporter sends.
+
+MockSalesforceServer puts MockSalesforce behind a local HTTP server that
+speaks the REST endpoints and the SOAP login, so the real simple_salesforce
+client, its HTTP stack and JSON decoding included, can run against it.
+Built with shapes=load_shapes(), MockSalesforce models records on the
+salesforce_*_data.json dumps and returns only the fields a query selects.
+"""
+import copy
+import csv
+import fnmatch
+import glob
+import io
+import json
+import os
+import random
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from chatbot_engine import fallback_query_processing
+
+# Records per page, as returned by the REST query endpoint
+PAGE_SIZE = 2000
+
+# Rows returned for queries without a LIMIT
+DEFAULT_ROWS = 500
+
+_REFERENCE = re.compile(r"@\{([^}]+)\}")
+_PATH_PART = re.compile(r"(\w+)(?:\[(\d+)\])?")
+
+# Fields the mock optimizer treats as indexed
+INDEXED_FIELDS = {"id", "name", "createddate", "lastmodifieddate", "systemmodstamp", "ownerid", "recordtypeid", "accountid", "email"}
+
+_SELECT = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\s", re.IGNORECASE | re.DOTALL)
+
+_FILTER = re.compile(r"([A-Za-z_][\w.]*)\s*(?:=|!=|<>|<=|>=|<|>|\bLIKE\b|\bNOT\s+IN\b|\bIN\b|\bINCLUDES\b|\bEXCLUDES\b)", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+
+STAGES = ["Prospecting", "Qualification", "Needs Analysis", "Proposal/Price Quote", "Negotiation/Review", "Closed Won", "Closed Lost"]
+
+
+def _account(i):
+    return {"attributes": {"type": "Account"}, "Name": f"Account {i % 97}"}
+
+
+def mock_record(sobject, i):
+    """One record of the given sObject type, deterministic in i"""
+    record_id = f"{sobject[:3].upper()}{i:015d}"
+    if sobject == "Opportunity":
+        return {
+            "attributes": {"type": "Opportunity", "url": f"/services/data/v59.0/sobjects/Opportunity/{record_id}"},
+            "Id": record_id,
+            "Name": f"Opportunity {i}",
+            "Amount": float((i * 7919) % 500_000),
+            "StageName": STAGES[i % len(STAGES)],
+            "CloseDate": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            "Account": _account(i),
+        }
+    if sobject == "Contact":
+        return {
+            "attributes": {"type": "Contact", "url": f"/services/data/v59.0/sobjects/Contact/{record_id}"},
+            "Id": record_id,
+            "Name": f"Contact {i}",
+            "Email": f"contact{i}@example.com",
+            "Phone": None if i % 3 else f"(555) {i % 1000:03d}-{i % 10000:04d}",
+            "Account": _account(i),
+        }
+    if sobject == "Account":
+        return {
+            "attributes": {"type": "Account", "url": f"/services/data/v59.0/sobjects/Account/{record_id}"},
+            "Id": record_id,
+            "Name": f"Account {i}",
+            "Industry": ["Electronics", "Energy", "Apparel", "Biotechnology"][i % 4],
+            "AnnualRevenue": float((i * 104729) % 100_000_000),
+        }
+    return {
+        "attributes": {"type": sobject, "url": f"/services/data/v59.0/sobjects/{sobject}/{record_id}"},
+        "Id": record_id,
+        "Name": f"{sobject} {i}",
+    }
+
+
+def load_shapes(pattern=os.path.join(os.path.dirname(os.path.abspath(__file__)), "salesforce_*_data.json")):
+    """Recorded example records per sObject type, from the JSON dumps in this directory"""
+    shapes = {}
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            for record in json.load(f):
+                sobject = record.get("attributes", {}).get("type")
+                if sobject and sobject != "AggregateResult" and record.get("Id"):
+                    shapes.setdefault(sobject, []).append(record)
+    return shapes
+
+
+def shaped_record(sobject, i, examples):
+    """Record i of an sObject modelled on recorded examples: their fields and values, with a unique Id"""
+    example = examples[i % len(examples)]
+    record = copy.deepcopy(example)
+    record_id = f"{example['Id'][:3]}{i:015d}"
+    record["Id"] = record_id
+    record["attributes"]["url"] = f"/services/data/v59.0/sobjects/{sobject}/{record_id}"
+    if i >= len(examples) and isinstance(record.get("Name"), str):
+        record["Name"] = f"{record['Name']} {i // len(examples)}"
+    return record
+
+
+def selected_fields(query):
+    """Field paths in a query's SELECT list, or None if it has functions or subqueries"""
+    match = _SELECT.search(query)
+    if not match or "(" in match.group(1):
+        return None
+    return [f.strip() for f in match.group(1).split(",") if f.strip()]
+
+
+def synthetic_value(field, i):
+    """A plausible value for a field no recorded example has, from its name"""
+    name = field.lower().removesuffix("__c")
+    if name == "id" or name.endswith("id"):
+        return f"{field[:3].upper()}{i:015d}"
+    if name in ("createddate", "lastmodifieddate", "systemmodstamp") or name.endswith("datetime"):
+        return f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:00:00.000+0000"
+    if name.endswith("date"):
+        return f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+    if name.startswith("is") or name.startswith("has"):
+        return i % 2 == 0
+    if any(word in name for word in ("amount", "revenue", "price", "total", "count", "number", "score", "fee")):
+        return float((i * 7919) % 500_000)
+    if "email" in name:
+        return f"user{i}@example.com"
+    if "phone" in name:
+        return f"(555) {i % 1000:03d}-{i % 10000:04d}"
+    return f"{field.removesuffix('__c').replace('_', ' ')} {i}"
+
+
+def project(record, fields, i):
+    """Only the selected fields of a record, relationship paths included, as the REST API returns them"""
+    projected = {"attributes": record["attributes"]}
+    for path in fields:
+        source, target = record, projected
+        parts = path.split(".")
+        for depth, part in enumerate(parts):
+            # SOQL field names are case-insensitive; responses use the API name
+            key = next((k for k in (source or {}) if k.lower() == part.lower()), part)
+            if depth == len(parts) - 1:
+                target[key] = source[key] if source and key in source else synthetic_value(part, i)
+                break
+            child = source.get(key) if source else None
+            sobject = child["attributes"]["type"] if child else part[:-3] + "__c" if part.endswith("__r") else part
+            target = target.setdefault(key, {"attributes": {"type": sobject}})
+            source = child
+    return projected
+
+
+def mock_aggregate(query, i):
+    """One AggregateResult row for a GROUP BY query"""
+    if "StageName" in query:
+        return {"attributes": {"type": "AggregateResult"}, "StageName": STAGES[i % len(STAGES)], "opportunityCount": 10 + i, "totalAmount": float(100_000 * (i + 1))}
+    return {"attributes": {"type": "AggregateResult"}, "AccountId": f"ACC{i:015d}", "Name": f"Account {i}", "totalAmount": float(2_100_000 - 100_000 * i)}
+
+
+class MockSalesforce:
+    """Answers query/query_more/query_all_iter like simple_salesforce, without a network"""
+
+    def __init__(self, latency=0.05, rows=DEFAULT_ROWS, page_size=PAGE_SIZE, table_rows=None, shapes=None):
+        self.latency = latency
+        self.rows = rows
+        # Recorded examples per sObject (see load_shapes); with them, queries return only the fields they select
+        self.shapes = shapes
+        # Object size reported by the explain endpoint
+        self.table_rows = table_rows or rows
+        self.page_size = page_size
+        self.session_id = "mock-session"
+        self.sf_instance = "mock.my.salesforce.com"
+        self.sf_version = "59.0"
+        self.api_calls = 0
+        self.records_written = 0
+        self._cursors = {}
+
+    def _records(self, query):
+        sobject = re.search(r"\bFROM\s+(\w+)", query, re.IGNORECASE)
+        sobject = sobject.group(1) if sobject else "Account"
+        limit = re.search(r"\bLIMIT\s+(\d+)", query, re.IGNORECASE)
+        rows = int(limit.group(1)) if limit else self.rows
+        if re.search(r"\bGROUP\s+BY\b", query, re.IGNORECASE):
+            rows = min(rows, len(STAGES))
+            return [mock_aggregate(query, i) for i in range(rows)]
+        if self.shapes is None:
+            return [mock_record(sobject, i) for i in range(rows)]
+        examples = self.shapes.get(sobject)
+        records = [shaped_record(sobject, i, examples) if examples else mock_record(sobject, i) for i in range(rows)]
+        fields = selected_fields(query)
+        return [project(r, fields, i) for i, r in enumerate(records)] if fields else records
+
+    def _page(self, cursor, records, offset):
+        time.sleep(self.latency)
+        self.api_calls += 1
+        page = records[offset:offset + self.page_size]
+        done = offset + len(page) >= len(records)
+        result = {"totalSize": len(records), "done": done, "records": page}
+        if not done:
+            result["nextRecordsUrl"] = f"/services/data/v59.0/query/{cursor}-{offset + len(page)}"
+            self._cursors[cursor] = records
+        else:
+            self._cursors.pop(cursor, None)
+        return result
+
+    def query(self, query, include_deleted=False, **kwargs):
+        return self._page(uuid.uuid4().hex, self._records(query), 0)
+
+    def query_more(self, next_records_identifier, identifier_is_url=False, include_deleted=False, **kwargs):
+        cursor, offset = next_records_identifier.rsplit("/", 1)[-1].rsplit("-", 1)
+        return self._page(cursor, self._cursors[cursor], int(offset))
+
+    def query_all(self, query, include_deleted=False, **kwargs):
+        records = list(self.query_all_iter(query))
+        return {"totalSize": len(records), "done": True, "records": records}
+
+    def query_all_iter(self, query, include_deleted=False, **kwargs):
+        result = self.query(query)
+        yield from result["records"]
+        while not result["done"]:
+            result = self.query_more(result["nextRecordsUrl"], identifier_is_url=True)
+            yield from result["records"]
+
+    def _resolve(self, text, results):
+        """Substitute @{referenceId.path} references with values from earlier sub-request results"""
+        def value(match):
+            reference_id, _, path = match.group(1).partition(".")
+            target = results[reference_id]
+            for name, index in _PATH_PART.findall(path):
+                target = target[name]
+                if index:
+                    target = target[int(index)]
+            return str(target)
+        return _REFERENCE.sub(value, text)
+
+    def _subrequest(self, method, url):
+        parts = urlsplit(url)
+        params = parse_qs(parts.query)
+        if method == "GET" and parts.path.endswith("/query"):
+            records = self._records(params["q"][0])
+            result = {"totalSize": len(records), "done": len(records) <= self.page_size, "records": records[:self.page_size]}
+            return 200, result
+        match = re.search(r"/sobjects/(\w+)/(\w+)$", parts.path)
+        if method == "GET" and match:
+            sobject, record_id = match.groups()
+            record = mock_record(sobject, int(record_id[3:]))
+            fields = params.get("fields", [""])[0].split(",")
+            return 200, {"attributes": record["attributes"], **{f: record.get(f) for f in fields if f}}
+        return 404, [{"errorCode": "NOT_FOUND", "message": f"The requested resource does not exist: {url}"}]
+
+    def restful(self, path, params=None, method="GET", **kwargs):
+        """The Composite and sObject Collections endpoints, each answered after a single latency"""
+        path = path.strip("/")
+        if path == "query" and params and "explain" in params:
+            time.sleep(self.latency)
+            self.api_calls += 1
+            return self.explain_plan(params["explain"])
+        if path.startswith("composite/sobjects"):
+            time.sleep(self.latency)
+            self.api_calls += 1
+            return self._collections(path, params or {}, method, kwargs)
+        if path != "composite" or method != "POST":
+            raise NotImplementedError(f"MockSalesforce does not emulate {method} {path}")
+        time.sleep(self.latency)
+        self.api_calls += 1
+        body = kwargs["json"] if "json" in kwargs else json.loads(kwargs["data"])
+        results, responses, failed = {}, [], False
+        for subrequest in body["compositeRequest"]:
+            reference_id = subrequest["referenceId"]
+            if failed and body.get("allOrNone"):
+                status, result = 400, [{"errorCode": "PROCESSING_HALTED", "message": "The transaction was rolled back since another operation in the same transaction failed."}]
+            else:
+                try:
+                    status, result = self._subrequest(subrequest["method"], self._resolve(subrequest["url"], results))
+                except (KeyError, IndexError, TypeError):
+                    status, result = 400, [{"errorCode": "PROCESSING_HALTED", "message": f"Invalid reference specified in {subrequest['url']}"}]
+            if status < 300:
+                results[reference_id] = result
+            else:
+                failed = True
+            responses.append({"body": result, "httpHeaders": {}, "httpStatusCode": status, "referenceId": reference_id})
+        return {"compositeResponse": responses}
+
+    def _collections(self, path, params, method, kwargs):
+        if method == "DELETE":
+            ids = params["ids"].split(",")
+            if len(ids) > 200:
+                raise ValueError("sObject Collections take at most 200 records")
+            return [write_result(DELETE, None, {"Id": i}) for i in ids]
+        body = kwargs["json"] if "json" in kwargs else json.loads(kwargs["data"])
+        if len(body["records"]) > 200:
+            raise ValueError("sObject Collections take at most 200 records")
+        operation = INSERT if method == "POST" else UPSERT if path.count("/") == 3 else UPDATE
+        results = [write_result(operation, r["attributes"]["type"], r) for r in body["records"]]
+        if body.get("allOrNone") and not all(r["success"] for r in results):
+            rolled_back = {"statusCode": "ALL_OR_NONE_OPERATION_ROLLED_BACK", "message": "Record rolled back because not all records were valid and the request was using AllOrNone header", "fields": []}
+            results = [r if not r["success"] else {"id": r["id"], "success": False, "errors": [rolled_back]} for r in results]
+        self.records_written += sum(1 for r in results if r["success"])
+        return results
+
+    def explain_plan(self, query):
+        """The explain endpoint's answer: an index plan when an indexed field is filtered on, else a table scan"""
+        sobject = re.search(r"\bFROM\s+(\w+)", query, re.IGNORECASE)
+        sobject = sobject.group(1) if sobject else "Account"
+        where = _WHERE.search(re.sub(r"'(?:[^'\\]|\\.)*'", "''", query))
+        fields = _FILTER.findall(where.group(1)) if where else []
+        indexed = [f for f in fields if "." not in f and f.lower() in INDEXED_FIELDS]
+        scan = {
+            "cardinality": self.table_rows // 2 if fields else self.table_rows,
+            "fields": [],
+            "leadingOperationType": "TableScan",
+            "notes": [{"description": "Not considering filter for optimization because unindexed", "fields": [f], "tableEnumOrId": sobject} for f in fields if f not in indexed],
+            # Unfiltered queries read the table on purpose; a filter that can't use an index is the costly case
+            "relativeCost": 2.8 if fields else 0.65,
+            "sobjectCardinality": self.table_rows,
+            "sobjectType": sobject,
+        }
+        plans = [scan]
+        if indexed and not re.search(r"\bOR\b", where.group(1), re.IGNORECASE):
+            plans.insert(0, {**scan, "cardinality": max(1, self.table_rows // 100), "fields": indexed, "leadingOperationType": "Index", "notes": [], "relativeCost": 0.1})
+        return {"plans": plans, "sourceQuery": query}
+
+    @property
+    def bulk2(self):
+        return MockBulk2(self)
+
+
+INSERT, UPDATE, UPSERT, DELETE = "insert", "update", "upsert", "delete"
+
+_written = iter(range(10**12))
+
+
+def write_result(operation, sobject, record):
+    """Salesforce's per-record result for a write: missing names and malformed ids fail"""
+    record_id = record.get("Id")
+    if operation in (UPDATE, DELETE) and not re.fullmatch(r"[A-Za-z0-9]{15}([A-Za-z0-9]{3})?", record_id or ""):
+        return {"id": record_id, "success": False, "errors": [{"statusCode": "MALFORMED_ID", "message": f"malformed id {record_id}", "fields": ["Id"]}]}
+    if operation == INSERT and sobject != "Contact" and not record.get("Name"):
+        return {"success": False, "errors": [{"statusCode": "REQUIRED_FIELD_MISSING", "message": "Required fields are missing: [Name]", "fields": ["Name"]}]}
+    if operation == INSERT or (operation == UPSERT and not record_id):
+        return {"id": f"{(sobject or 'Rec')[:3].upper()}{next(_written):015d}", "success": True, "created": True, "errors": []}
+    return {"id": record_id, "success": True, "created": False, "errors": []}
+
+
+class MockBulk2:
+    """sf.bulk2 stand-in: sf.bulk2.Account.update(records=...) runs an ingest job in memory"""
+
+    def __init__(self, sf):
+        self.sf = sf
+
+    def __getattr__(self, sobject):
+        return MockBulk2Type(self.sf, sobject)
+
+
+class MockBulk2Type:
+    # Every job's results, shared across the per-object handles like the real job store
+    jobs = {}
+
+    def __init__(self, sf, sobject):
+        self.sf = sf
+        self.sobject = sobject
+
+    def _ingest(self, operation, records, batch_size=None, external_id_field=None, **kwargs):
+        batch_size = batch_size or 10_000
+        summaries = []
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            # create, upload, close and one poll
+            time.sleep(self.sf.latency * 4)
+            self.sf.api_calls += 4
+            job_id = uuid.uuid4().hex[:18]
+            successful, failed = [], []
+            for row in batch:
+                record = {k: None if v == "#N/A" else v for k, v in row.items() if v != ""}
+                result = write_result(operation, self.sobject, record)
+                if result["success"]:
+                    successful.append({"sf__Id": result["id"], "sf__Created": str(result.get("created", False)).lower(), **row})
+                else:
+                    error = result["errors"][0]
+                    failed.append({"sf__Id": result.get("id") or "", "sf__Error": f"{error['statusCode']}:{error['message']}", **row})
+            self.sf.records_written += len(successful)
+            self.jobs[job_id] = {"successful": successful, "failed": failed}
+            summaries.append({"numberRecordsFailed": len(failed), "numberRecordsProcessed": len(batch), "numberRecordsTotal": len(batch), "job_id": job_id})
+        return summaries
+
+    def insert(self, records=None, **kwargs):
+        return self._ingest(INSERT, records, **kwargs)
+
+    def update(self, records=None, **kwargs):
+        return self._ingest(UPDATE, records, **kwargs)
+
+    def upsert(self, records=None, external_id_field=None, **kwargs):
+        return self._ingest(UPSERT, records, external_id_field=external_id_field, **kwargs)
+
+    def delete(self, records=None, **kwargs):
+        return self._ingest(DELETE, records, **kwargs)
+
+    def _results_csv(self, rows):
+        time.sleep(self.sf.latency)
+        self.sf.api_calls += 1
+        if not rows:
+            return ""
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+
+    def get_successful_records(self, job_id, file=None):
+        return self._results_csv(self.jobs[job_id]["successful"])
+
+    def get_failed_records(self, job_id, file=None):
+        return self._results_csv(self.jobs[job_id]["failed"])
+
+    def get_unprocessed_records(self, job_id, file=None):
+        return self._results_csv([])
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeLLM:
+    """Stands in for a Gemini GenerativeModel: same generate_content call, canned answers"""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        self.calls += 1
+        if "more selective SOQL query" in prompt:
+            return FakeResponse(json.dumps(self._rewrite(prompt)))
+        match = re.search(r"User query: (.*?)\n\nPlease analyze", prompt, re.DOTALL)
+        user_query = match.group(1) if match else prompt
+        if user_query.strip().upper().startswith("SELECT"):
+            answer = {"intent": "custom_query", "query": user_query, "explanation": "Running your custom SOQL query"}
+        else:
+            answer = fallback_query_processing(user_query)
+        return FakeResponse(f"```json\n{json.dumps(answer)}\n```")
+
+    def _rewrite(self, prompt):
+        """Answer the query advisor's rewrite request
+
+        A filter on a relationship name becomes a semi-join on the lookup Id;
+        anything else is narrowed to recently created records, the kind of
+        answer that changes the result and that the advisor has to turn down.
+        """
+        query = re.search(r"^Query: (.*)$", prompt, re.MULTILINE).group(1)
+        relationship = re.search(r"\b(\w+?)(__r)?\.Name\s*=\s*('(?:[^'\\]|\\.)*')", query)
+        if relationship:
+            name, custom, value = relationship.groups()
+            lookup, target = (f"{name}__c", f"{name}__c") if custom else (f"{name}Id", name)
+            rewritten = query.replace(relationship.group(0), f"{lookup} IN (SELECT Id FROM {target} WHERE Name = {value})", 1)
+            explanation = f"Filtered on the {lookup} lookup instead of the related record's name"
+        elif re.search(r"\bWHERE\b", query, re.IGNORECASE):
+            rewritten = re.sub(r"\bWHERE\s+(.*?)\s*(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", r"WHERE CreatedDate = LAST_N_DAYS:365 AND (\1) ", query, count=1, flags=re.IGNORECASE).strip()
+            explanation = "Limited to records created in the last year so the CreatedDate index can be used"
+        else:
+            rewritten, explanation = None, ""
+        return {"intent": "custom_query", "query": rewritten, "explanation": explanation}
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            with server.lock:
+                if name == b"PING":
+                    reply = b"+PONG\r\n"
+                elif name in (b"AUTH", b"SELECT"):
+                    reply = b"+OK\r\n"
+                elif name == b"GET":
+                    reply = self._bulk(server.get(args[1]))
+                elif name == b"SET":
+                    ttl = None
+                    if len(args) >= 5 and args[3].upper() in (b"PX", b"EX"):
+                        ttl = int(args[4]) / (1000 if args[3].upper() == b"PX" else 1)
+                    server.data[args[1]] = (args[2], time.time() + ttl if ttl else None)
+                    reply = b"+OK\r\n"
+                elif name == b"DEL":
+                    removed = sum(1 for key in args[1:] if server.data.pop(key, None) is not None)
+                    reply = b":%d\r\n" % removed
+                elif name == b"SCAN":
+                    pattern = args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*"
+                    keys = [k for k in list(server.data) if fnmatch.fnmatchcase(k.decode(), pattern) and server.get(k) is not None]
+                    reply = b"*2\r\n" + self._bulk(b"0") + b"*%d\r\n" % len(keys) + b"".join(self._bulk(k) for k in keys)
+                elif name == b"FLUSHDB":
+                    server.data.clear()
+                    reply = b"+OK\r\n"
+                else:
+                    reply = b"-ERR unknown command '%s'\r\n" % name
+            self.wfile.write(reply)
+
+
+class MockRedisServer(socketserver.ThreadingTCPServer):
+    """In-process Redis stand-in: GET, SET with PX/EX, DEL, SCAN, PING and FLUSHDB"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _RedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _OTLPHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/v1/traces":
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            for resource in payload.get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    self.server.spans.extend(scope.get("spans", []))
+        reply = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockOTLPCollector(ThreadingHTTPServer):
+    """In-process OTLP/HTTP collector: keeps every span posted to /v1/traces as JSON"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _OTLPHandler)
+        self.spans = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def traces(self):
+        """Spans grouped by trace id"""
+        with self.lock:
+            spans = list(self.spans)
+        grouped = {}
+        for span in spans:
+            grouped.setdefault(span["traceId"], []).append(span)
+        return grouped
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+LOGIN_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns="urn:partner.soap.sforce.com">
+<soapenv:Body><loginResponse><result>
+<serverUrl>https://{instance}/services/Soap/u/{version}/00D000000000001</serverUrl>
+<sessionId>{session_id}</sessionId>
+</result></loginResponse></soapenv:Body></soapenv:Envelope>"""
+
+LOGIN_FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:sf="urn:fault.partner.soap.sforce.com">
+<soapenv:Body><soapenv:Fault><faultcode>sf:INVALID_LOGIN</faultcode>
+<faultstring>INVALID_LOGIN: Invalid username, password, security token; or user locked out.</faultstring>
+<detail><sf:LoginFault><sf:exceptionCode>INVALID_LOGIN</sf:exceptionCode>
+<sf:exceptionMessage>Invalid username, password, security token; or user locked out.</sf:exceptionMessage>
+</sf:LoginFault></detail></soapenv:Fault></soapenv:Body></soapenv:Envelope>"""
+
+_DATA_PATH = re.compile(r"^/services/data/v[\d.]+/(.*)$")
+
+
+class _SalesforceHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a pooled requests session reuses connections the way it would with Salesforce
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status, body, content_type="application/json;charset=UTF-8"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        server, backend = self.server, self.server.backend
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parts = urlsplit(self.path)
+
+        if method == "POST" and parts.path.startswith("/services/Soap/u/"):
+            server.count("login")
+            time.sleep(backend.latency)
+            if b"<n1:password></n1:password>" in body:
+                return self._reply(500, LOGIN_FAULT.encode("utf-8"), "text/xml;charset=UTF-8")
+            response = LOGIN_RESPONSE.format(instance=backend.sf_instance, version=backend.sf_version, session_id=backend.session_id)
+            return self._reply(200, response.encode("utf-8"), "text/xml;charset=UTF-8")
+
+        if self.headers.get("Authorization") != f"Bearer {backend.session_id}":
+            server.count("unauthorized")
+            return self._reply(401, [{"errorCode": "INVALID_SESSION_ID", "message": "Session expired or invalid"}])
+        match = _DATA_PATH.match(parts.path)
+        if match is None:
+            return self._reply(404, [{"errorCode": "NOT_FOUND", "message": f"The requested resource does not exist: {parts.path}"}])
+        path = match.group(1).strip("/")
+        if server.should_fail():
+            server.count("unavailable")
+            time.sleep(backend.latency)
+            return self._reply(503, [{"errorCode": "SERVER_UNAVAILABLE", "message": "Server temporarily unavailable"}])
+        params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+
+        try:
+            if path == "query" and "explain" in params:
+                server.count("explain")
+                result = backend.restful("query", params={"explain": params["explain"]})
+            elif path in ("query", "queryAll"):
+                server.count("query")
+                result = backend.query(params["q"])
+            elif path.startswith("query/"):
+                server.count("query_more")
+                result = backend.query_more(parts.path, identifier_is_url=True)
+            else:
+                server.count("collections" if path.startswith("composite/sobjects") else path.split("/")[0])
+                result = backend.restful(path, params=params or None, method=method, data=body.decode("utf-8") if body else None)
+        except NotImplementedError as e:
+            return self._reply(404, [{"errorCode": "NOT_FOUND", "message": str(e)}])
+        except (KeyError, ValueError) as e:
+            return self._reply(400, [{"errorCode": "MALFORMED_QUERY", "message": str(e)}])
+        self._reply(200, result)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalAdapter(HTTPAdapter):
+    """Sends https:// requests for any host to a local plain-HTTP server
+
+    simple_salesforce always builds https:// URLs from the instance name, so
+    a session with this adapter mounted is how it reaches MockSalesforceServer.
+    """
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit(("http", self.address, parts.path, parts.query, parts.fragment))
+        return super().send(request, **kwargs)
+
+
+class MockSalesforceServer(ThreadingHTTPServer):
+    """MockSalesforce over HTTP: SOAP login, query and queryMore, explain, Composite and sObject Collections
+
+    Requests are counted per endpoint in calls. Latency comes from the
+    backend, slept on each request's own server thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, backend=None, host="127.0.0.1", port=0, error_rate=0.0, seed=0):
+        super().__init__((host, port), _SalesforceHandler)
+        self.backend = backend or MockSalesforce()
+        self.calls = Counter()
+        # Fraction of data requests answered 503, as Salesforce does under load or during maintenance
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    @property
+    def address(self):
+        host, port = self.server_address
+        return f"{host}:{port}"
+
+    def session(self, pool_size=64):
+        """requests session that sends every https:// call to this server"""
+        session = Session()
+        session.mount("https://", LocalAdapter(self.address, pool_connections=pool_size, pool_maxsize=pool_size))
+        return session
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
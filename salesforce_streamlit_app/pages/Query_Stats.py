@@ -0,0 +1,75 @@
+import hmac
+import os
+
+import pandas as pd
+import streamlit as st
+
+from query_stats import get_query_stats
+from shared_resources import format_bytes
+
+# The page shows every user's queries and can reset the stats, so it stays
+# closed to everyone, logged in or not, until ADMIN_PASSWORD is set
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "")
+
+st.title("📈 Query Stats")
+
+if not ADMIN_PASSWORD:
+    st.error("Query stats are disabled. Set ADMIN_PASSWORD to enable this page.")
+    st.stop()
+
+if not st.session_state.get("query_stats_admin"):
+    password = st.text_input("Admin password", type="password")
+    if not hmac.compare_digest(password.encode("utf-8"), ADMIN_PASSWORD.encode("utf-8")):
+        if password:
+            st.error("Wrong password")
+        st.stop()
+    st.session_state.query_stats_admin = True
+
+stats = get_query_stats()
+queries = pd.DataFrame(stats.query_rows())
+llm = pd.DataFrame(stats.llm_rows())
+st.caption(f"Salesforce queries and Gemini calls served by this process since {pd.Timestamp(stats.started_at, unit='s'):%Y-%m-%d %H:%M:%S} UTC")
+
+if queries.empty and llm.empty:
+    st.info("No queries have run in this process yet.")
+    st.stop()
+
+cols = st.columns(4)
+if not queries.empty:
+    lookups = queries["cache_hits"].sum() + queries["cache_misses"].sum()
+    cols[0].metric("Queries", f"{queries['calls'].sum():,}")
+    cols[1].metric("Time in Salesforce", f"{queries['total_s'].sum():.1f} s")
+    cols[2].metric("Query cache hit rate", f"{queries['cache_hits'].sum() / lookups:.0%}" if lookups else "n/a")
+if not llm.empty:
+    cols[3].metric("Gemini tokens", f"{llm['prompt_tokens'].sum() + llm['output_tokens'].sum():,}")
+
+if not queries.empty:
+    # Which intents dominate load: total time, calls and data per intent
+    st.subheader("Load by intent")
+    by_intent = queries.groupby("intent")[["calls", "total_s", "rows", "bytes"]].sum().sort_values("total_s", ascending=False)
+    st.bar_chart(by_intent["total_s"])
+    st.dataframe(by_intent.assign(bytes=by_intent["bytes"].map(format_bytes)))
+
+    st.subheader("Hot queries")
+    st.dataframe(
+        queries.assign(bytes=queries["bytes"].map(format_bytes)),
+        hide_index=True,
+        column_config={
+            "total_s": st.column_config.NumberColumn("total (s)", format="%.2f"),
+            "mean_ms": st.column_config.NumberColumn("mean (ms)", format="%.0f"),
+            "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.0f"),
+            "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.0f"),
+        }
+    )
+
+if not llm.empty:
+    st.subheader("Gemini calls")
+    st.dataframe(llm, hide_index=True)
+
+st.subheader("Export")
+cols = st.columns(3)
+cols[0].download_button("Prometheus text", stats.to_text(), file_name="query_stats.prom", mime="text/plain")
+cols[1].download_button("OpenMetrics", stats.to_text(openmetrics=True), file_name="query_stats.om.txt", mime="application/openmetrics-text")
+if cols[2].button("Reset stats"):
+    stats.reset()
+    st.rerun()
@@ -0,0 +1,584 @@
+"""Predictive prefetch of the queries an analyst is likely to ask next
+
+Analysts follow well-worn paths: the top accounts, then the top account's
+opportunities, then its contacts. The prefetcher learns those paths as
+transition counts between turns and, after each answer, fetches the most
+probable next queries into the shared query cache while the analyst is
+still reading. A prediction that comes true is answered from the cache.
+
+A turn's state is its query (plus the intent, for multi-step intents such
+as top_accounts that are fetched differently). Salesforce IDs in the query
+that came from the session's earlier results are replaced by their place
+in them, so "opportunities WHERE AccountId = '001...'" is learned as
+"opportunities of {AccountId@0}", the first row's account, and is filled in
+from whatever the current result's first row is.
+
+Transitions are learned from the app log at startup, then from every turn.
+Each turn is logged with its session and state for the next start; logs
+from before that only have their "Query executed" lines, which are split
+into sessions at gaps of inactivity.
+
+Speculative fetches are charged to a per-user budget of API calls per
+window, and accounted for: a hit is a prefetched query a later turn asked
+for while it was still cached; a prefetch nobody asked for before it
+expired is wasted, and so are its calls. Raising PREFETCH_MIN_PROBABILITY
+or lowering PREFETCH_MAX_PER_TURN trades hits for fewer wasted calls;
+evaluate that against the logged sessions with:
+
+    python prefetch.py                 # learned transitions
+    python prefetch.py --evaluate      # hit rate and waste per threshold
+
+Settings, from the environment:
+
+    PREFETCH                   1 prefetches after each turn (0 turns it off)
+    PREFETCH_LOG               log the transitions are learned from (default salesforce_data.log)
+    PREFETCH_MIN_PROBABILITY   least likely follow-up worth fetching (default 0.3)
+    PREFETCH_MIN_OBSERVATIONS  transitions seen from a state before predicting from it (default 3)
+    PREFETCH_MAX_PER_TURN      follow-ups fetched after one turn (default 2)
+    PREFETCH_BUDGET            speculative API calls per user per window (default 30)
+    PREFETCH_BUDGET_WINDOW     seconds (default 3600)
+    PREFETCH_WORKERS           speculative fetches at once (default 2)
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from cache import QUERY_CACHE_TTL, get_cache
+from chatbot_engine import MULTI_STEP_INTENTS, cached_query_pages, get_default_queries, query_cache_key, top_accounts_cache_key
+from snapshots import query_key
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH", "1") not in ("0", "false", "no")
+PREFETCH_LOG = os.getenv("PREFETCH_LOG", "salesforce_data.log")
+PREFETCH_MIN_PROBABILITY = float(os.getenv("PREFETCH_MIN_PROBABILITY", "0.3"))
+PREFETCH_MIN_OBSERVATIONS = int(os.getenv("PREFETCH_MIN_OBSERVATIONS", "3"))
+PREFETCH_MAX_PER_TURN = int(os.getenv("PREFETCH_MAX_PER_TURN", "2"))
+PREFETCH_BUDGET = int(os.getenv("PREFETCH_BUDGET", "30"))
+PREFETCH_BUDGET_WINDOW = float(os.getenv("PREFETCH_BUDGET_WINDOW", "3600"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
+# Logged turns without a session id are split into sessions at this much idle time
+SESSION_GAP = 30 * 60
+
+# Rows of each result whose IDs later queries may refer to
+ENTITY_ROWS = 5
+
+# Sessions whose last state is remembered
+MAX_SESSIONS = 1000
+
+QUERY_EXECUTED = "Query executed: "
+
+# States of a prefetch in the ledger
+PENDING = "pending"
+FETCHED = "fetched"
+LATE = "late"
+
+COUNTERS = ("predicted", "fetched", "cached", "over_budget", "failed", "hits", "late", "wasted", "calls", "hit_calls", "wasted_calls")
+
+_SALESFORCE_ID = re.compile(r"'([a-zA-Z0-9]{18}|[a-zA-Z0-9]{15})'")
+_PLACEHOLDER = re.compile(r"\{([^{}@']+)@(\d+)\}")
+_TEXT_LOG_TIME = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) ")
+
+
+def is_salesforce_id(value):
+    """15- or 18-character record ID; real ones always have a digit, which keeps out long words"""
+    return (isinstance(value, str) and len(value) in (15, 18) and value.isalnum() and value.isascii()
+            and any(c.isdigit() for c in value))
+
+
+def result_entities(frame, rows=ENTITY_ROWS):
+    """Salesforce IDs in a result frame's first rows, by (column, row)"""
+    entities = {}
+    head = frame.head(rows)
+    for column in head.columns:
+        for row, value in enumerate(head[column].tolist()):
+            if is_salesforce_id(value):
+                entities[(str(column), row)] = value
+    return entities
+
+
+def query_pattern(query, entities):
+    """The query with IDs from earlier results replaced by their {column@row} place in them"""
+    places = {}
+    for place, value in entities.items():
+        places.setdefault(value, place)
+
+    def placeholder(match):
+        place = places.get(match.group(1))
+        return f"'{{{place[0]}@{place[1]}}}'" if place else match.group(0)
+    return _SALESFORCE_ID.sub(placeholder, query)
+
+
+def instantiate(pattern, entities):
+    """The query a pattern stands for given the current results, or None if one of its places is empty"""
+    missing = []
+
+    def value(match):
+        found = entities.get((match.group(1), int(match.group(2))))
+        if found is None:
+            missing.append(match.group(0))
+            return match.group(0)
+        return found
+    query = _PLACEHOLDER.sub(value, pattern)
+    return None if missing else query
+
+
+def route_for(intent):
+    """The multi-step intent whose fetch a query goes through, or "" for a plain query"""
+    return intent if intent in MULTI_STEP_INTENTS else ""
+
+
+class TransitionModel:
+    """Counts of which state followed which, and the probabilities they give"""
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(following) for following in self.counts.values())
+
+    def observe(self, state, next_state):
+        with self._lock:
+            self.counts[state][next_state] += 1
+
+    def learn(self, sessions):
+        """Count every transition in sequences of states"""
+        for states in sessions:
+            for state, next_state in zip(states, states[1:]):
+                self.observe(state, next_state)
+        return self
+
+    def predict(self, state, min_probability=PREFETCH_MIN_PROBABILITY, min_observations=PREFETCH_MIN_OBSERVATIONS):
+        """(probability, next state) pairs, most likely first; nothing until the state has been seen enough"""
+        with self._lock:
+            following = dict(self.counts.get(state, ()))
+        seen = sum(following.values())
+        if seen < max(1, min_observations):
+            return []
+        ranked = sorted(((count / seen, next_state) for next_state, count in following.items() if next_state != state), key=lambda p: -p[0])
+        return [(probability, next_state) for probability, next_state in ranked if probability >= min_probability]
+
+    def rows(self):
+        """(state, next state, count, probability) for every transition, the most common states first"""
+        with self._lock:
+            counts = {state: dict(following) for state, following in self.counts.items()}
+        rows = []
+        for state, following in sorted(counts.items(), key=lambda item: -sum(item[1].values())):
+            seen = sum(following.values())
+            for next_state, count in sorted(following.items(), key=lambda item: -item[1]):
+                rows.append((state, next_state, count, count / seen))
+        return rows
+
+
+def _preset_states():
+    """State of each preset query by its whitespace-free text; the log keeps multi-line queries only approximately"""
+    states = {}
+    for intent, query in get_default_queries().items():
+        states.setdefault(query_key(query), (route_for(intent), query))
+    return states
+
+
+def _log_time(text):
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def logged_sessions(path=PREFETCH_LOG, gap=SESSION_GAP):
+    """Sequences of turn states from the app log, oldest session first
+
+    Turns the prefetcher logged carry their session. "Query executed" lines
+    of chat turns that have no such record (older logs) are split into
+    sessions wherever nothing ran for gap seconds.
+    """
+    turns = defaultdict(list)
+    traced, executed, current = set(), [], None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("{"):
+                current = None
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                when = _log_time(entry.get("time"))
+                turn = entry.get("turn")
+                if isinstance(turn, dict) and when is not None:
+                    turns[turn["session"]].append((when, (turn["route"], turn["pattern"])))
+                    traced.add(entry.get("trace_id"))
+                elif str(entry.get("message", "")).startswith(QUERY_EXECUTED) and when is not None:
+                    executed.append([when, entry.get("trace_id"), [entry["message"][len(QUERY_EXECUTED):]]])
+            elif QUERY_EXECUTED in line:
+                stamp = _TEXT_LOG_TIME.match(line)
+                when = datetime.strptime(f"{stamp.group(1)}.{stamp.group(2)}", "%Y-%m-%d %H:%M:%S.%f").timestamp() if stamp else None
+                current = [when, None, [line.split(QUERY_EXECUTED, 1)[1]]] if when is not None else None
+                if current is not None:
+                    executed.append(current)
+            elif current is not None and not _TEXT_LOG_TIME.match(line):
+                # The rest of a multi-line query
+                current[2].append(line)
+            else:
+                current = None
+
+    # Stable sorts on time alone: log order settles turns logged in the same millisecond
+    sessions = [sorted(session, key=lambda turn: turn[0]) for session in turns.values()]
+    presets = _preset_states()
+    untraced = sorted(((when, "".join(lines)) for when, trace_id, lines in executed if trace_id is None or trace_id not in traced), key=lambda turn: turn[0])
+    session, last = [], None
+    for when, text in untraced:
+        if not text.strip():
+            continue
+        if last is not None and when - last > gap and session:
+            sessions.append(session)
+            session = []
+        session.append((when, presets.get(query_key(text), ("", " ".join(text.split())))))
+        last = when
+    if session:
+        sessions.append(session)
+    sessions.sort(key=lambda s: s[0][0])
+    return [[state for _, state in session] for session in sessions]
+
+
+class CallBudget:
+    """API calls each scope may spend in a sliding window"""
+
+    def __init__(self, limit=PREFETCH_BUDGET, window=PREFETCH_BUDGET_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._spent = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _trim(self, spent, now):
+        while spent and spent[0] <= now - self.window:
+            spent.popleft()
+
+    def remaining(self, scope):
+        with self._lock:
+            spent = self._spent[scope]
+            self._trim(spent, time.monotonic())
+            return max(0, self.limit - len(spent))
+
+    def spend(self, scope, calls=1):
+        """Charge calls to a scope if it has them left; returns whether it did"""
+        with self._lock:
+            now = time.monotonic()
+            spent = self._spent[scope]
+            self._trim(spent, now)
+            if len(spent) + calls > self.limit:
+                return False
+            spent.extend([now] * calls)
+            return True
+
+
+class Prefetcher:
+    """Learns where sessions go next and fetches the likely next queries after each turn
+
+    after_turn is called with every answered turn. It settles any prefetch
+    of that turn's query (a hit), learns the transition from the session's
+    previous turn, and queues the follow-ups worth fetching on a small pool
+    of threads, so the turn itself never waits for them.
+    """
+
+    def __init__(self, model=None, budget=None, min_probability=PREFETCH_MIN_PROBABILITY,
+                 min_observations=PREFETCH_MIN_OBSERVATIONS, max_per_turn=PREFETCH_MAX_PER_TURN,
+                 workers=PREFETCH_WORKERS, ttl=QUERY_CACHE_TTL):
+        self.model = model if model is not None else TransitionModel()
+        self.budget = budget if budget is not None else CallBudget()
+        self.min_probability = min_probability
+        self.min_observations = min_observations
+        self.max_per_turn = max_per_turn
+        self.ttl = ttl
+        self.counters = defaultdict(Counter)
+        self._sessions = OrderedDict()
+        self._ledger = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+
+    def learn_log(self, path=PREFETCH_LOG):
+        """Learn the transitions in a log file, if there is one; returns the number of sessions"""
+        if not os.path.exists(path):
+            return 0
+        sessions = logged_sessions(path)
+        self.model.learn(sessions)
+        logger.info(f"Prefetch learned {len(self.model)} transitions from {len(sessions)} logged sessions")
+        return len(sessions)
+
+    def _submit(self, fn, *args):
+        # The speculative fetch stays in the turn's trace
+        future = self._pool.submit(contextvars.copy_context().run, fn, *args)
+        with self._lock:
+            self._in_flight.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._in_flight.discard(future)
+
+    @staticmethod
+    def _key(sf, route, query):
+        return (getattr(sf, "sf_instance", ""), getattr(sf, "session_id", ""), route, query)
+
+    def _count(self, scope, name, value=1):
+        self.counters[scope][name] += value
+
+    def after_turn(self, sf, reply, session, scope="", speculate=True):
+        """Account for, learn from and prefetch after one answered turn; returns the queries queued"""
+        if "query" not in reply:
+            # Nothing came back, so nothing to follow on from
+            with self._lock:
+                self._sessions.pop(session, None)
+            return []
+        route, query = route_for(reply["intent"]), reply["query"]
+        self.expire()
+        with self._lock:
+            self._settle(self._key(sf, route, query))
+            previous_state, entities = self._sessions.pop(session, (None, {}))
+            state = (route, query_pattern(query, entities))
+            entities = {**entities, **result_entities(reply["frame"])}
+            self._sessions[session] = (state, entities)
+            if len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        if previous_state is not None:
+            self.model.observe(previous_state, state)
+        # Next start learns from this turn, whatever process it ran in
+        logger.info(f"Chat turn {reply['intent']}: {len(reply['frame'])} rows",
+                    extra={"turn": {"session": session, "route": route, "pattern": state[1]}})
+        if not speculate:
+            return []
+        return self._speculate(sf, scope, state, entities)
+
+    def predictions(self, state, entities):
+        """(probability, route, query) of the follow-ups worth fetching after a state"""
+        found = []
+        for probability, (route, pattern) in self.model.predict(state, self.min_probability, self.min_observations):
+            query = instantiate(pattern, entities)
+            if query is not None:
+                found.append((probability, route, query))
+            if len(found) >= self.max_per_turn:
+                break
+        return found
+
+    def _cached(self, sf, route, query):
+        cache = get_cache("query", self.ttl)
+        if cache.get(query_cache_key(sf, query)) is not None:
+            return True
+        return bool(route) and cache.get(top_accounts_cache_key(sf, query)) is not None
+
+    def _speculate(self, sf, scope, state, entities):
+        queued = []
+        for probability, route, query in self.predictions(state, entities):
+            key = self._key(sf, route, query)
+            with self._lock:
+                self._count(scope, "predicted")
+                if key in self._ledger:
+                    continue
+            if self._cached(sf, route, query):
+                with self._lock:
+                    self._count(scope, "cached")
+                continue
+            with self._lock:
+                if key in self._ledger:
+                    continue
+                if not self.budget.spend(scope):
+                    self._count(scope, "over_budget")
+                    continue
+                self._ledger[key] = {"scope": scope, "status": PENDING, "calls": 0, "at": time.monotonic(), "probability": probability}
+            self._submit(self.fetch, sf, scope, key)
+            queued.append(query)
+        return queued
+
+    def fetch(self, sf, scope, key):
+        """Run one speculative query through the query cache, the first call already charged to the budget"""
+        route, query = key[2], key[3]
+        calls, complete = 0, False
+        try:
+            with span("prefetch", route=route or None) as fetch_span:
+                pages = MULTI_STEP_INTENTS.get(route, cached_query_pages)(sf, query, intent=route or None)
+                for _, fetched, total in pages:
+                    calls += 1
+                    # Reserve the next page's call before asking for it
+                    if fetched < total and not self.budget.spend(scope):
+                        pages.close()
+                        break
+                else:
+                    complete = True
+                fetch_span.update(calls=calls, complete=complete)
+        except Exception as e:
+            logger.warning(f"Prefetching a follow-up query failed: {str(e)}")
+            failed = True
+        else:
+            failed = False
+        with self._lock:
+            entry = self._ledger.get(key)
+            late = entry is not None and entry["status"] == LATE
+            self._count(scope, "calls", calls)
+            if failed or not complete or late or entry is None:
+                # Nothing usable in the cache, or the turn already fetched it itself
+                self._ledger.pop(key, None)
+                self._count(scope, "failed" if failed else "over_budget" if not complete else "late" if late else "wasted")
+                self._count(scope, "wasted_calls", calls)
+            else:
+                entry.update(status=FETCHED, calls=calls, at=time.monotonic())
+                self._count(scope, "fetched")
+
+    def _settle(self, key):
+        # A turn asked for this query: was it prefetched, and in time?
+        entry = self._ledger.get(key)
+        if entry is None:
+            return
+        if entry["status"] == PENDING:
+            entry["status"] = LATE
+            return
+        del self._ledger[key]
+        self._count(entry["scope"], "hits")
+        self._count(entry["scope"], "hit_calls", entry["calls"])
+
+    def expire(self, now=None):
+        """Count prefetches that expired from the cache unasked as wasted"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key, entry in list(self._ledger.items()):
+                if entry["status"] == FETCHED and entry["at"] + self.ttl <= now:
+                    del self._ledger[key]
+                    self._count(entry["scope"], "wasted")
+                    self._count(entry["scope"], "wasted_calls", entry["calls"])
+
+    def drain(self, timeout=None):
+        """Wait for the speculative fetches in flight"""
+        with self._lock:
+            futures = list(self._in_flight)
+        wait(futures, timeout=timeout)
+
+    def stats(self, scope=None):
+        """Counters for one scope, or all of them, with the hit rate and the share of calls wasted
+
+        The hit rate is over settled prefetches: hits against those that were
+        wasted or arrived late. Prefetches still cached and unasked aren't settled.
+        """
+        self.expire()
+        with self._lock:
+            scopes = [scope] if scope is not None else list(self.counters)
+            totals = Counter()
+            for name in scopes:
+                totals.update(self.counters[name])
+            outstanding = sum(1 for entry in self._ledger.values() if scope is None or entry["scope"] == scope)
+        stats = {name: totals[name] for name in COUNTERS}
+        settled = stats["hits"] + stats["wasted"] + stats["late"]
+        stats.update(
+            outstanding=outstanding,
+            hit_rate=round(stats["hits"] / settled, 3) if settled else None,
+            waste_ratio=round(stats["wasted_calls"] / stats["calls"], 3) if stats["calls"] else None,
+            transitions=len(self.model),
+        )
+        if scope is not None:
+            stats["budget_left"] = self.budget.remaining(scope)
+        return stats
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """The process-wide Prefetcher, learning from PREFETCH_LOG in the background on first use"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+            _prefetcher._submit(_prefetcher.learn_log, PREFETCH_LOG)
+        return _prefetcher
+
+
+def prefetch_after_turn(sf, reply, session, scope="", speculate=True):
+    """Hand an answered turn to the prefetcher if prefetch is on; a failure is logged, never raised"""
+    if not PREFETCH_ENABLED:
+        return []
+    try:
+        return get_prefetcher().after_turn(sf, reply, session, scope, speculate)
+    except Exception as e:
+        logger.warning(f"Could not prefetch after a chat turn: {str(e)}")
+        return []
+
+
+def evaluate(sessions, min_probability=PREFETCH_MIN_PROBABILITY, max_per_turn=PREFETCH_MAX_PER_TURN,
+             min_observations=PREFETCH_MIN_OBSERVATIONS, train_fraction=0.5):
+    """Replay logged sessions through a model learned from the earlier ones
+
+    The first train_fraction of the sessions is learned up front; the rest
+    are predicted turn by turn and learned as they go, as in the app. Each
+    prediction counts as a fetch; it's a hit if the next turn asked for it.
+    Budgets, timing and the cache aren't modelled, so this is an upper bound
+    on the hit rate for the settings.
+    """
+    split = int(len(sessions) * train_fraction)
+    model = TransitionModel().learn(sessions[:split])
+    turns = predicted = hits = 0
+    for states in sessions[split:]:
+        for state, next_state in zip(states, states[1:]):
+            guesses = [guess for _, guess in model.predict(state, min_probability, min_observations)[:max_per_turn]]
+            turns += 1
+            predicted += len(guesses)
+            hits += next_state in guesses
+            model.observe(state, next_state)
+    return {
+        "turns": turns,
+        "predicted": predicted,
+        "hits": hits,
+        "hit_rate": round(hits / predicted, 3) if predicted else None,
+        "coverage": round(hits / turns, 3) if turns else None,
+    }
+
+
+def _describe(state, width=70):
+    route, pattern = state
+    text = " ".join(pattern.split())
+    text = text if len(text) <= width else text[:width - 3] + "..."
+    return f"[{route}] {text}" if route else text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transitions the prefetcher learns from the app log, and how well they predict")
+    parser.add_argument("--log", default=PREFETCH_LOG, help=f"log file (default {PREFETCH_LOG})")
+    parser.add_argument("--top", type=int, default=20, help="transitions to list (default 20)")
+    parser.add_argument("--evaluate", action="store_true", help="hit rate and waste over the later sessions at a range of thresholds")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.log):
+        print(f"{args.log} not found")
+        return 1
+    sessions = logged_sessions(args.log)
+    model = TransitionModel().learn(sessions)
+    print(f"{len(sessions)} sessions, {sum(len(s) for s in sessions)} turns, {len(model)} distinct transitions in {args.log}")
+    if args.evaluate:
+        print(f"\n  {'min p':>6}  {'per turn':>8}  {'turns':>6}  {'fetched':>7}  {'hits':>5}  {'hit rate':>8}  {'wasted':>6}  {'coverage':>8}")
+        for min_probability in (0.1, 0.2, 0.3, 0.5, 0.7):
+            for max_per_turn in (1, 2, 3):
+                result = evaluate(sessions, min_probability, max_per_turn)
+                hit_rate = f"{result['hit_rate']:.0%}" if result["hit_rate"] is not None else "-"
+                coverage = f"{result['coverage']:.0%}" if result["coverage"] is not None else "-"
+                print(f"  {min_probability:>6.1f}  {max_per_turn:>8}  {result['turns']:>6}  {result['predicted']:>7}  {result['hits']:>5}  "
+                      f"{hit_rate:>8}  {result['predicted'] - result['hits']:>6}  {coverage:>8}")
+        return 0
+    print(f"\n  {'count':>5}  {'p':>5}  transition")
+    for state, next_state, count, probability in model.rows()[:args.top]:
+        print(f"  {count:>5}  {probability:>5.2f}  {_describe(state)}\n  {'':>5}  {'':>5}    -> {_describe(next_state)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
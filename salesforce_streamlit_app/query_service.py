@@ -0,0 +1,336 @@
+"""Headless HTTP API for the chatbot engine
+
+Run N stateless workers behind a load balancer:
+
+    python query_service.py --port 8000 --workers 4
+
+Endpoints:
+    GET  /health         liveness check
+    GET  /ready          readiness: 503 until the startup warm-up is done (see warmup.py)
+    GET  /metrics        per-query-fingerprint and Gemini stats (Prometheus text or OpenMetrics)
+    POST /query          {"query": "..."} -> the whole answer as JSON
+    POST /query/stream   {"query": "..."} -> newline-delimited JSON events
+
+Requests must carry an existing Salesforce session as
+``Authorization: Bearer <session id>`` plus ``X-Salesforce-Instance``, and run
+with that user's permissions; anything else is answered 401. The instance
+must be a Salesforce host (QUERY_SERVICE_INSTANCES, *.salesforce.com by
+default) or the request is answered 400, so a caller can't have the worker
+send its session anywhere else. Only with
+QUERY_SERVICE_DEFAULT_LOGIN=1 do requests without one fall back to the
+worker's own login from the SF_* environment variables, so leave it off
+unless nothing but trusted callers can reach the workers.
+A W3C ``traceparent`` header makes the request part of the caller's trace.
+Gemini is used when GEMINI_API_KEY is set, the rule-based fallback otherwise.
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import requests
+from anyio import to_thread
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from chatbot_engine import FastSalesforce, connect_salesforce, stream_answer
+from log_config import setup_logging
+from query_stats import get_query_stats
+from tracing import SERVER, extract, span, start_span, traced
+from warmup import WARMUP_ENABLED, Warmer, env_scope
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv('salesforce_arcgis.env')
+
+# Console only by default: several workers mustn't rotate one file
+setup_logging(os.getenv("LOG_FILE"))
+logger = logging.getLogger(__name__)
+
+# Blocking engine calls run in this many threads per worker process
+SERVICE_THREADS = int(os.getenv("QUERY_SERVICE_THREADS", "64"))
+
+# Salesforce clients kept per worker for forwarded sessions
+CLIENT_CACHE_SIZE = 256
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Answer requests without a forwarded session as the SF_* service account
+DEFAULT_LOGIN = os.getenv("QUERY_SERVICE_DEFAULT_LOGIN", "0") in ("1", "true", "yes")
+
+# Host patterns a forwarded X-Salesforce-Instance may name, comma-separated
+ALLOWED_INSTANCES = tuple(p.strip().lower() for p in os.getenv("QUERY_SERVICE_INSTANCES", "*.my.salesforce.com,*.salesforce.com").split(",") if p.strip())
+
+_HOST = re.compile(r"[a-z0-9-]+(?:\.[a-z0-9-]+)+")
+
+
+def dumps(payload):
+    """Compact JSON bytes for one response body or stream line"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def http_session():
+    """Pooled requests.Session shared by the Salesforce clients of one worker"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=SERVICE_THREADS, pool_maxsize=SERVICE_THREADS)
+    session.mount("https://", adapter)
+    return session
+
+
+def allowed_instance(instance, patterns=ALLOWED_INSTANCES):
+    """Whether a forwarded instance is a bare host name matching one of the patterns
+
+    The client sends requests to https://<instance>/services/..., so a port,
+    path, credentials or scheme in it is refused along with other hosts.
+    """
+    host = instance.strip().lower()
+    return _HOST.fullmatch(host) is not None and any(fnmatch.fnmatchcase(host, pattern) for pattern in patterns)
+
+
+def env_salesforce_client():
+    """Default client logged in with the SF_* environment variables, sharing the session across workers"""
+    return connect_salesforce(
+        os.getenv("SF_USERNAME"),
+        os.getenv("SF_PASSWORD"),
+        os.getenv("SF_SECURITY_TOKEN"),
+        os.getenv("SF_DOMAIN", "login"),
+        session=http_session()
+    )
+
+
+def env_gemini_model():
+    """Gemini model from GEMINI_API_KEY, or None to use the rule-based fallback"""
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+class SalesforceClients:
+    """Default client plus clients for forwarded sessions, built lazily and shared by requests
+
+    The default client only serves requests without a forwarded session when
+    allow_default is set. Forwarded sessions are only used against instances
+    matching allowed_instances.
+    """
+
+    def __init__(self, factory, allow_default=DEFAULT_LOGIN, allowed_instances=ALLOWED_INSTANCES):
+        self.factory = factory
+        self.allow_default = allow_default
+        self.allowed_instances = allowed_instances
+        self._default = None
+        self._forwarded = OrderedDict()
+        self._lock = threading.Lock()
+        self._session = None
+
+    def default(self):
+        with self._lock:
+            if self._default is None:
+                self._default = self.factory()
+            return self._default
+
+    def forwarded(self, session_id, instance):
+        if not allowed_instance(instance, self.allowed_instances):
+            raise ValueError(f"{instance!r} is not a Salesforce instance")
+        key = (instance.strip().lower(), session_id)
+        with self._lock:
+            if key in self._forwarded:
+                self._forwarded.move_to_end(key)
+                return self._forwarded[key]
+            if self._session is None:
+                self._session = http_session()
+            client = FastSalesforce(instance=key[0], session_id=session_id, session=self._session)
+            self._forwarded[key] = client
+            if len(self._forwarded) > CLIENT_CACHE_SIZE:
+                self._forwarded.popitem(last=False)
+            return client
+
+    @staticmethod
+    def _forwarded_session(request):
+        auth = request.headers.get("authorization", "")
+        instance = request.headers.get("x-salesforce-instance")
+        if auth.lower().startswith("bearer ") and auth[7:].strip() and instance:
+            return auth[7:].strip(), instance
+        return None
+
+    def authorized(self, request):
+        """Whether a request has a client to run as: its own forwarded session, or the default if allowed"""
+        return self.allow_default or self._forwarded_session(request) is not None
+
+    def bad_instance(self, request):
+        """The forwarded instance if it isn't an allowed Salesforce host, else None"""
+        forwarded = self._forwarded_session(request)
+        if forwarded is not None and not allowed_instance(forwarded[1], self.allowed_instances):
+            return forwarded[1]
+        return None
+
+    def for_request(self, request):
+        forwarded = self._forwarded_session(request)
+        if forwarded is not None:
+            return self.forwarded(*forwarded)
+        if not self.allow_default:
+            raise PermissionError("A forwarded Salesforce session is required")
+        return self.default()
+
+
+def create_app(salesforce_factory=env_salesforce_client, model_factory=env_gemini_model, warm=WARMUP_ENABLED,
+               allow_default=DEFAULT_LOGIN, allowed_instances=ALLOWED_INSTANCES):
+    """Build the service; the factories are swapped for mocks in benchmarks
+
+    The model is resolved in the background at startup. With warm and
+    allow_default, the default login, query plans and preset queries are
+    warmed up too, and /ready reports 503 until that is done or its budget
+    is spent. Without allow_default the worker never logs in itself.
+    """
+    clients = SalesforceClients(salesforce_factory, allow_default, allowed_instances)
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        to_thread.current_default_thread_limiter().total_tokens = SERVICE_THREADS
+        if warm and allow_default:
+            state["warmer"] = Warmer(clients.default, model_factory, scope=env_scope())
+        else:
+            state["warmer"] = Warmer(None, model_factory, intents=())
+        state["warmer"].start()
+        yield
+
+    def model():
+        # Requests that arrive before the model is resolved wait for the warm-up's, rather than resolving another
+        return state["warmer"].result("model")
+
+    async def read_question(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        user_query = body.get("query") if isinstance(body, dict) else None
+        if not user_query or not isinstance(user_query, str):
+            return None
+        return user_query
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    async def ready(request):
+        status = state["warmer"].status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    async def metrics(request):
+        # Scrapers that ask for OpenMetrics get it; everything else gets the Prometheus text format
+        if "application/openmetrics-text" in request.headers.get("accept", ""):
+            return Response(get_query_stats().to_text(openmetrics=True), media_type="application/openmetrics-text; version=1.0.0; charset=utf-8")
+        return Response(get_query_stats().to_text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def refused(request):
+        """The response for a request without a usable session, or None to go ahead"""
+        if not clients.authorized(request):
+            return JSONResponse({"error": "Forward a Salesforce session as 'Authorization: Bearer <session id>' with X-Salesforce-Instance"}, status_code=401)
+        if clients.bad_instance(request) is not None:
+            return JSONResponse({"error": "X-Salesforce-Instance must be the host name of a Salesforce instance"}, status_code=400)
+        return None
+
+    async def query(request):
+        error = refused(request)
+        if error is not None:
+            return error
+        user_query = await read_question(request)
+        if user_query is None:
+            return JSONResponse({"error": "Request body must be JSON with a 'query' string"}, status_code=400)
+
+        def answer():
+            with span("query_service.query", parent=extract(request.headers.get("traceparent")), kind=SERVER) as request_span:
+                sf = clients.for_request(request)
+                reply = {"records": []}
+                for event in stream_answer(user_query, model(), sf):
+                    if event["event"] == "plan":
+                        reply.update(intent=event["intent"], query=event["query"], filename=event["filename"])
+                    elif event["event"] == "records":
+                        reply["records"].extend(event["records"])
+                    elif event["event"] == "done":
+                        reply.update(text=event["text"], rows=event["rows"])
+                request_span.update(intent=reply.get("intent"), rows=reply.get("rows"))
+                return reply
+
+        try:
+            reply = await run_in_threadpool(answer)
+        except Exception as e:
+            logger.error(f"Query failed: {str(e)}")
+            return JSONResponse({"error": str(e)}, status_code=502)
+        return Response(dumps(reply), media_type="application/json")
+
+    async def query_stream(request):
+        error = refused(request)
+        if error is not None:
+            return error
+        user_query = await read_question(request)
+        if user_query is None:
+            return JSONResponse({"error": "Request body must be JSON with a 'query' string"}, status_code=400)
+
+        request_span = start_span("query_service.query_stream", parent=extract(request.headers.get("traceparent")), kind=SERVER)
+
+        def events():
+            try:
+                sf = clients.for_request(request)
+                for event in stream_answer(user_query, model(), sf):
+                    if event["event"] == "plan":
+                        request_span.set("intent", event["intent"])
+                    elif event["event"] == "done":
+                        request_span.set("rows", event["rows"])
+                    yield dumps(event) + b"\n"
+            except Exception as e:
+                # Headers are already sent, so failures travel as an event
+                logger.error(f"Query failed: {str(e)}")
+                request_span.record_exception(e)
+                yield dumps({"event": "error", "error": str(e)}) + b"\n"
+            finally:
+                request_span.end()
+
+        # Each event is produced on whichever pool thread is free, so the span is re-activated per event
+        return StreamingResponse(iterate_in_threadpool(traced(events(), request_span)), media_type="application/x-ndjson")
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/ready", ready),
+            Route("/metrics", metrics),
+            Route("/query", query, methods=["POST"]),
+            Route("/query/stream", query_stream, methods=["POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Headless Salesforce chatbot query service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="stateless worker processes")
+    args = parser.parse_args()
+    uvicorn.run("query_service:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""Per-query-shape statistics for Salesforce queries and Gemini calls
+
+Every SOQL query is reduced to a fingerprint (literals replaced, IN lists
+collapsed, whitespace and case normalized), so "top accounts" asked a
+thousand times with different limits is one row rather than a thousand log
+lines. Per fingerprint we keep a latency histogram, rows and bytes
+returned, cache hits and misses, errors and the intents that produced it;
+Gemini calls are tracked per model and intent with their token counts.
+
+Stats live in the process that served the queries. The Streamlit apps show
+them on the "Query stats" page and query_service exports them at /metrics
+in the Prometheus text format or OpenMetrics. The same trackers also open
+the query and Gemini spans of a traced chat turn (see tracing).
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from fast_json import bytes_decoded
+from tracing import CLIENT, span, start_span
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fingerprints kept before the least recently seen is dropped
+MAX_FINGERPRINTS = 1000
+
+HIT = "hit"
+MISS = "miss"
+BYPASS = "bypass"
+
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize_query(query):
+    """The query with literals replaced by ?, so queries differing only in values match"""
+    return " ".join(_IN_LIST.sub("(?)", _LITERAL.sub("?", query)).split()).lower()
+
+
+def fingerprint(query):
+    """Short stable id for a query's normalized form"""
+    return hashlib.blake2b(normalize_query(query).encode("utf-8"), digest_size=6).hexdigest()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus defines one"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            yield bound, total
+
+
+class QueryEntry:
+    def __init__(self, key, query):
+        self.key = key
+        self.query = normalize_query(query)
+        self.latency = Histogram()
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+        self.cache = Counter()
+        self.intents = Counter()
+        self.last_seen = 0.0
+
+
+class LLMEntry:
+    def __init__(self, model, intent):
+        self.model = model
+        self.intent = intent
+        self.latency = Histogram()
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.errors = 0
+        self.cache = Counter()
+
+
+class QuerySample:
+    """What one query cost; filled in by the code running it"""
+
+    def __init__(self, query, intent=None, span=None):
+        self.query = query
+        self.intent = intent
+        self.span = span
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.cache = BYPASS
+        self.error = False
+        self.calls = 0
+
+    @contextmanager
+    def call(self, name="salesforce.page"):
+        """Time one round-trip or cache lookup and count the JSON it decoded
+
+        Measured per call rather than around the whole query, since a paged
+        query's pages may be fetched from different threads with the
+        consumer's own work in between. Each call is also a child span of the
+        query's span, named after what it does.
+        """
+        start, start_bytes = time.perf_counter(), bytes_decoded()
+        self.calls += 1
+        with span(name, parent=self.span, call=self.calls):
+            try:
+                yield
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.bytes += max(0, bytes_decoded() - start_bytes)
+
+
+class LLMSample:
+    def __init__(self, model):
+        self.model = model
+        self.intent = "unknown"
+        self.seconds = 0.0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cache = BYPASS
+        self.error = False
+
+    def count_tokens(self, response, prompt):
+        """Token counts from Gemini's usage metadata, estimated at 4 characters a token without it"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self.prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+            self.output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        else:
+            self.prompt_tokens = len(prompt) // 4
+            self.output_tokens = len(getattr(response, "text", "") or "") // 4
+
+
+class QueryStats:
+    """Thread-safe registry of query and LLM statistics for this process"""
+
+    def __init__(self, max_fingerprints=MAX_FINGERPRINTS):
+        self.max_fingerprints = max_fingerprints
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self._llm = {}
+
+    def record_query(self, sample):
+        key = fingerprint(sample.query)
+        with self._lock:
+            entry = self._queries.pop(key, None) or QueryEntry(key, sample.query)
+            self._queries[key] = entry
+            while len(self._queries) > self.max_fingerprints:
+                self._queries.popitem(last=False)
+            entry.latency.observe(sample.seconds)
+            entry.rows += sample.rows
+            entry.bytes += sample.bytes
+            entry.errors += sample.error
+            entry.cache[sample.cache] += 1
+            entry.intents[sample.intent or "unknown"] += 1
+            entry.last_seen = time.time()
+
+    def record_llm(self, sample):
+        with self._lock:
+            entry = self._llm.setdefault((sample.model, sample.intent), LLMEntry(sample.model, sample.intent))
+            entry.latency.observe(sample.seconds)
+            entry.prompt_tokens += sample.prompt_tokens
+            entry.output_tokens += sample.output_tokens
+            entry.errors += sample.error
+            entry.cache[sample.cache] += 1
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._llm.clear()
+            self.started_at = time.time()
+
+    def query_rows(self):
+        """One dict per fingerprint, busiest (by total time) first"""
+        with self._lock:
+            entries = list(self._queries.values())
+            rows = [{
+                "fingerprint": e.key,
+                "intent": e.intents.most_common(1)[0][0] if e.intents else "unknown",
+                "query": e.query,
+                "calls": e.latency.count,
+                "total_s": e.latency.sum,
+                "mean_ms": e.latency.sum / e.latency.count * 1000 if e.latency.count else 0.0,
+                "p50_ms": e.latency.quantile(0.5) * 1000,
+                "p95_ms": e.latency.quantile(0.95) * 1000,
+                "rows": e.rows,
+                "bytes": e.bytes,
+                "cache_hits": e.cache[HIT],
+                "cache_misses": e.cache[MISS],
+                "errors": e.errors,
+            } for e in entries]
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def llm_rows(self):
+        with self._lock:
+            rows = [{
+                "model": e.model,
+                "intent": e.intent,
+                "calls": e.latency.count,
+                "total_s": e.latency.sum,
+                "p50_ms": e.latency.quantile(0.5) * 1000,
+                "p95_ms": e.latency.quantile(0.95) * 1000,
+                "prompt_tokens": e.prompt_tokens,
+                "output_tokens": e.output_tokens,
+                "cache_hits": e.cache[HIT],
+                "errors": e.errors,
+            } for e in self._llm.values()]
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def to_text(self, openmetrics=False):
+        """Prometheus text exposition format, or OpenMetrics when asked for"""
+        with self._lock:
+            queries = list(self._queries.values())
+            llm = list(self._llm.values())
+        out = []
+
+        def family(name, kind, help_text):
+            # OpenMetrics names counter families without the _total suffix their samples carry
+            if openmetrics and kind == "counter":
+                name = name[:-len("_total")]
+            if not openmetrics and kind == "info":
+                kind = "gauge"
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def sample(name, labels, value):
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            out.append(f"{name}{{{label_text}}} {_number(value)}")
+
+        def histogram(name, entries, labels_of):
+            for e in entries:
+                labels = labels_of(e)
+                for bound, count in e.latency.cumulative():
+                    sample(f"{name}_bucket", {**labels, "le": "+Inf" if bound == float("inf") else _number(bound)}, count)
+                sample(f"{name}_sum", labels, e.latency.sum)
+                sample(f"{name}_count", labels, e.latency.count)
+
+        family("salesforce_query", "info", "Normalized SOQL and main intent per fingerprint")
+        for e in queries:
+            intent = e.intents.most_common(1)[0][0] if e.intents else "unknown"
+            sample("salesforce_query_info", {"fingerprint": e.key, "intent": intent, "query": e.query}, 1)
+        family("salesforce_query_duration_seconds", "histogram", "Time spent in Salesforce calls or cache lookups per query")
+        histogram("salesforce_query_duration_seconds", queries, lambda e: {"fingerprint": e.key})
+        for name, attr, help_text in (
+            ("salesforce_query_rows_total", "rows", "Records returned"),
+            ("salesforce_query_bytes_total", "bytes", "Bytes of JSON decoded"),
+            ("salesforce_query_errors_total", "errors", "Queries that raised"),
+        ):
+            family(name, "counter", help_text)
+            for e in queries:
+                sample(name, {"fingerprint": e.key}, getattr(e, attr))
+        family("salesforce_query_cache_total", "counter", "Query cache outcomes")
+        for e in queries:
+            for outcome, count in sorted(e.cache.items()):
+                sample("salesforce_query_cache_total", {"fingerprint": e.key, "outcome": outcome}, count)
+
+        family("llm_request_duration_seconds", "histogram", "Gemini request time, cache lookups included")
+        histogram("llm_request_duration_seconds", llm, lambda e: {"model": e.model, "intent": e.intent})
+        family("llm_tokens_total", "counter", "Gemini tokens by direction")
+        for e in llm:
+            sample("llm_tokens_total", {"model": e.model, "intent": e.intent, "direction": "prompt"}, e.prompt_tokens)
+            sample("llm_tokens_total", {"model": e.model, "intent": e.intent, "direction": "output"}, e.output_tokens)
+        family("llm_cache_total", "counter", "Gemini response cache outcomes")
+        for e in llm:
+            for outcome, count in sorted(e.cache.items()):
+                sample("llm_cache_total", {"model": e.model, "intent": e.intent, "outcome": outcome}, count)
+
+        if openmetrics:
+            out.append("# EOF")
+        return "\n".join(out) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_stats = QueryStats()
+
+
+def get_query_stats():
+    """The process-wide QueryStats"""
+    return _stats
+
+
+@contextmanager
+def track_query(query, intent=None):
+    """Record one query's cost; the body fills in the yielded QuerySample
+
+    The query's span is started here but never made active, since paged
+    queries yield to their consumer in between calls; QuerySample.call
+    parents its spans on it explicitly.
+    """
+    sample = QuerySample(query, intent, start_span("salesforce.query", kind=CLIENT))
+    try:
+        yield sample
+    except GeneratorExit:
+        # The consumer stopped reading pages early; what was fetched still counts
+        raise
+    except Exception as e:
+        sample.error = True
+        sample.span.record_exception(e)
+        raise
+    finally:
+        _stats.record_query(sample)
+        if sample.span.recording:
+            sample.span.update(**{
+                "db.system": "salesforce",
+                "db.statement": normalize_query(query),
+                "query.fingerprint": fingerprint(query),
+                "intent": intent,
+                "cache": sample.cache,
+                "rows": sample.rows,
+                "bytes": sample.bytes,
+                "calls": sample.calls,
+            })
+        sample.span.end()
+
+
+@contextmanager
+def track_llm(model):
+    """Record one Gemini request; the body sets the intent, cache outcome and tokens"""
+    sample = LLMSample(model)
+    start = time.perf_counter()
+    with span("gemini.generate_content", kind=CLIENT) as llm_span:
+        try:
+            yield sample
+        except Exception:
+            sample.error = True
+            raise
+        finally:
+            sample.seconds = time.perf_counter() - start
+            _stats.record_llm(sample)
+            if llm_span.recording:
+                llm_span.update(**{
+                    "gen_ai.request.model": sample.model,
+                    "gen_ai.usage.input_tokens": sample.prompt_tokens,
+                    "gen_ai.usage.output_tokens": sample.output_tokens,
+                    "intent": sample.intent,
+                    "cache": sample.cache,
+                })
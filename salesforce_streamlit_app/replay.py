@@ -0,0 +1,285 @@
+"""Offline replay of recorded chat workloads, as a performance regression baseline
+
+    python replay.py                                   # logged prompts, queries and presets
+    python replay.py --rows 20000 --sf-latency 0.08 --concurrency 8
+    python replay.py --workload prompts.txt --repeat 3
+    python replay.py --save-baseline replay_baseline.json
+    python replay.py --baseline replay_baseline.json   # exits 1 on a regression
+
+Nothing leaves the machine. Salesforce is MockSalesforceServer on localhost,
+reached through the real simple_salesforce client (SOAP login, REST
+queries, queryMore, explain and Composite calls over HTTP), with records
+modelled on the salesforce_*_data.json dumps. Gemini is FakeLLM, which
+answers deterministically. Each prompt runs the way process_chatbot_query
+runs it: a JobRunner job answering it with answer_query.
+
+The default workload is every prompt and every executed query recorded in
+salesforce_data.log, plus the preset questions. --workload takes a file of
+one prompt per line, or JSON lines with a "prompt" key.
+
+The report gives latency percentiles per turn (queueing included),
+throughput, peak memory and API calls per turn by endpoint. Caching is off
+unless --cache is given, so every turn does its full share of work.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from benchmarks import logged_queries
+from cache import MemoryBackend, NullBackend, set_backend
+from chatbot_engine import advisor, answer_query, connect_salesforce
+from jobs import DONE, JobRunner
+from mock_services import FakeLLM, MockSalesforce, MockSalesforceServer, load_shapes
+
+LOG_FILE = "salesforce_data.log"
+
+PRESET_QUESTIONS = [
+    "Show me top accounts",
+    "Show recent opportunities",
+    "Show opportunities by stage",
+    "List contacts",
+    "Show me a chart of opportunities by stage",
+]
+
+PROMPT_PREFIX = "Sending prompt to Gemini: "
+
+# Relative slowdown in a latency percentile, or drop in throughput, reported as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Settings a baseline is only comparable under
+RUN_SETTINGS = ("rows", "page_size", "sf_latency", "llm_latency", "concurrency", "cache", "turns")
+
+
+def logged_prompts(path=LOG_FILE):
+    """Questions the apps have sent to Gemini, from text or JSON log lines
+
+    The log keeps only the first 100 characters of each prompt; what's left
+    is replayed as is.
+    """
+    prompts = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("{"):
+                line = json.loads(line).get("message", "")
+            if PROMPT_PREFIX not in line:
+                continue
+            prompt = line.split(PROMPT_PREFIX, 1)[1].rstrip("\n").removesuffix("...").strip()
+            if prompt:
+                prompts.append(prompt)
+    return prompts
+
+
+def load_workload(path):
+    """Prompts from a file, one per line, or JSON lines with a "prompt" key"""
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            prompts.append(json.loads(line)["prompt"] if line.startswith("{") else line)
+    return prompts
+
+
+def default_workload(log_path=LOG_FILE):
+    """Logged prompts and queries plus the preset questions"""
+    prompts = list(PRESET_QUESTIONS)
+    if os.path.exists(log_path):
+        prompts += logged_prompts(log_path) + logged_queries(log_path)
+    return prompts
+
+
+def percentiles(values):
+    values = np.asarray(values) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)} if len(values) else {}
+
+
+@contextmanager
+def stand_ins(rows=2000, page_size=2000, sf_latency=0.0, llm_latency=0.0, cache=False, pool_size=10, sf_error_rate=0.0):
+    """A logged-in Salesforce client on a local MockSalesforceServer and a FakeLLM, as (server, sf, model)"""
+    set_backend(MemoryBackend() if cache else NullBackend())
+    # The advisor's decisions are part of the run, not worth a log file
+    advisor.ADVISOR_LOG = None
+    backend = MockSalesforce(latency=sf_latency, rows=rows, page_size=page_size, shapes=load_shapes())
+    server = MockSalesforceServer(backend, error_rate=sf_error_rate).start()
+    try:
+        sf = connect_salesforce("replay@example.com", "replay", "token", session=server.session(pool_size=pool_size))
+        # Login is paid once per session, not per turn
+        server.calls.clear()
+        yield server, sf, FakeLLM(latency=llm_latency)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def replay_turn(job, prompt, model, sf):
+    """One chat turn, as run_chat_turn runs it without the query service"""
+    return answer_query(prompt, model, sf, progress=job.report)
+
+
+def run_replay(prompts, rows=2000, page_size=2000, sf_latency=0.0, llm_latency=0.0, concurrency=1, repeat=1, cache=False, memory=True):
+    """Replay prompts against the local stand-ins and return the report dict
+
+    With concurrency above 1, that many simulated users each submit their
+    next prompt as soon as their last one is answered.
+    """
+    with stand_ins(rows, page_size, sf_latency, llm_latency, cache, pool_size=max(concurrency, 10)) as (server, sf, model):
+        runner = JobRunner(max_workers=concurrency)
+        workload = list(prompts) * repeat
+
+        def turn(prompt):
+            # No key: replaying the same question must not reuse a finished job
+            job = runner.submit(replay_turn, prompt, model, sf, label="Replaying a chat turn")
+            job.wait()
+            return job
+
+        queue_lock = threading.Lock()
+        remaining = iter(workload)
+
+        def user():
+            jobs = []
+            while True:
+                with queue_lock:
+                    prompt = next(remaining, None)
+                if prompt is None:
+                    return jobs
+                jobs.append(turn(prompt))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as users:
+            jobs = [job for done in [users.submit(user) for _ in range(concurrency)] for job in done.result()]
+        elapsed = time.perf_counter() - start
+        api_calls = dict(server.calls)
+        llm_calls = model.calls
+
+        latencies = [job.finished_at - job.submitted_at for job in jobs]
+        failures = [job for job in jobs if job.status != DONE]
+        report = {
+            "settings": {"rows": rows, "page_size": page_size, "sf_latency": sf_latency, "llm_latency": llm_latency,
+                         "concurrency": concurrency, "cache": cache, "turns": len(jobs)},
+            "latency": percentiles(latencies),
+            "throughput_per_s": round(len(jobs) / elapsed, 2),
+            "failed": len(failures),
+            "errors": sorted({job.error for job in failures})[:10],
+            "api_calls": api_calls,
+            "api_calls_per_turn": round(sum(api_calls.values()) / len(jobs), 3),
+            "llm_calls_per_turn": round(llm_calls / len(jobs), 3),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+        if memory:
+            # A separate pass, since tracing allocations would skew the timings
+            peaks = []
+            tracemalloc.start()
+            try:
+                for prompt in prompts:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    try:
+                        answer_query(prompt, model, sf)
+                    except Exception:
+                        pass
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            finally:
+                tracemalloc.stop()
+            report["heap_peak_per_turn_mb"] = {"p50": round(float(np.percentile(peaks, 50)) / 2**20, 2), "max": round(max(peaks) / 2**20, 2)}
+        return report
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of report against a saved baseline, as readable lines; empty when there are none"""
+    regressions = []
+    mismatched = [k for k in RUN_SETTINGS if report["settings"].get(k) != baseline["settings"].get(k)]
+    if mismatched:
+        return [f"settings differ from the baseline ({', '.join(mismatched)}), so the runs aren't comparable"]
+    for name, value in report["latency"].items():
+        before = baseline["latency"].get(name)
+        if before and value > before * (1 + tolerance):
+            regressions.append(f"{name} {before:.2f} -> {value:.2f} ({(value / before - 1) * 100:+.0f}%)")
+    before = baseline["throughput_per_s"]
+    if report["throughput_per_s"] < before * (1 - tolerance):
+        regressions.append(f"throughput {before:.2f} -> {report['throughput_per_s']:.2f} turns/s")
+    # Call counts are deterministic, so any increase is a change in behaviour
+    for name in ("api_calls_per_turn", "llm_calls_per_turn"):
+        if report[name] > baseline[name]:
+            regressions.append(f"{name} {baseline[name]} -> {report[name]}")
+    if report["failed"] > baseline["failed"]:
+        regressions.append(f"failed turns {baseline['failed']} -> {report['failed']}")
+    heap, heap_before = report.get("heap_peak_per_turn_mb"), baseline.get("heap_peak_per_turn_mb")
+    if heap and heap_before and heap["max"] > heap_before["max"] * (1 + tolerance):
+        regressions.append(f"heap peak per turn {heap_before['max']} -> {heap['max']} MB")
+    return regressions
+
+
+def print_report(report):
+    settings = report["settings"]
+    print(f"{settings['turns']} turns, {settings['concurrency']} at a time, {settings['rows']:,} rows per object, "
+          f"Salesforce {settings['sf_latency'] * 1000:.0f} ms, LLM {settings['llm_latency'] * 1000:.0f} ms, cache {'on' if settings['cache'] else 'off'}")
+    latency = report["latency"]
+    print(f"  latency        p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+    print(f"  throughput     {report['throughput_per_s']:.1f} turns/s")
+    print(f"  failed turns   {report['failed']}")
+    for error in report["errors"]:
+        print(f"                 {error[:100]}")
+    calls = ", ".join(f"{name} {count}" for name, count in sorted(report["api_calls"].items()))
+    print(f"  API calls      {report['api_calls_per_turn']:.2f} per turn ({calls})")
+    print(f"  LLM calls      {report['llm_calls_per_turn']:.2f} per turn")
+    print(f"  memory         peak RSS {report['peak_rss_mb']:.0f} MB", end="")
+    if "heap_peak_per_turn_mb" in report:
+        heap = report["heap_peak_per_turn_mb"]
+        print(f", heap per turn p50 {heap['p50']:.2f} MB, max {heap['max']:.2f} MB")
+    else:
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded chat workloads against local Salesforce and Gemini stand-ins")
+    parser.add_argument("--workload", help="file of prompts, one per line or JSON lines with a \"prompt\" key (default: logged prompts, queries and presets)")
+    parser.add_argument("--log", default=LOG_FILE, help="log to take the default workload from")
+    parser.add_argument("--rows", type=int, default=2000, help="records per object (default 2000)")
+    parser.add_argument("--page-size", type=int, default=2000, help="records per query page (default 2000)")
+    parser.add_argument("--sf-latency", type=float, default=0.0, help="seconds per Salesforce request (default 0)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per LLM call (default 0)")
+    parser.add_argument("--concurrency", type=int, default=1, help="simulated users, and job workers (default 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="times to run the workload (default 1)")
+    parser.add_argument("--cache", action="store_true", help="keep the in-process caches on")
+    parser.add_argument("--no-memory", action="store_true", help="skip the per-turn heap measurement pass")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the report as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a saved baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative slowdown allowed against the baseline (default 0.2)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    prompts = load_workload(args.workload) if args.workload else default_workload(args.log)
+    report = run_replay(prompts, rows=args.rows, page_size=args.page_size, sf_latency=args.sf_latency, llm_latency=args.llm_latency,
+                        concurrency=args.concurrency, repeat=args.repeat, cache=args.cache, memory=not args.no_memory)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
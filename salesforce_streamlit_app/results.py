@@ -0,0 +1,249 @@
+"""Columnar query results backed by Apache Arrow
+
+Salesforce returns records as JSON dicts, each carrying an ``attributes`` dict
+and repeating every field name. QueryResult turns each page straight into an
+Arrow record batch instead: relationship fields are flattened (Account.Name),
+dates and datetimes get real date/timestamp types, booleans and numbers keep
+theirs, and low-cardinality text such as picklists is dictionary-encoded.
+The raw JSON shape is only rebuilt when something asks for it.
+"""
+import datetime
+import json
+import logging
+import re
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Text columns with at most this share of distinct values are dictionary-encoded,
+# once a page has enough values for the dictionary to pay off
+DICTIONARY_MAX_RATIO = 0.5
+DICTIONARY_MAX_VALUES = 1024
+DICTIONARY_MIN_VALUES = 20
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})$")
+
+_TIMESTAMP = pa.timestamp("ms", tz="UTC")
+_PICKLIST = pa.dictionary(pa.int32(), pa.string())
+
+
+def flatten_record(record, prefix="", out=None):
+    """Drop attributes and flatten relationship dicts into dotted keys (Account.Name)"""
+    out = {} if out is None else out
+    for key, value in record.items():
+        if key == "attributes":
+            continue
+        if isinstance(value, dict) and "attributes" in value:
+            flatten_record(value, f"{prefix}{key}.", out)
+        else:
+            out[f"{prefix}{key}"] = value
+    return out
+
+
+def _infer_type(values):
+    """Arrow type for one column of JSON values"""
+    present = [v for v in values if v is not None]
+    if not present:
+        return pa.string()
+    kinds = {type(v) for v in present}
+    if kinds == {bool}:
+        return pa.bool_()
+    if kinds == {int}:
+        return pa.int64()
+    if kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {str}:
+        if all(_DATE.match(v) for v in present):
+            return pa.date32()
+        if all(_DATETIME.match(v) for v in present):
+            return _TIMESTAMP
+        distinct = len(set(present))
+        if len(present) >= DICTIONARY_MIN_VALUES and distinct <= min(DICTIONARY_MAX_VALUES, len(present) * DICTIONARY_MAX_RATIO):
+            return _PICKLIST
+        return pa.string()
+    # Compound fields (addresses, geolocations) and mixed values are kept as JSON text
+    return pa.string()
+
+
+def _wider_type(arrow_type, values):
+    """The type a column widens to when a later page's values don't fit it
+
+    Whole numbers that turn out to have fractions become floats, so a column
+    such as Amount stays numeric; anything else becomes text.
+    """
+    if arrow_type == pa.int64() and all(v is None or type(v) in (int, float) for v in values):
+        return pa.float64()
+    return pa.string()
+
+
+def _to_array(values, arrow_type):
+    """Build a typed array, raising if the values don't fit the type"""
+    if arrow_type == pa.date32():
+        return pa.array(values, pa.string()).cast(pa.date32())
+    if arrow_type == _TIMESTAMP:
+        parsed = pd.to_datetime(pd.Series(values, dtype=object), utc=True, format="ISO8601")
+        return pa.array(parsed, _TIMESTAMP)
+    if arrow_type == _PICKLIST:
+        return pa.array(values, pa.string()).dictionary_encode()
+    if arrow_type == pa.string():
+        return pa.array([v if v is None or isinstance(v, str) else json.dumps(v) if isinstance(v, (dict, list)) else str(v) for v in values], pa.string())
+    if arrow_type == pa.int64() and any(type(v) is float for v in values):
+        # pyarrow would truncate 2.5 to 2 rather than refuse it
+        raise TypeError("Fractional values in an integer column")
+    return pa.array(values, arrow_type)
+
+
+class ResultBuilder:
+    """Accumulates pages of records as Arrow batches, one page at a time
+
+    The first page fixes each column's type; a later page that doesn't fit
+    (say a number column that turns out to hold text) widens that column to
+    string across every batch. Columns that only appear on later pages are
+    back-filled with nulls.
+    """
+
+    def __init__(self):
+        self.types = {}
+        self.batches = []
+        self.sobject = None
+        self.rows = 0
+
+    def add_page(self, records):
+        if not records:
+            return
+        if self.sobject is None:
+            self.sobject = records[0].get("attributes", {}).get("type")
+
+        flat = [flatten_record(r) for r in records]
+        names = list(dict.fromkeys(name for r in flat for name in r))
+        arrays = {}
+        for name in names:
+            values = [r.get(name) for r in flat]
+            arrow_type = self.types.get(name)
+            if arrow_type is None:
+                arrow_type = self.types[name] = _infer_type(values)
+            try:
+                arrays[name] = _to_array(values, arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError, TypeError):
+                wider = _wider_type(arrow_type, values)
+                self._widen(name, wider)
+                arrays[name] = _to_array(values, wider)
+        self.batches.append(pa.RecordBatch.from_pydict(arrays))
+        self.rows += len(records)
+
+    def _widen(self, name, arrow_type=None):
+        """Change a column's type, plain strings by default, in the type map and every earlier batch"""
+        arrow_type = arrow_type or pa.string()
+        logger.info(f"Widening column {name} from {self.types[name]} to {arrow_type}")
+        self.types[name] = arrow_type
+        for i, batch in enumerate(self.batches):
+            if name in batch.schema.names:
+                index = batch.schema.get_field_index(name)
+                column = batch.column(index)
+                if pa.types.is_dictionary(column.type):
+                    column = column.dictionary_decode()
+                self.batches[i] = batch.set_column(index, name, column.cast(arrow_type))
+
+    def _schema(self):
+        names = list(self.types)
+        # A null relationship comes through as a bare "Account" column next to "Account.Name"
+        names = [n for n in names if not (self._all_null(n) and any(m.startswith(f"{n}.") for m in names))]
+        return pa.schema([(n, self.types[n]) for n in names])
+
+    def _all_null(self, name):
+        return all(batch.column(name).null_count == len(batch) for batch in self.batches if name in batch.schema.names)
+
+    def build(self):
+        """Finish and return the QueryResult"""
+        schema = self._schema()
+        batches = []
+        for batch in self.batches:
+            columns = []
+            for field in schema:
+                if field.name in batch.schema.names:
+                    columns.append(batch.column(field.name))
+                else:
+                    columns.append(pa.nulls(len(batch), field.type))
+            batches.append(pa.RecordBatch.from_arrays(columns, schema=schema))
+        return QueryResult(pa.Table.from_batches(batches, schema=schema), sobject=self.sobject)
+
+
+class QueryResult:
+    """A query result as an Arrow table, convertible to pandas and back to raw JSON on demand"""
+
+    def __init__(self, table, sobject=None):
+        self.table = table
+        self.sobject = sobject
+
+    @classmethod
+    def from_pages(cls, pages):
+        builder = ResultBuilder()
+        for page in pages:
+            builder.add_page(page)
+        return builder.build()
+
+    @classmethod
+    def from_records(cls, records):
+        return cls.from_pages([records])
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def to_pandas(self):
+        """DataFrame view of the table
+
+        Numeric columns without nulls are converted without copying, text stays
+        Arrow-backed through pandas' string dtype, picklists become categoricals
+        and dates become datetime64 rather than Python date objects.
+        """
+        return self.table.to_pandas(split_blocks=True, date_as_object=False)
+
+    def raw_records(self):
+        """Rebuild Salesforce-shaped JSON records (nested relationships, attributes)"""
+        return unflatten_records(self.table.to_pylist(), self.sobject)
+
+
+def json_value(value):
+    """Plain JSON value for a cell read back out of a frame (NaN/NA become None, dates ISO strings)"""
+    if value is pd.NaT or value is pd.NA or value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, "item") and not isinstance(value, (pd.Timestamp, datetime.date)):
+        # numpy scalars
+        return json_value(value.item())
+    if isinstance(value, pd.Timestamp) and value.tzinfo is None and value == value.normalize():
+        # Date fields come back from pandas as naive midnight timestamps
+        return value.date().isoformat()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def unflatten_records(rows, sobject=None):
+    """Turn flat rows with dotted keys back into nested Salesforce-style records"""
+    records = []
+    for row in rows:
+        record = {"attributes": {"type": sobject}} if sobject else {}
+        for key, value in row.items():
+            target = record
+            *parents, leaf = key.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = json_value(value)
+        records.append(record)
+    return records
+
+
+def raw_json_records(df, sobject=None):
+    """Raw-JSON view of a result frame, built only when someone asks to see it"""
+    return unflatten_records(df.to_dict(orient="records"), sobject)
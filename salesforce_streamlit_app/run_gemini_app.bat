@@ -1,4 +1,6 @@
 @echo off
 echo Starting Salesforce Gemini Assistant...
+rem With a shared CACHE_URL, prefetch the preset queries before the server takes traffic
+python warmup.py
 streamlit run gemini_salesforce_app.py
 pause
\ No newline at end of file
@@ -1,3 +1,5 @@
 #!/bin/bash
 echo "Starting Salesforce Gemini Assistant..."
-streamlit run gemini_salesforce_app.py 
\ No newline at end of file
+# With a shared CACHE_URL, prefetch the preset queries before the server takes traffic
+python warmup.py
+streamlit run gemini_salesforce_app.py
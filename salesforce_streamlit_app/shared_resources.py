@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# Lives with the cache helpers so Streamlit-free code can scope by credentials too
+from cache import credential_scope  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open per host in the shared HTTP pool
+HTTP_POOL_SIZE = 32
+
+# Salesforce sessions expire, so shared clients are rebuilt after this many seconds
+SALESFORCE_CLIENT_TTL = 3600
+
+
+def frame_fingerprint(df):
+    """Stable content hash of a DataFrame"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    try:
+        hashed = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Raw records can still hold nested dicts, which pandas can't hash
+        hashed = pd.util.hash_pandas_object(df.astype(str), index=False)
+    digest.update(hashed.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ResultStore:
+    """Process-wide store of immutable result frames shared between sessions
+
+    Frames are content-addressed within a credential scope, so sessions logged
+    in as the same user that fetch the same data hold one copy. Each session
+    (owner) takes a reference per use; a frame is dropped once nobody holds it.
+    Stored frames must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames = {}
+        self._holders = defaultdict(set)
+        self._owned = defaultdict(Counter)
+
+    def put(self, frame, scope, owner):
+        """Store a frame (or reuse an identical one) and take a reference for owner"""
+        key = f"{scope}-{frame_fingerprint(frame)}"
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = (frame, int(frame.memory_usage(deep=True).sum()))
+            self._owned[owner][key] += 1
+            self._holders[key].add(owner)
+        return key
+
+    def get(self, key):
+        """Return the frame for key, or None if it has been released"""
+        entry = self._frames.get(key)
+        return entry[0] if entry else None
+
+    def release(self, owner, key):
+        """Drop one of owner's references to key"""
+        with self._lock:
+            owned = self._owned.get(owner)
+            if not owned or not owned[key]:
+                return
+            owned[key] -= 1
+            if owned[key] == 0:
+                del owned[key]
+                self._drop_holder(owner, key)
+            if not owned:
+                del self._owned[owner]
+
+    def release_owner(self, owner):
+        """Drop every reference owner holds, e.g. when its session goes away"""
+        with self._lock:
+            for key in self._owned.pop(owner, {}):
+                self._drop_holder(owner, key)
+
+    def _drop_holder(self, owner, key):
+        holders = self._holders[key]
+        holders.discard(owner)
+        if not holders:
+            del self._holders[key]
+            self._frames.pop(key, None)
+
+    def usage(self, owner):
+        """Memory accounting for one owner, with shared frames split between their holders"""
+        with self._lock:
+            keys = list(self._owned.get(owner, {}))
+            sizes = [(self._frames[k][1], len(self._holders[k])) for k in keys if k in self._frames]
+        return {
+            "frames": len(sizes),
+            "referenced_bytes": sum(size for size, _ in sizes),
+            "attributed_bytes": sum(size / holders for size, holders in sizes),
+            "shared_frames": sum(1 for _, holders in sizes if holders > 1),
+        }
+
+    def stats(self):
+        """Totals for the whole process"""
+        with self._lock:
+            return {
+                "frames": len(self._frames),
+                "bytes": sum(size for _, size in self._frames.values()),
+                "owners": len(self._owned),
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_store():
+    """The process-wide ResultStore"""
+    return ResultStore()
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """One pooled requests.Session shared by every session in the process"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_resource(show_spinner=False, ttl=SALESFORCE_CLIENT_TTL)
+def get_salesforce_client(username, password, security_token, domain):
+    """Salesforce client shared by every session logged in with the same credentials
+
+    connect_salesforce reuses a session the process already opened for the
+    credentials and logs in again if Salesforce revokes it.
+    """
+    from chatbot_engine import connect_salesforce
+
+    logger.info(f"Creating shared Salesforce client for {username} ({domain})")
+    return connect_salesforce(username, password, security_token, domain, session=get_http_session())
+
+
+def format_bytes(size):
+    """Human readable byte count for the memory readouts"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
@@ -1,25 +1,22 @@
 import streamlit as st
 import pandas as pd
 import os
-import json
-import requests
 from dotenv import load_dotenv
-from simple_salesforce import Salesforce
 import logging
-from arcgis.gis import GIS
-from arcgis.geocoding import geocode
-from arcgis.geometry import Point
-from arcgis.mapping import WebMap
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("salesforce_arcgis.log"),
-        logging.StreamHandler()
-    ]
-)
+import uuid
+from map_features import build_feature_collection, build_full_address
+from map_tiles import MAX_ZOOM, MapTileIndex, viewport_bbox
+from cache import GEOCODE_CACHE_TTL, cache_key, credential_scope, get_cache
+from chatbot_engine import cached_query_pages, format_records
+from dml import INSERT, UPDATE, DmlEngine
+from exports import download_buttons
+from jobs import DONE, get_job_runner, poll_pending_jobs, track_job
+from log_config import setup_logging
+from results import json_value
+from shared_resources import frame_fingerprint
+
+# Set up logging: JSON lines to a rotating log file, written from a background thread
+setup_logging("salesforce_arcgis.log")
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -38,17 +35,36 @@ ARCGIS_PASSWORD = os.getenv("ARCGIS_PASSWORD", "")
 # For public access without credentials
 USE_PUBLIC_ACCESS = True
 
+# The arcgis package takes seconds to import, so it is only imported once the
+# Location Intelligence tab actually fetches, geocodes or maps something
+
+# Objects and fields offered in the edit and create tabs
+EDITABLE_FIELDS = {
+    "Account": ["Id", "Name", "Industry", "Phone", "Website", "AnnualRevenue"],
+    "Contact": ["Id", "FirstName", "LastName", "Email", "Phone"],
+    "Opportunity": ["Id", "Name", "StageName", "Amount", "CloseDate"],
+}
+
+@st.cache_resource(show_spinner=False)
+def get_anonymous_gis():
+    """Anonymous ArcGIS Online connection shared by every session"""
+    from arcgis.gis import GIS
+
+    return GIS()
+
 def create_arcgis_connection():
     """Connect to ArcGIS Online"""
     try:
         if USE_PUBLIC_ACCESS:
-            # Connect anonymously to ArcGIS Online
-            gis = GIS()
+            # Connect anonymously to ArcGIS Online, sharing one connection per process
+            gis = get_anonymous_gis()
             st.session_state.gis = gis
             logger.info("Connected to ArcGIS Online anonymously")
             return True
         else:
             # Connect with credentials
+            from arcgis.gis import GIS
+
             gis = GIS("https://www.arcgis.com", ARCGIS_USERNAME, ARCGIS_PASSWORD)
             st.session_state.gis = gis
             logger.info(f"Connected to ArcGIS Online as {ARCGIS_USERNAME}")
@@ -58,98 +74,160 @@ def create_arcgis_connection():
         return False
 
 def geocode_address(address):
-    """Geocode an address using ArcGIS geocoding service"""
+    """Geocode an address using ArcGIS geocoding service, sharing results through the cache"""
+    cache = get_cache("geocode", GEOCODE_CACHE_TTL)
+    key = cache_key(address)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
     try:
+        from arcgis.geocoding import geocode
+
         location = geocode(address)[0]
-        return {
+        result = {
             'address': location['address'],
-            'location': location['location'],
+            'location': dict(location['location']),
             'score': location['score']
         }
+        cache.set(key, result)
+        return result
     except Exception as e:
         logger.error(f"Geocoding failed for {address}: {str(e)}")
         return None
 
-def display_arcgis_map(df, location_field='geocoded_location'):
-    """Display accounts on an ArcGIS map"""
-    try:
-        # Create a new map centered on the average of all points
-        if df.empty or location_field not in df.columns:
-            st.warning("No geocoded data available to display on map")
-            return
+def render_features(features):
+    """Render point features into a WebMap and embed it in the page"""
+    if not features:
+        st.warning("No features to display on map")
+        return False
 
-        # Filter out rows with no location data
-        map_df = df.dropna(subset=[location_field])
-        
-        if map_df.empty:
+    from arcgis.mapping import WebMap
+
+    # Create a new WebMap and add the feature collection to it
+    wm = WebMap()
+    wm.add_layer(build_feature_collection(features))
+    
+    # Get HTML for the map and display in Streamlit
+    map_html = wm._repr_html_()
+    st.components.v1.html(map_html, height=600)
+    return True
+
+def display_map_viewport(index):
+    """Display only the tiles of the account index that fall inside the chosen viewport"""
+    try:
+        if len(index) == 0:
             st.warning("No valid location data found")
-            return
-
-        # Create a feature collection from the dataframe
-        features = []
-        for _, row in map_df.iterrows():
-            if row[location_field] and isinstance(row[location_field], dict):
-                point_geom = row[location_field]['location']
-                attributes = {k: str(v) for k, v in row.items() if k != location_field}
-                attributes['display_name'] = row.get('Name', 'Unknown')
-                
-                feature = {
-                    'geometry': point_geom,
-                    'attributes': attributes
-                }
-                features.append(feature)
-
-        # Create a new WebMap
-        wm = WebMap()
-        
-        # Add the feature collection to the map
-        if features:
-            # Create a feature collection
-            feature_collection = {
-                'featureCollection': {
-                    'layers': [{
-                        'layerDefinition': {
-                            'name': 'Accounts',
-                            'geometryType': 'esriGeometryPoint'
-                        },
-                        'featureSet': {
-                            'features': features,
-                            'geometryType': 'esriGeometryPoint'
-                        }
-                    }]
-                }
-            }
-            
-            # Add the feature collection to the map
-            wm.add_layer(feature_collection)
-            
-            # Get HTML for the map
-            map_html = wm._repr_html_()
-            
-            # Display in Streamlit
-            st.components.v1.html(map_html, height=600)
-            
-            return True
-        else:
-            st.warning("No features to display on map")
             return False
+
+        min_lon, min_lat, max_lon, max_lat = index.bounds()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            center_lon = st.number_input("Center longitude", -180.0, 180.0, (min_lon + max_lon) / 2, key="map_center_lon")
+        with col2:
+            center_lat = st.number_input("Center latitude", -85.0, 85.0, (min_lat + max_lat) / 2, key="map_center_lat")
+        with col3:
+            zoom = st.slider("Zoom", 0, MAX_ZOOM, 4, key="map_zoom")
+
+        bbox = viewport_bbox(center_lon, center_lat, zoom)
+        features = index.query(bbox, zoom)
+        st.caption(f"Showing {len(features)} points and clusters from {len(index)} geocoded accounts")
+        return render_features(features)
     except Exception as e:
-        logger.error(f"Error displaying map: {str(e)}")
+        logger.error(f"Error displaying map viewport: {str(e)}")
         st.error(f"Error displaying map: {str(e)}")
         return False
 
+def session_scope():
+    """This browser session and its Salesforce login, as a prefix for job keys"""
+    sf = st.session_state.get('sf')
+    session = st.session_state.setdefault('job_session', uuid.uuid4().hex)
+    return f"{session}:{credential_scope(getattr(sf, 'sf_instance', ''), getattr(sf, 'session_id', ''))}"
+
+def geocode_accounts(job, df):
+    """Background job: geocode each account's address, reporting progress per account"""
+    df = df.copy()
+    df['geocoded_location'] = None
+    for i, (idx, row) in enumerate(df.iterrows()):
+        job.report(i / len(df), f"Geocoding: {row['Name']}")
+        if row['full_address']:
+            geo_result = geocode_address(row['full_address'])
+            if geo_result:
+                df.at[idx, 'geocoded_location'] = geo_result
+                df.at[idx, 'longitude'] = geo_result['location']['x']
+                df.at[idx, 'latitude'] = geo_result['location']['y']
+    return df
+
+def deliver_geocoding_job(job):
+    """Keep a finished geocoding job's accounts and index them for the map"""
+    if job.status != DONE:
+        st.session_state.geocoding_error = job.error
+        return
+    df = job.result
+    st.session_state.pop('geocoding_error', None)
+    st.session_state.geocoded_accounts = df
+    # Index the locations into tiles so the map only loads the current viewport
+    st.session_state.map_index = MapTileIndex(df)
+
+def deliver_write_job(job):
+    """Keep a finished write's per-record results; the loaded records are stale after it"""
+    if job.status != DONE:
+        st.session_state.write_error = job.error
+        return
+    st.session_state.pop('write_error', None)
+    st.session_state.write_result = job.result
+    st.session_state.pop('edit_records', None)
+
+def deliver_job(job):
+    if job.key and job.key.startswith("dml:"):
+        deliver_write_job(job)
+    else:
+        deliver_geocoding_job(job)
+
+@st.fragment(run_every=1.0)
+def show_job_progress():
+    """Poll this session's geocoding and write jobs, rerunning the app once one finishes"""
+    if poll_pending_jobs(deliver_job):
+        st.rerun()
+
+def display_geocoded_accounts(df):
+    """Show the geocoded account table, regional summaries and downloads"""
+    # Show data table
+    with st.expander("Account Data"):
+        st.dataframe(df.drop(columns=['geocoded_location']))
+    
+    # Show accounts by region
+    st.subheader("Accounts by Region")
+    
+    # Create a simple choropleth or summary by state/region
+    if 'BillingState' in df.columns:
+        state_counts = df['BillingState'].value_counts()
+        st.bar_chart(state_counts)
+        
+        # Sort by revenue
+        if 'AnnualRevenue' in df.columns:
+            state_revenue = df.groupby('BillingState')['AnnualRevenue'].sum().sort_values(ascending=False)
+            st.subheader("Annual Revenue by State")
+            st.bar_chart(state_revenue)
+    
+    # Option to download the data
+    download_buttons(df.drop(columns=['geocoded_location']), "account_locations.csv", key="account_locations")
+
 # Add this to your existing Streamlit app
-def add_arcgis_tab():
+def run_query(sf, query):
+    """Every record of a query, read through the shared query cache that writes invalidate"""
+    return [record for page, _, _ in cached_query_pages(sf, query) for record in page]
+
+def add_arcgis_tab(sf):
     """Add the ArcGIS mapping tab to the app"""
     st.header("🗺️ Account Location Explorer")
     
-    # Initialize ArcGIS connection if not already done
-    if 'gis' not in st.session_state:
-        create_arcgis_connection()
-    
     # Fetch Accounts with address information
     if st.button("Fetch Accounts with Location Data"):
-        with st.spinner("Fetching account data and geocoding..."):
+        # Initialize ArcGIS connection if not already done; geocoding uses it
+        if 'gis' not in st.session_state:
+            create_arcgis_connection()
+        
+        with st.spinner("Fetching account data..."):
             try:
                 # Query Salesforce for accounts with address information
                 query = """
@@ -159,74 +237,108 @@ def add_arcgis_tab():
                     WHERE BillingStreet != NULL OR BillingCity != NULL
                     LIMIT 25
                 """
-                accounts = run_query(query)
+                accounts = run_query(sf, query)
                 
                 if accounts:
                     # Format the records
                     df = format_records(accounts)
+                    df['full_address'] = build_full_address(df)
                     
-                    # Add a geocoding progress bar
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Geocode the addresses
-                    df['geocoded_location'] = None
-                    df['full_address'] = df.apply(
-                        lambda row: ", ".join([
-                            str(row.get(f, "")) for f in 
-                            ['BillingStreet', 'BillingCity', 'BillingState', 'BillingPostalCode', 'BillingCountry'] 
-                            if row.get(f)
-                        ]), 
-                        axis=1
+                    # Geocode in the background so widget interactions don't lose the work;
+                    # the same accounts for the same session reuse a running job
+                    job = get_job_runner().submit(
+                        geocode_accounts, df,
+                        label="Geocoding accounts",
+                        key=f"geocode:{session_scope()}:{frame_fingerprint(df)}"
                     )
-                    
-                    # Geocode each address
-                    for i, (idx, row) in enumerate(df.iterrows()):
-                        if row['full_address']:
-                            status_text.text(f"Geocoding: {row['Name']}")
-                            geo_result = geocode_address(row['full_address'])
-                            if geo_result:
-                                df.at[idx, 'geocoded_location'] = geo_result
-                        
-                        # Update progress
-                        progress_bar.progress((i + 1) / len(df))
-                    
-                    status_text.text("Geocoding complete!")
-                    progress_bar.progress(100)
-                    
-                    # Store the geocoded data in session state
-                    st.session_state.geocoded_accounts = df
-                    
-                    # Show data table
-                    with st.expander("Account Data"):
-                        st.dataframe(df.drop(columns=['geocoded_location']))
-                    
-                    # Display map
-                    st.subheader("Account Locations")
-                    display_arcgis_map(df)
-                    
-                    # Show accounts by region
-                    st.subheader("Accounts by Region")
-                    
-                    # Create a simple choropleth or summary by state/region
-                    if 'BillingState' in df.columns:
-                        state_counts = df['BillingState'].value_counts()
-                        st.bar_chart(state_counts)
-                        
-                        # Sort by revenue
-                        if 'AnnualRevenue' in df.columns:
-                            state_revenue = df.groupby('BillingState')['AnnualRevenue'].sum().sort_values(ascending=False)
-                            st.subheader("Annual Revenue by State")
-                            st.bar_chart(state_revenue)
-                    
-                    # Option to download the data
-                    csv = df.drop(columns=['geocoded_location']).to_csv(index=False)
-                    st.download_button("Download Account Location Data", csv, "account_locations.csv", "text/csv")
+                    track_job(job)
                 else:
                     st.warning("No accounts found with address information.")
             except Exception as e:
                 st.error(f"Error loading ArcGIS map: {str(e)}")
                 logger.error(f"Error loading ArcGIS map: {str(e)}")
+    
+    if 'geocoding_error' in st.session_state:
+        st.error(f"Geocoding stopped: {st.session_state.geocoding_error}")
+    
+    # Results and map are kept outside the button so viewport changes don't refetch
+    if 'geocoded_accounts' in st.session_state:
+        display_geocoded_accounts(st.session_state.geocoded_accounts)
+    
+    if 'map_index' in st.session_state:
+        st.subheader("Account Locations")
+        display_map_viewport(st.session_state.map_index)
+
+def write_records(job, sf, operation, sobject, records):
+    """Background job: write records in batches through the DML engine, reporting progress per batch"""
+    return DmlEngine(sf).run(operation, sobject, records, progress=job.report)
+
+def submit_write(sf, operation, sobject, records):
+    # A double click while the first save is still running reuses it; once it
+    # finishes, saving the same edits again writes again
+    job = get_job_runner().submit(
+        write_records, sf, operation, sobject, records,
+        label=f"Saving {len(records)} {sobject} records",
+        key=f"dml:{session_scope()}:{operation}:{cache_key(sobject, records)}"
+    )
+    track_job(job)
+
+def changed_records(original, edited):
+    """Id plus only the changed fields for each row edited in st.data_editor"""
+    changes = []
+    for idx in edited.index:
+        fields = {
+            column: json_value(edited.at[idx, column])
+            for column in edited.columns
+            if column != 'Id' and json_value(edited.at[idx, column]) != json_value(original.at[idx, column])
+        }
+        if fields:
+            changes.append({'Id': original.at[idx, 'Id'], **fields})
+    return changes
+
+def show_write_result():
+    if 'write_error' in st.session_state:
+        st.error(f"Saving stopped: {st.session_state.write_error}")
+    result = st.session_state.get('write_result')
+    if result is None:
+        return
+    if result.ok:
+        st.success(result.summary())
+    else:
+        st.warning(result.summary())
+        failures = result.to_frame()
+        st.dataframe(failures[~failures['success']], hide_index=True)
+
+def edit_records_tab(sf):
+    """Edit loaded records in a grid and save every change in batched writes"""
+    sobject = st.selectbox("Object", list(EDITABLE_FIELDS), key="edit_sobject")
+    if st.button("Load Records"):
+        query = f"SELECT {', '.join(EDITABLE_FIELDS[sobject])} FROM {sobject} ORDER BY LastModifiedDate DESC LIMIT 200"
+        st.session_state.edit_records = (sobject, format_records(run_query(sf, query)))
+    
+    if 'edit_records' in st.session_state:
+        loaded, original = st.session_state.edit_records
+        edited = st.data_editor(original, disabled=['Id'], hide_index=True, key=f"editor_{loaded}")
+        changes = changed_records(original, edited)
+        if st.button(f"Save {len(changes)} changed records", disabled=not changes):
+            submit_write(sf, UPDATE, loaded, changes)
+    
+    show_write_result()
+
+def create_records_tab(sf):
+    """Enter new records as rows of a grid and insert them together"""
+    sobject = st.selectbox("Object", list(EDITABLE_FIELDS), key="create_sobject")
+    fields = [f for f in EDITABLE_FIELDS[sobject] if f != 'Id']
+    new_rows = st.data_editor(pd.DataFrame(columns=fields), num_rows="dynamic", key=f"new_{sobject}")
+    records = []
+    for row in new_rows.to_dict(orient="records"):
+        record = {field: json_value(value) for field, value in row.items() if json_value(value) not in (None, "")}
+        if record:
+            records.append(record)
+    if st.button(f"Create {len(records)} records", disabled=not records):
+        submit_write(sf, INSERT, sobject, records)
+    
+    show_write_result()
 
 # Add to the main part of your app
 def main():
@@ -237,20 +349,22 @@ def main():
         # Data Selection Section
         st.header("📊 Data Explorer")
         
+        # Geocoding and record writes run as background jobs polled from here
+        if st.session_state.get('pending_jobs'):
+            show_job_progress()
+        
         # Add the ArcGIS tab to your existing tabs
         tabs = st.tabs(["View & Edit Data", "Create New Records", "Location Intelligence"])
         
         with tabs[0]:
-            # Your existing "View & Edit Data" tab code
-            pass
+            edit_records_tab(st.session_state.sf)
         
         with tabs[1]:
-            # Your existing "Create New Records" tab code
-            pass
+            create_records_tab(st.session_state.sf)
         
         with tabs[2]:
             # This is the new tab for ArcGIS integration
-            add_arcgis_tab()
+            add_arcgis_tab(st.session_state.sf)
     else:
         st.info("Please log in to Salesforce using the sidebar.")
         
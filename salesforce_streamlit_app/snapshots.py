@@ -0,0 +1,448 @@
+"""Versioned, content-addressed snapshots of query results
+
+Replaces the salesforce_<intent>_data.json dumps an earlier flow wrote:
+pretty-printed, full of per-record attributes, and overwritten on every
+run. A snapshot is the result's Arrow table in an IPC file, compressed per
+buffer (zstd by default). The file is named by a digest of the table's
+content, so fetching the same data again adds a version without writing
+another file. An SQLite index holds the metadata of every version: scope,
+query and its fingerprint, intent, fetch time, row count, columns and size.
+
+Reads memory-map the file. With SNAPSHOT_COMPRESSION=none they are
+zero-copy, so a large snapshot opens in about the time it takes to read
+its footer. Compressed buffers are decompressed as they are read.
+
+    python snapshots.py list [--query SOQL]
+    python snapshots.py show ID
+    python snapshots.py diff OLD_ID NEW_ID
+    python snapshots.py import salesforce_*_data.json
+    python snapshots.py prune --keep 5 --max-age 604800 --max-bytes 104857600
+
+Settings, from the environment:
+
+    SNAPSHOTS              1 records every answered query (default 0, off)
+    SNAPSHOT_DIR           snapshots
+    SNAPSHOT_COMPRESSION   zstd, lz4 or none
+    SNAPSHOT_KEEP          versions kept per query and scope (default 20)
+    SNAPSHOT_MAX_AGE       versions older than this are dropped, seconds (default 30 days; 0 keeps them)
+    SNAPSHOT_MAX_BYTES     oldest versions are dropped while the files take more (default 1 GiB; 0 for no cap)
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from query_stats import fingerprint
+from results import QueryResult
+
+logger = logging.getLogger(__name__)
+
+# Every answered query writes a file, so recording is opt-in
+SNAPSHOTS_ENABLED = os.getenv("SNAPSHOTS", "0") in ("1", "true", "yes")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "zstd")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "20"))
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", str(30 * 24 * 3600)))
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", str(1024 ** 3)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    query_key TEXT NOT NULL,
+    query TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    intent TEXT,
+    sobject TEXT,
+    digest TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    columns TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_query ON snapshots (scope, query_key, fetched_at);
+CREATE INDEX IF NOT EXISTS snapshots_digest ON snapshots (digest);
+"""
+
+_FIELDS = ("id", "scope", "query_key", "query", "fingerprint", "intent", "sobject", "digest", "rows", "columns", "bytes", "fetched_at")
+
+_LEGACY_DUMP = re.compile(r"salesforce_(.+)_data\.json$")
+
+
+def query_key(query):
+    """The query with whitespace collapsed; unlike the fingerprint, literals still count"""
+    return " ".join(query.split())
+
+
+class Snapshot:
+    """Metadata of one stored version of a query's result"""
+
+    __slots__ = _FIELDS
+
+    def __init__(self, **fields):
+        for name in _FIELDS:
+            setattr(self, name, fields.get(name))
+        if isinstance(self.columns, str):
+            self.columns = json.loads(self.columns)
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in _FIELDS}
+
+    def __repr__(self):
+        fetched = datetime.fromtimestamp(self.fetched_at, timezone.utc).isoformat(timespec="seconds")
+        return f"<Snapshot {self.id} {self.fingerprint} {self.rows} rows at {fetched}>"
+
+
+class _HashingSink:
+    """File-like object that only digests what is written to it"""
+
+    def __init__(self):
+        self.digest = hashlib.blake2b(digest_size=20)
+        self.closed = False
+
+    def write(self, data):
+        self.digest.update(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def content_digest(table):
+    """Digest of a table's schema and values, the same however its rows are chunked"""
+    sink = _HashingSink()
+    table = table.combine_chunks()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.digest.hexdigest()
+
+
+def _as_table(result):
+    if isinstance(result, QueryResult):
+        return result.table, result.sobject
+    if isinstance(result, pd.DataFrame):
+        return pa.Table.from_pandas(result, preserve_index=False), None
+    return result, None
+
+
+class SnapshotStore:
+    """Snapshot files under root plus their SQLite index, safe to share between threads and processes
+
+    Like cache.SQLiteBackend, the index runs in WAL mode with a connection
+    per thread. Files are written to a temporary name and renamed into
+    place, so a reader never sees half a snapshot.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR, compression=SNAPSHOT_COMPRESSION, keep=SNAPSHOT_KEEP,
+                 max_age=SNAPSHOT_MAX_AGE, max_bytes=SNAPSHOT_MAX_BYTES):
+        self.root = root
+        self.compression = None if compression in ("", "none") else compression
+        self.keep = keep
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.arrow")
+
+    def _write(self, table, digest):
+        path = self.path(digest)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with pa.ipc.new_file(f, table.schema, options=pa.ipc.IpcWriteOptions(compression=self.compression)) as writer:
+                    writer.write_table(table)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return os.path.getsize(path)
+
+    def save(self, result, query, scope="", intent=None, fetched_at=None):
+        """Store a result (QueryResult, DataFrame or Arrow table) as the query's newest version"""
+        table, sobject = _as_table(result)
+        digest = content_digest(table)
+        size = self._write(table, digest)
+        snapshot = Snapshot(
+            scope=scope, query_key=query_key(query), query=query.strip(), fingerprint=fingerprint(query), intent=intent,
+            sobject=sobject, digest=digest, rows=table.num_rows, columns=table.column_names, bytes=size,
+            fetched_at=fetched_at if fetched_at is not None else time.time(),
+        )
+        cursor = self._connection().execute(
+            f"INSERT INTO snapshots ({', '.join(_FIELDS[1:])}) VALUES ({', '.join('?' * (len(_FIELDS) - 1))})",
+            [json.dumps(v) if name == "columns" else v for name, v in zip(_FIELDS[1:], (getattr(snapshot, n) for n in _FIELDS[1:]))],
+        )
+        snapshot.id = cursor.lastrowid
+        if self.keep:
+            self.prune(self.keep, scope=scope, query=query)
+        if self.max_age or self.max_bytes:
+            self.expire(self.max_age, self.max_bytes)
+        return snapshot
+
+    def _select(self, where="", params=(), limit=None):
+        sql = f"SELECT * FROM snapshots {where} ORDER BY fetched_at DESC, id DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [Snapshot(**dict(row)) for row in self._connection().execute(sql, params)]
+
+    def get(self, snapshot_id):
+        found = self._select("WHERE id = ?", (snapshot_id,))
+        return found[0] if found else None
+
+    def latest(self, query, scope=""):
+        """The newest snapshot of a query in a scope, or None"""
+        found = self._select("WHERE scope = ? AND query_key = ?", (scope, query_key(query)), limit=1)
+        return found[0] if found else None
+
+    def history(self, query=None, scope=None, limit=None):
+        """Snapshots newest first, of one query or all of them, in one scope or all of them"""
+        clauses, params = [], []
+        if query is not None:
+            clauses.append("query_key = ?")
+            params.append(query_key(query))
+        if scope is not None:
+            clauses.append("scope = ?")
+            params.append(scope)
+        return self._select(f"WHERE {' AND '.join(clauses)}" if clauses else "", params, limit)
+
+    def read_table(self, snapshot):
+        """The snapshot's Arrow table, read through a memory map"""
+        with pa.memory_map(self.path(snapshot.digest)) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def read(self, snapshot):
+        """The snapshot as a QueryResult, ready for to_pandas like a fresh one"""
+        return QueryResult(self.read_table(snapshot), sobject=snapshot.sobject)
+
+    def diff(self, old, new, key="Id"):
+        """What changed between two snapshots of a query
+
+        Rows are matched on key when both have it, and on their whole
+        content otherwise (aggregate results have no Id). Returns counts
+        plus the added, removed and changed rows as frames.
+        """
+        before, after = self.read(old).to_pandas(), self.read(new).to_pandas()
+        if key in before.columns and key in after.columns:
+            merged = before.merge(after, on=key, how="outer", suffixes=("_old", ""), indicator=True)
+            added = after[after[key].isin(merged.loc[merged["_merge"] == "right_only", key])]
+            removed = before[before[key].isin(merged.loc[merged["_merge"] == "left_only", key])]
+            both = merged[merged["_merge"] == "both"]
+            shared = [c for c in after.columns if c != key and c in before.columns]
+            mask = pd.Series(False, index=both.index)
+            for column in shared:
+                old_values, new_values = both[f"{column}_old"], both[column]
+                mask |= ~((old_values == new_values).fillna(False) | (old_values.isna() & new_values.isna()))
+            changed = after[after[key].isin(both.loc[mask, key])]
+        else:
+            columns = [c for c in after.columns if c in before.columns]
+            merged = before[columns].astype(str).merge(after[columns].astype(str), how="outer", indicator=True)
+            added = merged[merged["_merge"] == "right_only"].drop(columns="_merge")
+            removed = merged[merged["_merge"] == "left_only"].drop(columns="_merge")
+            changed = after.iloc[0:0]
+        return {
+            "same": old.digest == new.digest,
+            "added": len(added), "removed": len(removed), "changed": len(changed),
+            "columns_added": [c for c in after.columns if c not in before.columns],
+            "columns_removed": [c for c in before.columns if c not in after.columns],
+            "added_rows": added, "removed_rows": removed, "changed_rows": changed,
+        }
+
+    def prune(self, keep=SNAPSHOT_KEEP, scope=None, query=None):
+        """Keep the newest `keep` versions per query and scope, deleting files nothing refers to any more"""
+        conn = self._connection()
+        clauses, params = [], []
+        if scope is not None:
+            clauses.append("scope = ?")
+            params.append(scope)
+        if query is not None:
+            clauses.append("query_key = ?")
+            params.append(query_key(query))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        stale = conn.execute(f"""
+            SELECT id, digest FROM (
+                SELECT id, digest, ROW_NUMBER() OVER (PARTITION BY scope, query_key ORDER BY fetched_at DESC, id DESC) AS n
+                FROM snapshots {where}
+            ) WHERE n > ?""", (*params, keep)).fetchall()
+        return self._delete(stale)
+
+    def expire(self, max_age=SNAPSHOT_MAX_AGE, max_bytes=SNAPSHOT_MAX_BYTES, now=None):
+        """Drop versions older than max_age seconds, then the oldest ones while the files take more than max_bytes"""
+        conn = self._connection()
+        removed = 0
+        if max_age:
+            cutoff = (now if now is not None else time.time()) - max_age
+            removed += self._delete(conn.execute("SELECT id, digest FROM snapshots WHERE fetched_at < ?", (cutoff,)).fetchall())
+        if max_bytes:
+            # Files are shared between versions, so count each digest once
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM (SELECT MAX(bytes) AS bytes FROM snapshots GROUP BY digest)").fetchone()[0]
+            if total > max_bytes:
+                # A file is only freed once every version using it is gone
+                users = dict(conn.execute("SELECT digest, COUNT(*) FROM snapshots GROUP BY digest").fetchall())
+                stale = []
+                for row in conn.execute("SELECT id, digest, bytes FROM snapshots ORDER BY fetched_at, id").fetchall():
+                    if total <= max_bytes:
+                        break
+                    stale.append(row)
+                    users[row["digest"]] -= 1
+                    if not users[row["digest"]]:
+                        total -= row["bytes"]
+                removed += self._delete(stale)
+        return removed
+
+    def _delete(self, rows):
+        """Delete versions by id, and the files no remaining version refers to"""
+        if not rows:
+            return 0
+        conn = self._connection()
+        conn.executemany("DELETE FROM snapshots WHERE id = ?", [(row["id"],) for row in rows])
+        for digest in {row["digest"] for row in rows}:
+            if conn.execute("SELECT 1 FROM snapshots WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+        return len(rows)
+
+    def import_json(self, path, query=None, scope="", intent=None):
+        """Store one of the old salesforce_<intent>_data.json dumps as a snapshot, fetched when it was written"""
+        match = _LEGACY_DUMP.search(os.path.basename(path))
+        intent = intent or (match.group(1) if match else None)
+        if query is None:
+            from chatbot_engine import get_default_queries
+
+            query = get_default_queries().get(intent) or f"-- imported from {os.path.basename(path)}"
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+        return self.save(QueryResult.from_records(records), query, scope, intent, fetched_at=os.path.getmtime(path))
+
+    def stats(self):
+        row = self._connection().execute("SELECT COUNT(*) AS versions, COUNT(DISTINCT digest) AS files, COUNT(DISTINCT scope || query_key) AS queries FROM snapshots").fetchone()
+        on_disk = 0
+        for directory, _, files in os.walk(os.path.join(self.root, "objects")):
+            on_disk += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return {**dict(row), "bytes": on_disk}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """The process-wide SnapshotStore under SNAPSHOT_DIR, created on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+        return _store
+
+
+def record_snapshot(result, query, scope="", intent=None):
+    """Snapshot a freshly fetched result if snapshots are on; a failure is logged, never raised"""
+    if not SNAPSHOTS_ENABLED:
+        return None
+    try:
+        return get_snapshot_store().save(result, query, scope, intent)
+    except Exception as e:
+        logger.warning(f"Could not snapshot query result: {str(e)}")
+        return None
+
+
+def _print_snapshots(snapshots):
+    for s in snapshots:
+        fetched = datetime.fromtimestamp(s.fetched_at).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{s.id:>6}  {fetched}  {s.fingerprint}  {s.rows:>8,} rows  {s.bytes / 1024:>8.1f} KiB  {s.digest[:10]}  {(s.intent or '-'):<22} {s.query_key[:60]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and manage query result snapshots")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help=f"snapshot directory (default {SNAPSHOT_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="snapshots, newest first")
+    listing.add_argument("--query", help="only versions of this query")
+    listing.add_argument("--limit", type=int, default=50)
+    show = commands.add_parser("show", help="print a snapshot's rows")
+    show.add_argument("id", type=int)
+    show.add_argument("--rows", type=int, default=20)
+    diff = commands.add_parser("diff", help="compare two snapshots of a query")
+    diff.add_argument("old", type=int)
+    diff.add_argument("new", type=int)
+    diff.add_argument("--key", default="Id", help="column rows are matched on (default Id)")
+    imports = commands.add_parser("import", help="store old salesforce_<intent>_data.json dumps as snapshots")
+    imports.add_argument("paths", nargs="+")
+    prune = commands.add_parser("prune", help="drop old versions and the files only they used")
+    prune.add_argument("--keep", type=int, default=SNAPSHOT_KEEP)
+    prune.add_argument("--max-age", type=float, default=SNAPSHOT_MAX_AGE, help="seconds (0 keeps every age)")
+    prune.add_argument("--max-bytes", type=int, default=SNAPSHOT_MAX_BYTES, help="0 for no size cap")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.dir)
+    if args.command == "list":
+        _print_snapshots(store.history(args.query, limit=args.limit))
+        stats = store.stats()
+        print(f"{stats['versions']} versions of {stats['queries']} queries in {stats['files']} files, {stats['bytes'] / 1024:.1f} KiB")
+    elif args.command == "show":
+        snapshot = store.get(args.id)
+        if snapshot is None:
+            parser.error(f"No snapshot {args.id}")
+        _print_snapshots([snapshot])
+        print(store.read(snapshot).to_pandas().head(args.rows).to_string())
+    elif args.command == "diff":
+        old, new = store.get(args.old), store.get(args.new)
+        if old is None or new is None:
+            parser.error("Both snapshots must exist")
+        changes = store.diff(old, new, args.key)
+        if changes["same"]:
+            print("Identical content")
+            return 0
+        print(f"{changes['added']} added, {changes['removed']} removed, {changes['changed']} changed rows")
+        for label in ("columns_added", "columns_removed"):
+            if changes[label]:
+                print(f"{label.replace('_', ' ')}: {', '.join(changes[label])}")
+        for label in ("added_rows", "removed_rows", "changed_rows"):
+            if len(changes[label]):
+                print(f"\n{label.replace('_', ' ').capitalize()}:\n{changes[label].head(20).to_string()}")
+    elif args.command == "import":
+        for path in args.paths:
+            snapshot = store.import_json(path)
+            json_size = os.path.getsize(path)
+            print(f"{path}: {snapshot.rows} rows, {json_size / 1024:.1f} KiB of JSON -> snapshot {snapshot.id} ({snapshot.bytes / 1024:.1f} KiB)")
+    elif args.command == "prune":
+        print(f"Removed {store.prune(args.keep) + store.expire(args.max_age, args.max_bytes)} old versions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
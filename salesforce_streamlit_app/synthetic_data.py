@@ -0,0 +1,494 @@
+"""Synthetic Salesforce datasets for scale testing
+
+    python synthetic_data.py --accounts 100000                      # every format into synthetic/
+    python synthetic_data.py --accounts 1000000 --format parquet --out /data/sf
+    python synthetic_data.py --accounts 1000 --opportunities 10000000 --format csv
+
+Generates Accounts with billing addresses and coordinates, Opportunities,
+Contacts, College__c and Student__c. Every field of a record is a pure
+function of the seed and the record's position, so any slice of an object
+can be generated on its own. Lookups stay consistent that way: an
+Opportunity's AccountId and Account.Name come from the same function that
+generates that Account.
+
+Output formats:
+- json: REST query pages as Salesforce returns them (totalSize, done,
+  nextRecordsUrl, records with attributes and nested relationship
+  fields), one file per page;
+- csv: one Bulk API 2.0 style CSV per object, relationship fields as
+  Account.Name columns, booleans as true/false and empty cells for nulls;
+- parquet: one Parquet file per object, with typed dates.
+
+Objects are generated and written in chunks of --chunk-rows, so memory
+stays flat from 10^3 to 10^7 rows.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_VERSION = "59.0"
+
+# Rows generated and written at a time, which bounds memory whatever the dataset size
+CHUNK_ROWS = 100_000
+
+# Records per REST query page, Salesforce's default batch size
+PAGE_SIZE = 2000
+
+FORMATS = ["json", "csv", "parquet"]
+
+# Related records per account, and students per college, unless sizes are given
+OPPORTUNITIES_PER_ACCOUNT = 4
+CONTACTS_PER_ACCOUNT = 3
+ACCOUNTS_PER_COLLEGE = 100
+STUDENTS_PER_COLLEGE = 200
+
+# Key prefixes of the standard objects; the custom ones match the recorded Student__c ids
+KEY_PREFIXES = {"Account": "001", "Contact": "003", "Opportunity": "006", "College__c": "a00", "Student__c": "a01"}
+
+# Fields holding a date, or a date and time; Parquet keeps them typed, text formats get Salesforce's formats
+DATE_FIELDS = {"CloseDate", "Enrollment_Date__c"}
+DATETIME_FIELDS = {"CreatedDate"}
+
+# Lookups written as nested relationship objects in JSON pages: column -> (relationship, sObject)
+RELATIONSHIPS = {"Account.Name": ("Account", "Account"), "College__r.Name": ("College__r", "College__c")}
+
+EPOCH = np.datetime64("2023-01-01", "D")
+TODAY = np.datetime64("2025-06-30", "D")
+
+INDUSTRIES = ["Technology", "Education", "Energy", "Retail", "Healthcare", "Finance", "Manufacturing", "Media", "Transportation", "Hospitality"]
+ACCOUNT_TYPES = ["Customer - Direct", "Customer - Channel", "Prospect", "Partner"]
+NAME_WORDS = ["Acme", "Global", "United", "Pioneer", "Summit", "Blue", "Red", "Silver", "North", "Pacific", "Atlantic", "Apex",
+              "Bright", "Cedar", "Delta", "Eagle", "Falcon", "Granite", "Harbor", "Iron", "Juniper", "Keystone", "Liberty",
+              "Maple", "Nova", "Orion", "Prime", "Quantum", "River", "Sierra", "Titan", "Vertex", "Willow", "Zenith"]
+NAME_SUFFIXES = ["Systems", "Dynamics", "Labs", "Holdings", "Partners", "Industries", "Solutions", "Networks", "Energy",
+                 "Logistics", "Health", "Media", "Foods", "Capital", "Motors", "Works"]
+LEGAL_FORMS = ["Inc", "LLC", "Corp", "Group", "Ltd"]
+STREETS = ["Main St", "Market St", "Oak Ave", "Pine St", "Maple Ave", "Cedar Rd", "Elm St", "Washington Blvd", "Lake Dr",
+           "Park Ave", "Broadway", "Mission St", "Highland Ave", "Sunset Blvd", "Industrial Pkwy"]
+
+# City, state, ZIP prefix, latitude, longitude and a weight by population
+CITIES = [
+    ("New York", "NY", "100", 40.7128, -74.0060, 8.3), ("Los Angeles", "CA", "900", 34.0522, -118.2437, 3.9),
+    ("Chicago", "IL", "606", 41.8781, -87.6298, 2.7), ("Houston", "TX", "770", 29.7604, -95.3698, 2.3),
+    ("Phoenix", "AZ", "850", 33.4484, -112.0740, 1.6), ("Philadelphia", "PA", "191", 39.9526, -75.1652, 1.6),
+    ("San Antonio", "TX", "782", 29.4241, -98.4936, 1.4), ("San Diego", "CA", "921", 32.7157, -117.1611, 1.4),
+    ("Dallas", "TX", "752", 32.7767, -96.7970, 1.3), ("Austin", "TX", "787", 30.2672, -97.7431, 1.0),
+    ("San Jose", "CA", "951", 37.3382, -121.8863, 1.0), ("Seattle", "WA", "981", 47.6062, -122.3321, 0.7),
+    ("Denver", "CO", "802", 39.7392, -104.9903, 0.7), ("Boston", "MA", "021", 42.3601, -71.0589, 0.7),
+    ("Atlanta", "GA", "303", 33.7490, -84.3880, 0.5), ("Miami", "FL", "331", 25.7617, -80.1918, 0.5),
+    ("San Francisco", "CA", "941", 37.7749, -122.4194, 0.8), ("Portland", "OR", "972", 45.5152, -122.6784, 0.6),
+    ("Nashville", "TN", "372", 36.1627, -86.7816, 0.7), ("Detroit", "MI", "482", 42.3314, -83.0458, 0.6),
+    ("Minneapolis", "MN", "554", 44.9778, -93.2650, 0.4), ("Charlotte", "NC", "282", 35.2271, -80.8431, 0.9),
+    ("Columbus", "OH", "432", 39.9612, -82.9988, 0.9), ("Salt Lake City", "UT", "841", 40.7608, -111.8910, 0.2),
+]
+
+# The stages mock_services uses, with Salesforce's default probabilities and how common each is
+STAGES = ["Prospecting", "Qualification", "Needs Analysis", "Proposal/Price Quote", "Negotiation/Review", "Closed Won", "Closed Lost"]
+STAGE_PROBABILITY = [10, 10, 20, 75, 90, 100, 0]
+STAGE_WEIGHTS = [0.12, 0.10, 0.08, 0.07, 0.05, 0.33, 0.25]
+OPPORTUNITY_TYPES = ["New Customer", "Existing Customer - Upgrade", "Existing Customer - Replacement", "Existing Customer - Downgrade"]
+LEAD_SOURCES = ["Web", "Phone Inquiry", "Partner Referral", "Purchased List", "Other"]
+PRODUCTS = ["Platform License", "Support Renewal", "Implementation", "Expansion", "Training", "Consulting", "Add-on Seats"]
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William",
+               "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Aayush", "Priya", "Wei", "Fatima",
+               "Carlos", "Sofia", "Utkarsh", "Ananya", "Kenji", "Amara", "Luca", "Olga"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Jain",
+              "Patel", "Chen", "Kim", "Nguyen", "Watson", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor",
+              "Moore", "Jackson", "Martin", "Lee", "Singh", "Khan", "Rossi", "Ivanova"]
+TITLES = ["CEO", "CFO", "VP Sales", "VP Marketing", "Director of IT", "Procurement Manager", "Operations Manager",
+          "Account Manager", "Engineer", "Analyst"]
+COLLEGE_KINDS = ["Community College", "State University", "Institute of Technology", "College", "School of Business"]
+COLLEGE_TYPES = ["Public", "Private", "Community"]
+
+
+def dataset_sizes(accounts, opportunities=None, contacts=None, colleges=None, students=None):
+    """Row counts per object, with related objects scaled to the number of accounts unless given"""
+    colleges = colleges if colleges is not None else max(accounts // ACCOUNTS_PER_COLLEGE, 10)
+    return {
+        "Account": accounts,
+        "Opportunity": opportunities if opportunities is not None else accounts * OPPORTUNITIES_PER_ACCOUNT,
+        "Contact": contacts if contacts is not None else accounts * CONTACTS_PER_ACCOUNT,
+        "College__c": colleges,
+        "Student__c": students if students is not None else colleges * STUDENTS_PER_COLLEGE,
+    }
+
+
+_U64 = np.uint64
+
+
+def _hash(index, seed, field):
+    """splitmix64 of each position, salted per seed and field, so every field is independent and reproducible"""
+    salt = zlib.crc32(f"{seed}:{field}".encode()) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF
+    z = index.astype(_U64) + _U64(salt)
+    z = (z ^ (z >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return z ^ (z >> _U64(31))
+
+
+def _unit(index, seed, field):
+    """Uniform floats in [0, 1)"""
+    return (_hash(index, seed, field) >> _U64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def _integers(index, seed, field, low, high):
+    """Uniform integers in [low, high)"""
+    return (low + _hash(index, seed, field) % _U64(high - low)).astype(np.int64)
+
+
+def _normal(index, seed, field):
+    """Standard normal values, by Box-Muller"""
+    u1 = 1.0 - _unit(index, seed, field + ":1")
+    u2 = _unit(index, seed, field + ":2")
+    return np.sqrt(-2.0 * np.log(u1)) * np.cos(2.0 * np.pi * u2)
+
+
+def _positions(index, seed, field, weights):
+    """Weighted choice of positions into a list of options"""
+    cumulative = np.cumsum(weights, dtype=np.float64)
+    return np.searchsorted(cumulative / cumulative[-1], _unit(index, seed, field), side="right")
+
+
+def _pick(index, seed, field, options, weights=None):
+    options = np.asarray(options, dtype=object)
+    if weights is None:
+        return options[_hash(index, seed, field) % _U64(len(options))]
+    return options[_positions(index, seed, field, weights)]
+
+
+def _ids(sobject, index):
+    """18-character record ids in the object's key prefix"""
+    return np.char.add(KEY_PREFIXES[sobject], _digits(index, 15)).astype(object)
+
+
+def _digits(values, width):
+    return np.char.zfill(values.astype(str), width)
+
+
+def _phones(index, seed, field):
+    """US numbers as (555) 123-4567"""
+    area = _integers(index, seed, field + ":area", 201, 990)
+    number = _integers(index, seed, field, 2_000_000, 10_000_000)
+    text = np.char.add(np.char.add("(", area.astype(str)), ") ")
+    text = np.char.add(np.char.add(text, _digits(number // 10_000, 3)), "-")
+    return np.char.add(text, _digits(number % 10_000, 4)).astype(object)
+
+
+def _with_nulls(values, index, seed, field, rate):
+    values = values.astype(object)
+    values[_unit(index, seed, field + ":null") < rate] = None
+    return values
+
+
+def account_columns(index, seed):
+    """Account fields for the accounts at these positions, the ones lookups into accounts need included"""
+    seed = f"{seed}:Account"
+    first = _pick(index, seed, "name1", NAME_WORDS)
+    second = _pick(index, seed, "name2", NAME_SUFFIXES)
+    form = _pick(index, seed, "form", LEGAL_FORMS)
+    name = first + " " + second + " " + form
+    website = "www." + np.char.lower((first + second).astype(str)).astype(object) + ".com"
+    return {"Name": name, "Website": website}
+
+
+def college_names(index, seed):
+    """College names and city positions for the colleges at these positions"""
+    seed = f"{seed}:College__c"
+    city = _positions(index, seed, "city", [c[5] for c in CITIES])
+    kind = _pick(index, seed, "kind", COLLEGE_KINDS)
+    return np.array([c[0] for c in CITIES], dtype=object)[city] + " " + kind, city
+
+
+def _accounts(index, sizes, seed):
+    dataset_seed, seed = seed, f"{seed}:Account"
+    columns = account_columns(index, dataset_seed)
+    city = _positions(index, seed, "city", [c[5] for c in CITIES])
+    table = list(zip(*CITIES))
+    # Lognormal revenue, from tens of thousands to hundreds of millions, in thousands
+    revenue = np.round(np.exp(15.0 + 1.8 * _normal(index, seed, "revenue")), -3)
+    return {
+        "Id": _ids("Account", index),
+        "Name": columns["Name"],
+        "Type": _pick(index, seed, "type", ACCOUNT_TYPES, [5, 2, 3, 1]),
+        "Industry": _pick(index, seed, "industry", INDUSTRIES),
+        "AnnualRevenue": revenue,
+        "NumberOfEmployees": np.maximum(revenue // 250_000, 1).astype(np.int64),
+        "Phone": _phones(index, seed, "phone"),
+        "Website": _with_nulls(columns["Website"], index, seed, "website", 0.1),
+        "BillingStreet": np.char.add(_integers(index, seed, "street_number", 1, 9999).astype(str), " ").astype(object) + _pick(index, seed, "street", STREETS),
+        "BillingCity": np.array(table[0], dtype=object)[city],
+        "BillingState": np.array(table[1], dtype=object)[city],
+        "BillingPostalCode": np.array(table[2], dtype=object)[city] + _digits(_integers(index, seed, "zip", 0, 100), 2).astype(object),
+        "BillingCountry": np.full(len(index), "USA", dtype=object),
+        # Scattered around the city centre, so maps and tiles see realistic clusters
+        "BillingLatitude": np.round(np.array(table[3])[city] + 0.08 * _normal(index, seed, "lat"), 6),
+        "BillingLongitude": np.round(np.array(table[4])[city] + 0.08 * _normal(index, seed, "lon"), 6),
+        "CreatedDate": _datetimes(index, seed, "created", EPOCH - 3 * 365, EPOCH),
+    }
+
+
+def _datetimes(index, seed, field, start, stop):
+    days = _integers(index, seed, field, 0, int((stop - start).astype(int)))
+    seconds = _integers(index, seed, field + ":time", 8 * 3600, 19 * 3600)
+    return start.astype("datetime64[s]") + days * 86400 + seconds
+
+
+def _opportunities(index, sizes, seed):
+    dataset_seed, seed = seed, f"{seed}:Opportunity"
+    account = _integers(index, seed, "account", 0, sizes["Account"])
+    accounts = account_columns(account, dataset_seed)
+    stage = _positions(index, seed, "stage", STAGE_WEIGHTS)
+    closed = stage >= STAGES.index("Closed Won")
+    # Closed deals closed in the past, open ones are expected to close within the next nine months
+    past = EPOCH + _integers(index, seed, "close_past", 0, int((TODAY - EPOCH).astype(int)))
+    future = TODAY + _integers(index, seed, "close_future", 1, 270)
+    close_date = np.where(closed, past, future)
+    created = close_date.astype("datetime64[s]") - _integers(index, seed, "cycle", 15 * 86400, 270 * 86400)
+    return {
+        "Id": _ids("Opportunity", index),
+        "Name": accounts["Name"] + " - " + _pick(index, seed, "product", PRODUCTS),
+        "AccountId": _ids("Account", account),
+        "Account.Name": accounts["Name"],
+        "StageName": np.array(STAGES, dtype=object)[stage],
+        "Probability": np.array(STAGE_PROBABILITY, dtype=np.float64)[stage],
+        "Amount": np.round(np.exp(10.3 + 1.1 * _normal(index, seed, "amount")), -2),
+        "CloseDate": close_date,
+        "IsClosed": closed,
+        "IsWon": stage == STAGES.index("Closed Won"),
+        "Type": _pick(index, seed, "type", OPPORTUNITY_TYPES, [4, 3, 2, 1]),
+        "LeadSource": _pick(index, seed, "lead_source", LEAD_SOURCES),
+        "CreatedDate": created,
+    }
+
+
+def _people(index, seed):
+    first = _pick(index, seed, "first_name", FIRST_NAMES)
+    last = _pick(index, seed, "last_name", LAST_NAMES)
+    handle = np.char.lower((first + "." + last).astype(str)).astype(object) + index.astype(str).astype(object)
+    return first, last, handle
+
+
+def _contacts(index, sizes, seed):
+    dataset_seed, seed = seed, f"{seed}:Contact"
+    account = _integers(index, seed, "account", 0, sizes["Account"])
+    accounts = account_columns(account, dataset_seed)
+    first, last, handle = _people(index, seed)
+    domain = np.array([w[4:] if w else "example.com" for w in accounts["Website"]], dtype=object)
+    return {
+        "Id": _ids("Contact", index),
+        "FirstName": first,
+        "LastName": last,
+        "Name": first + " " + last,
+        "Title": _pick(index, seed, "title", TITLES),
+        "Email": handle + "@" + domain,
+        "Phone": _with_nulls(_phones(index, seed, "phone"), index, seed, "phone", 0.3),
+        "AccountId": _ids("Account", account),
+        "Account.Name": accounts["Name"],
+        "CreatedDate": _datetimes(index, seed, "created", EPOCH - 365, TODAY),
+    }
+
+
+def _colleges(index, sizes, seed):
+    dataset_seed, seed = seed, f"{seed}:College__c"
+    name, city = college_names(index, dataset_seed)
+    table = list(zip(*CITIES))
+    return {
+        "Id": _ids("College__c", index),
+        "Name": name,
+        "City__c": np.array(table[0], dtype=object)[city],
+        "State__c": np.array(table[1], dtype=object)[city],
+        "Type__c": _pick(index, seed, "type", COLLEGE_TYPES, [5, 3, 2]),
+        "CreatedDate": _datetimes(index, seed, "created", EPOCH - 5 * 365, EPOCH),
+    }
+
+
+def _students(index, sizes, seed):
+    dataset_seed, seed = seed, f"{seed}:Student__c"
+    college = _integers(index, seed, "college", 0, sizes["College__c"])
+    first, last, handle = _people(index, seed)
+    return {
+        "Id": _ids("Student__c", index),
+        "Name": np.char.add("S-", _digits(index, 8)).astype(object),
+        "First_Name__c": first,
+        "Last_Name__c": last,
+        "Email__c": handle + "@students.example.edu",
+        "College__c": _ids("College__c", college),
+        "College__r.Name": college_names(college, dataset_seed)[0],
+        "Enrollment_Date__c": EPOCH - 3 * 365 + _integers(index, seed, "enrolled", 0, 4 * 365),
+        "GPA__c": np.round(np.clip(3.0 + 0.5 * _normal(index, seed, "gpa"), 0.0, 4.0), 2),
+        "CreatedDate": _datetimes(index, seed, "created", EPOCH - 3 * 365, TODAY),
+    }
+
+
+GENERATORS = {
+    "Account": _accounts,
+    "Opportunity": _opportunities,
+    "Contact": _contacts,
+    "College__c": _colleges,
+    "Student__c": _students,
+}
+
+
+def generate(sobject, start, stop, sizes, seed=0):
+    """Records start to stop of an object as a DataFrame, relationship fields as Account.Name columns"""
+    index = np.arange(start, stop, dtype=np.int64)
+    return pd.DataFrame(GENERATORS[sobject](index, sizes, seed))
+
+
+def iter_frames(sobject, sizes, seed=0, chunk_rows=CHUNK_ROWS):
+    """Every record of an object, chunk_rows at a time"""
+    for start in range(0, sizes[sobject], chunk_rows):
+        yield generate(sobject, start, min(start + chunk_rows, sizes[sobject]), sizes, seed)
+
+
+def as_text(frame):
+    """Dates and times in Salesforce's text formats"""
+    frame = frame.copy()
+    for name in frame.columns:
+        if name in DATE_FIELDS:
+            frame[name] = np.datetime_as_string(frame[name].to_numpy().astype("datetime64[D]"), unit="D")
+        elif name in DATETIME_FIELDS:
+            frame[name] = np.char.add(np.datetime_as_string(frame[name].to_numpy().astype("datetime64[s]"), unit="s"), ".000+0000")
+    return frame
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def page_records(sobject, frame):
+    """A frame's rows as REST API records: attributes first, relationship fields nested"""
+    relationships = [(column, *RELATIONSHIPS[column]) for column in frame.columns if column in RELATIONSHIPS]
+    frame = as_text(frame)
+    names = list(frame.columns)
+    # Column lists zipped into dicts, several times faster than DataFrame.to_dict
+    records = []
+    for row in zip(*(frame[name].tolist() for name in names)):
+        record = {"attributes": {"type": sobject, "url": f"/services/data/v{API_VERSION}/sobjects/{sobject}/{row[0]}"}}
+        record.update(zip(names, row))
+        for column, relationship, related in relationships:
+            record[relationship] = {"attributes": {"type": related}, "Name": record.pop(column)}
+        records.append(record)
+    return records
+
+
+def write_json_pages(sobject, frames, total, directory, page_size=PAGE_SIZE):
+    """Write frames as numbered query pages, the way a query for every record would return them"""
+    os.makedirs(directory, exist_ok=True)
+    offset, files, size = 0, 0, 0
+    pending = None
+    for frame in frames:
+        pending = frame if pending is None else pd.concat([pending, frame], ignore_index=True)
+        while len(pending) >= page_size or (offset + len(pending) == total and len(pending)):
+            page, pending = pending.iloc[:page_size], pending.iloc[page_size:]
+            offset += len(page)
+            body = {"totalSize": total, "done": offset >= total, "records": page_records(sobject, page)}
+            if offset < total:
+                body["nextRecordsUrl"] = f"/services/data/v{API_VERSION}/query/{sobject}-{offset}"
+            path = os.path.join(directory, f"{files:06d}.json")
+            with open(path, "wb") as f:
+                f.write(_dumps(body))
+            files += 1
+            size += os.path.getsize(path)
+    return files, size
+
+
+def write_bulk_csv(frames, path):
+    """Write frames as one Bulk API 2.0 style CSV: a header row, true/false booleans, empty cells for nulls"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    writer = schema = None
+    try:
+        for frame in frames:
+            table = pa.Table.from_pandas(as_text(frame), schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema.remove_metadata()
+                # Arrow's CSV writer runs several times faster than DataFrame.to_csv
+                writer = pa_csv.CSVWriter(path, schema, write_options=pa_csv.WriteOptions(quoting_style="needed"))
+            writer.write_table(table.replace_schema_metadata(None))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_object(sobject, fmt, sizes, directory, seed=0, chunk_rows=CHUNK_ROWS, page_size=PAGE_SIZE):
+    """Generate one object straight into one format; returns (files, bytes)"""
+    from exports import write_parquet
+
+    frames = iter_frames(sobject, sizes, seed, chunk_rows)
+    if fmt == "json":
+        return write_json_pages(sobject, frames, sizes[sobject], os.path.join(directory, "json", sobject), page_size)
+    os.makedirs(os.path.join(directory, fmt), exist_ok=True)
+    path = os.path.join(directory, fmt, f"{sobject}.{fmt}")
+    if fmt == "csv":
+        write_bulk_csv(frames, path)
+    elif fmt == "parquet":
+        with open(path, "wb") as f:
+            write_parquet(frames, f)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}. Choose from: {', '.join(FORMATS)}")
+    return 1, os.path.getsize(path)
+
+
+def write_dataset(directory, sizes, formats=FORMATS, seed=0, chunk_rows=CHUNK_ROWS, page_size=PAGE_SIZE, progress=None):
+    """Write every object with rows in every format; returns one summary row per object and format"""
+    summary = []
+    for sobject, rows in sizes.items():
+        if not rows:
+            continue
+        for fmt in formats:
+            start = time.perf_counter()
+            files, size = write_object(sobject, fmt, sizes, directory, seed, chunk_rows, page_size)
+            elapsed = time.perf_counter() - start
+            row = {"sobject": sobject, "format": fmt, "rows": rows, "files": files, "bytes": size, "seconds": round(elapsed, 2)}
+            summary.append(row)
+            if progress:
+                progress(row)
+    return summary
+
+
+def _print_row(row):
+    rate = row["rows"] / row["seconds"] if row["seconds"] else float("inf")
+    print(f"{row['sobject']:>12} {row['format']:>8} {row['rows']:>12,} rows {row['files']:>7,} files {row['bytes'] / 2**20:>10.1f} MiB "
+          f"{row['seconds']:>8.2f} s {rate:>12,.0f} rows/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic, referentially consistent Salesforce dataset")
+    parser.add_argument("--accounts", type=int, default=10_000, help="accounts; other objects scale with it unless given (default 10000)")
+    parser.add_argument("--opportunities", type=int, help=f"opportunities (default {OPPORTUNITIES_PER_ACCOUNT} per account)")
+    parser.add_argument("--contacts", type=int, help=f"contacts (default {CONTACTS_PER_ACCOUNT} per account)")
+    parser.add_argument("--colleges", type=int, help=f"College__c records (default one per {ACCOUNTS_PER_COLLEGE} accounts, at least 10)")
+    parser.add_argument("--students", type=int, help=f"Student__c records (default {STUDENTS_PER_COLLEGE} per college)")
+    parser.add_argument("--format", default=",".join(FORMATS), help=f"comma-separated formats (default {','.join(FORMATS)})")
+    parser.add_argument("--out", default="synthetic", help="output directory (default synthetic)")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed gives the same data (default 0)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help=f"rows generated at a time (default {CHUNK_ROWS})")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help=f"records per JSON page (default {PAGE_SIZE})")
+    args = parser.parse_args(argv)
+
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"Unknown format {', '.join(sorted(unknown))}. Choose from: {', '.join(FORMATS)}")
+    sizes = dataset_sizes(args.accounts, args.opportunities, args.contacts, args.colleges, args.students)
+    write_dataset(args.out, sizes, formats, args.seed, args.chunk_rows, args.page_size, progress=_print_row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
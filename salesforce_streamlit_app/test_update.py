@@ -2,16 +2,11 @@ from simple_salesforce import Salesforce
 import logging
 import os
 from dotenv import load_dotenv
+from dml import DmlEngine
+from log_config import setup_logging
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("test_update.log"),
-        logging.StreamHandler()
-    ]
-)
+# Set up logging: JSON lines to a rotating log file, written from a background thread
+setup_logging("test_update.log")
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -57,17 +52,15 @@ def main():
         
         logger.info(f"Updating Account {account_id} with data: {update_data}")
         
-        # Get the Account object and update the record
+        # Write through the DML engine: one sObject Collections call covers up to 200 records
         try:
-            # Method 1: Using object attribute
-            result = sf.Account.update(account_id, update_data)
-            logger.info(f"Update result (method 1): {result}")
+            result = DmlEngine(sf).update('Account', [{'Id': account_id, **update_data}])
+            logger.info(f"Update result: {result.results}")
             
-            # Method 2: Using generic update
-            # result = sf.update('Account', account_id, update_data)
-            # logger.info(f"Update result (method 2): {result}")
-            
-            logger.info("Update appears to be successful!")
+            if result.ok:
+                logger.info("Update appears to be successful!")
+            else:
+                logger.error(f"Error updating record: {result.failed[0].errors}")
         except Exception as e:
             logger.error(f"Error updating record: {str(e)}")
             
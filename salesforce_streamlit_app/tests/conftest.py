@@ -0,0 +1,25 @@
+"""Tests run against the mocks in mock_services.py, with no network or credentials
+
+    cd salesforce_streamlit_app && python -m pytest tests
+"""
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def memory_cache():
+    """A fresh process-local cache per test, so no test sees another's results"""
+    from cache import MemoryBackend, set_backend
+
+    set_backend(MemoryBackend())
+    yield
+
+
+@pytest.fixture(autouse=True)
+def quiet_logging():
+    logging.getLogger().setLevel(logging.WARNING)
@@ -0,0 +1,149 @@
+import json
+import time
+
+import pytest
+
+import chatbot_engine.advisor as advisor
+import log_config
+from chatbot_engine.advisor import BLOCKED, REWRITTEN, RUN, UNCHECKED, WARNED, advise, rewrite_problem
+from mock_services import FakeLLM, FakeResponse, MockSalesforce
+
+# Filters on an unindexed field, so the mock explain endpoint plans a costly table scan
+SCAN = "SELECT Id, Name FROM Opportunity WHERE StageName = 'Closed Won' ORDER BY Name"
+BY_COLLEGE = "SELECT Id, First_Name__c FROM Student__c WHERE College__r.Name = 'College A'"
+
+
+class CannedModel:
+    """Answers every rewrite request with the same query"""
+
+    def __init__(self, query):
+        self.query = query
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        return FakeResponse(json.dumps({"intent": "custom_query", "query": self.query, "explanation": "canned"}))
+
+
+@pytest.fixture(autouse=True)
+def no_advisor_log(monkeypatch):
+    monkeypatch.setattr(advisor, "ADVISOR_LOG", None)
+
+
+def large_org():
+    return MockSalesforce(latency=0, table_rows=120_000)
+
+
+def test_default_mode_warns_without_rewriting():
+    sf, llm = large_org(), FakeLLM(latency=0)
+    decision = advise(sf, SCAN, llm)
+    assert decision["action"] == WARNED
+    assert decision["query"] == SCAN
+    assert "full scan of 120,000 Opportunity records" in decision["warning"]
+    assert llm.calls == 0
+
+
+def test_selective_and_small_queries_run():
+    assert advise(large_org(), "SELECT Id FROM Opportunity WHERE Name = 'x'")["action"] == RUN
+    # An unfiltered read scans on purpose
+    assert advise(large_org(), "SELECT Id FROM Opportunity")["action"] == RUN
+    assert advise(MockSalesforce(latency=0, table_rows=500), SCAN)["action"] == RUN
+
+
+def test_rewrite_that_narrows_the_result_is_rejected():
+    sf, llm = large_org(), FakeLLM(latency=0)
+    decision = advise(sf, SCAN, llm, mode="rewrite")
+
+    # The model offered WHERE CreatedDate = LAST_N_DAYS:365 AND (...), which explains cheaper but drops old deals
+    assert llm.calls == 1
+    assert "LAST_N_DAYS:365" in decision["rejected_rewrite"]
+    assert decision["rejected_reason"] == "adds a filter"
+    assert decision["action"] == WARNED
+    assert decision["query"] == SCAN
+    # Only the original was explained
+    assert sf.api_calls == 1
+
+
+def test_rewrite_that_adds_a_limit_is_rejected():
+    model = CannedModel("SELECT Id, Name FROM Opportunity WHERE StageName = 'Closed Won' AND Name = 'x' ORDER BY Name LIMIT 100")
+    decision = advise(large_org(), SCAN, model, mode="rewrite")
+    assert decision["action"] == WARNED
+    assert decision["rejected_reason"] == "adds a LIMIT clause"
+
+
+def test_lookup_rewrite_is_used_when_cheaper():
+    sf = large_org()
+    decision = advise(sf, BY_COLLEGE, FakeLLM(latency=0), mode="rewrite")
+    assert decision["action"] == REWRITTEN
+    assert decision["query"] == "SELECT Id, First_Name__c FROM Student__c WHERE College__c IN (SELECT Id FROM College__c WHERE Name = 'College A')"
+    assert decision["plan"]["leadingOperationType"] == "TableScan"
+    assert decision["rewrite_plan"]["leadingOperationType"] == "Index"
+    assert sf.api_calls == 2
+
+
+def test_block_mode_refuses_to_run():
+    decision = advise(large_org(), SCAN, mode="block")
+    assert decision["action"] == BLOCKED
+    assert decision["warning"]
+
+
+def test_decisions_are_cached_per_query():
+    sf = large_org()
+    first = advise(sf, SCAN)
+    assert advise(sf, SCAN) == first
+    # Same shape, different literal: the plan is reused, the decision made afresh
+    advise(sf, SCAN.replace("Closed Won", "Prospecting"))
+    assert sf.api_calls == 1
+
+
+def test_failed_explain_runs_unchecked():
+    class Broken(MockSalesforce):
+        def restful(self, path, params=None, method="GET", **kwargs):
+            raise ConnectionError("timed out")
+
+    decision = advise(Broken(latency=0), SCAN)
+    assert decision["action"] == UNCHECKED
+    assert decision["query"] == SCAN
+
+
+def test_decisions_are_logged_in_the_background(monkeypatch, tmp_path, caplog):
+    path = tmp_path / "query_advisor.jsonl"
+    monkeypatch.setattr(advisor, "ADVISOR_LOG", str(path))
+    monkeypatch.setattr(advisor, "_decision_logger", log_config.dedicated_logger("query_advisor.test", str(path)))
+    advise(large_org(), SCAN, FakeLLM(latency=0))
+    # The listener thread writes the file
+    deadline = time.time() + 2
+    while not (path.exists() and path.read_text(encoding="utf-8")) and time.time() < deadline:
+        time.sleep(0.01)
+
+    [line] = path.read_text(encoding="utf-8").splitlines()
+    entry = json.loads(line)
+    assert entry["logger"] == "query_advisor.test"
+    assert entry["decision"]["action"] == WARNED and entry["decision"]["query"] == SCAN
+    # Decisions stay out of the app log
+    assert not [r for r in caplog.records if r.name.startswith("query_advisor")]
+
+
+def test_off_skips_the_check():
+    sf = large_org()
+    assert advise(sf, SCAN, mode="off") == {"query": SCAN, "action": RUN}
+    assert sf.api_calls == 0
+
+
+@pytest.mark.parametrize("rewritten, problem", [
+    ("SELECT Id, First_Name__c FROM Student__c WHERE College__c IN (SELECT Id FROM College__c WHERE Name = 'College A')", None),
+    ("SELECT Id, First_Name__c FROM Student__c WHERE (College__c IN (SELECT Id FROM College__c WHERE Name = 'College A'))", None),
+    ("SELECT Id, First_Name__c FROM Student__c WHERE CreatedDate = LAST_N_DAYS:365 AND (College__r.Name = 'College A')", "adds a filter"),
+    ("SELECT Id, First_Name__c FROM Student__c WHERE CreatedDate = LAST_N_DAYS:365", "adds the filter CreatedDate = LAST_N_DAYS:365"),
+    ("SELECT Id, First_Name__c FROM Student__c WHERE College__r.Name = 'College A' LIMIT 10", "adds a LIMIT clause"),
+    ("SELECT Id FROM Student__c WHERE College__r.Name = 'College A'", "changes the SELECT clause"),
+    ("SELECT Id, First_Name__c FROM Student__c", "drops a filter"),
+])
+def test_rewrite_problem(rewritten, problem):
+    assert rewrite_problem(BY_COLLEGE, rewritten) == problem
+
+
+def test_rewrite_problem_reads_past_literals_and_subqueries():
+    query = "SELECT Id, (SELECT Id FROM OpportunityLineItems LIMIT 5) FROM Opportunity WHERE Account.Name = 'x' AND Description LIKE '%ORDER BY%'"
+    same = "SELECT Id, (SELECT Id FROM OpportunityLineItems LIMIT 5) FROM Opportunity WHERE Description LIKE '%ORDER BY%' AND AccountId IN (SELECT Id FROM Account WHERE Name = 'x')"
+    assert rewrite_problem(query, same) is None
@@ -0,0 +1,60 @@
+import socket
+import threading
+
+import pytest
+
+from cache import _JSON, _MSGPACK, Cache, MemoryBackend, RedisBackend, RedisError, encode_value
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"X not a tagged value",
+    _JSON + b'{"records": [',
+    _MSGPACK + b"\xc1",
+])
+def test_unreadable_entry_is_a_miss_and_is_dropped(data):
+    backend = MemoryBackend()
+    cache = Cache(backend, "query")
+    backend.set("query:k", data)
+
+    assert cache.get("k", "default") == "default"
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert backend.get("query:k") is None
+    # The next lookup recomputes and stores a good value
+    assert cache.get_or_compute("k", lambda: {"totalSize": 0}) == {"totalSize": 0}
+    assert backend.get("query:k") == encode_value({"totalSize": 0})
+
+
+def fake_redis(replies):
+    """A server that sends each connection its reply in turn; None hangs up without replying"""
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        for reply in replies:
+            conn, _ = listener.accept()
+            with conn:
+                conn.recv(1024)
+                if reply is not None:
+                    conn.sendall(reply)
+                    conn.recv(1024)
+        listener.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_reconnect_closes_the_dropped_socket():
+    backend = RedisBackend(port=fake_redis([None, b"$5\r\nvalue\r\n"]), timeout=2)
+    backend._connect()
+    stale, stale_reader = backend._local.sock, backend._local.reader
+
+    assert backend.get("k") == b"value"
+    assert stale.fileno() == -1 and stale_reader.closed
+    assert backend._local.sock is not stale
+
+
+def test_failed_auth_does_not_keep_the_connection():
+    backend = RedisBackend(port=fake_redis([b"-WRONGPASS invalid password\r\n"]), password="nope", timeout=2)
+    with pytest.raises(RedisError, match="WRONGPASS"):
+        backend._connect()
+    assert backend._local.sock is None and backend._local.reader is None
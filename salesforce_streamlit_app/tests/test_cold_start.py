@@ -0,0 +1,14 @@
+"""Each app's startup imports against its budget, in a fresh interpreter per run"""
+import os
+
+import pytest
+
+from import_profile import APP_DIR, COLD_START_BUDGETS, best_profile, check, total_ms
+
+
+@pytest.mark.parametrize("script", sorted(COLD_START_BUDGETS))
+def test_startup_imports_stay_lazy_and_in_budget(script):
+    path = os.path.join(APP_DIR, script)
+    timings, _ = best_profile(path, repeat=2)
+    assert timings, f"nothing was imported for {script}"
+    assert check(path, timings) == [], f"{script} imports in {total_ms(timings):.0f} ms"
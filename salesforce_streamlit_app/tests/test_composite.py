@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from chatbot_engine import (
+    Composite,
+    CompositeError,
+    get_default_queries,
+    merge_account_details,
+    reference,
+    top_accounts_pages,
+    top_accounts_request,
+)
+from chatbot_engine.composite import MAX_QUERIES, MAX_SUBREQUESTS
+from mock_services import MockSalesforce
+
+TOP_ACCOUNTS = get_default_queries()["top_accounts"]
+
+
+def test_top_accounts_merges_details_in_one_call():
+    sf = MockSalesforce(latency=0)
+    pages = list(top_accounts_pages(sf, TOP_ACCOUNTS))
+
+    assert sf.api_calls == 1
+    assert len(pages) == 1
+    records, fetched, total = pages[0]
+    assert fetched == total == len(records) == 5
+    for i, record in enumerate(records):
+        assert record["AccountId"] == f"ACC{i:015d}"
+        assert record["totalAmount"] == 2_100_000 - 100_000 * i
+        # Detail fields come from the retrieve of the same account
+        assert record["Industry"] is not None
+        assert "AnnualRevenue" in record
+
+
+def test_top_accounts_are_cached():
+    sf = MockSalesforce(latency=0)
+    first = list(top_accounts_pages(sf, TOP_ACCOUNTS))
+    second = list(top_accounts_pages(sf, TOP_ACCOUNTS))
+    assert sf.api_calls == 1
+    assert first == second
+
+
+def test_request_needs_a_limit_that_fits_one_call():
+    assert top_accounts_request("SELECT AccountId, SUM(Amount) totalAmount FROM Opportunity GROUP BY AccountId") is None
+    assert top_accounts_request(TOP_ACCOUNTS.replace("LIMIT 5", f"LIMIT {MAX_SUBREQUESTS}")) is None
+    composite = top_accounts_request(TOP_ACCOUNTS)
+    assert len(composite.subrequests) == 6
+    assert composite.subrequests[1]["url"].endswith(f"/sobjects/Account/{reference('top', 'records[0].AccountId')}?fields=Id,Name,Industry,AnnualRevenue")
+
+
+def test_without_composite_falls_back_to_the_plain_query():
+    class NoComposite(MockSalesforce):
+        restful = property()
+
+    sf = NoComposite(latency=0)
+    assert not hasattr(sf, "restful")
+    records, _, _ = next(top_accounts_pages(sf, TOP_ACCOUNTS))
+    assert len(records) == 5
+    assert "Industry" not in records[0]
+
+
+def test_failed_subrequest_only_loses_its_own_result():
+    # The aggregate returns 7 rows at most, so the last retrieves refer to records that don't exist
+    composite = top_accounts_request(TOP_ACCOUNTS.replace("LIMIT 5", "LIMIT 9"))
+    results = composite.send(MockSalesforce(latency=0))
+
+    assert len(results["top"]["records"]) == 7
+    assert all(results[f"account{i}"] is not None for i in range(7))
+    assert results["account7"] is None and results["account8"] is None
+
+    records = merge_account_details(results)
+    assert len(records) == 7
+    assert all("Industry" in r for r in records)
+
+
+def test_all_or_none_fails_the_whole_call():
+    composite = Composite(all_or_none=True).query("top", TOP_ACCOUNTS)
+    composite.retrieve("missing", "Account", reference("top", "records[40].AccountId"), ["Id", "Name"])
+    with pytest.raises(CompositeError, match="missing"):
+        composite.send(MockSalesforce(latency=0))
+
+
+def test_broken_reference():
+    composite = Composite().query("top", TOP_ACCOUNTS)
+    composite.retrieve("account", "Account", reference("nope", "records[0].AccountId"), ["Id"])
+    composite.retrieve("field", "Account", reference("top", "records[0].NoSuchField"), ["Id"])
+    results = composite.send(MockSalesforce(latency=0))
+    assert results["top"] is not None
+    assert results["account"] is None
+    assert results["field"] is None
+
+
+def test_parse_reports_sub_request_errors():
+    response = {"compositeResponse": [
+        {"referenceId": "top", "httpStatusCode": 200, "body": {"records": []}},
+        {"referenceId": "account0", "httpStatusCode": 404, "body": [{"errorCode": "NOT_FOUND", "message": "gone"}]},
+    ]}
+    assert Composite().parse(response) == {"top": {"records": []}, "account0": None}
+    with pytest.raises(CompositeError, match="account0 failed: gone"):
+        Composite(all_or_none=True).parse(response)
+
+
+def test_subrequest_limit():
+    composite = Composite()
+    for i in range(MAX_SUBREQUESTS):
+        composite.retrieve(f"account{i}", "Account", f"ACC{i:015d}", ["Id"])
+    with pytest.raises(CompositeError, match=str(MAX_SUBREQUESTS)):
+        composite.retrieve("one_more", "Account", "ACC000000000000099", ["Id"])
+
+
+def test_query_limit():
+    composite = Composite()
+    for i in range(MAX_QUERIES):
+        composite.query(f"q{i}", "SELECT Id FROM Account LIMIT 1")
+    with pytest.raises(CompositeError, match=str(MAX_QUERIES)):
+        composite.query("one_more", "SELECT Id FROM Account LIMIT 1")
+    # Retrieves still fit
+    composite.retrieve("account", "Account", "ACC000000000000001", ["Id"])
+
+
+def test_payload_is_what_the_endpoint_takes():
+    composite = top_accounts_request(TOP_ACCOUNTS)
+    payload = json.loads(json.dumps(composite.payload))
+    assert payload["allOrNone"] is False
+    assert [s["referenceId"] for s in payload["compositeRequest"]] == ["top"] + [f"account{i}" for i in range(5)]
@@ -0,0 +1,179 @@
+import pytest
+
+from cache import get_cache
+from chatbot_engine import prime_query_cache, query_cache_key
+from dml import BULK_NULL, DELETE, INSERT, UPDATE, DmlEngine, DmlError
+from mock_services import MockBulk2Type, MockSalesforce
+
+
+def account(i, **fields):
+    return {"Id": f"ACC{i:015d}", **fields}
+
+
+def engine(sf, **options):
+    # Bulk only when a test asks for it
+    options.setdefault("bulk_threshold", 10**9)
+    return DmlEngine(sf, **options)
+
+
+def test_per_record_errors_keep_input_positions():
+    sf = MockSalesforce(latency=0)
+    records = [account(0, Phone="1"), {"Id": "bad id", "Phone": "2"}, {"Phone": "3"}, account(3, Phone="4")]
+    result = engine(sf).update("Account", records)
+
+    assert [r.index for r in result.results] == [0, 1, 2, 3]
+    assert [r.success for r in result.results] == [True, False, False, True]
+    assert result.results[1].errors == ["MALFORMED_ID: malformed id bad id"]
+    assert result.results[1].id == "bad id"
+    # A record without an Id is refused before anything is sent
+    assert result.results[2].errors == ["MISSING_ARGUMENT: Id not specified"]
+    assert result.api_calls == 1
+    assert result.summary() == "2 of 4 Account records updated, 2 failed"
+    frame = result.to_frame()
+    assert frame["success"].tolist() == [True, False, False, True]
+
+
+def test_insert_reports_new_ids():
+    sf = MockSalesforce(latency=0)
+    result = engine(sf).insert("Account", [{"Name": "Acme"}, {"Industry": "Energy"}])
+    created, missing_name = result.results
+    assert created.success and created.created and created.id.startswith("ACC")
+    assert not missing_name.success
+    assert missing_name.errors == ["REQUIRED_FIELD_MISSING: Required fields are missing: [Name]"]
+    assert sf.records_written == 1
+
+
+def test_records_are_sent_in_collections_of_200():
+    sf = MockSalesforce(latency=0)
+    result = engine(sf, workers=3).update("Account", [account(i, Phone=str(i)) for i in range(450)])
+    assert result.ok
+    assert result.api_calls == sf.api_calls == 3
+    assert [r.index for r in result.results] == list(range(450))
+
+
+def test_a_failed_request_only_fails_its_own_chunk():
+    class FlakySalesforce(MockSalesforce):
+        def restful(self, path, params=None, method="GET", **kwargs):
+            if '"ACC000000000000200"' in kwargs.get("data", ""):
+                raise ConnectionError("connection reset")
+            return super().restful(path, params, method, **kwargs)
+
+    sf = FlakySalesforce(latency=0)
+    result = engine(sf, workers=1).update("Account", [account(i, Phone=str(i)) for i in range(450)])
+
+    assert [r.success for r in result.results] == [True] * 200 + [False] * 200 + [True] * 50
+    assert result.results[200].errors == ["REQUEST_FAILED: connection reset"]
+    assert sf.records_written == 250
+
+
+def test_all_or_none_rolls_back_the_chunk():
+    sf = MockSalesforce(latency=0)
+    records = [account(i, Phone=str(i)) for i in range(250)]
+    records[210]["Id"] = "bad id"
+    result = engine(sf, all_or_none=True).update("Account", records)
+
+    # The first chunk of 200 committed; the second rolled back around the bad record
+    assert all(r.success for r in result.results[:200])
+    assert not any(r.success for r in result.results[200:])
+    assert result.results[210].errors == ["MALFORMED_ID: malformed id bad id"]
+    assert result.results[211].errors[0].startswith("ALL_OR_NONE_OPERATION_ROLLED_BACK")
+    assert sf.records_written == 200
+
+
+def test_delete_by_id():
+    sf = MockSalesforce(latency=0)
+    result = engine(sf).delete("Account", ["ACC000000000000001", "nope"])
+    assert [r.success for r in result.results] == [True, False]
+    assert result.operation == DELETE
+
+
+def test_writes_invalidate_the_writers_cached_queries():
+    sf, other = MockSalesforce(latency=0), MockSalesforce(latency=0)
+    other.session_id = "another-session"
+    query = "SELECT Id, Phone FROM Account"
+    prime_query_cache(sf, query, [{"Id": "ACC000000000000001"}])
+    prime_query_cache(other, query, [{"Id": "ACC000000000000001"}])
+    cache = get_cache("query")
+
+    engine(sf).update("Account", [{"Id": "bad id", "Phone": "1"}])
+    assert cache.get(query_cache_key(sf, query)) is not None, "nothing was written, so nothing is invalidated"
+
+    engine(sf).update("Account", [account(1, Phone="1")])
+    assert cache.get(query_cache_key(sf, query)) is None
+    # Another user's results aren't evicted by this user's write
+    assert cache.get(query_cache_key(other, query)) is not None
+
+
+def test_invalidation_failure_does_not_fail_a_committed_write(monkeypatch):
+    def outage(prefix):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(get_cache("query").backend, "clear", outage)
+    result = engine(MockSalesforce(latency=0)).update("Account", [account(1, Phone="1")])
+    assert result.ok
+
+
+def test_bulk_rows_are_matched_back_to_their_input(monkeypatch):
+    # Bulk results come back in no particular order; reverse them to prove matching is by content
+    original = MockBulk2Type._results_csv
+
+    def reversed_csv(self, rows):
+        return original(self, list(reversed(rows)))
+
+    monkeypatch.setattr(MockBulk2Type, "_results_csv", reversed_csv)
+    sf = MockSalesforce(latency=0)
+    records = [
+        account(0, Phone="1", Industry=None),
+        {"Id": "bad id", "Phone": "2"},
+        account(2, Phone="3"),
+        # Same values twice: each gets its own result
+        account(3, Phone="4"),
+        account(3, Phone="4"),
+    ]
+    result = engine(sf, bulk_threshold=1).update("Account", records)
+
+    assert result.mode == "bulk"
+    assert [r.index for r in result.results] == [0, 1, 2, 3, 4]
+    assert [r.success for r in result.results] == [True, False, True, True, True]
+    assert result.results[1].errors == ["MALFORMED_ID:malformed id bad id"]
+    assert result.results[0].id == "ACC000000000000000"
+    assert not result.results[0].created
+
+
+def test_bulk_null_is_echoed_back_and_matched(monkeypatch):
+    sent = []
+    original = MockBulk2Type._ingest
+
+    def recording(self, operation, records, **kwargs):
+        sent.extend(records)
+        return original(self, operation, records, **kwargs)
+
+    monkeypatch.setattr(MockBulk2Type, "_ingest", recording)
+    result = engine(MockSalesforce(latency=0), bulk_threshold=1).update("Account", [account(0, Industry=None), account(1, Phone="5")])
+
+    # None clears the field; a field the record doesn't have is left empty (unchanged)
+    assert sent[0] == {"Id": "ACC000000000000000", "Industry": BULK_NULL, "Phone": ""}
+    assert sent[1] == {"Id": "ACC000000000000001", "Industry": "", "Phone": "5"}
+    assert result.ok
+
+
+def test_bulk_rows_without_a_result_fail(monkeypatch):
+    monkeypatch.setattr(MockBulk2Type, "get_successful_records", lambda self, job_id, file=None: "")
+    result = engine(MockSalesforce(latency=0), bulk_threshold=1).update("Account", [account(0, Phone="1")])
+    assert result.results[0].errors == ["UNKNOWN: No result returned by the bulk job"]
+
+
+def test_bulk_insert_counts_calls():
+    sf = MockSalesforce(latency=0)
+    result = engine(sf, bulk_threshold=1).run(INSERT, "Account", [{"Name": f"New {i}"} for i in range(5)])
+    assert result.ok and all(r.created for r in result.results)
+    # create, upload, close, poll and three result files
+    assert result.api_calls == sf.api_calls == 7
+
+
+def test_bad_arguments():
+    with pytest.raises(DmlError):
+        engine(MockSalesforce(latency=0)).run("merge", "Account", [])
+    with pytest.raises(DmlError):
+        engine(MockSalesforce(latency=0)).run("upsert", "Account", [{"Name": "x"}])
+    assert engine(MockSalesforce(latency=0)).run(UPDATE, "Account", []).results == []
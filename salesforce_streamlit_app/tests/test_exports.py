@@ -0,0 +1,71 @@
+import io
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from chatbot_engine.records import format_records
+from exports import reconcile_chunks, write_export
+
+
+def opportunity(i):
+    # The first five have no account and whole amounts; later ones have both an account and cents
+    account = None if i < 5 else {"attributes": {"type": "Account"}, "Name": f"Account {i}"}
+    return {"attributes": {"type": "Opportunity"}, "Id": f"006{i:015d}", "Name": f"Deal {i}",
+            "Amount": i * 10 if i < 5 else i * 10 + 0.5, "Account": account}
+
+
+RECORDS = [opportunity(i) for i in range(12)]
+
+
+def export(fmt):
+    fileobj = io.BytesIO()
+    rows = write_export(lambda: iter(RECORDS), fmt, fileobj, chunk_rows=5, transform=format_records)
+    fileobj.seek(0)
+    return rows, fileobj
+
+
+def test_csv_keeps_late_columns():
+    rows, fileobj = export("CSV")
+    frame = pd.read_csv(fileobj, dtype={"Id": str})
+    assert rows == 12
+    assert list(frame.columns) == ["Id", "Name", "Amount", "Account.Name"]
+    assert frame["Account.Name"].isna().sum() == 5
+    assert frame["Account.Name"].iloc[-1] == "Account 11"
+    assert frame["Amount"].tolist()[4:6] == [40.0, 50.5]
+
+
+def test_parquet_widens_integers_that_later_have_fractions():
+    rows, fileobj = export("Parquet")
+    table = pq.read_table(fileobj)
+    assert rows == table.num_rows == 12
+    assert str(table.schema.field("Amount").type) == "double"
+    assert table.column("Account.Name").to_pylist()[5:7] == ["Account 5", "Account 6"]
+
+
+def test_excel_keeps_late_columns():
+    openpyxl = pytest.importorskip("openpyxl")
+    _, fileobj = export("Excel")
+    rows = list(openpyxl.load_workbook(fileobj).active.iter_rows(values_only=True))
+    assert rows[0] == ("Id", "Name", "Amount", "Account.Name")
+    assert rows[-1][2:] == (110.5, "Account 11")
+
+
+def test_reconciled_dtypes():
+    chunks = [
+        pd.DataFrame({"n": [1, 2], "flag": [True, False], "mixed": [1, 2]}),
+        pd.DataFrame({"n": [3, 4], "mixed": ["a", None]}),
+    ]
+    first, second = reconcile_chunks(iter(chunks))
+    # Integers with a gap stay integers, booleans with a gap stay booleans, mixed values become text
+    assert str(first["n"].dtype) == "int64"
+    assert str(second["flag"].dtype) == "boolean" and second["flag"].isna().all()
+    assert first["mixed"].tolist() == ["1", "2"]
+    assert second["mixed"].tolist() == ["a", None]
+
+
+def test_frames_are_exported_as_they_are():
+    frame = pd.DataFrame({"Id": ["a", "b", "c"], "Amount": [1, 2, 3]})
+    fileobj = io.BytesIO()
+    assert write_export(frame, "CSV", fileobj, chunk_rows=2) == 3
+    assert fileobj.getvalue().decode().splitlines() == ["Id,Amount", "a,1", "b,2", "c,3"]
@@ -0,0 +1,56 @@
+import pytest
+
+import chatbot_engine.advisor as advisor
+import fast_json
+from chatbot_engine import connect_salesforce
+from chatbot_engine.advisor import WARNED, advise
+from chatbot_engine.auth import is_query_page
+from mock_services import MockSalesforce, MockSalesforceServer
+
+msgspec = pytest.importorskip("msgspec")
+
+BASE = "https://example.my.salesforce.com/services/data/v59.0"
+
+
+@pytest.fixture
+def sf(monkeypatch):
+    monkeypatch.setattr(advisor, "ADVISOR_LOG", None)
+    server = MockSalesforceServer(MockSalesforce(latency=0, rows=50, table_rows=120_000)).start()
+    try:
+        yield connect_salesforce("decode@example.com", "decode", "token", session=server.session())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("url, page", [
+    (f"{BASE}/query/?q=SELECT+Id+FROM+Account", True),
+    (f"{BASE}/query?q=SELECT+Id+FROM+Account", True),
+    (f"{BASE}/queryAll/?q=SELECT+Id+FROM+Account", True),
+    (f"{BASE}/query/01gD0000002HU6KIAW-2000", True),
+    (f"{BASE}/query?explain=SELECT+Id+FROM+Account", False),
+    (f"{BASE}/sobjects/Account/describe", False),
+])
+def test_only_query_and_query_more_urls_are_pages(url, page):
+    assert is_query_page(url) is page
+
+
+def test_typed_decoding_is_in_use():
+    assert fast_json.DECODER == "msgspec"
+
+
+def test_a_body_that_is_not_a_page_decodes_plainly():
+    assert fast_json.decode_query_page(b'{"plans": []}') == {"plans": []}
+    with pytest.raises(msgspec.DecodeError):
+        fast_json.decode_query_page(b'{"totalSize": ')
+
+
+def test_explain_responses_reach_the_advisor(sf):
+    decision = advise(sf, "SELECT Id FROM Opportunity WHERE StageName = 'Closed Won'")
+    assert decision["action"] == WARNED
+    assert decision["plan"]["leadingOperationType"] == "TableScan"
+
+
+def test_query_pages_still_decode(sf):
+    result = sf.query("SELECT Id, Name FROM Account")
+    assert result["totalSize"] == len(result["records"]) == 50
@@ -0,0 +1,112 @@
+import threading
+import time
+
+from benchmarks import slow_backend, wait_for
+from jobs import CANCELLED, DONE, FAILED, QUEUED, TIMED_OUT, Job, JobRunner
+
+
+def test_slow_backends_run_concurrently():
+    runner = JobRunner(max_workers=4)
+    start = time.perf_counter()
+    jobs = [runner.submit(slow_backend(0.4), label=f"query {i}") for i in range(4)]
+    # Submitting doesn't wait for the backend
+    assert time.perf_counter() - start < 0.2
+    wait_for(jobs)
+    elapsed = time.perf_counter() - start
+
+    assert [job.status for job in jobs] == [DONE] * 4
+    assert [job.result for job in jobs] == [5] * 4
+    assert all(job.progress == 1.0 for job in jobs)
+    # Inline these would take 1.6s
+    assert elapsed < 1.2
+
+
+def test_duplicate_submit_reuses_a_running_job():
+    runner = JobRunner(max_workers=4)
+    first = runner.submit(slow_backend(0.3), label="same query", key="q")
+    second = runner.submit(slow_backend(0.3), label="same query", key="q")
+    assert second is first
+
+    wait_for([first])
+    # A finished result may be stale, so the same key runs again
+    third = runner.submit(slow_backend(0.3), label="same query", key="q")
+    assert first.status == DONE and third is not first
+    wait_for([third])
+
+
+def test_cancel_stops_the_job():
+    runner = JobRunner(max_workers=2)
+    job = runner.submit(slow_backend(5, pages=50), label="cancelled", key="q")
+    time.sleep(0.2)
+    runner.cancel(job.id)
+
+    assert job.status == CANCELLED and job.error == "cancelled was cancelled"
+    assert job.wait(1)
+    # The worker stops at its next report, and the key is free again
+    assert runner.submit(slow_backend(0.1), label="again", key="q") is not job
+    time.sleep(0.3)
+    assert job.status == CANCELLED and job.progress < 0.5
+
+
+def test_overrunning_job_times_out():
+    runner = JobRunner(max_workers=2)
+    job = runner.submit(slow_backend(5, pages=50), label="slow", timeout=0.3)
+    wait_for([job], timeout=2)
+    assert job.status == TIMED_OUT
+    assert job.error == "slow timed out after 0.3s"
+
+
+def test_polling_marks_an_overrun_job_timed_out():
+    release = threading.Event()
+    runner = JobRunner(max_workers=1)
+    # A backend that never reports can't notice its own deadline
+    job = runner.submit(lambda job: release.wait(5), label="stuck", timeout=0.2)
+    time.sleep(0.3)
+    assert runner.get(job.id).status == TIMED_OUT
+    release.set()
+    time.sleep(0.1)
+    # The late result doesn't overwrite the timeout
+    assert job.status == TIMED_OUT and job.result is None
+
+
+def test_failures_are_recorded():
+    def broken(job):
+        raise ValueError("INVALID_FIELD: No such column 'Nope'")
+
+    job = JobRunner(max_workers=1).submit(broken, label="broken")
+    assert job.wait(2)
+    assert job.status == FAILED and job.error == "INVALID_FIELD: No such column 'Nope'"
+
+
+def test_only_the_first_finish_wins():
+    job = Job("race")
+    barrier = threading.Barrier(8)
+    won = []
+
+    def finish(i):
+        barrier.wait()
+        status = DONE if i % 2 else CANCELLED
+        if job._finish(status, result=i if status == DONE else None, error=None if status == DONE else "cancelled"):
+            won.append(i)
+
+    threads = [threading.Thread(target=finish, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(won) == 1
+    # Status, result and error all come from the same finish
+    if job.status == DONE:
+        assert job.result == won[0] and job.error is None
+    else:
+        assert job.result is None and job.error == "cancelled"
+
+
+def test_job_cancelled_while_queued_never_runs():
+    ran = []
+    job = Job("queued")
+    job._finish(CANCELLED, error="queued was cancelled")
+    JobRunner(max_workers=1)._run(job, lambda job: ran.append(1), (), {})
+    assert ran == [] and job.status == CANCELLED and job.started_at is None
+    assert Job("fresh").status == QUEUED
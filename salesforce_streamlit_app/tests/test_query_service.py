@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+from benchmarks import serve_in_thread
+from mock_services import FakeLLM, MockSalesforce
+from query_service import SalesforceClients, allowed_instance, create_app
+
+QUESTION = {"query": "List contacts"}
+
+
+@pytest.fixture
+def service():
+    servers = []
+
+    def start(**options):
+        base_url, server = serve_in_thread(create_app(lambda: MockSalesforce(latency=0), lambda: FakeLLM(latency=0), warm=False, **options))
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.should_exit = True
+
+
+def forwarded(instance):
+    return {"Authorization": "Bearer 00Dxx!session", "X-Salesforce-Instance": instance}
+
+
+@pytest.mark.parametrize("instance, allowed", [
+    ("acme.my.salesforce.com", True),
+    ("ACME.my.salesforce.com", True),
+    ("na1.salesforce.com", True),
+    ("169.254.169.254", False),
+    ("internal.example.com", False),
+    ("salesforce.com.example.com", False),
+    ("acme.my.salesforce.com:8443", False),
+    ("acme.my.salesforce.com/x", False),
+    ("user@acme.my.salesforce.com", False),
+    ("evil.com#.salesforce.com", False),
+    ("https://acme.my.salesforce.com", False),
+])
+def test_allowed_instances(instance, allowed):
+    assert allowed_instance(instance) is allowed
+
+
+def test_allowlist_is_configurable():
+    assert allowed_instance("sf.internal", ("sf.internal",))
+    assert not allowed_instance("acme.my.salesforce.com", ("sf.internal",))
+
+
+def test_forwarded_clients_only_for_salesforce_hosts():
+    clients = SalesforceClients(factory=None)
+    assert clients.forwarded("session", "Acme.my.salesforce.com").sf_instance == "acme.my.salesforce.com"
+    with pytest.raises(ValueError):
+        clients.forwarded("session", "127.0.0.1")
+
+
+def test_other_hosts_are_refused_before_any_call(service):
+    base_url = service()
+    response = requests.post(f"{base_url}/query", json=QUESTION, headers=forwarded("127.0.0.1:6379"), timeout=10)
+    assert response.status_code == 400
+    response = requests.post(f"{base_url}/query/stream", json=QUESTION, headers=forwarded("metadata.internal"), timeout=10)
+    assert response.status_code == 400
+
+
+def test_a_session_is_required(service):
+    response = requests.post(f"{service()}/query", json=QUESTION, timeout=10)
+    assert response.status_code == 401
+
+
+def test_default_login_when_allowed(service):
+    response = requests.post(f"{service(allow_default=True)}/query", json=QUESTION, timeout=10)
+    assert response.status_code == 200
+    assert response.json()["rows"] > 0
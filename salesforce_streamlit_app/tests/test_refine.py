@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+from chatbot_engine import parse_refinement, refine_reply
+from chatbot_engine.refine import HEAD, SORT, TAIL
+from mock_services import MockSalesforce
+
+QUERY = "SELECT Id, Name, StageName, Amount, CloseDate FROM Opportunity ORDER BY CloseDate DESC"
+
+
+@pytest.fixture
+def opportunities():
+    return pd.DataFrame({
+        "Id": [f"006{i:015d}" for i in range(12)],
+        "Name": [f"Deal {i}" for i in range(12)],
+        "StageName": ["Prospecting", "Closed Won", "Negotiation/Review"] * 4,
+        "Amount": [float(a) for a in (5, 90, 40, 70, 10, 60, 30, 80, 20, 100, 50, 0)],
+        "CloseDate": pd.date_range("2024-01-01", periods=12, freq="MS"),
+    })
+
+
+def parse(text, frame, sobject="Opportunity"):
+    return parse_refinement(text, frame, sobject=sobject)
+
+
+@pytest.mark.parametrize("text", [
+    "Show me the top 5 accounts",
+    "first 3 students",
+    "top 10 contacts by amount",
+    "only the accounts in Closed Won",
+])
+def test_other_objects_make_a_new_question(text, opportunities):
+    assert parse(text, opportunities) is None
+
+
+def test_without_a_known_object_no_object_words_are_filler(opportunities):
+    assert parse("top 10 opportunities", opportunities, sobject=None) is None
+
+
+@pytest.mark.parametrize("text", ["top 10 opportunities", "top 10 deals", "show me the top 10", "top 10 amounts"])
+def test_top_ranks_by_the_only_numeric_column(text, opportunities):
+    assert parse(text, opportunities) == [
+        {"step": SORT, "column": "Amount", "descending": True},
+        {"step": HEAD, "n": 10},
+    ]
+
+
+def test_bottom_ranks_ascending(opportunities):
+    assert parse("bottom 2 opportunities", opportunities) == [
+        {"step": SORT, "column": "Amount", "descending": False},
+        {"step": HEAD, "n": 2},
+    ]
+
+
+def test_first_and_last_are_positional(opportunities):
+    assert parse("first 3 opportunities", opportunities) == [{"step": HEAD, "n": 3}]
+    assert parse("last 3", opportunities) == [{"step": TAIL, "n": 3}]
+
+
+def test_top_without_one_numeric_column_keeps_the_order(opportunities):
+    frame = opportunities.assign(Probability=50.0)
+    assert parse("top 3 deals", frame) == [{"step": HEAD, "n": 3}]
+    assert parse("top 3 deals by probability", frame)[0] == {"step": SORT, "column": "Probability", "descending": True}
+
+
+def test_custom_objects_are_named_by_their_label(opportunities):
+    students = pd.DataFrame({"Id": ["a001", "a002"], "First_Name__c": ["Ann", "Bo"]})
+    assert parse("first 1 students", students, sobject="Student__c") == [{"step": HEAD, "n": 1}]
+    assert parse("first 1 colleges", students, sobject="Student__c") is None
+
+
+def test_refine_reply_sorts_the_previous_result(opportunities):
+    sf = MockSalesforce(latency=0)
+    previous = {"frame": opportunities, "query": QUERY, "intent": "custom_query"}
+    reply = refine_reply("top 3 opportunities", previous, sf)
+    assert reply["frame"]["Amount"].tolist() == [100.0, 90.0, 80.0]
+    assert reply["query"] == QUERY
+    assert sf.api_calls == 0
+    assert refine_reply("Show me the top 5 accounts", previous, sf) is None
@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+
+import snapshots
+from snapshots import SnapshotStore, record_snapshot
+
+
+def frame(n, start=0):
+    return pd.DataFrame({"Id": [f"ID{i:04d}" for i in range(start, start + n)], "Amount": [float(i) for i in range(start, start + n)]})
+
+
+def store(tmp_path, **options):
+    return SnapshotStore(str(tmp_path), compression="none", **{"max_age": 0, "max_bytes": 0, **options})
+
+
+def files(tmp_path):
+    return sorted(name for _, _, names in os.walk(tmp_path / "objects") for name in names)
+
+
+def test_recording_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "_store", store(tmp_path))
+    assert not snapshots.SNAPSHOTS_ENABLED
+    assert record_snapshot(frame(3), "SELECT Id FROM Account") is None
+    monkeypatch.setattr(snapshots, "SNAPSHOTS_ENABLED", True)
+    assert record_snapshot(frame(3), "SELECT Id FROM Account").rows == 3
+
+
+def test_keep_limits_versions_per_query(tmp_path):
+    snapshots_ = store(tmp_path, keep=2)
+    for i in range(4):
+        snapshots_.save(frame(3, start=i), "SELECT Id FROM Account", fetched_at=100 + i)
+    assert [s.fetched_at for s in snapshots_.history()] == [103, 102]
+    assert len(files(tmp_path)) == 2
+
+
+def test_old_versions_expire(tmp_path):
+    snapshots_ = store(tmp_path)
+    snapshots_.save(frame(3), "SELECT Id FROM Account", fetched_at=1_000)
+    snapshots_.save(frame(4), "SELECT Id FROM Contact", fetched_at=5_000)
+    assert snapshots_.expire(max_age=2_000, max_bytes=0, now=6_000) == 1
+    assert [s.query for s in snapshots_.history()] == ["SELECT Id FROM Contact"]
+    assert len(files(tmp_path)) == 1
+
+
+def test_size_cap_drops_oldest_first_and_counts_shared_files_once(tmp_path):
+    snapshots_ = store(tmp_path)
+    first = snapshots_.save(frame(500), "SELECT Id FROM Account", fetched_at=1)
+    # Same content under another query: a second version, no second file
+    snapshots_.save(frame(500), "SELECT Id, Amount FROM Account", fetched_at=2)
+    newest = snapshots_.save(frame(500, start=500), "SELECT Id FROM Contact", fetched_at=3)
+    assert first.bytes + newest.bytes == snapshots_.stats()["bytes"]
+
+    # Room for both files: nothing goes
+    assert snapshots_.expire(max_age=0, max_bytes=first.bytes + newest.bytes) == 0
+    # Room for one: both versions of the older file go
+    assert snapshots_.expire(max_age=0, max_bytes=newest.bytes) == 2
+    assert [s.id for s in snapshots_.history()] == [newest.id]
+    assert files(tmp_path) == [f"{newest.digest}.arrow"]
+
+
+def test_save_applies_the_limits(tmp_path):
+    snapshots_ = store(tmp_path, max_age=60)
+    snapshots_.save(frame(3), "SELECT Id FROM Account", fetched_at=0)
+    snapshots_.save(frame(4), "SELECT Id FROM Contact")
+    assert [s.query for s in snapshots_.history()] == ["SELECT Id FROM Contact"]
@@ -0,0 +1,461 @@
+"""Distributed tracing of chat turns, as OpenTelemetry-style spans
+
+A chat turn is one trace: a span for the turn, with child spans for intent
+resolution, the Gemini call, the query-plan check, each Salesforce
+round-trip, building the result frame, the chart and exports. Spans carry
+attributes such as the intent, row counts and cache outcomes. The trace
+crosses the job thread and, through the W3C ``traceparent`` header, the
+query service.
+
+Finished spans are queued and exported in OTLP/JSON from a background
+thread, so a chat turn never waits on trace I/O. They are either appended
+to a local file (one OTLP request body per line) or posted to any OTLP/HTTP
+collector (the OpenTelemetry Collector, Jaeger, Tempo). Sampling happens
+once per trace, at its root, so unsampled turns cost a couple of attribute
+lookups per span and nothing is half-recorded.
+
+Configured with the standard OpenTelemetry variables:
+
+    OTEL_TRACES_EXPORTER          none (default), file or otlp
+    OTEL_TRACES_SAMPLER_ARG       fraction of traces kept, 0.0-1.0 (default 0.1)
+    OTEL_EXPORTER_OTLP_ENDPOINT   collector base URL (default http://localhost:4318)
+    OTEL_SERVICE_NAME             service.name on every span
+
+plus TRACE_FILE for the file exporter (default traces.jsonl). The
+opentelemetry SDK isn't needed; this module speaks its wire format.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+EXPORTER = os.getenv("OTEL_TRACES_EXPORTER", "none")
+SAMPLE_RATE = float(os.getenv("OTEL_TRACES_SAMPLER_ARG", "0.1"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "salesforce-chatbot")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+# Finished spans waiting for export; past this, new spans are dropped rather than blocking
+MAX_QUEUE_SIZE = 4096
+
+# Spans per export request, and the longest a finished span waits to be exported
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 2.0
+
+# OTLP span kinds and status codes
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+SCOPE_NAME = "salesforce_chatbot"
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    """The ids a child span or a remote service needs to join a trace"""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id, span_id, sampled=True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self):
+        """W3C trace context header value"""
+        return f"00-{self.trace_id:032x}-{self.span_id:016x}-{'01' if self.sampled else '00'}"
+
+
+class Span:
+    """One timed operation in a trace; ended once, then handed to the exporter"""
+
+    recording = True
+
+    def __init__(self, name, context, parent_id=None, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.events = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return self.context.traceparent
+
+    def set(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def update(self, **attributes):
+        for key, value in attributes.items():
+            self.set(key, value)
+
+    def add_event(self, name, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def record_exception(self, exc):
+        self.status = STATUS_ERROR
+        self.status_message = str(exc)
+        self.add_event("exception", **{"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _tracer.on_end(self)
+
+
+class NonRecordingSpan:
+    """Stand-in for spans of unsampled traces; carries the context and ignores everything else"""
+
+    recording = False
+
+    def __init__(self, context=None):
+        self.context = context
+
+    @property
+    def traceparent(self):
+        return self.context.traceparent if self.context is not None else None
+
+    def set(self, key, value):
+        pass
+
+    def update(self, **attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def end(self):
+        pass
+
+
+_NOT_TRACING = NonRecordingSpan()
+
+
+def _new_id(bits):
+    value = 0
+    while not value:
+        value = random.getrandbits(bits)
+    return value
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_payload(spans, service_name=SERVICE_NAME):
+    """OTLP/JSON ExportTraceServiceRequest body for a batch of finished spans"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": service_name, "process.pid": os.getpid()})},
+        "scopeSpans": [{
+            "scope": {"name": SCOPE_NAME},
+            "spans": [{
+                "traceId": f"{s.context.trace_id:032x}",
+                "spanId": f"{s.context.span_id:016x}",
+                "parentSpanId": f"{s.parent_id:016x}" if s.parent_id else "",
+                "name": s.name,
+                "kind": s.kind,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": _otlp_attributes(s.attributes),
+                "events": [{"timeUnixNano": str(t), "name": name, "attributes": _otlp_attributes(attrs)} for t, name, attrs in s.events],
+                "status": {"code": s.status, "message": s.status_message} if s.status_message else {"code": s.status},
+            } for s in spans],
+        }],
+    }]}
+
+
+class FileExporter:
+    """Appends one OTLP/JSON request body per batch to a local file"""
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(otlp_payload(spans), separators=(",", ":")) + "\n")
+
+
+class OTLPExporter:
+    """Posts batches to an OTLP/HTTP collector's /v1/traces endpoint as JSON"""
+
+    def __init__(self, endpoint=OTLP_ENDPOINT, session=None, timeout=10):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def export(self, spans):
+        response = self.session.post(
+            self.url,
+            data=json.dumps(otlp_payload(spans), separators=(",", ":")),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+
+class BatchExporter:
+    """Queues finished spans and exports them in batches from a daemon thread"""
+
+    def __init__(self, exporter, max_queue_size=MAX_QUEUE_SIZE, batch_size=EXPORT_BATCH_SIZE, interval=EXPORT_INTERVAL):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.exported = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def add(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch, flushed = [], None
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    # A flush marker: everything queued before it is in this batch
+                    flushed = item
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    logger.warning(f"Could not export {len(batch)} spans: {str(e)}")
+            if flushed is not None:
+                flushed.set()
+
+    def flush(self, timeout=5.0):
+        """Export everything queued so far; returns False if the exporter didn't catch up in time"""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+
+class Tracer:
+    """Starts spans, samples traces at their root and hands finished spans to the exporter"""
+
+    def __init__(self, exporter=None, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.batch = BatchExporter(exporter) if exporter is not None else None
+
+    @property
+    def enabled(self):
+        return self.batch is not None and self.sample_rate > 0
+
+    def sampled(self, trace_id):
+        """Keep a trace when its id falls below the rate, as OpenTelemetry's TraceIdRatioBased sampler does"""
+        return (trace_id & 0xFFFFFFFFFFFFFFFF) < self.sample_rate * 2 ** 64
+
+    def start(self, name, parent=None, kind=INTERNAL, attributes=None):
+        if not self.enabled:
+            return _NOT_TRACING
+        parent_context = parent.context if isinstance(parent, (Span, NonRecordingSpan)) else parent
+        if parent_context is not None and not parent_context.sampled:
+            # Unsampled traces stay unsampled all the way down, at the cost of one object
+            return parent if isinstance(parent, NonRecordingSpan) else NonRecordingSpan(parent_context)
+        if parent_context is None:
+            trace_id = _new_id(128)
+            context = SpanContext(trace_id, _new_id(64), self.sampled(trace_id))
+        else:
+            context = SpanContext(parent_context.trace_id, _new_id(64))
+        if not context.sampled:
+            return NonRecordingSpan(context)
+        return Span(name, context, parent_context.span_id if parent_context else None, kind, attributes)
+
+    def on_end(self, span):
+        if self.batch is not None:
+            self.batch.add(span)
+
+
+def _exporter_from_env():
+    if EXPORTER == "file":
+        return FileExporter(TRACE_FILE)
+    if EXPORTER == "otlp":
+        return OTLPExporter(OTLP_ENDPOINT)
+    if EXPORTER not in ("none", ""):
+        logger.warning(f"Unknown OTEL_TRACES_EXPORTER {EXPORTER!r}; tracing is off")
+    return None
+
+
+_tracer = Tracer(_exporter_from_env())
+
+
+def configure_tracing(exporter=None, sample_rate=SAMPLE_RATE):
+    """Replace the process-wide tracer, flushing the old one; exporter=None turns tracing off"""
+    global _tracer
+    flush_spans()
+    _tracer = Tracer(exporter, sample_rate)
+    return _tracer
+
+
+def get_tracer():
+    """The process-wide Tracer"""
+    return _tracer
+
+
+def flush_spans(timeout=5.0):
+    """Export every finished span now, e.g. before the process exits"""
+    if _tracer.batch is not None:
+        return _tracer.batch.flush(timeout)
+    return True
+
+
+atexit.register(flush_spans)
+
+
+def current_span():
+    """The active span in this thread or task, or None outside any trace"""
+    return _current.get()
+
+
+def start_span(name, parent=None, kind=INTERNAL, **attributes):
+    """Start a span without making it active; the caller must end() it
+
+    For work that spans yields, such as a paged query: its child spans name
+    it as their parent explicitly. parent defaults to the active span; pass a
+    Span, a SpanContext (e.g. from extract) or leave both unset for a new trace.
+    """
+    if parent is None:
+        parent = _current.get()
+    return _tracer.start(name, parent, kind, attributes)
+
+
+class _Activation:
+    """Makes a span the active one for a with block; see use_span"""
+
+    __slots__ = ("span", "end", "previous")
+
+    def __init__(self, span, end):
+        self.span = span
+        self.end = end
+
+    def __enter__(self):
+        self.previous = _current.get()
+        _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        # Restored by value rather than with a context token, so this is
+        # safe in generators resumed from other threads
+        _current.set(self.previous)
+        if exc is not None and exc_type is not GeneratorExit:
+            self.span.record_exception(exc)
+        if self.end:
+            self.span.end()
+        return False
+
+
+class _NotTracing:
+    """What span() returns while tracing is off: a with block that does nothing"""
+
+    def __enter__(self):
+        return _NOT_TRACING
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOT_TRACING_BLOCK = _NotTracing()
+
+
+def use_span(span, end=False):
+    """Make span the active one for a with block, ending it afterwards if asked"""
+    return _Activation(span, end)
+
+
+def span(name, parent=None, kind=INTERNAL, **attributes):
+    """Time a with block as a child of the active span (or of parent), active inside the block"""
+    if not _tracer.enabled:
+        return _NOT_TRACING_BLOCK
+    return _Activation(start_span(name, parent, kind, **attributes), True)
+
+
+def traced(events, span):
+    """Iterate a generator with span active while each item is produced
+
+    Keeps spans started inside the generator parented correctly when its
+    items are pulled from different threads, as Starlette streams them.
+    """
+    while True:
+        with use_span(span):
+            try:
+                item = next(events)
+            except StopIteration:
+                return
+        yield item
+
+
+def inject(headers=None):
+    """Add the active trace's traceparent to outgoing request headers"""
+    headers = dict(headers or {})
+    active = _current.get()
+    if active is not None and active.context is not None:
+        headers["traceparent"] = active.traceparent
+    return headers
+
+
+def extract(traceparent):
+    """SpanContext from a W3C traceparent header, or None if missing or malformed"""
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        trace_id, span_id, flags = int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if not trace_id or not span_id:
+        return None
+    return SpanContext(trace_id, span_id, bool(flags & 1))
@@ -0,0 +1,351 @@
+"""Warm a process up before it takes traffic
+
+Right after a deploy the first users pay for everything at once: the
+Salesforce login, finding a Gemini model, the query-plan checks and the
+dashboard's preset queries. A Warmer does that work in a background thread
+as the process starts:
+
+1. login: log in to Salesforce (reusing a session the process already has);
+2. model: resolve the Gemini model, at the same time as the login;
+3. plans: load each preset query's plan into the advisor's cache, the
+   object sizes and indexes it checks every query against;
+4. prefetch: put each preset intent's records from get_default_queries()
+   into the query cache. A recent snapshot of the query is used when there
+   is one (no API calls); otherwise it is fetched, and snapshotted for the
+   next start.
+
+The whole run has a time budget. Once every step is done, or the budget is
+spent, the warmer reports ready; steps still running carry on, but nobody
+waits for them. The query service answers GET /ready with 503 until then,
+so a load balancer only routes to warm workers. The Streamlit app starts a
+warmer on its first run. Its server doesn't run any script before the first
+visitor, so with a shared CACHE_URL run_gemini_app.sh also warms the cache
+before starting it:
+
+    python warmup.py [--budget 30] [--intents top_accounts,contacts]
+
+Settings, from the environment:
+
+    WARMUP                    1 warms up at startup (0 only resolves the model)
+    WARMUP_BUDGET             seconds before reporting ready regardless (default 30)
+    WARMUP_WORKERS            preset queries fetched at once (default 4)
+    WARMUP_SNAPSHOT_MAX_AGE   oldest snapshot used instead of fetching, with SNAPSHOTS=1, seconds (default 3600; 0 always fetches)
+    WARMUP_INTENTS            comma-separated presets to prefetch (default all)
+"""
+import argparse
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from cache import MemoryBackend, credential_scope, get_backend, get_cache
+from chatbot_engine import MULTI_STEP_INTENTS, advisor, cached_query_pages, get_default_queries, prime_query_cache, query_cache_key
+from results import ResultBuilder, json_value
+from snapshots import SNAPSHOTS_ENABLED, get_snapshot_store, record_snapshot
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP", "1") not in ("0", "false", "no")
+WARMUP_BUDGET = float(os.getenv("WARMUP_BUDGET", "30"))
+WARMUP_WORKERS = int(os.getenv("WARMUP_WORKERS", "4"))
+WARMUP_SNAPSHOT_MAX_AGE = float(os.getenv("WARMUP_SNAPSHOT_MAX_AGE", "3600"))
+WARMUP_INTENTS = [name for name in os.getenv("WARMUP_INTENTS", "").split(",") if name]
+
+PENDING = "pending"
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+TIMED_OUT = "timed out"
+
+# Where a prefetched preset's records came from
+FROM_CACHE = "cache"
+FROM_SNAPSHOT = "snapshot"
+FROM_SALESFORCE = "salesforce"
+
+STEPS = ("login", "model", "plans", "prefetch")
+
+
+def snapshot_records(snapshot, store):
+    """A snapshot's rows as flat records, shaped like a page cached_query_pages would yield
+
+    Relationship fields keep their dotted names (Account.Name): the result
+    builder flattens records anyway, and flat ones come out the same.
+    """
+    frame = store.read(snapshot).to_pandas()
+    attributes = {"attributes": {"type": snapshot.sobject}} if snapshot.sobject else {}
+    return [{**attributes, **{key: json_value(value) for key, value in row.items()}} for row in frame.to_dict(orient="records")]
+
+
+class Warmer:
+    """Runs the warm-up steps once, within a time budget, and reports readiness
+
+    login and model are callables returning the Salesforce client and the
+    Gemini model; either may be None to skip that step. result("model")
+    waits for a step and returns its value (None if it failed), so requests
+    that arrive early share the warmer's work instead of repeating it.
+    """
+
+    def __init__(self, login, model=None, scope="", intents=None, budget=WARMUP_BUDGET, workers=WARMUP_WORKERS,
+                 snapshot_max_age=WARMUP_SNAPSHOT_MAX_AGE):
+        self.login = login
+        self.model = model
+        self.scope = scope
+        self.intents = list(intents if intents is not None else WARMUP_INTENTS or get_default_queries())
+        self.budget = budget
+        self.workers = workers
+        self.snapshot_max_age = snapshot_max_age
+        self.started = None
+        self.finished = None
+        self.steps = {name: {"status": PENDING} for name in STEPS}
+        self.presets = {}
+        self._values = {}
+        self._done = {name: threading.Event() for name in STEPS}
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Warm up in a daemon thread and return self"""
+        with self._lock:
+            if self._thread is None:
+                self.started = time.monotonic()
+                self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+                self._thread.start()
+        return self
+
+    @property
+    def deadline(self):
+        return self.started + self.budget
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def ready(self):
+        """True once every step has finished or the budget has run out"""
+        return self._finished.is_set() or (self.started is not None and time.monotonic() >= self.deadline)
+
+    def wait(self, timeout=None):
+        """Block until ready or timeout; returns ready"""
+        if self.started is not None:
+            limit = self.remaining() if timeout is None else min(timeout, self.remaining())
+            self._finished.wait(limit)
+        return self.ready
+
+    def done(self, name):
+        """Whether a step has finished, one way or another"""
+        return self._done[name].is_set()
+
+    def result(self, name, timeout=None):
+        """Wait for a step and return its value, or None if it failed, was skipped or didn't finish in time"""
+        self._done[name].wait(timeout)
+        return self._values.get(name)
+
+    def run(self):
+        """Run every step in this thread, stopping at the budget"""
+        if self.started is None:
+            self.started = time.monotonic()
+        with span("warmup", budget=self.budget, intents=len(self.intents)) as warmup_span:
+            # Only the plans and the prefetch need the login; nothing else depends on anything
+            model = self._in_background("model", self.model)
+            sf = self._step("login", self.login)
+            if sf is None:
+                self._skip("plans", "no Salesforce client")
+                self._skip("prefetch", "no Salesforce client")
+            else:
+                plans = self._in_background("plans", self.load_plans, sf)
+                self._step("prefetch", self.prefetch, sf)
+                plans.join(self.remaining())
+            model.join(self.remaining())
+            self.finished = time.monotonic()
+            self._finished.set()
+            warmup_span.update(status=self.state, seconds=round(self.finished - self.started, 3))
+        logger.info(f"Warm-up {self.state} in {self.finished - self.started:.1f}s: "
+                    + ", ".join(f"{name} {step['status']}" for name, step in self.steps.items()))
+        return self
+
+    def _in_background(self, name, fn, *args):
+        # The thread runs in this context, so its spans stay in the warm-up's trace
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(self._step, name, fn, *args), name=f"warmup-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _in_parallel(self, name, fn, items):
+        """Run fn(item) for each item on the worker threads until the budget; returns (futures, done, pending)"""
+        # Not a context manager: leaving it would wait for work the budget has given up on
+        pool = ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(items))), thread_name_prefix=f"warmup-{name}")
+        futures = {pool.submit(contextvars.copy_context().run, fn, item): item for item in items}
+        done, pending = wait(futures, timeout=self.remaining())
+        pool.shutdown(wait=False, cancel_futures=True)
+        return futures, done, pending
+
+    def _skip(self, name, reason):
+        self.steps[name] = {"status": SKIPPED, "detail": reason}
+        self._done[name].set()
+
+    def _step(self, name, fn, *args):
+        if fn is None:
+            self._skip(name, "not configured")
+            return None
+        if self.remaining() <= 0:
+            self._skip(name, "out of time")
+            return None
+        self.steps[name] = {"status": RUNNING}
+        start = time.perf_counter()
+        try:
+            with span(f"warmup.{name}"):
+                value = fn(*args)
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {str(e)}")
+            self.steps[name] = {"status": FAILED, "seconds": round(time.perf_counter() - start, 3), "detail": str(e)}
+            value = None
+        else:
+            self.steps[name] = {"status": OK, "seconds": round(time.perf_counter() - start, 3)}
+        self._values[name] = value
+        self._done[name].set()
+        return value
+
+    def load_plans(self, sf):
+        """Cache the query plan of each preset query; the advisor checks them before every run"""
+        if advisor.ADVISOR_MODE == "off" or not hasattr(sf, "restful"):
+            return 0
+        queries = list(dict.fromkeys(get_default_queries()[intent] for intent in self.intents if intent in get_default_queries()))
+        futures, done, pending = self._in_parallel("plans", lambda query: advisor.explain(sf, query), queries)
+        failed = [future for future in done if future.exception() is not None]
+        if failed:
+            raise failed[0].exception()
+        if pending:
+            raise TimeoutError(f"{len(pending)} of {len(queries)} query plans not loaded within the budget")
+        return len(done)
+
+    def prefetch_intent(self, sf, intent):
+        """Put one preset's records in the query cache and return where they came from"""
+        query = get_default_queries()[intent]
+        start = time.perf_counter()
+        source, rows = FROM_SALESFORCE, 0
+        with span("warmup.preset", intent=intent) as preset_span:
+            multi_step = intent in MULTI_STEP_INTENTS
+            if not multi_step and get_cache("query").get(query_cache_key(sf, query)) is not None:
+                source = FROM_CACHE
+            elif not multi_step and SNAPSHOTS_ENABLED and self.snapshot_max_age > 0:
+                store = get_snapshot_store()
+                snapshot = store.latest(query, self.scope)
+                if snapshot is not None and snapshot.age <= self.snapshot_max_age:
+                    records = snapshot_records(snapshot, store)
+                    prime_query_cache(sf, query, records)
+                    source, rows = FROM_SNAPSHOT, len(records)
+            if source == FROM_SALESFORCE:
+                # Fetched through the cache exactly as a chat turn would, and kept for the next start
+                builder = ResultBuilder()
+                for page, _, _ in MULTI_STEP_INTENTS.get(intent, cached_query_pages)(sf, query, intent=intent):
+                    builder.add_page(page)
+                rows = builder.rows
+                if rows:
+                    record_snapshot(builder.build(), query, scope=self.scope, intent=intent)
+            preset_span.update(source=source, rows=rows)
+        self.presets[intent] = {"source": source, "rows": rows, "seconds": round(time.perf_counter() - start, 3)}
+        return source
+
+    def prefetch(self, sf):
+        """Prefetch every preset intent in parallel, giving up on what's left at the budget"""
+        # Presets sharing a query (a breakdown and its chart) share one fetch
+        first = {}
+        for intent in self.intents:
+            if intent in get_default_queries():
+                first.setdefault(get_default_queries()[intent], intent)
+        for intent in first.values():
+            self.presets[intent] = {"source": None, "status": PENDING}
+        futures, done, pending = self._in_parallel("prefetch", lambda intent: self.prefetch_intent(sf, intent), list(first.values()))
+        failed = 0
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                logger.warning(f"Prefetching {futures[future]} failed: {str(error)}")
+                self.presets[futures[future]] = {"source": None, "status": FAILED, "detail": str(error)}
+        for future in pending:
+            self.presets[futures[future]] = {"source": None, "status": TIMED_OUT}
+        for intent in self.intents:
+            fetched = first.get(get_default_queries().get(intent))
+            if fetched is not None and fetched != intent:
+                self.presets[intent] = {**self.presets[fetched], "source": self.presets[fetched]["source"] and FROM_CACHE, "seconds": 0.0}
+        if pending:
+            raise TimeoutError(f"{len(pending)} of {len(first)} preset queries not fetched within the budget")
+        if failed:
+            raise RuntimeError(f"{failed} of {len(first)} preset queries failed")
+        return len(done)
+
+    @property
+    def state(self):
+        """warming, ready (everything succeeded) or partial (ready, but something failed or ran out of time)"""
+        if not self.ready:
+            return "warming"
+        if all(step["status"] in (OK, SKIPPED) and step.get("detail") != "out of time" for step in self.steps.values()):
+            return "ready"
+        return "partial"
+
+    def status(self):
+        """JSON-friendly readiness report for health checks"""
+        now = self.finished if self.finished is not None else time.monotonic()
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "elapsed": round(now - self.started, 3) if self.started is not None else 0.0,
+            "budget": self.budget,
+            "steps": {name: dict(step) for name, step in self.steps.items()},
+            "presets": {intent: dict(preset) for intent, preset in self.presets.items()},
+        }
+
+
+def env_scope():
+    """Snapshot scope of the SF_* environment login, the same one the apps use for it"""
+    return credential_scope(os.getenv("SF_USERNAME"), os.getenv("SF_DOMAIN", "login"))
+
+
+def print_status(status):
+    print(f"Warm-up {status['state']} in {status['elapsed']:.1f}s (budget {status['budget']:.0f}s)")
+    for name, step in status["steps"].items():
+        seconds = f"{step['seconds']:.2f}s" if "seconds" in step else ""
+        print(f"  {name:<10} {step['status']:<10} {seconds:>8}  {step.get('detail', '')}")
+    for intent, preset in status["presets"].items():
+        source = preset.get("source") or preset.get("status")
+        print(f"    {intent:<26} {source:<11} {preset.get('rows', 0):>6} rows  {preset.get('seconds', 0):.2f}s")
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    from chatbot_engine import connect_salesforce
+
+    parser = argparse.ArgumentParser(description="Warm the shared caches before the app takes traffic")
+    parser.add_argument("--budget", type=float, default=WARMUP_BUDGET, help=f"seconds to spend at most (default {WARMUP_BUDGET:.0f})")
+    parser.add_argument("--intents", help="comma-separated presets to prefetch (default all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    load_dotenv('salesforce_arcgis.env')
+    if isinstance(get_backend(), MemoryBackend):
+        print("CACHE_URL is memory://, so nothing warmed here would outlive this process; the app warms itself up instead")
+        return 0
+    if not os.getenv("SF_USERNAME"):
+        print("SF_USERNAME is not set; nothing to warm up")
+        return 0
+
+    def login():
+        return connect_salesforce(os.getenv("SF_USERNAME"), os.getenv("SF_PASSWORD"), os.getenv("SF_SECURITY_TOKEN"), os.getenv("SF_DOMAIN", "login"))
+
+    intents = args.intents.split(",") if args.intents else None
+    # The model object can't be handed to another process, so only the caches are warmed
+    warmer = Warmer(login, scope=env_scope(), intents=intents, budget=args.budget).run()
+    print_status(warmer.status())
+    # A cold start is slower, not broken: never hold the app back
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())